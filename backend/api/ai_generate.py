@@ -1,4 +1,5 @@
 # backend/api/ai_generate.py
+import contextlib
 import time  # 用于计时
 import json  # 确保导入 json
 from flask import current_app  # 用于日志记录
@@ -928,9 +929,11 @@ def generate_audio_with_gemini_tts(
     voice_name: str = None,  # 对于 tts-001 模型，通常不需要指定voice_name
     temperature: float = 0,  # 对于TTS，更稳定的0是更好的选择
     proxy_url=None,
+    http_client=None,
 ):
     """
     通过手动创建httpx.Client并发送流式请求来调用Gemini TTS API。
+    传入 http_client 时复用该常驻客户端（需已按 proxy_url 配置好代理），不再每次新建连接。
     """
     prefix_prompt = "你是一名专业育儿嫂培训师，请用口语化的培训师的口吻以及标准的普通话来讲解以下内容："
     final_text_to_speak = f"{prefix_prompt}{text_to_speak}"
@@ -971,7 +974,7 @@ def generate_audio_with_gemini_tts(
             # 如果没有代理，直接在 Client 上配置重试
             client_args['retries'] = 3
 
-        with httpx.Client(**client_args) as client:
+        with contextlib.nullcontext(http_client) if http_client else httpx.Client(**client_args) as client:
             with client.stream(
                 "POST", api_url, headers=headers, json=payload
             ) as response:
@@ -4,6 +4,7 @@ from backend.models import BankTransaction, BankTransactionStatus, TransactionDi
 from backend.services.bank_statement_service import BankStatementService
 from backend.api.billing_api import delete_payment_record as delete_payment_record_from_billing # 导入目标函数
 from sqlalchemy import or_, extract
+from decimal import Decimal, InvalidOperation
 
 bank_statement_api = Blueprint('bank_statement_api', __name__)
 
@@ -135,6 +136,21 @@ def allocate_transaction_route(bank_transaction_id):
     
     return jsonify(result), 200
 
+@bank_statement_api.route('/api/bank-transactions/allocation-candidates', methods=['POST'])
+@jwt_required()
+def get_allocation_candidates_route():
+    """一次返回当前页面所有可见流水的分配候选，替代逐笔请求。"""
+    data = request.get_json() or {}
+    transaction_ids = data.get('transaction_ids') or []
+    year = data.get('year')
+    month = data.get('month')
+    if not transaction_ids or not year or not month:
+        return jsonify({"error": "transaction_ids, year and month are required"}), 400
+
+    service = BankStatementService()
+    candidates = service.get_allocation_candidates(transaction_ids, int(year), int(month))
+    return jsonify({"candidates": candidates}), 200
+
 @bank_statement_api.route('/api/bank-transactions/<bank_transaction_id>/cancel-allocation', methods=['POST'])
 @jwt_required()
 def cancel_allocation_route(bank_transaction_id):
@@ -347,4 +363,26 @@ def post_pasted_statement():
     operator_id = get_jwt_identity()
     service = BankStatementService()
     result = service.parse_and_store_statement(lines, operator_id)
+    # 可选：导入后立即对未匹配的入账流水做一次自动匹配
+    if data.get('auto_match') and result.get('new_imports'):
+        result['auto_match'] = service.match_transactions(operator_id)
+    return jsonify(result), 200
+
+
+@bank_statement_api.route('/api/bank-statement/auto-match', methods=['POST'])
+@jwt_required()
+def auto_match_transactions():
+    """对全部未匹配的入账流水运行自动匹配：唯一精确匹配直接入账，其余写入候选待人工确认。"""
+    data = request.get_json(silent=True) or {}
+    try:
+        tolerance = Decimal(str(data.get('tolerance', '1.00')))
+    except InvalidOperation:
+        return jsonify({"error": "tolerance must be a number"}), 400
+    if tolerance < 0:
+        return jsonify({"error": "tolerance must not be negative"}), 400
+
+    service = BankStatementService()
+    result = service.match_transactions(get_jwt_identity(), tolerance=tolerance)
+    if result.get("error"):
+        return jsonify(result), 400
     return jsonify(result), 200
\ No newline at end of file
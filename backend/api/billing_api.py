@@ -2,7 +2,7 @@
 
 from flask import Blueprint, jsonify, current_app, request, send_from_directory, url_for
 from flask_jwt_extended import jwt_required
-from sqlalchemy import or_, case, and_, not_, func, distinct, cast, String
+from sqlalchemy import or_, case, and_, not_, func, distinct, tuple_
 from sqlalchemy.orm import with_polymorphic, attributes, joinedload
 from flask_jwt_extended import get_jwt_identity
 from dateutil.parser import parse as date_parse
@@ -54,11 +54,13 @@ from backend.models import (
     PayerAlias,
     SubstituteRecord,
     Customer,
+    BillingMonthSummary,
     SigningStatus
 )
 from backend.tasks import (
     sync_all_contracts_task,
     calculate_monthly_billing_task,
+    dispatch_monthly_billing_run_task,
     post_virtual_contract_creation_task,
     generate_all_bills_for_contract_task,
 )  # 导入新任务
@@ -107,14 +109,14 @@ def _to_money(value) -> D:
 
 
 def _sum_bills_management_fee(bill_ids) -> D:
-    """账单 calculation_details.management_fee 合计（育儿嫂/月嫂统一字段）。"""
+    """账单管理费合计（育儿嫂/月嫂统一字段，读物化列 CustomerBill.management_fee）。"""
     if not bill_ids:
         return D(0)
     total = db.session.query(
-        func.sum(CustomerBill.calculation_details["management_fee"].as_float())
+        func.sum(CustomerBill.management_fee)
     ).filter(
         CustomerBill.id.in_(bill_ids),
-        CustomerBill.calculation_details.has_key("management_fee"),
+        CustomerBill.management_fee.isnot(None),
     ).scalar()
     return _to_money(total)
 
@@ -138,6 +140,76 @@ def _payroll_ids_for_bills(bill_ids):
     return [row[0] for row in rows]
 
 
+def _load_bill_list_context(bills, contracts):
+    """
+    为账单列表一页数据批量预取关联记录，避免逐行查询（N+1）。
+
+    以固定次数的集合查询拉取：工资单、员工应缴款调整项、替班记录（含替班员工）、
+    合同原员工，并一次性计算整页账单的发票余额。
+    """
+    context = {
+        "payrolls": {},
+        "payable_adjustments": defaultdict(list),
+        "substitute_records": {},
+        "invoice_balances": {},
+        "personnel": [],
+    }
+    if not bills:
+        return context
+
+    payroll_keys = {
+        (bill.contract_id, bill.cycle_start_date, bill.is_substitute_bill)
+        for bill in bills
+    }
+    payrolls = EmployeePayroll.query.filter(
+        tuple_(
+            EmployeePayroll.contract_id,
+            EmployeePayroll.cycle_start_date,
+            EmployeePayroll.is_substitute_payroll,
+        ).in_(list(payroll_keys))
+    ).all()
+    for payroll in payrolls:
+        key = (payroll.contract_id, payroll.cycle_start_date, payroll.is_substitute_payroll)
+        context["payrolls"][key] = payroll
+
+    if payrolls:
+        payable_adjustments = FinancialAdjustment.query.filter(
+            FinancialAdjustment.employee_payroll_id.in_([p.id for p in payrolls]),
+            FinancialAdjustment.adjustment_type.in_([
+                AdjustmentType.EMPLOYEE_DECREASE,
+                AdjustmentType.EMPLOYEE_COMMISSION
+            ])
+        ).all()
+        for adj in payable_adjustments:
+            context["payable_adjustments"][adj.employee_payroll_id].append(adj)
+
+    substitute_bill_ids = [bill.id for bill in bills if bill.is_substitute_bill]
+    if substitute_bill_ids:
+        sub_records = (
+            SubstituteRecord.query.filter(
+                SubstituteRecord.generated_bill_id.in_(substitute_bill_ids)
+            )
+            .options(
+                db.selectinload(SubstituteRecord.substitute_user),
+                db.selectinload(SubstituteRecord.substitute_personnel),
+            )
+            .all()
+        )
+        for sub_record in sub_records:
+            context["substitute_records"].setdefault(sub_record.generated_bill_id, sub_record)
+
+    # 多对一关系按主键命中会话标识映射，预取后 contract.service_personnel 不再发出查询；
+    # 保留强引用，防止对象在循环中被回收。
+    personnel_ids = {c.service_personnel_id for c in contracts if c.service_personnel_id}
+    if personnel_ids:
+        context["personnel"] = ServicePersonnel.query.filter(
+            ServicePersonnel.id.in_(personnel_ids)
+        ).all()
+
+    context["invoice_balances"] = BillingEngine().calculate_invoice_balances(bills)
+    return context
+
+
 def _iter_adjustments_for_bills(bill_ids, payroll_ids=None):
     """拉取账单 + 关联工资单上的财务调整项。"""
     if not bill_ids:
@@ -266,9 +338,7 @@ def _compute_billing_month_fee_summary(bill_ids):
 
 def _bill_fee_breakdown(bill, contract=None):
     """单账单维度的管理费/应收拆分（导出明细用）。"""
-    management_fee = D(0)
-    if bill.calculation_details and bill.calculation_details.get("management_fee") is not None:
-        management_fee = _to_money(bill.calculation_details.get("management_fee"))
+    management_fee = _to_money(bill.management_fee)
 
     payroll = EmployeePayroll.query.filter_by(
         contract_id=bill.contract_id,
@@ -486,8 +556,8 @@ def trigger_calculate_bills():
     if not all([year, month]):
         return jsonify({"error": "缺少 year 和 month 参数"}), 400
 
-    # 调用 Celery 任务，使用 .delay()
-    task = calculate_monthly_billing_task.delay(
+    # 按合同分块并行计算，每个合同独立事务；任务结果为成功/失败/跳过的运行报告
+    task = dispatch_monthly_billing_run_task.delay(
         year=year, month=month, force_recalculate=False
     )
     return jsonify({"task_id": task.id, "message": "批量计算任务已提交"})
@@ -683,7 +753,10 @@ def get_bills():
         )
 
         results = []
-        engine = BillingEngine()
+        list_context = _load_bill_list_context(
+            [bill for bill, _ in paginated_results.items],
+            [contract for _, contract in paginated_results.items],
+        )
 
         # 【V2 修改】定义状态到中文的映射
         status_map = {
@@ -700,24 +773,18 @@ def get_bills():
         }
 
         for i, (bill, contract) in enumerate(paginated_results.items):
-            payroll = EmployeePayroll.query.filter_by(
-                contract_id=bill.contract_id, cycle_start_date=bill.cycle_start_date, is_substitute_payroll=bill.is_substitute_bill
-            ).first()
+            payroll = list_context["payrolls"].get(
+                (bill.contract_id, bill.cycle_start_date, bill.is_substitute_bill)
+            )
 
-            invoice_balance = engine.calculate_invoice_balance(str(bill.id))
+            invoice_balance = list_context["invoice_balances"][str(bill.id)]
 
             # --- 新增逻辑：查询员工应缴款 ---
             employee_payable_amount = D(0)
             employee_payable_is_settled = True # 如果没有应缴款，默认为已结清
             if payroll:
                 # --- 这是修改点 ---
-                payable_adjustments = FinancialAdjustment.query.filter(
-                    FinancialAdjustment.employee_payroll_id == payroll.id,
-                    FinancialAdjustment.adjustment_type.in_([
-                        AdjustmentType.EMPLOYEE_DECREASE,
-                        AdjustmentType.EMPLOYEE_COMMISSION
-                    ])
-                ).all()
+                payable_adjustments = list_context["payable_adjustments"].get(payroll.id, [])
 
                 if payable_adjustments:
                     total_payable = sum(adj.amount for adj in payable_adjustments)
@@ -777,7 +844,7 @@ def get_bills():
                 item["contract_type_label"] = (
                     f"{item.get('contract_type_label', '未知类型')} (替)"
                 )
-                sub_record = bill.source_substitute_record
+                sub_record = list_context["substitute_records"].get(bill.id)
                 if sub_record:
                     sub_employee = (
                         sub_record.substitute_user or sub_record.substitute_personnel
@@ -2267,9 +2334,11 @@ def get_bills_for_contract(contract_id):
     }
 
 
+    invoice_balances = engine.calculate_invoice_balances(bills)
+
     for bill in bills:
         calc = bill.calculation_details or {}
-        invoice_balance = engine.calculate_invoice_balance(str(bill.id))
+        invoice_balance = invoice_balances[str(bill.id)]
 
         results.append(
             {
@@ -3284,17 +3353,15 @@ def get_dashboard_summary():
         )
         pending_deposit_count = pending_deposit_query.scalar() or 0
 
-        yearly_management_fee_received = db.session.query(
-            func.sum(case((CustomerBill.payment_status == PaymentStatus.PAID,CustomerBill.calculation_details['management_fee'].as_float()), else_=0))
-        ).filter(
-            CustomerBill.year == today.year
-        ).scalar() or 0
+        # 管理费、应收构成与趋势图均读取预聚合的月度汇总表（billing_month_summary）
+        trend_start = today - relativedelta(months=11)
+        summary_rows = BillingMonthSummary.query.filter(
+            BillingMonthSummary.year >= trend_start.year
+        ).all()
+        this_year_rows = [row for row in summary_rows if row.year == today.year]
 
-        yearly_management_fee_total = db.session.query(
-            func.sum(CustomerBill.calculation_details['management_fee'].as_float())
-        ).filter(
-            CustomerBill.year == today.year
-        ).scalar() or 0
+        yearly_management_fee_received = sum((row.management_fee_paid for row in this_year_rows), D(0))
+        yearly_management_fee_total = sum((row.management_fee for row in this_year_rows), D(0))
 
         kpis = {
             "monthly_management_fee_received": f"{D(yearly_management_fee_received).quantize(D('0.01'))}",
@@ -3639,8 +3706,6 @@ func.date(MaternityNurseContract.provisional_start_date).between(today, today+ t
         }
 
         # === 3. 应收款构成 (Receivables Summary for This Year) (V2 - 修正版) ===
-        this_year = today.year
-
         receivables_summary = {
             "management_fee": D(0),
             "introduction_fee": D(0),
@@ -3648,42 +3713,11 @@ func.date(MaternityNurseContract.provisional_start_date).between(today, today+ t
             "other_receivables": D(0)
         }
 
-        customer_linked_adjustments = db.session.query(
-            FinancialAdjustment.adjustment_type,
-            func.sum(FinancialAdjustment.amount)
-        ).join(
-            CustomerBill, FinancialAdjustment.customer_bill_id ==CustomerBill.id
-        ).filter(
-            CustomerBill.year == this_year,
-            FinancialAdjustment.adjustment_type.in_([
-                AdjustmentType.INTRODUCTION_FEE,
-                AdjustmentType.CUSTOMER_INCREASE
-            ])
-        ).group_by(FinancialAdjustment.adjustment_type).all()
-
-        for adj_type, total_amount in customer_linked_adjustments:
-            if adj_type == AdjustmentType.INTRODUCTION_FEE:
-                receivables_summary["introduction_fee"] = total_amount or D(0)
-            elif adj_type == AdjustmentType.CUSTOMER_INCREASE:
-                receivables_summary["other_receivables"] = total_amount or D(0)
-
-        employee_commission_total = db.session.query(
-            func.sum(FinancialAdjustment.amount)
-        ).join(
-            EmployeePayroll, FinancialAdjustment.employee_payroll_id ==EmployeePayroll.id
-        ).filter(
-            EmployeePayroll.year == this_year,
-            FinancialAdjustment.adjustment_type ==AdjustmentType.EMPLOYEE_COMMISSION
-        ).scalar()
-        receivables_summary["employee_commission"] =D(employee_commission_total or 0)
-
-        total_management_fee = db.session.query(
-            func.sum(CustomerBill.calculation_details['management_fee'].as_float())
-        ).filter(
-            CustomerBill.year == this_year,
-            CustomerBill.calculation_details.has_key('management_fee')
-        ).scalar() or 0
-        receivables_summary["management_fee"] = D(total_management_fee)
+        for row in this_year_rows:
+            receivables_summary["management_fee"] += row.management_fee
+            receivables_summary["introduction_fee"] += row.introduction_fee
+            receivables_summary["other_receivables"] += row.customer_increase
+            receivables_summary["employee_commission"] += row.employee_commission
 
         final_receivables_summary = {
             "management_fee": str(receivables_summary["management_fee"].quantize(D('0.01'))),
@@ -3694,24 +3728,12 @@ func.date(MaternityNurseContract.provisional_start_date).between(today, today+ t
 
         # === 4. Charts ===
         last_12_months_dates = [today - relativedelta(months=i) for i in range(12)]
-
-        due_revenue_data = db.session.query(
-            CustomerBill.year,
-            CustomerBill.month,
-            func.sum(CustomerBill.calculation_details['management_fee'].as_float())
-        ).filter(
-            func.date_trunc('month',func.to_date(func.concat(cast(CustomerBill.year, String), '-',cast(CustomerBill.month, String)), 'YYYY-MM')) >= func.date_trunc('month',today - relativedelta(months=11))
-        ).group_by(CustomerBill.year, CustomerBill.month).all()
-        due_revenue_by_month = {f"{r.year}-{r.month}": float(r[2] or 0) for r in due_revenue_data}
-
-        paid_revenue_data = db.session.query(
-            CustomerBill.year,
-            CustomerBill.month,
-            func.sum(case((CustomerBill.payment_status == PaymentStatus.PAID,CustomerBill.calculation_details['management_fee'].as_float()), else_=0))
-        ).filter(
-            func.date_trunc('month',func.to_date(func.concat(cast(CustomerBill.year, String), '-',cast(CustomerBill.month, String)), 'YYYY-MM')) >= func.date_trunc('month',today - relativedelta(months=11))
-        ).group_by(CustomerBill.year, CustomerBill.month).all()
-        paid_revenue_by_month = {f"{r.year}-{r.month}": float(r[2] or 0) for r in paid_revenue_data}
+        due_revenue_by_month = defaultdict(D)
+        paid_revenue_by_month = defaultdict(D)
+        for row in summary_rows:
+            month_key = f"{row.year}-{row.month}"
+            due_revenue_by_month[month_key] += row.management_fee
+            paid_revenue_by_month[month_key] += row.management_fee_paid
 
         revenue_trend = {
             "categories": [],
@@ -3721,21 +3743,18 @@ func.date(MaternityNurseContract.provisional_start_date).between(today, today+ t
         for dt in sorted(last_12_months_dates, key=lambda d: (d.year,d.month)):
             month_key = f"{dt.year}-{dt.month}"
             revenue_trend["categories"].append(f"{dt.month}月")
-            revenue_trend["series"][0]["data"].append(due_revenue_by_month.get(month_key, 0))
-            revenue_trend["paid_data"].append(paid_revenue_by_month.get(month_key, 0))
+            revenue_trend["series"][0]["data"].append(float(due_revenue_by_month.get(month_key, 0)))
+            revenue_trend["paid_data"].append(float(paid_revenue_by_month.get(month_key, 0)))
 
-        distribution_query = db.session.query(
-            BaseContract.type,
-            func.sum(CustomerBill.calculation_details['management_fee'].as_float())
-        ).join(CustomerBill).filter(
-            CustomerBill.year == today.year
-        ).group_by(BaseContract.type).all()
+        fee_by_contract_type = defaultdict(D)
+        for row in this_year_rows:
+            fee_by_contract_type[row.contract_type] += row.management_fee
 
         management_fee_distribution = {
             "this_year": {"labels": [], "series": []},
             "last_12_months": {"labels": [], "series": []}
         }
-        for contract_type, total_fee in distribution_query:
+        for contract_type, total_fee in sorted(fee_by_contract_type.items()):
             management_fee_distribution["this_year"]["labels"].append(get_contract_type_details(contract_type))
             management_fee_distribution["this_year"]["series"].append(float(total_fee or 0))
 
@@ -3784,7 +3803,7 @@ def export_management_fees():
         )
         query = query.filter(
             CustomerBill.year == billing_year, CustomerBill.month ==billing_month,
-            CustomerBill.calculation_details.has_key('management_fee')
+            CustomerBill.management_fee.isnot(None)
         )
         if status:
             query = query.filter(contract_poly.status == status)
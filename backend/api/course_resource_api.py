@@ -2,14 +2,12 @@
 # ... (existing imports) ...
 import os
 import uuid
-import re
 from flask import (
     Blueprint,
     request,
     jsonify,
     current_app,
     Response,
-    stream_with_context,
 )
 from werkzeug.exceptions import NotFound  # 可以用来抛出标准的404
 from flask_jwt_extended import (
@@ -37,6 +35,12 @@ from backend.models import (
     UserResourceAccess,
     UserResourcePlayLog,  # <<<--- 确保这些都导入了
 )
+from backend.services.media_delivery import send_media_file
+from backend.services.play_events import (
+    normalize_play_events,
+    record_play_events,
+    resource_play_counts,
+)
 
 course_resource_bp = Blueprint("course_resource_api", __name__, url_prefix="/api")
 
@@ -746,111 +750,15 @@ def stream_course_resource(resource_id_str):
         )
         return jsonify({"error": "File not found on server"}), 404
 
-    file_size = resource.size_bytes or os.path.getsize(file_absolute_path)
-    range_header = request.headers.get("Range", None)
     is_download = request.args.get("download", "0") == "1"
-
-    start = 0
-    end = file_size - 1
-    status_code = 200
-    content_length = file_size
     safe_filename = secure_filename(resource.name) or "video.mp4"
-    disposition = f'attachment; filename="{safe_filename}"' if is_download else f'inline; filename="{safe_filename}"'
-    headers = {
-        "Content-Type": resource.mime_type or "application/octet-stream",
-        "Content-Disposition": disposition,
-        "Accept-Ranges": "bytes",  # 非常重要，告知客户端支持 Range
-    }
-
-    if range_header:
-        current_app.logger.info(f"Stream: Received Range header: {range_header}")
-        try:
-            # 尝试解析 bytes=start-end 和 bytes=start-
-            range_match = re.match(r"bytes=(\d*)-(\d*)", range_header)
-            if range_match:
-                g = range_match.groups()
-                range_start_str = g[0]
-                range_end_str = g[1]
-
-                if range_start_str:
-                    start = int(range_start_str)
-                if range_end_str:
-                    end = int(range_end_str)
-                elif range_start_str:
-                    end = file_size - 1  # 如果只有 start，则到末尾
-                else:
-                    raise ValueError(
-                        "Invalid Range format (no start)"
-                    )  # 例如 "bytes=-100" 暂时不处理
-
-                if start < 0 or start >= file_size or start > end:
-                    current_app.logger.warning(
-                        f"Stream: Range Not Satisfiable. Range: {range_header}, FileSize: {file_size}"
-                    )
-                    # 对于不满足的 Range，返回 416
-                    return Response(
-                        status=416, headers={"Content-Range": f"bytes */{file_size}"}
-                    )
 
-                end = min(end, file_size - 1)  # 确保 end 不超过文件边界
-                status_code = 206
-                content_length = (end - start) + 1
-                headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-                current_app.logger.info(
-                    f"Stream: Responding with 206. Content-Range: {headers['Content-Range']}, Content-Length: {content_length}"
-                )
-            else:  # 如果 Range 格式不匹配我们解析的，忽略它，发送整个文件
-                current_app.logger.warning(
-                    f"Stream: Could not parse Range header with regex: {range_header}, sending full content."
-                )
-                start = 0
-                end = file_size - 1
-                status_code = 200
-                content_length = file_size
-        except ValueError as e_val:  # 捕获 int() 转换错误等
-            current_app.logger.warning(
-                f"Stream: ValueError parsing Range header '{range_header}': {e_val}. Sending full content."
-            )
-            start = 0
-            end = file_size - 1
-            status_code = 200
-            content_length = file_size
-        except Exception as e_range:  # 其他 Range 处理错误
-            current_app.logger.error(
-                f"Stream: Error processing Range header '{range_header}': {e_range}",
-                exc_info=True,
-            )
-            start = 0
-            end = file_size - 1
-            status_code = 200
-            content_length = file_size
-    else:
-        current_app.logger.info("Stream: No Range header, sending full content.")
-
-    headers["Content-Length"] = str(content_length)
-    current_app.logger.debug(
-        f"Stream: Final response headers: {headers}, Status: {status_code}"
-    )
-
-    def generate_file_stream(path, offset, length_to_read, chunk_size=8192):
-        with open(path, "rb") as f:
-            f.seek(offset)
-            bytes_remaining = length_to_read
-            while bytes_remaining > 0:
-                read_size = min(chunk_size, bytes_remaining)
-                data = f.read(read_size)
-                if not data:
-                    break
-                yield data
-                bytes_remaining -= len(data)
-
-    return Response(
-        stream_with_context(
-            generate_file_stream(file_absolute_path, start, content_length)
-        ),
-        status=status_code,
-        headers=headers,
+    # Range / ETag / 条件请求由 send_media_file 处理，文件体交给服务器或 nginx 直接发送
+    return send_media_file(
+        file_absolute_path,
         mimetype=resource.mime_type or "application/octet-stream",
+        as_attachment=is_download,
+        download_name=safe_filename,
     )
 
 
@@ -876,50 +784,35 @@ def log_resource_play(resource_id_str):
         )
         return jsonify({"error": "Resource not found"}), 404
 
-    data = request.get_json() or {}
-    watch_time = data.get("watch_time_seconds")
-    percentage = data.get("percentage_watched")
-    session_id = data.get("session_id")  # <<<--- 从请求 JSON 中读取 session_id
-    event_type = data.get("event_type")  # <<<--- 从请求 JSON 中读取 event_type
+    data = request.get_json(silent=True) or {}
+    # 支持批量上报：{"events": [事件, ...]}；单个事件仍可直接放在请求体中
+    events = data.get("events") if isinstance(data.get("events"), list) else [data]
 
-    # 验证必要的日志数据
-    if session_id is None or event_type is None:
+    # 校验并转换事件（长度、数值类型）；播放时间取客户端上报的事件时间（played_at 或 elapsed_ms），
+    # 未上报时按批内顺序依次错开
+    try:
+        rows = normalize_play_events(events, datetime.now(timezone.utc))
+    except (TypeError, ValueError) as e:
         current_app.logger.warning(
-            f"Play log attempt missing session_id or event_type from user {current_user_id_str} for resource {resource_id}"
+            f"Invalid play log payload from user {current_user_id_str} for resource {resource_id}: {e}"
         )
-        return jsonify(
-            {"error": "Missing session_id or event_type in log payload"}
-        ), 400
+        return jsonify({"error": f"Invalid play log payload: {e}"}), 400
 
     try:
-        # 可选：根据 event_type 更新资源的总播放次数
-        if event_type == "start_play":
-            # 确保 play_count 不是 None
-            resource.play_count = (resource.play_count or 0) + 1
-            db.session.add(resource)  # 标记资源对象已修改
-
-        play_log_entry = UserResourcePlayLog(
-            user_id=current_user_id_uuid,  # 使用从 JWT 获取的 UUID 用户ID
-            resource_id=uuid.UUID(resource_id),  # 将资源ID转换为 UUID
-            watch_time_seconds=watch_time if watch_time is not None else None,
-            percentage_watched=percentage if percentage is not None else None,
-            session_id=session_id,  # <<<--- 保存 session_id
-            event_type=event_type,  # <<<--- 保存 event_type
-        )
-        db.session.add(play_log_entry)
+        # 只追加播放日志，不再逐事件更新 play_count 热点行；play_count 由定时任务汇总
+        recorded = record_play_events(current_user_id_uuid, uuid.UUID(resource_id), rows)
         db.session.commit()
 
-        # Update log message format
         current_app.logger.info(
             f"Play Log Recorded: User={current_user_id_uuid}, Resource={resource_id}, "
-            f"Session='{session_id}', Event='{event_type}', "
-            f"Time={watch_time}s, Percent={percentage}%"
+            f"Events={[row['event_type'] for row in rows]}"
         )
 
         return jsonify(
             {
                 "message": "Play log recorded successfully",
-                "new_play_count": resource.play_count,
+                "recorded": recorded,
+                "new_play_count": resource_play_counts([resource.id]).get(resource.id, 0),
             }
         ), 200
     except Exception as e:
@@ -954,10 +847,11 @@ def get_resource_stats(resource_id_str):
     if not can_access:
         return jsonify({"error": "Access denied to this resource stats"}), 403
 
+    # 已汇总的 play_count 加上尚未汇总的 start_play 事件，与所有进程的写入一致
     return jsonify(
         {
             "resource_id": str(resource.id),
-            "play_count": resource.play_count,
+            "play_count": resource_play_counts([resource.id]).get(resource.id, 0),
         }
     )
 
@@ -1065,71 +959,10 @@ def stream_shared_resource_by_slug(share_slug_str):
         )
         raise NotFound("分享的资源文件在服务器上未找到。")
 
-    file_size = resource.size_bytes or os.path.getsize(file_absolute_path)
-    range_header = request.headers.get("Range", None)
-
-    start = 0
-    end = file_size - 1
-    status_code = 200
-    content_length = file_size
-    headers = {
-        "Content-Type": resource.mime_type or "application/octet-stream",
-        "Content-Disposition": f'inline; filename="{secure_filename(resource.name)}"',
-        "Accept-Ranges": "bytes",
-    }
-
-    if range_header:
-        # (此处省略 Range 处理逻辑，与 stream_course_resource 中的相同)
-        # 务必复制粘贴并确保正确性
-        try:
-            range_match = re.match(r"bytes=(\d*)-(\d*)", range_header)
-            if range_match:
-                g = range_match.groups()
-                range_start_str, range_end_str = g[0], g[1]
-                if range_start_str:
-                    start = int(range_start_str)
-                if range_end_str:
-                    end = int(range_end_str)
-                elif range_start_str:
-                    end = file_size - 1
-                else:
-                    raise ValueError("Invalid Range")
-                if start < 0 or start >= file_size or start > end:
-                    return Response(
-                        status=416, headers={"Content-Range": f"bytes */{file_size}"}
-                    )
-                end = min(end, file_size - 1)
-                status_code = 206
-                content_length = (end - start) + 1
-                headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-        except ValueError:
-            pass  # Ignore invalid range header
-        except Exception as e_range_parse:
-            current_app.logger.warning(
-                f"ShareStreamBySlug: Error parsing Range header '{range_header}': {e_range_parse}"
-            )
-
-    headers["Content-Length"] = str(content_length)
-
-    def generate_file_stream_slug(path, offset, length_to_read, chunk_size=8192):
-        with open(path, "rb") as f:
-            f.seek(offset)
-            bytes_remaining = length_to_read
-            while bytes_remaining > 0:
-                read_size = min(chunk_size, bytes_remaining)
-                data = f.read(read_size)
-                if not data:
-                    break
-                yield data
-                bytes_remaining -= len(data)
-
-    return Response(
-        stream_with_context(
-            generate_file_stream_slug(file_absolute_path, start, content_length)
-        ),
-        status=status_code,
-        headers=headers,
+    return send_media_file(
+        file_absolute_path,
         mimetype=resource.mime_type or "application/octet-stream",
+        download_name=secure_filename(resource.name) or None,
     )
 
 
@@ -7,6 +7,19 @@ import calendar
 
 dashboard_bp = Blueprint('revenue_dashboard', __name__, url_prefix='/api/dashboard')
 
+
+def _real_revenue_expr():
+    """
+    Per-bill real revenue: management_fee + extension_fee + employee_commission.
+    Reads the numeric columns the billing engine materializes from calculation_details.
+    """
+    return (
+        func.coalesce(CustomerBill.management_fee, 0) +
+        func.coalesce(CustomerBill.extension_fee, 0) +
+        func.coalesce(CustomerBill.employee_commission, 0)
+    )
+
+
 @dashboard_bp.route('/revenue/summary', methods=['GET'])
 def get_revenue_summary():
     """
@@ -36,17 +49,7 @@ def get_revenue_summary():
 
         # 2. Revenue Calculation (Real Revenue based on Fees & Commissions)
         # Formula: management_fee + extension_fee + employee_commission
-        real_revenue_expr = (
-            func.coalesce(
-                func.cast(CustomerBill.calculation_details['management_fee'].astext, db.Numeric), 0
-            ) +
-            func.coalesce(
-                func.cast(CustomerBill.calculation_details['extension_fee'].astext, db.Numeric), 0
-            ) +
-            func.coalesce(
-                func.cast(CustomerBill.calculation_details['employee_commission'].astext, db.Numeric), 0
-            )
-        )
+        real_revenue_expr = _real_revenue_expr()
 
         def calculate_revenue(y=None, start=None, end=None):
             query = db.session.query(func.sum(real_revenue_expr))
@@ -129,11 +132,7 @@ def get_revenue_charts():
         end_date = None
         
         # Real Revenue Expression (Management + Extension + Commission)
-        real_revenue_val = (
-            func.coalesce(func.cast(CustomerBill.calculation_details['management_fee'].astext, db.Numeric), 0) +
-            func.coalesce(func.cast(CustomerBill.calculation_details['extension_fee'].astext, db.Numeric), 0) +
-            func.coalesce(func.cast(CustomerBill.calculation_details['employee_commission'].astext, db.Numeric), 0)
-        )
+        real_revenue_val = _real_revenue_expr()
         
         if period == 'year':
             labels = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
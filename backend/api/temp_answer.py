@@ -1,74 +1,200 @@
+import os
 import uuid
+from datetime import datetime, timezone
 from flask import jsonify
 from psycopg2.extras import RealDictCursor
 from backend.db import get_db_connection  # 使用绝对导入
 
+# 客户端作答时间最多早于服务器收到时间这么多秒，超出按此下限计（防止客户端时钟偏差过大）
+MAX_CLIENT_LAG_SECONDS = float(os.environ.get("TEMP_ANSWER_MAX_CLIENT_LAG_SECONDS", "300"))
 
-def save_temp_answer(exam_id, user_id, question_id, selected_options):
-    """保存临时答案"""
-    print(
-        f"开始保存临时答案，参数：exam_id={exam_id}, user_id={user_id}, question_id={question_id}, selected_options={selected_options}"
+# 一条语句完成一批作答的校验与写入（依赖 uq_temp_answer_record_pending 部分唯一索引）：
+# - 作答时间缺省为数据库收到时间，并限制在 [收到时间 - MAX_CLIENT_LAG_SECONDS, 收到时间] 内；
+# - 同一题出现多次时保留作答时间最晚的一次（同一条语句不能更新同一行两次）；
+# - 有题目不属于该试卷、或选项不属于对应题目时整批不写入，返回这些题目/选项；
+# - 只在作答时间不早于库中记录时覆盖，乱序到达的旧答案不会盖掉新答案；
+# - 作答时间不晚于该题已提交记录（提交时间）的答案属于已交卷的那次考试，直接跳过，
+#   不会在交卷后再插入一条未提交记录。
+_SAVE_SQL = """
+    WITH received AS (
+        SELECT now() AS received_at
+    ),
+    incoming AS (
+        SELECT
+            a.question_id,
+            a.selected_option_ids::uuid[] AS selected_option_ids,
+            LEAST(
+                GREATEST(
+                    COALESCE(a.answered_at, r.received_at),
+                    r.received_at - make_interval(secs => %(max_lag)s)
+                ),
+                r.received_at
+            ) AS answered_at,
+            a.ord
+        FROM unnest(%(question_ids)s::uuid[], %(option_ids)s::text[], %(answered_at)s::timestamptz[])
+            WITH ORDINALITY AS a (question_id, selected_option_ids, answered_at, ord)
+        CROSS JOIN received r
+    ),
+    latest AS (
+        SELECT DISTINCT ON (question_id) question_id, selected_option_ids, answered_at
+        FROM incoming
+        ORDER BY question_id, answered_at DESC, ord DESC
+    ),
+    checked AS (
+        SELECT
+            l.*,
+            epq.question_id IS NOT NULL AS on_paper,
+            ARRAY(
+                SELECT unnest(l.selected_option_ids)
+                EXCEPT
+                SELECT o.id FROM option o WHERE o.question_id = l.question_id
+            ) AS invalid_option_ids
+        FROM latest l
+        LEFT JOIN exampaperquestion epq
+            ON epq.exam_paper_id = %(exam_paper_id)s::uuid
+            AND epq.question_id = l.question_id
+    ),
+    rejected AS (
+        SELECT question_id, on_paper, invalid_option_ids
+        FROM checked
+        WHERE NOT on_paper OR cardinality(invalid_option_ids) > 0
+    ),
+    saved AS (
+        INSERT INTO temp_answer_record (
+            exam_paper_id,
+            user_id,
+            question_id,
+            selected_option_ids,
+            created_at,
+            updated_at,
+            is_submitted
+        )
+        SELECT
+            %(exam_paper_id)s::uuid,
+            %(user_id)s::uuid,
+            c.question_id,
+            c.selected_option_ids,
+            c.answered_at,
+            c.answered_at,
+            false
+        FROM checked c
+        WHERE NOT EXISTS (SELECT 1 FROM rejected)
+        AND NOT EXISTS (
+            SELECT 1
+            FROM temp_answer_record submitted
+            WHERE submitted.exam_paper_id = %(exam_paper_id)s::uuid
+            AND submitted.user_id = %(user_id)s::uuid
+            AND submitted.question_id = c.question_id
+            AND submitted.is_submitted = true
+            AND submitted.updated_at >= c.answered_at
+        )
+        ON CONFLICT (exam_paper_id, user_id, question_id) WHERE is_submitted = false
+        DO UPDATE SET
+            selected_option_ids = EXCLUDED.selected_option_ids,
+            updated_at = EXCLUDED.updated_at
+        WHERE temp_answer_record.updated_at <= EXCLUDED.updated_at
+        RETURNING id, question_id
     )
+    SELECT id, question_id::text AS question_id, NULL::boolean AS on_paper, NULL::text[] AS invalid_option_ids
+    FROM saved
+    UNION ALL
+    SELECT NULL, question_id::text, on_paper, invalid_option_ids::text[]
+    FROM rejected
+"""
+
+
+def _options_literal(selected_options):
+    """把选项ID转换为PostgreSQL数组格式"""
+    return "{" + ",".join(selected_options) + "}"
+
+
+def _parse_answered_at(value):
+    """解析客户端的作答时间（ISO 8601 字符串或毫秒时间戳），未提供时返回 None。"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    answered_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if answered_at.tzinfo is None:
+        answered_at = answered_at.replace(tzinfo=timezone.utc)
+    return answered_at
+
+
+def _parse_answers(answers):
+    """校验一批作答，返回 [(题目ID, 选项ID列表, 客户端作答时间或 None)]。"""
+    if not isinstance(answers, list):
+        raise ValueError("answers 必须是列表")
+    parsed = []
+    for answer in answers:
+        question_uuid = str(uuid.UUID(answer.get("question_id")))
+        selected_options = answer.get("selected_options", [])
+        # 确保selected_options是列表
+        if not isinstance(selected_options, list):
+            selected_options = [selected_options]
+        option_uuids = [str(uuid.UUID(opt)) for opt in selected_options]
+        parsed.append((question_uuid, option_uuids, _parse_answered_at(answer.get("answered_at"))))
+    return parsed
+
+
+def save_temp_answers(exam_id, user_id, answers):
+    """
+    保存一批临时答案 answers=[{"question_id", "selected_options", "answered_at"(可选)}]。
+    校验题目和选项属于该试卷并写入在同一条语句中完成，返回 200 时答案已经落库。
+    """
     conn = None
     cur = None
     try:
         # 验证输入参数
         exam_uuid = str(uuid.UUID(exam_id))
         user_uuid = str(uuid.UUID(user_id))
-        question_uuid = str(uuid.UUID(question_id))
+        parsed = _parse_answers(answers)
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"参数错误: {str(e)}"}), 400
 
-        print(
-            f"参数验证通过，转换后的UUID：exam_uuid={exam_uuid}, user_uuid={user_uuid}, question_uuid={question_uuid}"
-        )
+    if not parsed:
+        return jsonify({"success": True, "accepted": 0, "skipped": 0})
 
+    try:
         # 建立数据库连接
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        # 确保selected_options是列表
-        if not isinstance(selected_options, list):
-            selected_options = [selected_options]
-
-        # 将选项ID转换为PostgreSQL数组格式
-        selected_options_literal = (
-            "{" + ",".join(str(uuid.UUID(opt)) for opt in selected_options) + "}"
-        )
-        print(f"选项ID数组：{selected_options_literal}")
-
-        # 先删除可能存在的记录
-        cur.execute(
-            """
-            DELETE FROM temp_answer_record
-            WHERE exam_paper_id = %s
-            AND question_id = %s
-            AND user_id = %s
-            AND is_submitted = false;
-        """,
-            (exam_uuid, question_uuid, user_uuid),
-        )
-
-        # 插入新记录
         cur.execute(
-            """
-            INSERT INTO temp_answer_record (
-                exam_paper_id,
-                question_id,
-                selected_option_ids,
-                user_id,
-                created_at,
-                updated_at,
-                is_submitted
-            ) VALUES (%s, %s, %s, %s, NOW(), NOW(), false)
-            RETURNING id;
-        """,
-            (exam_uuid, question_uuid, selected_options_literal, user_uuid),
+            _SAVE_SQL,
+            {
+                "exam_paper_id": exam_uuid,
+                "user_id": user_uuid,
+                "max_lag": MAX_CLIENT_LAG_SECONDS,
+                "question_ids": [question_uuid for question_uuid, _, _ in parsed],
+                "option_ids": [_options_literal(option_uuids) for _, option_uuids, _ in parsed],
+                "answered_at": [answered_at for _, _, answered_at in parsed],
+            },
         )
-
-        record_id = cur.fetchone()["id"]
-        print(f"临时答案保存成功，记录ID：{record_id}")
+        result_rows = cur.fetchall()
+        written = [row for row in result_rows if row["id"] is not None]
+        rejected = [row for row in result_rows if row["id"] is None]
+        if rejected:
+            conn.rollback()
+            return jsonify(
+                {
+                    "error": "题目或选项不属于该试卷",
+                    "invalid_question_ids": [row["question_id"] for row in rejected if not row["on_paper"]],
+                    "invalid_option_ids": [
+                        opt for row in rejected if row["on_paper"] for opt in row["invalid_option_ids"]
+                    ],
+                }
+            ), 400
         conn.commit()
 
-        return jsonify({"success": True, "record_id": record_id})
+        question_count = len({question_uuid for question_uuid, _, _ in parsed})
+        result = {
+            "success": True,
+            "accepted": len(written),
+            # 比库中已有答案更早、或属于已交卷那次考试的作答
+            "skipped": question_count - len(written),
+        }
+        if question_count == 1 and written:
+            result["record_id"] = written[0]["id"]
+        return jsonify(result)
 
     except Exception as e:
         print(f"保存临时答案时出错：{str(e)}")
@@ -82,6 +208,21 @@ def save_temp_answer(exam_id, user_id, question_id, selected_options):
             conn.close()
 
 
+def save_temp_answer(exam_id, user_id, question_id, selected_options, answered_at=None):
+    """保存单题临时答案"""
+    return save_temp_answers(
+        exam_id,
+        user_id,
+        [
+            {
+                "question_id": question_id,
+                "selected_options": selected_options,
+                "answered_at": answered_at,
+            }
+        ],
+    )
+
+
 def get_temp_answers(exam_id, user_id):
     """获取用户在指定考试中的所有临时答案"""
     conn = None
@@ -25,6 +25,7 @@ from celery_worker import celery_app as celery_app_instance
 
 from backend.tasks import generate_single_sentence_audio_async  # 导入新的Celery任务
 from backend.tasks import batch_generate_audio_task  # <--- 新增导入
+from backend.tasks import batch_synthesize_audio_task
 from backend.tasks import merge_all_audios_for_content  # Import the new task
 from backend.tasks import run_llm_function_async  # 导入新的Celery任务
 from backend.tasks import synthesize_video_task  # <<< 确保从 tasks 导入新任务
@@ -37,8 +38,13 @@ from backend.tasks import resplit_and_match_sentences_task  # 重新拆分后匹
 # from backend.tasks import generate_merged_audio_async # 导入新的Celery任务``
 from backend.tasks import trigger_tts_refine_async  # 导入新的Celery任务
 from sqlalchemy import func  # 导入 SQLAlchemy 的函数和操作符
-from datetime import datetime
 from backend.utils.pdf_generator import generate_alignment_pdf
+from backend.services.media_delivery import zip_stream_response
+from backend.services.sentence_split_service import (
+    bulk_create_sentences,
+    find_reusable_audios,
+    split_script_text,
+)
 
 
 tts_bp = Blueprint("tts", __name__, url_prefix="/api/tts")
@@ -1165,19 +1171,7 @@ def split_script_into_sentences_route(source_final_script_id):
             ), 500
 
         # 3. 拆分句子并尝试复用语音
-        sentences_text_list = [
-            s.strip() for s in new_final_script.content.split("\n") if s.strip()
-        ]
-        if not sentences_text_list:  # 尝试用句号分割作为备选
-            sentences_text_list = [
-                s.strip() + "。"
-                for s in new_final_script.content.split("。")
-                if s.strip()
-            ]  # 保留句号
-            if (
-                not sentences_text_list and new_final_script.content.strip()
-            ):  # 如果还有内容但无法分割，则视为一句
-                sentences_text_list = [new_final_script.content.strip()]
+        sentences_text_list = split_script_text(new_final_script.content)
 
         if not sentences_text_list:
             current_app.logger.warning(
@@ -1186,119 +1180,19 @@ def split_script_into_sentences_route(source_final_script_id):
             # 即使无法拆分，新版本的脚本也已创建。后续可以考虑是否回滚或保留。
             # 为保持简单，这里继续，让它创建一个没有句子的脚本版本。
 
-        created_sentences_count = 0
-        reused_audio_count = 0
-
-        for index, new_sentence_text in enumerate(sentences_text_list):
-            # ⭐ 将 new_sentence 的创建和 add 推迟到确定其状态之后
-            # new_sentence_obj_for_audio = None # 用于 TtsAudio 的关联
-
-            # --- 查找历史语音逻辑 ---
-            found_audio_to_reuse = None
-            # ... (您的历史语音查找逻辑，确保它不会意外地修改 session 或触发过早的 flush 失败)
-            # 假设您的查找逻辑是只读的，并且能正确返回 found_audio_to_reuse 或 None
-            historical_final_scripts_query = TtsScript.query.filter(
-                TtsScript.training_content_id == current_training_content_id,
-                TtsScript.script_type == "final_tts_script",
-                TtsScript.id != new_final_script.id,
-            ).order_by(TtsScript.version.desc())
-
-            for old_script in historical_final_scripts_query.all():
-                matching_old_sentence = TtsSentence.query.filter(
-                    TtsSentence.tts_script_id == old_script.id,
-                    TtsSentence.sentence_text == new_sentence_text,
-                ).first()
-                if matching_old_sentence:
-                    latest_valid_audio_for_old_sentence = (
-                        TtsAudio.query.filter(
-                            TtsAudio.tts_sentence_id == matching_old_sentence.id,
-                            TtsAudio.audio_type == "sentence_audio",
-                            TtsAudio.is_latest_for_sentence,
-                        )
-                        .join(TtsSentence, TtsAudio.tts_sentence_id == TtsSentence.id)
-                        .filter(TtsSentence.audio_status == "generated")
-                        .order_by(TtsAudio.created_at.desc())
-                        .first()
-                    )
-                    if latest_valid_audio_for_old_sentence:
-                        found_audio_to_reuse = latest_valid_audio_for_old_sentence
-                        break
-            # --- 查找结束 ---
-
-            # 创建 TtsSentence 对象
-            new_sentence = TtsSentence(
-                tts_script_id=new_final_script.id,  # 此时 new_final_script.id 应该是有效的 (如果是UUID)
-                sentence_text=new_sentence_text,
-                order_index=index,
-            )
-
-            if found_audio_to_reuse:
-                new_sentence.audio_status = "generated"
-                db.session.add(new_sentence)
-                try:
-                    db.session.flush()  # Flush new_sentence 以获取其 ID
-                    current_app.logger.debug(
-                        f"[SplitTask] Sentence flushed, ID: {new_sentence.id}"
-                    )
-                except Exception as e_flush_sent:
-                    current_app.logger.error(
-                        f"[SplitTask] Flush new_sentence (reused audio) 时出错: {e_flush_sent}",
-                        exc_info=True,
-                    )
-                    # 这里如果单个句子 flush 失败，是否要回滚整个操作？这是一个决策点。
-                    # 为简单起见，先继续，但标记错误。
-                    # db.session.rollback() # 如果要严格，这里应该回滚
-                    # return jsonify({'error': f'创建句子时内部错误 (flush sentence): {str(e_flush_sent)}'}), 500
-                    new_sentence.audio_status = (
-                        "error_creating_sentence_record"  # 标记一个错误状态
-                    )
-                    # continue # 或者跳过这个句子的语音记录创建
-
-                if (
-                    new_sentence.id and new_sentence.audio_status == "generated"
-                ):  # 确保句子已成功 flush 且状态正确
-                    reused_audio_entry = TtsAudio(
-                        tts_sentence_id=new_sentence.id,
-                        training_content_id=current_training_content_id,
-                        audio_type="sentence_audio",
-                        file_path=found_audio_to_reuse.file_path,
-                        duration_ms=found_audio_to_reuse.duration_ms,
-                        file_size_bytes=found_audio_to_reuse.file_size_bytes,
-                        tts_engine="ReusedHistoricalAudio",  # 更明确的引擎名
-                        voice_name=found_audio_to_reuse.voice_name,
-                        generation_params={
-                            "reused_from_audio_id": str(found_audio_to_reuse.id),
-                            "reused_at": datetime.utcnow().isoformat(),
-                        },
-                        version=1,
-                        is_latest_for_sentence=True,
-                    )
-                    db.session.add(reused_audio_entry)
-                    reused_audio_count += 1
-                    current_app.logger.info(
-                        f"[SplitTask] 句子 (新ID: {new_sentence.id}) '{new_sentence_text[:30]}...' 复用了历史语音 {found_audio_to_reuse.id}"
-                    )
-                elif (
-                    new_sentence.audio_status != "error_creating_sentence_record"
-                ):  # 如果句子创建失败，就不尝试关联语音了
-                    new_sentence.audio_status = (
-                        "pending_generation"  # 如果句子创建成功但语音关联失败
-                    )
-                    current_app.logger.warning(
-                        f"[SplitTask] 句子 '{new_sentence_text[:30]}...' 未能成功关联复用语音，状态设为 pending_generation。"
-                    )
-
-            else:  # 没有找到可复用的语音
-                new_sentence.audio_status = "pending_generation"
-                db.session.add(new_sentence)  # 添加到 session
-                # 可以选择在这里也 flush 一下，以尽早发现问题
-                # try:
-                #     db.session.flush()
-                # except Exception as e_flush_new_sent:
-                #     current_app.logger.error(f"[SplitTask] Flush new_sentence (pending gen) 时出错: {e_flush_new_sent}", exc_info=True)
-                #     new_sentence.audio_status = 'error_creating_sentence_record_no_reuse'
-
-            created_sentences_count += 1
+        # 一次查询找出历史版本中同文本的已生成语音，再批量插入句子和复用的语音记录
+        reusable_by_text = find_reusable_audios(
+            sentences_text_list,
+            current_training_content_id,
+            exclude_script_id=new_final_script.id,
+        )
+        created_sentences_count, reused_audio_count = bulk_create_sentences(
+            new_final_script.id,
+            current_training_content_id,
+            sentences_text_list,
+            reusable_by_text,
+            reuse_label="ReusedHistoricalAudio",  # 更明确的引擎名
+        )
 
         training_content.status = "pending_audio_generation"
         db.session.add(training_content)  # 确保状态更新也被加入
@@ -1500,6 +1394,16 @@ def generate_sentence_audio_route(sentence_id):
         default_pt_file_relative_path = "seed_1397_restored_emb.pt"
         # 获取 PT 文件路径 (主要用于 Gradio)
         pt_file_to_use_for_gradio = default_pt_file_relative_path
+        # 句子已有音频时，这是用户点击“重新生成”：跳过内容寻址缓存，真正调用引擎重新合成
+        has_audio = (
+            TtsAudio.query.filter_by(
+                tts_sentence_id=sentence.id, is_latest_for_sentence=True
+            ).first()
+            is not None
+        )
+        override_config["force_regenerate"] = bool(
+            request_data.get("force_regenerate", has_audio)
+        )
 
         sentence.audio_status = "processing_request"
         db.session.commit()
@@ -1596,7 +1500,16 @@ def batch_generate_audio_for_content_route(content_id):
         current_app.logger.info(
             f"==========latest_final_script======={str(latest_final_script.id)}"
         )
-        task = batch_generate_audio_task.delay(  # 假设任务变量名是这个
+        # batched: 单任务内按引擎批大小分组合成（默认）；subtasks: 每句一个子任务
+        synthesis_mode = request_data.get(
+            "synthesis_mode", current_app.config.get("TTS_BATCH_SYNTHESIS_MODE", "batched")
+        )
+        batch_task = (
+            batch_synthesize_audio_task
+            if synthesis_mode == "batched"
+            else batch_generate_audio_task
+        )
+        task = batch_task.delay(
             final_script_id_str=str(latest_final_script.id),
             tts_engine_identifier=tts_engine_to_use,
             pt_file_path_relative_for_gradio=pt_file_for_gradio
@@ -1833,10 +1746,7 @@ def export_training_materials(content_id):
     导出培训内容的所有资料，包括句子文本、音频文件和图片（如果有）。
     返回一个包含 manifest.json 和所有资源文件的 ZIP 压缩包。
     """
-    import zipfile
-    import io
     import json
-    from flask import send_file
     
     def detect_audio_extension(file_path):
         """通过读取文件头来检测音频格式"""
@@ -2012,165 +1922,148 @@ def export_training_materials(content_id):
     # 准备 manifest 数据
     manifest_data = []
     
-    # 创建内存中的 ZIP 文件
-    memory_file = io.BytesIO()
+    # ZIP 成员列表：[(压缩包内路径, 磁盘路径 或 bytes)]，响应时逐个流式写出，不在内存中拼出整个压缩包
+    zip_members = []
     
     # 记录已添加的图片，避免重复
     added_images = {}  # {image_relative_path: image_filename}
     
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # 创建 assets 文件夹结构
-        for idx, sentence in enumerate(sentences, 1):
-            slide_data = {
-                "text": sentence.sentence_text,
-                "audio_filename": None,
-                "image_filename": None,
-                "start": None,
-                "end": None
-            }
+    # 创建 assets 文件夹结构
+    for idx, sentence in enumerate(sentences, 1):
+        slide_data = {
+            "text": sentence.sentence_text,
+            "audio_filename": None,
+            "image_filename": None,
+            "start": None,
+            "end": None
+        }
+        
+        current_app.logger.info(f"[ExportMaterials] ========== 处理句子 {idx} ==========")
+        current_app.logger.info(f"[ExportMaterials] 句子ID: {sentence.id}")
+        current_app.logger.info(f"[ExportMaterials] 句子文本: {sentence.sentence_text[:50]}...")
+        current_app.logger.info(f"[ExportMaterials] 音频状态: {sentence.audio_status}")
+        
+        # 从 MergedAudioSegment 获取时间戳
+        sentence_id_str = str(sentence.id)
+        if sentence_id_str in sentence_to_timestamp:
+            timestamp_info = sentence_to_timestamp[sentence_id_str]
+            start_ms = timestamp_info['start_ms']
+            end_ms = timestamp_info['end_ms']
             
-            current_app.logger.info(f"[ExportMaterials] ========== 处理句子 {idx} ==========")
-            current_app.logger.info(f"[ExportMaterials] 句子ID: {sentence.id}")
-            current_app.logger.info(f"[ExportMaterials] 句子文本: {sentence.sentence_text[:50]}...")
-            current_app.logger.info(f"[ExportMaterials] 音频状态: {sentence.audio_status}")
+            # 转换为 SRT 格式：HH:MM:SS,mmm
+            def ms_to_srt_time(ms):
+                hours = ms // 3600000
+                ms %= 3600000
+                minutes = ms // 60000
+                ms %= 60000
+                seconds = ms // 1000
+                milliseconds = ms % 1000
+                return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
             
-            # 从 MergedAudioSegment 获取时间戳
-            sentence_id_str = str(sentence.id)
-            if sentence_id_str in sentence_to_timestamp:
-                timestamp_info = sentence_to_timestamp[sentence_id_str]
-                start_ms = timestamp_info['start_ms']
-                end_ms = timestamp_info['end_ms']
-                
-                # 转换为 SRT 格式：HH:MM:SS,mmm
-                def ms_to_srt_time(ms):
-                    hours = ms // 3600000
-                    ms %= 3600000
-                    minutes = ms // 60000
-                    ms %= 60000
-                    seconds = ms // 1000
-                    milliseconds = ms % 1000
-                    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
-                
-                start_time_str = ms_to_srt_time(start_ms)
-                end_time_str = ms_to_srt_time(end_ms)
-                slide_data["start"] = start_time_str
-                slide_data["end"] = end_time_str
-                
-                current_app.logger.info(
-                    f"[ExportMaterials] ✓ 句子 {idx} 时间戳: {start_time_str} --> {end_time_str} "
-                    f"({start_ms}-{end_ms}ms)"
-                )
-            else:
-                current_app.logger.warning(
-                    f"[ExportMaterials] ✗ 句子 {idx} 在 MergedAudioSegment 中没有找到时间戳"
+            start_time_str = ms_to_srt_time(start_ms)
+            end_time_str = ms_to_srt_time(end_ms)
+            slide_data["start"] = start_time_str
+            slide_data["end"] = end_time_str
+            
+            current_app.logger.info(
+                f"[ExportMaterials] ✓ 句子 {idx} 时间戳: {start_time_str} --> {end_time_str} "
+                f"({start_ms}-{end_ms}ms)"
+            )
+        else:
+            current_app.logger.warning(
+                f"[ExportMaterials] ✗ 句子 {idx} 在 MergedAudioSegment 中没有找到时间戳"
+            )
+        
+        # 处理音频文件
+        if sentence.audio_status == 'generated':
+            # 获取最新的音频
+            latest_audio = (
+                TtsAudio.query.filter_by(
+                    tts_sentence_id=sentence.id,
+                    audio_type='sentence_audio'
                 )
+                .order_by(TtsAudio.created_at.desc())
+                .first()
+            )
             
-            # 处理音频文件
-            if sentence.audio_status == 'generated':
-                # 获取最新的音频
-                latest_audio = (
-                    TtsAudio.query.filter_by(
-                        tts_sentence_id=sentence.id,
-                        audio_type='sentence_audio'
-                    )
-                    .order_by(TtsAudio.created_at.desc())
-                    .first()
+            if latest_audio and latest_audio.file_path:
+                audio_path = os.path.join(
+                    current_app.config.get('TTS_AUDIO_FOLDER', 'backend/static/tts_audio'),
+                    latest_audio.file_path
                 )
                 
-                if latest_audio and latest_audio.file_path:
-                    audio_path = os.path.join(
-                        current_app.config.get('TTS_AUDIO_FOLDER', 'backend/static/tts_audio'),
-                        latest_audio.file_path
-                    )
+                if os.path.exists(audio_path):
+                    # 从数据库路径获取扩展名
+                    audio_ext = os.path.splitext(latest_audio.file_path)[1]
                     
-                    if os.path.exists(audio_path):
-                        # 从数据库路径获取扩展名
-                        audio_ext = os.path.splitext(latest_audio.file_path)[1]
-                        
-                        # 如果数据库中没有扩展名，通过文件内容检测
-                        if not audio_ext or audio_ext == '.bin':
-                            audio_ext = detect_audio_extension(audio_path)
-                        
-                        audio_filename = f"audio_{idx}{audio_ext}"
-                        slide_data["audio_filename"] = audio_filename
-                        
-                        # 添加到 ZIP
-                        try:
-                            with open(audio_path, 'rb') as audio_file:
-                                zf.writestr(f"assets/{audio_filename}", audio_file.read())
-                        except Exception as e:
-                            current_app.logger.warning(f"无法读取音频文件 {audio_path}: {e}")
-            else:
-                current_app.logger.warning(f"[ExportMaterials] ✗ 句子 {idx} 音频状态不是 generated: {sentence.audio_status}")
-            
-            current_app.logger.info(f"[ExportMaterials] 句子 {idx} 最终 slide_data: {slide_data}")
-            current_app.logger.info(f"[ExportMaterials] ========================================")
+                    # 如果数据库中没有扩展名，通过文件内容检测
+                    if not audio_ext or audio_ext == '.bin':
+                        audio_ext = detect_audio_extension(audio_path)
+                    
+                    audio_filename = f"audio_{idx}{audio_ext}"
+                    slide_data["audio_filename"] = audio_filename
+                    
+                    # 加入 ZIP（响应发送时再从磁盘流式读取）
+                    zip_members.append((f"assets/{audio_filename}", audio_path))
+        else:
+            current_app.logger.warning(f"[ExportMaterials] ✗ 句子 {idx} 音频状态不是 generated: {sentence.audio_status}")
+        
+        current_app.logger.info(f"[ExportMaterials] 句子 {idx} 最终 slide_data: {slide_data}")
+        current_app.logger.info(f"[ExportMaterials] ========================================")
+        
+        # 处理图片文件（根据句子ID从映射中获取）
+        sentence_id_str = str(sentence.id)
+        if sentence_id_str in sentence_to_image:
+            image_relative_path = sentence_to_image[sentence_id_str]
             
-            # 处理图片文件（根据句子ID从映射中获取）
-            sentence_id_str = str(sentence.id)
-            if sentence_id_str in sentence_to_image:
-                image_relative_path = sentence_to_image[sentence_id_str]
+            # 检查是否已经添加过这张图片
+            if image_relative_path in added_images:
+                # 直接使用已有的文件名
+                slide_data["image_filename"] = added_images[image_relative_path]
+                current_app.logger.info(
+                    f"[ExportMaterials] 句子 {idx} 复用已添加的图片: {added_images[image_relative_path]}"
+                )
+            else:
+                # 第一次遇到这张图片，需要添加到 ZIP
+                # 图片可能在 instance/uploads 或其他位置
+                # 尝试多个可能的路径
+                possible_paths = [
+                    os.path.join(current_app.config.get('UPLOAD_FOLDER', 'instance/uploads'), image_relative_path),
+                    image_relative_path,  # 如果是绝对路径
+                ]
                 
-                # 检查是否已经添加过这张图片
-                if image_relative_path in added_images:
-                    # 直接使用已有的文件名
-                    slide_data["image_filename"] = added_images[image_relative_path]
+                image_path = None
+                for path in possible_paths:
+                    if os.path.exists(path):
+                        image_path = path
+                        break
+                
+                if image_path and os.path.exists(image_path):
+                    # 生成新的文件名（使用图片计数而不是句子索引）
+                    image_ext = os.path.splitext(image_relative_path)[1] or '.jpg'
+                    image_counter = len(added_images) + 1
+                    image_filename = f"image_{image_counter}{image_ext}"
+                    slide_data["image_filename"] = image_filename
+                    
+                    # 加入 ZIP（响应发送时再从磁盘流式读取）
+                    zip_members.append((f"assets/{image_filename}", image_path))
+                    added_images[image_relative_path] = image_filename
                     current_app.logger.info(
-                        f"[ExportMaterials] 句子 {idx} 复用已添加的图片: {added_images[image_relative_path]}"
+                        f"[ExportMaterials] 成功添加图片: {image_filename} <- {image_relative_path}"
                     )
                 else:
-                    # 第一次遇到这张图片，需要添加到 ZIP
-                    # 图片可能在 instance/uploads 或其他位置
-                    # 尝试多个可能的路径
-                    possible_paths = [
-                        os.path.join(current_app.config.get('UPLOAD_FOLDER', 'instance/uploads'), image_relative_path),
-                        image_relative_path,  # 如果是绝对路径
-                    ]
-                    
-                    image_path = None
-                    for path in possible_paths:
-                        if os.path.exists(path):
-                            image_path = path
-                            break
-                    
-                    if image_path and os.path.exists(image_path):
-                        # 生成新的文件名（使用图片计数而不是句子索引）
-                        image_ext = os.path.splitext(image_relative_path)[1] or '.jpg'
-                        image_counter = len(added_images) + 1
-                        image_filename = f"image_{image_counter}{image_ext}"
-                        slide_data["image_filename"] = image_filename
-                        
-                        # 添加到 ZIP
-                        try:
-                            with open(image_path, 'rb') as image_file:
-                                zf.writestr(f"assets/{image_filename}", image_file.read())
-                            added_images[image_relative_path] = image_filename
-                            current_app.logger.info(
-                                f"[ExportMaterials] 成功添加图片: {image_filename} <- {image_relative_path}"
-                            )
-                        except Exception as e:
-                            current_app.logger.warning(f"无法读取图片文件 {image_path}: {e}")
-                    else:
-                        current_app.logger.warning(f"[ExportMaterials] 找不到图片文件: {image_relative_path}")
-            
-            manifest_data.append(slide_data)
+                    current_app.logger.warning(f"[ExportMaterials] 找不到图片文件: {image_relative_path}")
         
-        # 添加 manifest.json 到 ZIP
-        manifest_json = json.dumps(manifest_data, ensure_ascii=False, indent=2)
-        zf.writestr("manifest.json", manifest_json)
+        manifest_data.append(slide_data)
     
-    # 重置文件指针到开始位置
-    memory_file.seek(0)
+    # 添加 manifest.json 到 ZIP
+    manifest_json = json.dumps(manifest_data, ensure_ascii=False, indent=2)
+    zip_members.append(("manifest.json", manifest_json.encode("utf-8")))
     
     # 生成下载文件名
     download_filename = f"{content.content_name}_materials.zip"
     
-    return send_file(
-        memory_file,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=download_filename
-    )
+    return zip_stream_response(zip_members, download_filename)
 
 
 @tts_bp.route("/content/<uuid:content_id>/video-synthesis/latest", methods=["GET"])
@@ -2200,6 +2093,7 @@ def get_latest_synthesis_task_for_content(content_id):
                 {
                     "id": str(latest_task.id),
                     "status": latest_task.status,
+                    "progress": latest_task.progress,
                     "video_script_json": latest_task.video_script_json,
                     "ppt_image_paths": latest_task.ppt_image_paths,
                     "generated_resource_id": str(latest_task.generated_resource_id)
@@ -2342,6 +2236,7 @@ def trigger_video_synthesis(synthesis_id):
 
     try:
         synthesis_task.status = "synthesizing"  # 更新状态为“合成中”
+        synthesis_task.progress = 0
         db.session.commit()
 
         # 触发视频合成的异步任务
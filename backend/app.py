@@ -10,7 +10,7 @@ import re
 from pypinyin import pinyin, Style
 from backend.security_utils import generate_password_hash
 from werkzeug.security import check_password_hash
-from psycopg2.extras import RealDictCursor, register_uuid 
+from psycopg2.extras import RealDictCursor, execute_values, register_uuid
 
 # from flask_sqlalchemy import SQLAlchemy # 如果你打算用 ORM，虽然 Flask-Migrate 不强制
 # from flask_migrate import Migrate # 导入 Migrate
@@ -33,6 +33,7 @@ from .extensions import db, migrate
 # -----------------------
 from backend.api.temp_answer import (
     save_temp_answer,
+    save_temp_answers,
     get_temp_answers,
     mark_temp_answers_submitted,
 )  # 使用绝对导入
@@ -42,7 +43,17 @@ from backend.api.evaluation import (
     update_evaluation,
 )
 from backend.api.user_profile import get_user_profile
-from backend.db import get_db_connection
+from backend.db import get_db_connection, pool_stats
+from backend.services.media_delivery import send_media_file
+from backend.services.exam_paper_cache import (
+    answer_key_for_paper,
+    answer_key_for_questions,
+    candidate_paper,
+    grade_answer,
+    invalidate_exam_paper,
+    paper_detail,
+    paper_questions,
+)
 from backend.models import db, UserCourseAccess, User  #
 # from backend.tasks import run_llm_function_async  # <<<--- 确保导入通用任务
 
@@ -132,6 +143,13 @@ app.config["TTS_AUDIO_STORAGE_PATH"] = os.path.join(
 # 并且 Flask (或 Nginx) 配置为可以服务这个目录下的文件。
 # 对于API返回的URL，您可能还需要一个基础URL
 app.config["TTS_AUDIO_BASE_URL_FOR_API"] = "/static/tts_audio"  # 前端拼接时用的基础路径
+# 由 nginx 直接发送媒体文件：{本地目录: nginx internal location}。
+# 未配置时由 send_file 发送（gunicorn 下走 sendfile），配置后 Flask 只返回 X-Accel-Redirect 头。
+app.config["MEDIA_ACCEL_REDIRECT"] = {}
+if os.environ.get("TTS_AUDIO_ACCEL_LOCATION"):
+    app.config["MEDIA_ACCEL_REDIRECT"][app.config["TTS_AUDIO_STORAGE_PATH"]] = os.environ["TTS_AUDIO_ACCEL_LOCATION"]
+if os.environ.get("UPLOADS_ACCEL_LOCATION"):
+    app.config["MEDIA_ACCEL_REDIRECT"][os.path.join(app.instance_path, "uploads")] = os.environ["UPLOADS_ACCEL_LOCATION"]
 app.config["DEFAULT_GRADIO_PT_FILE_PATH"] = (
     "seed_1397_restored_emb.pt"  # 默认的 Gradio 模型文件路径
 )
@@ -168,6 +186,15 @@ app.config["DEFAULT_TTS_CONFIG"] = {
     "system_prompt": "你是一名专业的育儿嫂培训师，请用口语化的培训师的口吻以及标准的普通话来讲解以下内容：",
 }
 
+# 批量生成语音的方式：batched（单任务按引擎批大小分组合成）或 subtasks（每句一个子任务）
+app.config["TTS_BATCH_SYNTHESIS_MODE"] = os.environ.get("TTS_BATCH_SYNTHESIS_MODE", "batched")
+
+# 视频合成：幻灯片按此宽度直接渲染（高度按第一页比例计算），预览图、视频帧、对齐稿 PDF 共用同一份缓存
+app.config["VIDEO_SLIDE_WIDTH"] = int(os.environ.get("VIDEO_SLIDE_WIDTH", "1920"))
+# 视频编码方式：static（每页静止图片单独编码后拼接，低帧率）或 moviepy（逐帧合成，24fps）
+app.config["VIDEO_SYNTHESIS_MODE"] = os.environ.get("VIDEO_SYNTHESIS_MODE", "static")
+app.config["VIDEO_STATIC_FPS"] = int(os.environ.get("VIDEO_STATIC_FPS", "5"))
+
 # 默认的 Gradio 参数
 app.config["DEFAULT_GRADIO_PARAMS"] = {
     "num_seeds": 1,
@@ -299,6 +326,16 @@ os.makedirs(AVATAR_DATA_FOLDER, exist_ok=True)  # 确保目录存在
 # 确保你的 DATABASE_URL 环境变量设置正确
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False  # 建议关闭
+# 连接池：ORM 与 backend/db.get_db_connection() 的原生 psycopg2 查询共用这一个池，
+# 每个进程最多 DB_POOL_SIZE + DB_MAX_OVERFLOW 个连接，池满时最多等待 DB_POOL_TIMEOUT 秒
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+    "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": True,
+    "connect_args": {"client_encoding": "utf8"},
+}
 
 # db = SQLAlchemy(app) # 初始化 SQLAlchemy
 # migrate = Migrate(app, db) # 初始化 Flask-Migrate
@@ -1234,7 +1271,8 @@ def update_knowledge_point(point_id):
             """
             UPDATE knowledgepoint 
             SET point_name = %s,
-                course_id = %s
+                course_id = %s,
+                updated_at = NOW()
             WHERE id = %s
             RETURNING id, point_name, course_id
         """,
@@ -1242,6 +1280,7 @@ def update_knowledge_point(point_id):
         )
         updated_point = cur.fetchone()
         conn.commit()
+        invalidate_exam_paper()
         return jsonify(updated_point)
     except Exception as e:
         conn.rollback()
@@ -1275,6 +1314,7 @@ def delete_knowledge_point(point_id):
             return jsonify({"error": "知识点不存在"}), 404
 
         conn.commit()
+        invalidate_exam_paper()
         return jsonify({"message": "知识点删除成功"})
     except Exception as e:
         conn.rollback()
@@ -1441,7 +1481,8 @@ def update_question(question_id):
             SET question_text = %s,
                 question_type = %s,
                 difficulty = %s,
-                knowledge_point_id = %s
+                knowledge_point_id = %s,
+                updated_at = NOW()
             WHERE id = %s::uuid
             RETURNING id, question_text, question_type, difficulty, knowledge_point_id
         """
@@ -1463,7 +1504,8 @@ def update_question(question_id):
             UPDATE answer 
             SET answer_text = %s,
                 explanation = %s,
-                source = %s
+                source = %s,
+                updated_at = NOW()
             WHERE question_id = %s::uuid
             RETURNING answer_text, explanation, source
         """
@@ -1507,6 +1549,7 @@ def update_question(question_id):
                 question["options"].append(cur.fetchone())
 
         conn.commit()
+        invalidate_exam_paper()
         return jsonify(question)
     except Exception as e:
         conn.rollback()
@@ -1672,6 +1715,7 @@ def delete_question(question_id):
             return jsonify({"error": "Question not found"}), 404
 
         conn.commit()
+        invalidate_exam_paper()
         return jsonify({"message": "Question deleted successfully", "id": question_id})
     except Exception as e:
         conn.rollback()
@@ -2195,7 +2239,8 @@ def update_course(course_id):
             UPDATE trainingcourse
             SET course_name = %s,
                 age_group = %s,
-                description = %s
+                description = %s,
+                updated_at = NOW()
             WHERE id = %s
             RETURNING id, course_name, age_group, description, created_at, updated_at
         """,
@@ -2208,6 +2253,8 @@ def update_course(course_id):
         )
         updated_course = cur.fetchone()
         conn.commit()
+        # 试卷的考生视图和详情中包含课程名称
+        invalidate_exam_paper()
         return jsonify(updated_course)
     except Exception as e:
         conn.rollback()
@@ -2494,47 +2541,8 @@ def get_exam(exam_id):
         if not exam:
             return jsonify({"error": "Exam not found"}), 404
 
-        # 获取试卷中的所有题目及其选项
-        cur.execute(
-            """
-            WITH option_numbers AS (
-                SELECT 
-                    id,
-                    question_id,
-                    option_text,
-                    is_correct,
-                    (ROW_NUMBER() OVER (PARTITION BY question_id ORDER BY id) - 1)::integer as option_index
-                FROM option
-            )
-            SELECT 
-                q.id,
-                q.question_type,
-                q.question_text,
-                a.explanation,
-                kp.id as knowledge_point_id,
-                kp.point_name as knowledge_point_name,
-                tc.course_name,
-                array_agg(json_build_object(
-                    'id', o.id,
-                    'option_text', o.option_text,
-                    'index', o.option_index,
-                    'is_correct', o.is_correct
-                ) ORDER BY o.option_index) as options
-            FROM exampaperquestion epq
-            JOIN question q ON epq.question_id = q.id
-            LEFT JOIN option_numbers o ON q.id = o.question_id
-            LEFT JOIN answer a ON q.id = a.question_id
-            LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id
-            LEFT JOIN trainingcourse tc ON kp.course_id = tc.id
-            WHERE epq.exam_paper_id = %s
-            GROUP BY q.id, q.question_type, q.question_text, a.explanation, kp.id, kp.point_name, tc.course_name, epq.created_at
-            ORDER BY epq.created_at ASC
-        """,
-            (exam_id,),
-        )
-
-        questions = cur.fetchall()
-        exam["questions"] = [dict(q) for q in questions]
+        # 获取试卷中的所有题目及其选项（按试卷版本缓存）
+        exam["questions"] = paper_questions(cur, exam_id) or []
         # print("SQL查询结果：==========>", exam)
         return jsonify(exam)
     except Exception as e:
@@ -2551,80 +2559,12 @@ def get_exam_detail(exam_id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
-        # 获取试卷基本信息和相关课程
-        cur.execute(
-            """
-            WITH exam_courses AS (
-                SELECT DISTINCT
-                    ep.id as exam_id,
-                    array_agg(DISTINCT tc.course_name) as course_names
-                FROM exampaper ep
-                JOIN exampapercourse epc ON ep.id = epc.exam_paper_id
-                JOIN trainingcourse tc ON epc.course_id = tc.id
-                WHERE ep.id = %s
-                GROUP BY ep.id
-            )
-            SELECT 
-                e.id,
-                e.title,
-                e.description,
-                e.created_at,
-                COALESCE(ec.course_names, ARRAY[]::text[]) as course_names
-            FROM exampaper e
-            LEFT JOIN exam_courses ec ON e.id = ec.exam_id
-            WHERE e.id = %s
-            GROUP BY e.id, e.title, e.description, e.created_at, ec.course_names
-        """,
-            (exam_id, exam_id),
-        )
-        exam = cur.fetchone()
-        # print("SQL查询结果：", exam)
+        # 试卷基本信息、相关课程与全部题目（按试卷版本缓存）
+        exam = paper_detail(cur, exam_id)
 
         if not exam:
             return jsonify({"error": "试卷不存在"}), 404
 
-        # 获取试卷中的所有题目及其选项
-        cur.execute(
-            """
-            WITH option_numbers AS (
-                SELECT 
-                    id,
-                    question_id,
-                    option_text,
-                    is_correct,
-                    (ROW_NUMBER() OVER (PARTITION BY question_id ORDER BY id) - 1)::integer as option_index
-                FROM option
-            )
-            SELECT 
-                q.id,
-                q.question_type,
-                q.question_text,
-                a.explanation,
-                kp.id as knowledge_point_id,
-                kp.point_name as knowledge_point_name,
-                tc.course_name,
-                array_agg(json_build_object(
-                    'id', o.id,
-                    'option_text', o.option_text,
-                    'index', o.option_index,
-                    'is_correct', o.is_correct
-                ) ORDER BY o.option_index) as options
-            FROM exampaperquestion epq
-            JOIN question q ON epq.question_id = q.id
-            LEFT JOIN option_numbers o ON q.id = o.question_id
-            LEFT JOIN answer a ON q.id = a.question_id
-            LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id
-            LEFT JOIN trainingcourse tc ON kp.course_id = tc.id
-            WHERE epq.exam_paper_id = %s
-            GROUP BY q.id, q.question_type, q.question_text, a.explanation, kp.id, kp.point_name, tc.course_name, epq.created_at
-            ORDER BY epq.created_at ASC
-        """,
-            (exam_id,),
-        )
-
-        questions = cur.fetchall()
-        exam["questions"] = [dict(q) for q in questions]
-
         return jsonify(exam)
     except Exception as e:
         print("Error in get_exam_record_detail:", str(e))
@@ -2655,7 +2595,7 @@ def update_exam(exam_id):
         cur.execute(
             """
             UPDATE exampaper
-            SET title = %s, description = %s
+            SET title = %s, description = %s, updated_at = NOW()
             WHERE id = %s
         """,
             (title, description, exam_id),
@@ -2681,6 +2621,7 @@ def update_exam(exam_id):
             )
 
         conn.commit()
+        invalidate_exam_paper(exam_id)
         return jsonify({"success": True})
     except Exception as e:
         conn.rollback()
@@ -2697,77 +2638,13 @@ def get_exam_for_taking(exam_id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
-        # 获取考卷基本信息
-        cur.execute(
-            """
-            SELECT 
-                e.id,
-                e.title,
-                e.description,
-                e.created_at,
-                json_agg(json_build_object(
-                    'id', tc.id,
-                    'name', tc.course_name
-                )) as courses
-            FROM exampaper e
-            LEFT JOIN exampapercourse epc ON e.id = epc.exam_paper_id
-            LEFT JOIN trainingcourse tc ON epc.course_id = tc.id
-            WHERE e.id = %s
-            GROUP BY e.id, e.title, e.description, e.created_at
-        """,
-            (exam_id,),
-        )
-        exam = cur.fetchone()
+        # 编译好的考生视图（不含正确答案），按试卷 ID + 版本缓存，多数请求直接命中
+        compiled = candidate_paper(cur, exam_id)
 
-        if not exam:
+        if not compiled:
             return jsonify({"error": "Exam not found"}), 404
 
-        # 获取考卷中的题目（不包含正确答案）
-        cur.execute(
-            """
-            SELECT 
-                q.id,
-                q.question_type,
-                q.question_text,
-                q.knowledge_point_id,
-                kp.course_id,
-                epq.id as exam_paper_question_id,
-                json_agg(
-                    json_build_object(
-                        'id', o.id,
-                        'content', o.option_text,
-                        'is_correct', o.is_correct
-                    ) ORDER BY o.id
-                ) as options
-            FROM exampaperquestion epq
-            JOIN question q ON epq.question_id = q.id
-            LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id
-            LEFT JOIN option o ON q.id = o.question_id
-            WHERE epq.exam_paper_id = %s
-            GROUP BY 
-                q.id,
-                q.question_type,
-                q.question_text,
-                q.knowledge_point_id,
-                kp.course_id,
-                epq.id
-            ORDER BY epq.created_at ASC
-        """,
-            (exam_id,),
-        )
-
-        questions = cur.fetchall()
-        # print(questions)
-        # 按题型分组
-        grouped_questions = {"single": [], "multiple": []}
-
-        for q in questions:
-            if q["question_type"] == "单选题":
-                grouped_questions["single"].append(q)
-            elif q["question_type"] == "多选题":
-                grouped_questions["multiple"].append(q)
-        # print(grouped_questions)
-        return jsonify({"exam": exam, "questions": grouped_questions})
+        return jsonify(compiled)
 
     except Exception as e:
         print("Error in get_exam_for_taking:", str(e))
@@ -2883,8 +2760,8 @@ def submit_exam_answer(exam_id):
         # 此处返回的是 此次参与考试的id
         exam_take_id = cur.fetchone()["id"]
 
-        # print("answer====",answers)
-
+        # 先校验并整理所有作答，再一次性取出整张试卷的答案（按试卷版本缓存）
+        graded_answers = []
         for answer in answers:
             question_id = answer.get("question_id")
             selected_options = answer.get("selected_options", [])
@@ -2907,190 +2784,84 @@ def submit_exam_answer(exam_id):
                 logger.error(f"Invalid UUID in selected_options: {str(e)}")
                 continue
 
-            # Get question info and correct answers
-            cur.execute(
-                """
-                WITH option_with_index AS (
-                    SELECT
-                        id,
-                        question_id,
-                        option_text,
-                        is_correct,
-                        chr(65 + (ROW_NUMBER() OVER (PARTITION BY question_id ORDER BY id) - 1)::integer) AS option_char
-                    FROM option
-                    WHERE question_id = %s
-                ),
-                correct_options AS (
-                  SELECT
-                        question_id,
-                        array_agg(id) as correct_option_ids,
-                        array_agg(option_char) AS correct_answer_chars
-                    FROM option_with_index
-                    WHERE is_correct
-                    GROUP BY question_id
-                )
-                SELECT
-                    q.id,
-                    q.question_type,
-                    q.question_text,
-                    a.explanation,
-                    co.correct_answer_chars,
-                    co.correct_option_ids,
-                    kp.point_name as knowledge_point_name,   -- 添加知识点名称
-                    json_agg(
-                        json_build_object(
-                            'id', owi.id,
-                            'content', owi.option_text,
-                            'is_correct', owi.is_correct,
-                            'char', owi.option_char
-                        ) ORDER BY owi.option_char
-                    ) AS options
-                FROM question q
-                LEFT JOIN answer a ON q.id = a.question_id
-                LEFT JOIN option_with_index owi ON q.id = owi.question_id
-                LEFT JOIN correct_options co ON q.id = co.question_id
-                LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id  -- 直接 JOIN knowledge_point 表
-                WHERE q.id = %s
-                GROUP BY q.id, q.question_type, q.question_text, a.explanation, co.correct_answer_chars, co.correct_option_ids, kp.point_name;
-            """,
-                (question_id, question_id),
-            )
-
-            question_info = cur.fetchone()
+            graded_answers.append((question_id, selected_options))
+
+        answer_key = answer_key_for_paper(cur, exam_uuid)
+        # 兼容提交了不在该试卷中的题目：这些题目再用一条查询补齐
+        missing_question_ids = [
+            question_id
+            for question_id, _ in graded_answers
+            if question_id not in answer_key
+        ]
+        if missing_question_ids:
+            answer_key = {
+                **answer_key,
+                **answer_key_for_questions(cur, missing_question_ids),
+            }
 
-            # print("question_info:",question_info)
+        # 在内存中判分，答题记录一条批量 INSERT 写入
+        answer_rows = []
+        for question_id, selected_options in graded_answers:
+            question_info = answer_key.get(question_id)
             if not question_info:
                 logger.warning(f"No question info found for question_id: {question_id}")
                 continue
 
-            # Calculate score
-            is_correct = False
-            score = 0
-
-            if question_info["question_type"] == "单选题":
-                # Ensure correct_option_ids are strings
-                correct_option_ids = []
-                for opt in question_info["correct_option_ids"]:
-                    if isinstance(opt, uuid.UUID):
-                        correct_option_ids.append(str(opt))
-                    else:
-                        correct_option_ids.append(str(uuid.UUID(opt)))
-
-                # Convert selected option to string
-                selected_option_str = ""
-                if selected_options:
-                    if isinstance(selected_options[0], uuid.UUID):
-                        selected_option_str = str(selected_options[0])
-                    else:
-                        selected_option_str = str(uuid.UUID(selected_options[0]))
-
-                is_correct = (
-                    len(selected_options) == 1
-                    and selected_option_str in correct_option_ids
-                )
-                score = 1 if is_correct else 0
-            elif question_info["question_type"] == "多选题":
-                # Handle correct_option_ids
-                if isinstance(question_info["correct_option_ids"], str):
-                    correct_options = (
-                        question_info["correct_option_ids"].strip("{}").split(",")
-                    )
-                    correct_options = [
-                        str(uuid.UUID(opt.strip()))
-                        for opt in correct_options
-                        if opt.strip()
-                    ]
-                else:
-                    correct_options = []
-                    for opt in question_info["correct_option_ids"]:
-                        if isinstance(opt, uuid.UUID):
-                            correct_options.append(str(opt))
-                        else:
-                            correct_options.append(str(uuid.UUID(opt)))
-
-                # Handle selected_options
-                selected_options_str = []
-                for opt in selected_options:
-                    if isinstance(opt, uuid.UUID):
-                        selected_options_str.append(str(opt))
-                    else:
-                        selected_options_str.append(str(uuid.UUID(opt)))
-
-                selected_set = set(selected_options_str)
-                correct_set = set(correct_options)
-
-                is_correct = selected_set == correct_set
-                score = 2 if is_correct else 0
-
-            # Record answer
-            try:
-                # Convert selected_options to PostgreSQL array literal
-                if not isinstance(selected_options, list):
-                    selected_options = [selected_options]
-
-                # Ensure all options are valid UUID strings
-                selected_options_array = []
-                for opt in selected_options:
-                    if isinstance(opt, uuid.UUID):
-                        selected_options_array.append(str(opt))
-                    else:
-                        selected_options_array.append(str(uuid.UUID(opt)))
-
-                selected_options_literal = "{" + ",".join(selected_options_array) + "}"
-                cur.execute(
-                    """
-                    INSERT INTO answerrecord (
-                        exam_paper_id,
-                        exam_id,
-                        question_id,
-                        selected_option_ids,
-                        user_id,
-                        score,
-                        created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                    RETURNING id;
-                """,
-                    (
-                        exam_uuid,
-                        exam_take_id,
-                        question_id,
-                        selected_options_literal,
-                        user_uuid,
-                        score,
-                    ),
+            is_correct, score = grade_answer(question_info, selected_options)
+            answer_rows.append(
+                (
+                    exam_uuid,
+                    exam_take_id,
+                    question_id,
+                    "{" + ",".join(selected_options) + "}",
+                    user_uuid,
+                    score,
                 )
+            )
 
-                # answer_record_id = cur.fetchone()["id"]
-
-                # 构建结果对象
-                result = {
-                    "id": question_id,
-                    "question_text": question_info["question_text"],
-                    "question_type": question_info["question_type"],
-                    "knowledge_point_name": question_info["knowledge_point_name"],
-                    "selected_option_ids": selected_options,
-                    "options": question_info["options"],
-                    "score": score,
-                    "is_correct": is_correct,
-                    "explanation": question_info["explanation"],
-                }
-                kp_coreect = {
-                    "knowledge_point_name": question_info.get(
-                        "knowledge_point_name", "未知知识点"
-                    ),
-                    "if_get": "已掌握"
-                    if is_correct
-                    else "未掌握",  # Python 的三元条件表达式
-                }
+            # 构建结果对象
+            result = {
+                "id": question_id,
+                "question_text": question_info["question_text"],
+                "question_type": question_info["question_type"],
+                "knowledge_point_name": question_info["knowledge_point_name"],
+                "selected_option_ids": selected_options,
+                "options": question_info["options"],
+                "score": score,
+                "is_correct": is_correct,
+                "explanation": question_info["explanation"],
+            }
+            kp_coreect = {
+                "knowledge_point_name": question_info.get(
+                    "knowledge_point_name", "未知知识点"
+                ),
+                "if_get": "已掌握"
+                if is_correct
+                else "未掌握",  # Python 的三元条件表达式
+            }
 
-                results.append(result)
-                kp_coreects.append(kp_coreect)
-                total_score += score
+            results.append(result)
+            kp_coreects.append(kp_coreect)
+            total_score += score
 
-            except Exception as e:
-                logger.error(f"Error recording answer: {str(e)}")
-                conn.rollback()
-                continue
+        if answer_rows:
+            execute_values(
+                cur,
+                """
+                INSERT INTO answerrecord (
+                    exam_paper_id,
+                    exam_id,
+                    question_id,
+                    selected_option_ids,
+                    user_id,
+                    score,
+                    created_at
+                ) VALUES %s
+            """,
+                answer_rows,
+                template="(%s, %s, %s, %s, %s, %s, NOW())",
+                page_size=500,
+            )
 
         # Commit the transaction
         conn.commit()
@@ -3171,6 +2942,7 @@ def delete_exam(exam_id):
                 cur.execute("DELETE FROM exampaper WHERE id = %s", (exam_id,))
 
                 conn.commit()
+                invalidate_exam_paper(exam_id)
 
         return jsonify({"message": "Exam deleted successfully"}), 200
 
@@ -3488,10 +3260,16 @@ def get_questions():
 def save_temp_answer_route(exam_id):
     data = request.json
     user_id = data.get("user_id")
+    # 支持一次提交多题的增量：{"user_id", "answers": [{"question_id", "selected_options", "answered_at"}]}
+    if "answers" in data:
+        return save_temp_answers(exam_id, user_id, data.get("answers") or [])
+
     question_id = data.get("question_id")
     selected_options = data.get("selected_options", [])
 
-    return save_temp_answer(exam_id, user_id, question_id, selected_options)
+    return save_temp_answer(
+        exam_id, user_id, question_id, selected_options, data.get("answered_at")
+    )
 
 
 @app.route("/api/exams/<exam_id>/temp-answers/<user_id>", methods=["GET"])
@@ -3725,6 +3503,7 @@ def patch_exam(exam_id):
 
         updated_exam = cur.fetchone()
         conn.commit()
+        invalidate_exam_paper(exam_id)
         return jsonify(updated_exam)
     except Exception as e:
         conn.rollback()
@@ -4213,6 +3992,15 @@ def delete_evaluation_route(evaluation_id):
         conn.close()
 
 
+@app.route("/api/admin/db-pool-stats", methods=["GET"])
+@jwt_required()
+def db_pool_stats_route():
+    """本进程数据库连接池的借出等待、占用时长与当前状态（仅管理员）。"""
+    if get_jwt().get("role") != "admin":
+        return jsonify({"error": "需要管理员权限"}), 403
+    return jsonify(pool_stats())
+
+
 @app.route("/api/users/sync", methods=["POST"])
 def user_sync_api():
     """用户数据同步API，供其他业务系统调用"""
@@ -4477,16 +4265,9 @@ def serve_tts_audio(filepath):
         return jsonify({"error": "文件未找到"}), 404
 
     try:
-        # send_from_directory 会自动处理 Content-Type
-        # directory 参数应该是文件的父目录，filename 是文件名
-        directory = os.path.dirname(full_path_to_file)
-        filename = os.path.basename(full_path_to_file)
-        current_app.logger.info(
-            f"Serving audio file: directory='{directory}', filename='{filename}'"
-        )
-        return send_from_directory(
-            directory, filename, as_attachment=False
-        )  # as_attachment=False 表示浏览器直接播放
+        current_app.logger.info(f"Serving audio file: '{full_path_to_file}'")
+        # as_attachment=False 表示浏览器直接播放；Range/ETag 由 send_media_file 处理
+        return send_media_file(full_path_to_file, as_attachment=False)
     except Exception as e:
         current_app.logger.error(f"服务音频文件 {filepath} 时出错: {e}", exc_info=True)
         return jsonify({"error": "服务文件时出错"}), 500
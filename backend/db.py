@@ -2,7 +2,11 @@
 import psycopg2
 import os
 import logging
+import threading
+import time
 from dotenv import load_dotenv
+from flask import has_app_context
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 load_dotenv()
 
@@ -20,13 +24,148 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 log.addHandler(handler)
 
+# 借连接等待超过该毫秒数时记一条警告，便于发现连接池过小
+SLOW_CHECKOUT_MS = float(os.environ.get("DB_SLOW_CHECKOUT_MS", "200"))
 
-def get_db_connection():
-    try:
+
+class _PoolMetrics:
+    """进程内累计的借出统计：等待时间、占用时间、超时次数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.held_ms_total = 0.0
+        self.held_ms_max = 0.0
+
+    def checked_out(self, wait_ms):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def checked_in(self, held_ms):
+        with self._lock:
+            self.in_use -= 1
+            self.held_ms_total += held_ms
+            self.held_ms_max = max(self.held_ms_max, held_ms)
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            checkouts = self.checkouts or 1
+            return {
+                "checkouts": self.checkouts,
+                "in_use": self.in_use,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_ms_total / checkouts, 2),
+                "max_wait_ms": round(self.wait_ms_max, 2),
+                "avg_held_ms": round(self.held_ms_total / checkouts, 2),
+                "max_held_ms": round(self.held_ms_max, 2),
+            }
+
+
+_metrics = _PoolMetrics()
+
+
+class PooledConnection:
+    """
+    从连接池借出的连接，用法与 psycopg2 连接相同（cursor / commit / rollback）。
+    close() 把连接归还连接池（未提交的事务会被回滚），而不是断开数据库连接；
+    用作 with 语句时，正常结束提交、异常回滚，并在退出时归还。
+    """
+
+    def __init__(self, pooled, dbapi_connection):
+        self._pooled = pooled
+        self._connection = dbapi_connection
+        self._checked_out_at = time.perf_counter()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    @property
+    def closed(self):
+        return self._pooled is None
+
+    def close(self):
+        if self._pooled is None:
+            return
+        pooled, self._pooled = self._pooled, None
+        try:
+            pooled.close()
+        finally:
+            _metrics.checked_in((time.perf_counter() - self._checked_out_at) * 1000)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self._pooled is not None:
+                if exc_type is None:
+                    self._connection.commit()
+                else:
+                    self._connection.rollback()
+        finally:
+            self.close()
+
+
+def _checkout():
+    if not has_app_context():
+        # 没有 Flask 应用上下文时（独立脚本）退回直连，归还即断开
         conn = psycopg2.connect(os.environ["DATABASE_URL"])
         conn.set_client_encoding("UTF8")
-        log.info("Database connection established successfully.")
-        return conn
+        return conn, conn
+
+    from backend.extensions import db
+
+    pooled = db.engine.raw_connection()
+    return pooled, pooled.dbapi_connection
+
+
+def get_db_connection():
+    """
+    获取一个 psycopg2 连接。
+
+    在应用上下文中从 Flask-SQLAlchemy 引擎的连接池借出（与 ORM 共用一个有上限的池，
+    大小由 SQLALCHEMY_ENGINE_OPTIONS 控制），调用方用完后照常 close() 即归还；
+    池满时最多等待 pool_timeout 秒，仍借不到则抛出 sqlalchemy.exc.TimeoutError。
+    推荐写成 with get_db_connection() as conn:，退出时自动提交/回滚并归还。
+    """
+    started = time.perf_counter()
+    try:
+        pooled, dbapi_connection = _checkout()
+    except PoolTimeoutError:
+        _metrics.timed_out()
+        log.error(f"等待数据库连接池超时: {pool_stats()}")
+        raise
     except Exception:
         log.exception("Failed to connect to the database:")
         raise  # 重新抛出异常，以便上层处理
+
+    wait_ms = (time.perf_counter() - started) * 1000
+    _metrics.checked_out(wait_ms)
+    if wait_ms > SLOW_CHECKOUT_MS:
+        log.warning(f"借出数据库连接等待 {wait_ms:.0f}ms: {pool_stats()}")
+    return PooledConnection(pooled, dbapi_connection)
+
+
+def pool_stats():
+    """借出统计加上连接池当前状态（需要应用上下文才有池状态）。"""
+    stats = _metrics.snapshot()
+    if has_app_context():
+        from backend.extensions import db
+
+        pool = db.engine.pool
+        for name in ("size", "checkedout", "overflow", "checkedin"):
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[f"pool_{name}"] = method()
+    return stats
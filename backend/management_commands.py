@@ -1468,6 +1468,83 @@ def register_commands(app):
             if not dry_run:
                 db.session.rollback()
 
+    @app.cli.command("backfill-bill-fee-columns")
+    @click.option("--batch-size", type=int, default=500, help="每批处理并提交的账单数量。")
+    @click.option("--dry-run", is_flag=True, help="只统计需要更新的账单，不实际修改数据库。")
+    @with_appcontext
+    def backfill_bill_fee_columns_command(batch_size, dry_run):
+        """
+        从 calculation_details 回填账单的管理费/延长期服务费/佣金数值列。
+        新计算的账单由 BillingEngine 自动同步，本命令只用于历史数据。
+        """
+        from backend.services.billing_engine import BILL_FEE_COLUMNS, _details_money
+
+        click.echo("--- 开始回填账单金额列 ---" if not dry_run else "---【演习模式】统计需要回填的账单 ---")
+        total_checked = 0
+        total_changed = 0
+        last_id = None
+
+        while True:
+            query = CustomerBill.query.order_by(CustomerBill.id)
+            if last_id is not None:
+                query = query.filter(CustomerBill.id > last_id)
+            batch = query.limit(batch_size).all()
+            if not batch:
+                break
+
+            for bill in batch:
+                changed = False
+                for key in BILL_FEE_COLUMNS:
+                    value = _details_money(bill.calculation_details, key)
+                    if getattr(bill, key) != value:
+                        changed = True
+                        if not dry_run:
+                            setattr(bill, key, value)
+                if changed:
+                    total_changed += 1
+
+            total_checked += len(batch)
+            last_id = batch[-1].id
+            if not dry_run:
+                db.session.commit()
+            else:
+                db.session.rollback()
+            click.echo(f"  已检查 {total_checked} 张账单，需更新 {total_changed} 张")
+
+        click.echo(click.style(f"完成：共检查 {total_checked} 张账单，更新 {total_changed} 张。", fg="green"))
+        if dry_run:
+            click.echo(click.style("【演习模式】未对数据库做任何实际修改。", fg="yellow"))
+
+    @app.cli.command("rebuild-billing-month-summary")
+    @click.option("--year", type=int, default=None, help="只重建指定年份。")
+    @click.option("--month", type=int, default=None, help="只重建指定月份（需配合 --year）。")
+    @click.option("--dry-run", is_flag=True, help="只打印将要重建的月份，不实际修改数据库。")
+    @with_appcontext
+    def rebuild_billing_month_summary_command(year, month, dry_run):
+        """
+        从账单/工资单明细全量重建仪表盘用的月度汇总表 billing_month_summary。
+        """
+        from backend.services.billing_summary_service import rebuild_billing_month_summary
+
+        if month and not year:
+            click.echo(click.style("错误：--month 需要与 --year 一起使用。", fg="red"))
+            return
+
+        click.echo("--- 开始重建账单月度汇总 ---" if not dry_run else "---【演习模式】重建账单月度汇总 ---")
+        try:
+            months = rebuild_billing_month_summary(year=year, month=month)
+            for y, m in months:
+                click.echo(f"  已重建 {y}-{m:02d}")
+            if dry_run:
+                db.session.rollback()
+                click.echo(click.style(f"【演习模式】将重建 {len(months)} 个月份，未对数据库做任何实际修改。", fg="yellow"))
+            else:
+                db.session.commit()
+                click.echo(click.style(f"完成：共重建 {len(months)} 个月份。", fg="green"))
+        except Exception as e:
+            db.session.rollback()
+            click.echo(click.style(f"重建失败: {e}", fg="red"))
+
 def _create_management_fee_refund_adjustment(contract, bill):
     """为指定合同和账单创建管理费退款调整项"""
     from backend.models import NannyContract
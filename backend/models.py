@@ -1,5 +1,6 @@
 # backend/models.py
 from flask import current_app, url_for
+import hashlib
 import uuid
 import enum
 from sqlalchemy import Enum as SAEnum
@@ -14,6 +15,7 @@ from sqlalchemy import (
     ForeignKeyConstraint,
     PrimaryKeyConstraint,
 )
+from sqlalchemy import event
 from sqlalchemy.orm import backref
 from datetime import datetime
 from .extensions import db
@@ -692,6 +694,15 @@ class TempAnswerRecord(db.Model):
     __table_args__ = (
         Index("idx_temp_answer_record_exam_user", "exam_paper_id", "user_id"),
         Index("idx_temp_answer_record_is_submitted", "is_submitted"),
+        # 每个考生每道题最多一条未提交的临时答案，供批量 upsert 使用
+        Index(
+            "uq_temp_answer_record_pending",
+            "exam_paper_id",
+            "user_id",
+            "question_id",
+            unique=True,
+            postgresql_where=sa.text("is_submitted = false"),
+        ),
         ForeignKeyConstraint(
             ["exam_paper_id"],
             ["exampaper.id"],
@@ -1972,6 +1983,12 @@ class TtsSentence(db.Model):
         comment="对应的最终TTS脚本ID",
     )
     sentence_text = db.Column(db.Text, nullable=False, comment="句子文本")
+    text_hash = db.Column(
+        db.String(32),
+        nullable=True,
+        index=True,
+        comment="句子文本的 MD5（与 PostgreSQL md5(sentence_text) 一致），用于批量查找可复用音频",
+    )
     order_index = db.Column(db.Integer, nullable=False, comment="句子在脚本中的顺序")
     audio_status = db.Column(
         db.String(50),
@@ -2014,6 +2031,15 @@ class TtsSentence(db.Model):
         return f"<TtsSentence Order {self.order_index} for Script {self.tts_script_id}>"
 
 
+def sentence_text_hash(text):
+    return hashlib.md5((text or "").encode("utf-8")).hexdigest()
+
+
+@event.listens_for(TtsSentence.sentence_text, "set")
+def _sync_sentence_text_hash(target, value, oldvalue, initiator):
+    target.text_hash = sentence_text_hash(value)
+
+
 class TtsAudio(db.Model):
     __tablename__ = "tts_audio"
     __table_args__ = (
@@ -2088,6 +2114,12 @@ class TtsAudio(db.Model):
         nullable=True,
         comment="是否是对应培训内容的最新合并语音 (用于合并语音)",
     )
+    cache_key = db.Column(
+        db.String(64),
+        nullable=True,
+        index=True,
+        comment="内容寻址缓存键 (规范化文本+引擎+音色+生效配置的 SHA-256)",
+    )
 
     # tts_sentence = db.relationship('TtsSentence', backref=backref('all_audios', lazy='dynamic'))
     tts_sentence = db.relationship(
@@ -2288,6 +2320,12 @@ class UserResourcePlayLog(db.Model):
             name="fk_userresourceplaylog_resource_id",
             ondelete="CASCADE",
         ),
+        # 尚未计入 play_count 的 start_play 事件，供定时汇总与统计接口使用
+        Index(
+            "ix_user_resource_play_log_uncounted_start_play",
+            "resource_id",
+            postgresql_where=sa.text("event_type = 'start_play' AND play_counted = false"),
+        ),
         {"comment": "用户资源播放日志表"},
     )
     id = db.Column(
@@ -2314,6 +2352,13 @@ class UserResourcePlayLog(db.Model):
         nullable=True,
         comment="事件类型 (e.g., session_start, heartbeat, session_end)",
     )
+    play_counted = db.Column(
+        db.Boolean,
+        default=False,
+        nullable=False,
+        server_default=sa.text("false"),
+        comment="start_play 事件是否已由定时汇总计入 course_resource.play_count",
+    )
 
     # Relationships
     # user = db.relationship('User', back_populates='resource_play_logs') # 在 User 中定义
@@ -2464,6 +2509,9 @@ class VideoSynthesis(db.Model):
         index=True,
         comment="合成状态 (pending_analysis, analysis_complete, synthesizing, complete, error)",
     )
+    progress = db.Column(
+        db.Integer, nullable=True, comment="视频合成进度 (0-100)"
+    )
 
     # 最终产物
     generated_resource_id = db.Column(
@@ -2642,6 +2690,7 @@ class BankTransaction(db.Model):
     __tablename__ = 'bank_transactions'
     __table_args__ = (
         db.Index('idx_bank_transactions_associated_object', 'associated_object_type', 'associated_object_id'),
+        db.Index('ix_bank_transactions_direction_status_time', 'direction', 'status', 'transaction_time'),
         {'comment': '银行交易流水表'}
     )
 
@@ -2675,6 +2724,7 @@ class BankTransaction(db.Model):
     ignore_remark = db.Column(db.Text, nullable=True, comment="忽略原因")
 
     allocated_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default='0', comment="已被分配的金额")
+    match_candidates = db.Column(PG_JSONB, nullable=True, comment="自动匹配给出的待确认账单候选 (按优先级排序)")
 
     # --- Polymorphic Association Fields ---
     associated_object_type = db.Column(db.String(50), nullable=True, comment="关联对象的模型名称 (e.g., 'Contract', 'User', 'ServicePersonnel')")
@@ -2789,6 +2839,40 @@ class MonthlyStatement(db.Model):
         return f'<MonthlyStatement {self.id} for {self.customer_name} - {self.year}-{self.month}>'
 
 
+class BillingMonthSummary(db.Model):
+    """
+    按 年/月/合同类型 预聚合的账单汇总，供仪表盘直接读取。
+    由 backend.services.billing_summary_service 在账单重算、收款、打款后增量刷新，
+    也可通过 `flask rebuild-billing-month-summary` 全量重建。
+    """
+    __tablename__ = 'billing_month_summary'
+    __table_args__ = (
+        db.UniqueConstraint('year', 'month', 'contract_type', name='uq_billing_month_summary_year_month_type'),
+        {'comment': '账单月度汇总（仪表盘预聚合）'}
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False, index=True)
+    month = db.Column(db.Integer, nullable=False)
+    contract_type = db.Column(db.String(50), nullable=False, comment="合同类型 (与 contracts.type 一致)")
+
+    bill_count = db.Column(db.Integer, nullable=False, server_default='0', comment="账单数")
+    paid_bill_count = db.Column(db.Integer, nullable=False, server_default='0', comment="已结清账单数")
+    total_due = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="客户应付合计")
+    total_paid = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="客户实付合计")
+    management_fee = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="应收管理费")
+    management_fee_paid = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="已结清账单的管理费")
+    introduction_fee = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="介绍费调整项合计")
+    customer_increase = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="客户增款调整项合计")
+    employee_commission = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="员工佣金调整项合计 (按工资单月份)")
+    payout_due = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="员工应发合计")
+    payout_paid = db.Column(db.Numeric(14, 2), nullable=False, server_default='0', comment="员工实发合计")
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f'<BillingMonthSummary {self.year}-{self.month} {self.contract_type}>'
+
+
 class FinancialAdjustment(db.Model):
     __tablename__ = "financial_adjustments"
     __table_args__ = {"comment": "财务调整项(增/减款)"}
@@ -3469,6 +3553,13 @@ class CustomerBill(db.Model):
             "is_substitute_bill",
             name="uq_bill_contract_cycle_is_sub",
         ),
+        db.Index(
+            "ix_customer_bills_year_month_fees",
+            "year",
+            "month",
+            "payment_status",
+            postgresql_include=["management_fee", "extension_fee", "employee_commission"],
+        ),
     )
 
     id = db.Column(PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -3499,6 +3590,11 @@ class CustomerBill(db.Model):
         server_default=sa.text("'{}'::jsonb"),
         comment="计算过程快照，用于展示和审计",
     )
+    # 由 BillingEngine._update_bill_with_log 从 calculation_details 同步，供聚合查询使用；
+    # NULL 表示 calculation_details 中没有该字段
+    management_fee = db.Column(db.Numeric(12, 2), nullable=True, comment="管理费 (物化自 calculation_details)")
+    extension_fee = db.Column(db.Numeric(12, 2), nullable=True, comment="延长期服务费 (物化自 calculation_details)")
+    employee_commission = db.Column(db.Numeric(12, 2), nullable=True, comment="员工佣金 (物化自 calculation_details)")
     invoice_needed = db.Column(
         db.Boolean,
         nullable=False,
@@ -3510,6 +3606,7 @@ class CustomerBill(db.Model):
         "InvoiceRecord",
         backref="customer_bill",
         cascade="all, delete-orphan",
+        order_by="[InvoiceRecord.created_at, InvoiceRecord.id]",
     )
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     contract = db.relationship("BaseContract", back_populates="customer_bills")
@@ -0,0 +1,363 @@
+# backend/services/audio_merge_service.py
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from pydub import AudioSegment
+
+logger = logging.getLogger(__name__)
+
+# 每个课程内容的句子 PCM 缓存目录的容量上限（16-bit PCM 约 10 MB/分钟/声道@44.1kHz）
+MAX_CACHE_BYTES = int(os.environ.get("MERGE_PCM_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+class AudioMergeError(RuntimeError):
+    """ffmpeg 编码进程异常退出或写入失败。"""
+
+
+class SentencePcmCache:
+    """
+    按 TtsAudio.id 缓存每句解码后的 16-bit PCM 及其时长。
+
+    句子音频一旦生成就不会被原地修改（重新生成会产生新的 TtsAudio 记录），
+    所以 TtsAudio.id 可以直接作为缓存键。重新合并时只需解码新生成的句子，
+    其余句子直接从缓存流入编码器，时间轴用缓存里的时长计算。
+
+    每句一个 {key}.pcm 和一个 {key}.json（格式与时长），都先写临时文件再原子改名，
+    并发合并互不覆盖对方的条目。使用期间持有缓存目录的共享 flock；清理旧条目
+    需要独占锁，拿不到（有其它合并正在读取缓存）时跳过清理，留给下一次合并。
+    目录总大小超过 max_bytes 时不再写入新条目，清理时按最近使用时间淘汰。
+    """
+
+    LOCK_NAME = ".lock"
+    LAST_MERGE_NAME = "last_merge.json"
+    LEGACY_MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(cache_dir, self.LOCK_NAME), "a+")
+        fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+        self._total_bytes = sum(size for _, size, _ in self._pcm_files())
+        self._last_merge = self._read_json(os.path.join(cache_dir, self.LAST_MERGE_NAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # 关闭文件即释放 flock
+            self._lock_file = None
+
+    def _pcm_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _pcm_files(self):
+        """[(key, 文件大小, 最近访问时间)]"""
+        files = []
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(".pcm"):
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((item.name[:-len(".pcm")], stat.st_size, max(stat.st_atime, stat.st_mtime)))
+        return files
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"合并缓存文件损坏，忽略: {path} ({e})")
+            return None
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key, frame_rate=None, channels=None):
+        """返回缓存条目；文件缺失、大小不符或格式与要求不同时视为未命中。"""
+        entry = self._read_json(self._meta_path(key))
+        if not entry:
+            return None
+        if frame_rate is not None and (entry["frame_rate"], entry["channels"]) != (frame_rate, channels):
+            return None
+        path = self._pcm_path(key)
+        try:
+            if os.path.getsize(path) != entry["size"]:
+                return None
+        except OSError:
+            return None
+        return dict(entry, path=path)
+
+    def put(self, key, segment):
+        """写入一句已转换为目标格式的音频，返回缓存条目；超出容量上限时不缓存，返回 None。"""
+        size = len(segment.raw_data)
+        if self._total_bytes + size > self.max_bytes:
+            return None
+        entry = {
+            "frame_rate": segment.frame_rate,
+            "channels": segment.channels,
+            "duration_ms": len(segment),
+            "size": size,
+        }
+        # 先写 PCM 再写元数据，读到元数据时 PCM 一定已完整
+        self._write_atomic(self._pcm_path(key), segment.raw_data)
+        self._write_atomic(self._meta_path(key), json.dumps(entry).encode("utf-8"))
+        self._total_bytes += size
+        return dict(entry, path=self._pcm_path(key))
+
+    @property
+    def last_merge(self):
+        return self._last_merge
+
+    def record_merge(self, keys, merged_file_path, duration_ms):
+        """记录本次合并的句子顺序，并在没有其它合并使用缓存时清理旧条目。"""
+        self._last_merge = {
+            "audio_ids": [str(key) for key in keys],
+            "merged_file_path": merged_file_path,
+            "duration_ms": duration_ms,
+        }
+        self._write_atomic(
+            os.path.join(self.cache_dir, self.LAST_MERGE_NAME),
+            json.dumps(self._last_merge).encode("utf-8"),
+        )
+        self._prune({str(key) for key in keys})
+
+    def _prune(self, keep):
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # flock 的锁转换不是原子的，失败时可能已放开共享锁，这里重新拿回
+            fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+            logger.info(f"其它合并正在使用缓存 {self.cache_dir}，本次跳过清理")
+            return
+        try:
+            files = self._pcm_files()
+            removed = {key for key, _, _ in files if key not in keep}
+            # 仍超出容量时，连本次用到的条目也按最近使用时间淘汰
+            total = sum(size for key, size, _ in files if key not in removed)
+            for key, size, _ in sorted(
+                (f for f in files if f[0] not in removed), key=lambda f: f[2]
+            ):
+                if total <= self.max_bytes:
+                    break
+                removed.add(key)
+                total -= size
+
+            for key in removed:
+                for path in (self._meta_path(key), self._pcm_path(key)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            # 独占锁下没有其它写入者，残留的临时文件和旧版清单可以直接删除
+            for item in os.scandir(self.cache_dir):
+                if item.name.endswith(".tmp") or item.name == self.LEGACY_MANIFEST_NAME:
+                    try:
+                        os.remove(item.path)
+                    except FileNotFoundError:
+                        pass
+            self._total_bytes = total
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+
+
+class StreamingAudioWriter:
+    """
+    流式合并音频：逐句解码后把 PCM 直接写入一个 ffmpeg 编码进程的 stdin，
+    一次编码成最终文件。
+
+    与 `merged = merged + segment` 相比，不会在每句之后复制整段已合并的 PCM，
+    时间与句子总时长成线性关系，内存中同一时刻只保留一句的音频。
+    输出的采样率/声道以第一句为准，后续句子会被转换到相同格式。
+    传入 pcm_cache 时可用 append_file 按 TtsAudio.id 复用已解码的句子。
+
+    用法：
+        with StreamingAudioWriter(path) as writer:
+            for segment in segments:
+                start_ms, end_ms = writer.append(segment)
+        file_size = writer.file_size
+    """
+
+    SAMPLE_WIDTH = 2  # 16-bit PCM
+
+    def __init__(self, output_path, audio_format="mp3", bitrate="128k", pcm_cache=None):
+        self.output_path = output_path
+        self.pcm_cache = pcm_cache
+        self.audio_format = audio_format
+        self.bitrate = bitrate
+        self.frame_rate = None
+        self.channels = None
+        self.duration_ms = 0
+        self.segment_count = 0
+        self.file_size = None
+        self._process = None
+        self._stderr = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _start(self, frame_rate, channels):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        self._stderr = tempfile.TemporaryFile()
+        command = [
+            AudioSegment.converter,
+            "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "s16le",
+            "-ar", str(self.frame_rate),
+            "-ac", str(self.channels),
+            "-i", "pipe:0",
+            "-b:a", self.bitrate,
+            "-f", self.audio_format,
+            self.output_path,
+        ]
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr,
+        )
+
+    def _ffmpeg_error(self):
+        if not self._stderr:
+            return ""
+        self._stderr.seek(0)
+        return self._stderr.read().decode("utf-8", errors="replace").strip()
+
+    def _write(self, write_fn):
+        try:
+            write_fn(self._process.stdin)
+        except (BrokenPipeError, OSError) as e:
+            self._process.wait()
+            raise AudioMergeError(f"ffmpeg 编码进程已退出: {self._ffmpeg_error() or e}") from e
+
+    def _advance(self, duration_ms):
+        start_ms = self.duration_ms
+        self.duration_ms += duration_ms
+        self.segment_count += 1
+        return start_ms, self.duration_ms
+
+    def _convert(self, segment):
+        if self._process is None:
+            self._start(segment.frame_rate, segment.channels)
+        return (
+            segment.set_frame_rate(self.frame_rate)
+            .set_channels(self.channels)
+            .set_sample_width(self.SAMPLE_WIDTH)
+        )
+
+    def append(self, segment):
+        """写入一句音频，返回它在合并结果中的 (start_ms, end_ms)。"""
+        segment = self._convert(segment)
+        self._write(lambda stdin: stdin.write(segment.raw_data))
+        return self._advance(len(segment))
+
+    def append_file(self, file_path, cache_key, audio_format=None):
+        """
+        写入一个句子音频文件，优先使用 pcm_cache 中该 cache_key 的已解码 PCM。
+        返回 (start_ms, end_ms, from_cache)；解码失败时抛出 pydub 的 CouldntDecodeError，
+        源文件不存在时抛出 FileNotFoundError。
+        """
+        cache = self.pcm_cache
+        if cache is not None:
+            entry = cache.get(cache_key, self.frame_rate, self.channels)
+            cached_file = None
+            if entry is not None:
+                try:
+                    # 先打开再写入：缓存文件在检查后被删除时回退到解码源文件，
+                    # 打开之后即使被删除也能读完
+                    cached_file = open(entry["path"], "rb")
+                except OSError as e:
+                    logger.info(f"缓存的 PCM 已不可用，改为解码源文件: {entry['path']} ({e})")
+            if cached_file is not None:
+                with cached_file:
+                    if self._process is None:
+                        self._start(entry["frame_rate"], entry["channels"])
+                    self._write(lambda stdin: shutil.copyfileobj(cached_file, stdin, 1024 * 1024))
+                cache.hits += 1
+                start_ms, end_ms = self._advance(entry["duration_ms"])
+                return start_ms, end_ms, True
+
+        segment = self._convert(AudioSegment.from_file(file_path, format=audio_format))
+        if cache is not None:
+            cache.put(cache_key, segment)
+            cache.misses += 1
+        self._write(lambda stdin: stdin.write(segment.raw_data))
+        start_ms, end_ms = self._advance(len(segment))
+        return start_ms, end_ms, False
+
+    def close(self):
+        """结束编码并返回输出文件大小；没有写入任何音频时返回 None。"""
+        if self._process is None:
+            return None
+        try:
+            self._process.stdin.close()
+            return_code = self._process.wait()
+            if return_code != 0:
+                raise AudioMergeError(f"ffmpeg 编码失败 (code {return_code}): {self._ffmpeg_error()}")
+        finally:
+            self._process = None
+            if self._stderr:
+                self._stderr.close()
+                self._stderr = None
+        self.file_size = os.path.getsize(self.output_path)
+        cache_note = ""
+        if self.pcm_cache is not None:
+            cache_note = f", 缓存命中 {self.pcm_cache.hits}/重新解码 {self.pcm_cache.misses}"
+        logger.info(
+            f"流式合并完成: {self.output_path} ({self.segment_count} 段, "
+            f"{self.duration_ms / 1000:.2f}s, {self.bitrate}{cache_note})"
+        )
+        return self.file_size
+
+    def abort(self):
+        """中止编码并删除未完成的输出文件。"""
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+        if self._stderr:
+            self._stderr.close()
+            self._stderr = None
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
@@ -0,0 +1,178 @@
+# backend/services/bank_matching_engine.py
+
+import bisect
+import decimal
+import itertools
+import re
+import unicodedata
+from collections import defaultdict
+
+from backend.models import (
+    db,
+    BaseContract,
+    CustomerBill,
+    PayerAlias,
+    PaymentStatus,
+)
+
+D = decimal.Decimal
+CENT = D("0.01")
+
+
+def normalize_payer_name(name: str) -> str:
+    """统一全角/半角、大小写并去掉空白和常见标点，用作付款人索引键。"""
+    if not name:
+        return ""
+    normalized = unicodedata.normalize("NFKC", name).casefold()
+    return re.sub(r"[\s·.,，。()（）\-_]", "", normalized)
+
+
+class UnpaidBillIndex:
+    """
+    一次对账运行内的未付账单内存索引。
+
+    构建时只查两次库（未付账单+客户名、付款人别名），之后按
+    规范化付款人名 -> 待付金额 -> 账单 做 O(1) 查找。已被本次运行
+    匹配的账单会从索引中移除，避免两笔流水匹配到同一张账单。
+    """
+
+    def __init__(self):
+        # {payer_key: {outstanding: [bill, ...]}}
+        self._by_amount = defaultdict(lambda: defaultdict(list))
+        # {payer_key: [bill, ...]}，按周期开始日排序，用于容差/组合候选
+        self._by_payer = defaultdict(list)
+        self._outstanding = {}
+        self._keys_by_bill = defaultdict(set)
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        rows = (
+            db.session.query(CustomerBill, BaseContract.customer_name)
+            .join(BaseContract, CustomerBill.contract_id == BaseContract.id)
+            .filter(
+                CustomerBill.payment_status.in_([PaymentStatus.UNPAID, PaymentStatus.PARTIALLY_PAID]),
+                CustomerBill.total_due > CustomerBill.total_paid,
+            )
+            .order_by(CustomerBill.cycle_start_date)
+            .all()
+        )
+
+        bills_by_contract = defaultdict(list)
+        names_by_contract = defaultdict(set)
+        for bill, customer_name in rows:
+            bills_by_contract[bill.contract_id].append(bill)
+            names_by_contract[bill.contract_id].add(normalize_payer_name(customer_name))
+
+        if bills_by_contract:
+            aliases = db.session.query(PayerAlias.payer_name, PayerAlias.contract_id).filter(
+                PayerAlias.contract_id.in_(list(bills_by_contract))
+            )
+            for payer_name, contract_id in aliases:
+                names_by_contract[contract_id].add(normalize_payer_name(payer_name))
+
+        for contract_id, bills in bills_by_contract.items():
+            for bill in bills:
+                index.add(bill, names_by_contract[contract_id], D(bill.total_due) - D(bill.total_paid))
+        return index
+
+    def add(self, bill, payer_keys, outstanding):
+        """把账单登记到这些付款人键下；同一付款人下的账单保持按账期排序。"""
+        self._outstanding[bill.id] = D(outstanding).quantize(CENT)
+        for key in payer_keys:
+            if not key:
+                continue
+            self._by_amount[key][self._outstanding[bill.id]].append(bill)
+            # build() 按账期顺序登记，insort 实际总是追加到末尾
+            bisect.insort(self._by_payer[key], bill, key=lambda b: b.cycle_start_date)
+            self._keys_by_bill[bill.id].add(key)
+
+    def outstanding(self, bill):
+        return self._outstanding[bill.id]
+
+    def exact(self, payer_key, amount):
+        return list(self._by_amount.get(payer_key, {}).get(amount, []))
+
+    def bills_for(self, payer_key):
+        return self._by_payer.get(payer_key, [])
+
+    def remove(self, bill):
+        """账单已被匹配：从所有付款人键下移除。"""
+        amount = self._outstanding.pop(bill.id, None)
+        if amount is None:
+            return
+        for key in self._keys_by_bill.pop(bill.id, ()):
+            self._by_payer[key].remove(bill)
+            self._by_amount[key][amount].remove(bill)
+
+
+class BankMatchingEngine:
+    """
+    将入账流水与未付账单自动匹配。
+
+    对每笔流水依次尝试：同付款人下金额完全相等的单张账单、多张账单金额组合、
+    容差范围内的单张账单，按 (匹配类型, 账单数, 金额差, 账期) 排序给出候选。
+    只有唯一的精确单张匹配会被自动入账，其余交给人工确认。
+    """
+
+    MATCH_EXACT = "exact"
+    MATCH_COMBINATION = "combination"
+    MATCH_TOLERANCE = "tolerance"
+    _RANK = {MATCH_EXACT: 0, MATCH_COMBINATION: 1, MATCH_TOLERANCE: 2}
+
+    def __init__(self, index: UnpaidBillIndex, tolerance=D("1.00"), max_combination_size=3,
+                 max_combination_bills=12, max_candidates=5):
+        self.index = index
+        self.tolerance = D(tolerance)
+        self.max_combination_size = max_combination_size
+        self.max_combination_bills = max_combination_bills
+        self.max_candidates = max_candidates
+
+    def _candidate(self, match_type, bills, amount):
+        total = sum((self.index.outstanding(bill) for bill in bills), D(0))
+        return {
+            "match_type": match_type,
+            "bills": bills,
+            "bill_ids": [str(bill.id) for bill in bills],
+            "total_outstanding": str(total),
+            "difference": str((amount - total).quantize(CENT)),
+        }
+
+    def candidates_for(self, payer_name, amount):
+        """返回按优先级排序的候选列表（最多 max_candidates 个）。"""
+        payer_key = normalize_payer_name(payer_name)
+        amount = D(amount).quantize(CENT)
+        candidates = [
+            self._candidate(self.MATCH_EXACT, [bill], amount)
+            for bill in self.index.exact(payer_key, amount)
+        ]
+
+        payer_bills = self.index.bills_for(payer_key)
+        if not candidates and len(payer_bills) > 1:
+            pool = payer_bills[:self.max_combination_bills]
+            for size in range(2, min(self.max_combination_size, len(pool)) + 1):
+                for combo in itertools.combinations(pool, size):
+                    if sum((self.index.outstanding(bill) for bill in combo), D(0)) == amount:
+                        candidates.append(self._candidate(self.MATCH_COMBINATION, list(combo), amount))
+
+        if self.tolerance > 0:
+            for bill in payer_bills:
+                difference = abs(self.index.outstanding(bill) - amount)
+                if 0 < difference <= self.tolerance:
+                    candidates.append(self._candidate(self.MATCH_TOLERANCE, [bill], amount))
+
+        candidates.sort(key=lambda c: (
+            self._RANK[c["match_type"]],
+            len(c["bills"]),
+            abs(D(c["difference"])),
+            min(bill.cycle_start_date for bill in c["bills"]),
+        ))
+        return candidates[:self.max_candidates]
+
+    @staticmethod
+    def auto_match(candidates):
+        """唯一的精确单张匹配可直接入账，否则返回 None。"""
+        exact = [c for c in candidates if c["match_type"] == BankMatchingEngine.MATCH_EXACT]
+        if len(exact) == 1:
+            return exact[0]
+        return None
@@ -1,12 +1,17 @@
+from collections import defaultdict
 from datetime import datetime
+from dateutil.relativedelta import relativedelta
 from decimal import Decimal
 from flask import current_app
 from backend.models import db, BankTransaction, BankTransactionStatus, CustomerBill, PaymentRecord, PayoutRecord, PaymentStatus, User, BaseContract,PayerAlias,PayeeAlias,FinancialActivityLog,TransactionDirection, ServicePersonnel, EmployeePayroll, FinancialAdjustment, PayoutStatus, AdjustmentType, PermanentIgnoreList
 from sqlalchemy import or_, func
-import traceback
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import decimal
+import uuid
 D = decimal.Decimal
-from backend.services.billing_engine import _update_payroll_payout_status, _update_bill_payment_status
+from backend.services.billing_engine import _update_payroll_payout_status, _update_bill_payment_status, _apply_bill_payment_status
+from backend.services.bank_matching_engine import BankMatchingEngine, UnpaidBillIndex
+from backend.services.payer_resolution_cache import payer_resolution_cache
 from backend.api.utils import get_billing_details_internal, _log_activity
 
 class BankStatementService:
@@ -62,6 +67,7 @@ class BankStatementService:
             'direction': txn.direction.value,
             'allocated_amount': str(txn.allocated_amount),
             'ignore_remark': txn.ignore_remark,
+            'match_candidates': txn.match_candidates,
             'updated_at': txn.updated_at.isoformat() if txn.updated_at else None, # <-- FIX: Add updated_at
             'associated_object': None # Default to None
         }
@@ -325,22 +331,8 @@ class BankStatementService:
         oldest_payroll = None
         oldest_refund = None
 
-        # 根据收款人类型查找关联合同
-        contract_ids = []
-        if payee_type == 'user':
-            # 查找与该用户关联的服务人员
-            service_personnel = ServicePersonnel.query.filter_by(user_id=payee_id).first()
-            if service_personnel:
-                contracts = BaseContract.query.filter_by(service_personnel_id=service_personnel. id).all()
-                contract_ids = [c.id for c in contracts]
-        elif payee_type == 'service_personnel':
-            contracts = BaseContract.query.filter_by(service_personnel_id=payee_id).all()
-            contract_ids = [c.id for c in contracts]
-        elif payee_type == 'customer':
-            # 注意：客户可能由姓名标识，而不是ID
-            contracts = BaseContract.query.filter_by(customer_name=payee_id).all()
-            contract_ids = [c.id for c in contracts]
-
+        # 根据收款人类型查找关联合同（客户由姓名标识，而不是ID）
+        contract_ids = payer_resolution_cache.contract_ids_for_payee(payee_type, payee_id)
         if not contract_ids:
             return None
 
@@ -497,51 +489,22 @@ class BankStatementService:
 
 
     def search_payable_items(self, search_term: str) -> dict:
-        print(f"--- DEBUG: Starting search_payable_items with term: '{search_term}' ---")
         results = []
-        pinyin_search_term = search_term.replace(" ", "")
-        print(f"--- DEBUG: Pinyin search term: '{pinyin_search_term}' ---")
-
-        matching_contract_ids = set()
-
-        # 1. 根据客户姓名或拼音查找合同
-        contracts_by_customer = BaseContract.query.filter(
-            or_(
-                BaseContract.customer_name.ilike(f"%{search_term}%"),
-                BaseContract.customer_name_pinyin.ilike(f"%{pinyin_search_term}%")
-            )
-        ).all()
-        customer_contract_ids = {c.id for c in contracts_by_customer}
-        print(f"--- DEBUG: Found {len(customer_contract_ids)} contracts by customer name: {customer_contract_ids} ---")
-        matching_contract_ids.update(customer_contract_ids)
-
-        # 2. 根据员工姓名或拼音查找关联的合同
-        matching_sp_ids = [sp.id for sp in ServicePersonnel.query.filter (or_(ServicePersonnel.name.ilike(f"%{search_term}%"), ServicePersonnel.name_pinyin.ilike(f"% {pinyin_search_term}%"))).all()]
-        print(f"--- DEBUG: Found {len(matching_sp_ids)} matching service personnel IDs: {matching_sp_ids} ---")
-
-        if matching_sp_ids:
-            contracts_by_employee = BaseContract.query.filter(
-                BaseContract.service_personnel_id.in_(matching_sp_ids)
-            ).all()
-            employee_contract_ids = {c.id for c in contracts_by_employee}
-            print(f"--- DEBUG: Found {len(employee_contract_ids)} contracts via employees: {employee_contract_ids} ---")
-            matching_contract_ids.update(employee_contract_ids)
-
-        print(f"--- DEBUG: Final combined set of {len(matching_contract_ids)} contract IDs: {matching_contract_ids} ---")
 
+        # 根据客户/员工姓名或拼音查找合同（走进程内的付款人解析缓存，不再逐次 ilike 扫表）
+        matching_contract_ids = payer_resolution_cache.search_contract_ids(search_term)
         if not matching_contract_ids:
-            print("--- DEBUG: No matching contract IDs found, returning empty results. ---")
             return {'results': []}
 
-        # 3. 根据收集到的合同ID，查找待支付项
         final_contract_id_list = list(matching_contract_ids)
 
         # 查找待付工资单
-        payrolls = EmployeePayroll.query.filter(
+        payrolls = EmployeePayroll.query.options(
+            db.joinedload(EmployeePayroll.contract).joinedload(BaseContract.service_personnel)
+        ).filter(
             EmployeePayroll.contract_id.in_(final_contract_id_list),
             EmployeePayroll.payout_status.in_([PayoutStatus.UNPAID, PayoutStatus.PARTIALLY_PAID])
         ).limit(10).all()
-        print(f"--- DEBUG: Found {len(payrolls)} matching unpaid payrolls. ---")
 
         for payroll in payrolls:
             employee = payroll.contract.service_personnel
@@ -561,7 +524,6 @@ class BankStatementService:
             FinancialAdjustment.adjustment_type == AdjustmentType.CUSTOMER_DECREASE,
             FinancialAdjustment.is_settled == False
         ).limit(10).all()
-        print(f"--- DEBUG: Found {len(refunds)} matching pending refunds. ---")
 
         for refund in refunds:
             if refund.contract:
@@ -573,7 +535,6 @@ class BankStatementService:
                     'amount_due': str(refund.amount)
                 })
 
-        print(f"--- DEBUG: Returning a total of {len(results)} items. ---")
         return {'results': results}
 
     def _format_payable_item(self, item, bank_transaction_id=None):
@@ -627,19 +588,7 @@ class BankStatementService:
     def get_payable_items_for_payee(self, payee_type: str, payee_id: str, year: int, month: int, bank_transaction_id: str = None) -> dict:
         current_app.logger.info(f"[DEBUG] Entering get_payable_items_for_payee for {payee_type}:{payee_id} @ {year}-{month}")
 
-        contract_ids = []
-        if payee_type == 'user':
-            # 查找与该用户关联的服务人员
-            service_personnel = ServicePersonnel.query.filter_by(user_id=payee_id).first()
-            if service_personnel:
-                contracts = BaseContract.query.filter_by(service_personnel_id=service_personnel. id).all()
-                contract_ids = [c.id for c in contracts]
-        elif payee_type == 'service_personnel':
-            contracts = BaseContract.query.filter_by(service_personnel_id=payee_id).all()
-            contract_ids = [c.id for c in contracts]
-        elif payee_type == 'customer':
-            contracts = BaseContract.query.filter_by(customer_name=payee_id).all()
-            contract_ids = [c.id for c in contracts]
+        contract_ids = payer_resolution_cache.contract_ids_for_payee(payee_type, payee_id)
 
         if not contract_ids:
             return {"items": [], "closest_item_period": None, "relevant_contract_id": None}
@@ -699,41 +648,114 @@ class BankStatementService:
         """
         获取指定年月的银行流水，并将其分为四类。
         【V4 修正版】正确处理一个付款人拥有多个合同的情况。
+
+        整个月视图只用固定次数的查询构建：一次按 transaction_time 区间取出当月全部入账流水
+        （走 direction/status/transaction_time 复合索引），其余别名、合同、未付账单、
+        支付记录都按批次一次性预取，查询次数与流水条数无关。
         """
-        txns_to_process = BankTransaction.query.filter(
-            BankTransaction.direction == TransactionDirection.CREDIT,
-            BankTransaction.status.in_([
-                BankTransactionStatus.UNMATCHED, 
-                BankTransactionStatus.PARTIALLY_ALLOCATED
-            ]),
-            db.extract('year', BankTransaction.transaction_time) == year,
-            db.extract('month', BankTransaction.transaction_time) == month
-        ).order_by(BankTransaction.payer_name.asc()).all()
+        month_start = datetime(year, month, 1)
+        next_month_start = month_start + relativedelta(months=1)
 
-        confirmed_txns = BankTransaction.query.filter(
+        month_txns = BankTransaction.query.filter(
             BankTransaction.direction == TransactionDirection.CREDIT,
             BankTransaction.status.in_([
+                BankTransactionStatus.UNMATCHED,
+                BankTransactionStatus.PARTIALLY_ALLOCATED,
                 BankTransactionStatus.MATCHED,
-                BankTransactionStatus.PARTIALLY_ALLOCATED
+                BankTransactionStatus.IGNORED,
             ]),
-            BankTransaction.allocated_amount > 0,
-            db.extract('year', BankTransaction.transaction_time) == year,
-            db.extract('month', BankTransaction.transaction_time) == month
-        ).order_by(BankTransaction.transaction_time.desc()).all()
+            BankTransaction.transaction_time >= month_start,
+            BankTransaction.transaction_time < next_month_start,
+        ).order_by(BankTransaction.payer_name.asc()).all()
 
-        ignored_txns = BankTransaction.query.filter(
-            BankTransaction.direction == TransactionDirection.CREDIT,
-            BankTransaction.status == BankTransactionStatus.IGNORED,
-            db.extract('year', BankTransaction.transaction_time) == year,
-            db.extract('month', BankTransaction.transaction_time) == month
-        ).order_by(BankTransaction.transaction_time.desc()).all()
+        by_time_desc = lambda txns: sorted(txns, key=lambda t: t.transaction_time, reverse=True)
+        txns_to_process = [
+            txn for txn in month_txns
+            if txn.status in (BankTransactionStatus.UNMATCHED, BankTransactionStatus.PARTIALLY_ALLOCATED)
+        ]
+        confirmed_txns = by_time_desc(
+            txn for txn in month_txns
+            if txn.status in (BankTransactionStatus.MATCHED, BankTransactionStatus.PARTIALLY_ALLOCATED)
+            and txn.allocated_amount > 0
+        )
+        ignored_txns = by_time_desc(
+            txn for txn in month_txns if txn.status == BankTransactionStatus.IGNORED
+        )
 
-        ignored_txns = BankTransaction.query.filter(
-            BankTransaction.direction == TransactionDirection.CREDIT,
-            BankTransaction.status == BankTransactionStatus.IGNORED,
-            db.extract('year', BankTransaction.transaction_time) == year,
-            db.extract('month', BankTransaction.transaction_time) == month
-        ).order_by(BankTransaction.transaction_time.desc()).all()
+        bill_options = (
+            db.joinedload(CustomerBill.contract).joinedload(BaseContract.service_personnel),
+        )
+
+        # 已分配流水的支付记录（含账单、合同、员工）一次取回
+        payments_by_txn = defaultdict(list)
+        paid_by_txn_and_bill = defaultdict(D)
+        txn_ids_with_payments = [
+            txn.id for txn in month_txns
+            if txn.status in (BankTransactionStatus.MATCHED, BankTransactionStatus.PARTIALLY_ALLOCATED)
+        ]
+        if txn_ids_with_payments:
+            payment_records = (
+                PaymentRecord.query.filter(PaymentRecord.bank_transaction_id.in_(txn_ids_with_payments))
+                .options(db.joinedload(PaymentRecord.customer_bill).options(*bill_options))
+                .order_by(PaymentRecord.created_at)
+                .all()
+            )
+            for pr in payment_records:
+                payments_by_txn[pr.bank_transaction_id].append(pr)
+                paid_by_txn_and_bill[(pr.bank_transaction_id, pr.customer_bill_id)] += pr.amount
+
+        def format_bill(bill, txn):
+            return self._format_bill(
+                bill, txn.id, paid_by_this_txn=paid_by_txn_and_bill.get((txn.id, bill.id), D('0'))
+            )
+
+        # 待处理流水涉及的别名、同名合同、未付账单各一次查询
+        payer_names = {txn.payer_name for txn in txns_to_process}
+        aliases_by_payer = defaultdict(list)
+        contracts_by_name = defaultdict(list)
+        contracts_by_id = {}
+        unpaid_bills_by_contract = defaultdict(list)
+        if payer_names:
+            for alias in PayerAlias.query.filter(PayerAlias.payer_name.in_(payer_names)):
+                aliases_by_payer[alias.payer_name].append(alias)
+            alias_contract_ids = {
+                alias.contract_id for aliases in aliases_by_payer.values() for alias in aliases
+            }
+            partial_contract_ids = {
+                pr.customer_bill.contract_id
+                for txn in txns_to_process
+                for pr in payments_by_txn.get(txn.id, [])
+                if pr.customer_bill
+            }
+            contracts = BaseContract.query.filter(
+                or_(
+                    BaseContract.customer_name.in_(payer_names),
+                    BaseContract.id.in_(alias_contract_ids | partial_contract_ids),
+                )
+            ).all()
+            for contract in contracts:
+                contracts_by_id[contract.id] = contract
+                if contract.customer_name in payer_names:
+                    contracts_by_name[contract.customer_name].append(contract)
+            if contracts_by_id:
+                unpaid_bills = CustomerBill.query.filter(
+                    CustomerBill.contract_id.in_(list(contracts_by_id)),
+                    CustomerBill.total_due > CustomerBill.total_paid,
+                ).options(*bill_options).all()
+                for bill in unpaid_bills:
+                    unpaid_bills_by_contract[bill.contract_id].append(bill)
+
+        def find_contract_for_txn(txn):
+            # 与 _find_contract_for_txn 相同的优先级：别名 -> 部分支付记录 -> 同名客户
+            for alias in aliases_by_payer.get(txn.payer_name, []):
+                if alias.contract_id in contracts_by_id:
+                    return contracts_by_id[alias.contract_id]
+            if txn.status == BankTransactionStatus.PARTIALLY_ALLOCATED:
+                payments = payments_by_txn.get(txn.id)
+                if payments and payments[0].customer_bill:
+                    return payments[0].customer_bill.contract
+            same_name = contracts_by_name.get(txn.payer_name)
+            return same_name[0] if same_name else None
 
         categorized_results = {
             "pending_confirmation": [],
@@ -744,14 +766,13 @@ class BankStatementService:
         }
 
         for txn in confirmed_txns:
-            payment_records = txn.payment_records.all()
             allocated_to_bills = []
-            for pr in payment_records:
+            for pr in payments_by_txn.get(txn.id, []):
                 if pr.customer_bill:
-                    bill_info = self._format_bill(pr.customer_bill, txn.id)
+                    bill_info = format_bill(pr.customer_bill, txn)
                     bill_info['allocated_amount_from_this_txn'] = str(pr.amount)
                     allocated_to_bills.append(bill_info)
-            
+
             if allocated_to_bills:
                 categorized_results["confirmed"].append({
                     **self._format_txn(txn),
@@ -760,16 +781,13 @@ class BankStatementService:
 
         for txn in txns_to_process:
             if txn.status == BankTransactionStatus.PARTIALLY_ALLOCATED:
-                contract = self._find_contract_for_txn(txn)
+                contract = find_contract_for_txn(txn)
                 unpaid_bills = []
                 customer_name = None
                 if contract:
                     customer_name = contract.customer_name
-                    unpaid_bills = CustomerBill.query.filter(
-                        CustomerBill.contract_id == contract.id,
-                        CustomerBill.total_due > CustomerBill.total_paid,
-                    ).all()
-                
+                    unpaid_bills = unpaid_bills_by_contract.get(contract.id, [])
+
                 # 判断是否为代付
                 matched_by = 'name'
                 if customer_name and txn.payer_name != customer_name:
@@ -777,7 +795,7 @@ class BankStatementService:
 
                 categorized_results["manual_allocation"].append({
                     **self._format_txn(txn),
-                    "unpaid_bills": [self._format_bill(b, txn.id) for b in unpaid_bills],
+                    "unpaid_bills": [format_bill(b, txn) for b in unpaid_bills],
                     "customer_name": customer_name,
                     "matched_by": matched_by
                 })
@@ -785,20 +803,19 @@ class BankStatementService:
 
             # --- NEW LOGIC for UNMATCHED transactions (V2) ---
             # 一个付款人可能对应多个客户（合同），所以必须查找所有可能性
-            aliases = PayerAlias.query.filter_by(payer_name=txn.payer_name).all()
-            
+            aliases = aliases_by_payer.get(txn.payer_name, [])
+
             # 收集所有可能的合同
             contracts = []
             matched_by = None # 'alias', 'name', or None
-            
+
             if aliases:
                 matched_by = 'alias'
                 contract_ids = {alias.contract_id for alias in aliases}
-                found_contracts = BaseContract.query.filter(BaseContract.id.in_(contract_ids)).all()
-                contracts.extend(found_contracts)
+                contracts.extend(contracts_by_id[cid] for cid in contract_ids if cid in contracts_by_id)
             else:
                 # 如果没有别名，回退到按客户名称直接匹配
-                found_contracts = BaseContract.query.filter_by(customer_name=txn.payer_name).all()
+                found_contracts = contracts_by_name.get(txn.payer_name, [])
                 if found_contracts:
                     matched_by = 'name'
                     contracts.extend(found_contracts)
@@ -807,21 +824,17 @@ class BankStatementService:
                 categorized_results["unmatched"].append(self._format_txn(txn))
                 continue
 
-            contract_ids = [c.id for c in contracts]
-            
-            unpaid_bills = CustomerBill.query.filter(
-                CustomerBill.contract_id.in_(contract_ids),
-                CustomerBill.total_due > CustomerBill.total_paid,
-                or_(
-                    CustomerBill.payment_status == PaymentStatus.UNPAID,
-                    CustomerBill.payment_status == PaymentStatus.PARTIALLY_PAID
-                )
-            ).all()
+            unpaid_bills = [
+                bill
+                for contract in contracts
+                for bill in unpaid_bills_by_contract.get(contract.id, [])
+                if bill.payment_status in (PaymentStatus.UNPAID, PaymentStatus.PARTIALLY_PAID)
+            ]
 
             if len(unpaid_bills) == 1:
                 categorized_results["pending_confirmation"].append({
                     **self._format_txn(txn),
-                    "matched_bill": self._format_bill(unpaid_bills[0], txn.id),
+                    "matched_bill": format_bill(unpaid_bills[0], txn),
                     "matched_by": matched_by
                 })
             else: # Covers len(unpaid_bills) == 0 and len(unpaid_bills) > 1
@@ -829,7 +842,7 @@ class BankStatementService:
                 customer_name = contracts[0].customer_name
                 categorized_results["manual_allocation"].append({
                     **self._format_txn(txn),
-                    "unpaid_bills": [self._format_bill(b, txn.id) for b in unpaid_bills],
+                    "unpaid_bills": [format_bill(b, txn) for b in unpaid_bills],
                     "customer_name": customer_name,  # 明确附加客户名称
                     "matched_by": matched_by # 附加匹配方式
                 })
@@ -838,6 +851,7 @@ class BankStatementService:
             categorized_results["ignored"].append(self._format_txn(txn))
 
         return categorized_results
+
     def delete_payment_record_and_reverse_allocation(self, payment_record_id: str, operator_id: str) -> dict:
         """
         删除单个支付记录并反转相关的分配。
@@ -979,6 +993,7 @@ class BankStatementService:
             "status": txn.status.value,
             "updated_at": txn.updated_at.isoformat() if txn.updated_at else None,
             "ignore_remark": txn.ignore_remark,
+            "match_candidates": txn.match_candidates,
         }
     
     def _find_contract_for_txn(self, txn: BankTransaction) -> BaseContract | None:
@@ -1017,19 +1032,21 @@ class BankStatementService:
             "allocated_to_bills": allocated_to_bills
         }
 
-    def _format_bill(self, bill: CustomerBill, bank_transaction_id: str = None) -> dict:
+    def _format_bill(self, bill: CustomerBill, bank_transaction_id: str = None, paid_by_this_txn=None) -> dict:
         """
         格式化账单信息，并可选地计算特定银行流水对该账单的已付金额。
+        批量场景可直接传入预先汇总好的 paid_by_this_txn，避免逐张查询支付记录。
         """
-        paid_by_this_txn = D('0')
-        if bank_transaction_id:
-            # 查找所有与当前账单和当前银行流水都关联的支付记录
-            payments = PaymentRecord.query.filter_by(
-                customer_bill_id=bill.id,
-                bank_transaction_id=bank_transaction_id
-            ).all()
-            if payments:
-                paid_by_this_txn = sum(p.amount for p in payments)
+        if paid_by_this_txn is None:
+            paid_by_this_txn = D('0')
+            if bank_transaction_id:
+                # 查找所有与当前账单和当前银行流水都关联的支付记录
+                payments = PaymentRecord.query.filter_by(
+                    customer_bill_id=bill.id,
+                    bank_transaction_id=bank_transaction_id
+                ).all()
+                if payments:
+                    paid_by_this_txn = sum(p.amount for p in payments)
 
         return {
             "id": str(bill.id),
@@ -1046,250 +1063,337 @@ class BankStatementService:
             "paid_by_this_txn": str(paid_by_this_txn) # <--- 新增返回字段
         }
 
-    def _parse_line(self, line: str) -> dict | None:
+    def _parse_line(self, line: str) -> dict:
         """
         根据真实的银行流水格式解析单行文本。
         格式: 交易流水号\t...\t登记时间\t...\t交易金额\t...\t收(付)方名称\t摘要
+
+        解析失败时抛出 ValueError（消息可直接返回给前端），不在此逐行写日志。
         """
         parts = line.strip().split('\t')
         if len(parts) < 11: # 真实格式至少有11列
-            current_app.logger.warning(f"Parse Warning: Line has only {len(parts)} parts, expected at least 11. Line: '{line}'")
-            return None
-        
-        try:
-            # 根据你提供的真实格式，提取我们需要的字段
-            # 交易流水号: 第0列
-            # 登记时间: 第2列
-            # 交易金额: 第5列
-            # 收(付)方名称: 第7列
-            # 摘要: 第8列
-            trans_id = parts[0].strip()
-            time_str = parts[2].strip()
-            transaction_method = parts[3].strip() # 交易方式在第3列，例如 "入账"
-            amount_str = parts[5].strip()
-            payer_name = parts[7].strip()
-            summary = parts[8].strip()
-
-            if not all([trans_id, time_str, amount_str, payer_name]):
-                current_app.logger.warning(f"Parse Warning: Missing essential data in line. Line: '{line}'")
-                return None
+            raise ValueError(f"列数不足：只有 {len(parts)} 列，至少需要 11 列")
+
+        # 根据你提供的真实格式，提取我们需要的字段
+        # 交易流水号: 第0列
+        # 登记时间: 第2列
+        # 交易金额: 第5列
+        # 收(付)方名称: 第7列
+        # 摘要: 第8列
+        trans_id = parts[0].strip()
+        time_str = parts[2].strip()
+        transaction_method = parts[3].strip() # 交易方式在第3列，例如 "入账"
+        amount_str = parts[5].strip()
+        payer_name = parts[7].strip()
+        summary = parts[8].strip()
+
+        if not all([trans_id, time_str, amount_str, payer_name]):
+            raise ValueError("缺少流水号、登记时间、交易金额或收(付)方名称")
 
+        try:
             transaction_time = datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            raise ValueError(f"无法解析登记时间: '{time_str}'")
+        try:
             amount = Decimal(amount_str)
-            direction = TransactionDirection.CREDIT if transaction_method == "入账" else TransactionDirection.DEBIT
+        except decimal.InvalidOperation:
+            raise ValueError(f"无法解析交易金额: '{amount_str}'")
+        direction = TransactionDirection.CREDIT if transaction_method == "入账" else TransactionDirection.DEBIT
 
-            return {
-                'transaction_id': trans_id,
-                'transaction_time': transaction_time,
-                'amount': amount,
-                'payer_name': payer_name,
-                'summary': summary,
-                'direction': direction,
-                'raw_text': line
-            }
-        except Exception as e:
-            current_app.logger.error(f"FATAL PARSE ERROR on line: '{line}'")
-            current_app.logger.error(f"Exception Type: {type(e).__name__}, Message: {e}")
-            current_app.logger.error(traceback.format_exc())
-            return None
+        return {
+            'transaction_id': trans_id,
+            'transaction_time': transaction_time,
+            'amount': amount,
+            'payer_name': payer_name,
+            'summary': summary,
+            'direction': direction,
+            'raw_text': line
+        }
 
+    IMPORT_BATCH_SIZE = 1000
 
     def parse_and_store_statement(self, statement_lines: list, operator_id: str):
         """
-        解析银行对账单文本行数组，并将有效交易存入数据库。
+        解析银行对账单文本行数组，并将有效交易批量存入数据库。
+
+        先解析全部行，再用一次查询取出已存在的流水号、一次查询取出相关的永久忽略规则，
+        最后以 INSERT ... ON CONFLICT (transaction_id) DO NOTHING 批量写入。
+        解析失败的行通过返回值中的 parse_errors 报告（行号从表头之后的第 1 行算起）。
         """
-        current_app.logger.info(f"--- RECEIVED {len(statement_lines)} LINES ---")
-        for i, line in enumerate(statement_lines):
-            current_app.logger.info(f"Line {i}: {line}")
-        current_app.logger.info("---------------------------------")
         if not statement_lines:
-            return {'new_imports': 0, 'duplicates': 0, 'errors': 0, 'total_lines': 0}
+            return {'new_imports': 0, 'duplicates': 0, 'errors': 0, 'total_lines': 0, 'parse_errors': []}
 
         header = statement_lines[0]
         transactions = statement_lines[1:]
-        
-        new_imports = 0
+
         duplicates = 0
-        errors = 0
+        parse_errors = []
+        parsed_rows = {}
 
-        for line in transactions:
+        # 1. 解析全部行；同一批次内重复的流水号只保留第一条
+        for line_number, line in enumerate(transactions, start=1):
             if not line.strip():
                 continue
-
-            parsed_data = self._parse_line(line)
-            if not parsed_data:
-                errors += 1
+            try:
+                parsed_data = self._parse_line(line)
+            except ValueError as e:
+                parse_errors.append({'line': line_number, 'error': str(e), 'raw_text': line})
                 continue
-
-            # 根据交易流水号检查是否重复
-            existing_txn = BankTransaction.query.filter_by(transaction_id=parsed_data['transaction_id']).first()
-            if existing_txn:
+            if parsed_data['transaction_id'] in parsed_rows:
                 duplicates += 1
                 continue
+            parsed_rows[parsed_data['transaction_id']] = parsed_data
 
-            try:
-                # 检查是否在永久忽略名单中
-                ignore_rule = PermanentIgnoreList.query.filter_by(
-                    payer_name=parsed_data['payer_name'],
-                    direction=parsed_data['direction']
-                ).first()
-
-                status = BankTransactionStatus.UNMATCHED
-                ignore_remark = None
-
-                if ignore_rule:
-                    status = BankTransactionStatus.IGNORED
-                    ignore_remark = f"{ignore_rule.initial_remark or ''} (永久忽略)".strip()
-
-                bank_txn = BankTransaction(
-                    transaction_id=parsed_data['transaction_id'],
-                    transaction_time=parsed_data['transaction_time'],
-                    amount=parsed_data['amount'],
-                    payer_name=parsed_data['payer_name'],
-                    summary=parsed_data['summary'],
-                    direction=parsed_data['direction'],
-                    raw_text=parsed_data['raw_text'],
-                    status=status,
-                    ignore_remark=ignore_remark
-                )
-                db.session.add(bank_txn)
-                new_imports += 1
-            except Exception as e:
-                errors += 1
-                current_app.logger.error(f"Error creating BankTransaction object: {e}")
+        # 2. 一次查询剔除库中已存在的流水号
+        if parsed_rows:
+            existing_ids = {
+                transaction_id for (transaction_id,) in db.session.query(BankTransaction.transaction_id)
+                .filter(BankTransaction.transaction_id.in_(list(parsed_rows)))
+            }
+            duplicates += len(existing_ids)
+            for transaction_id in existing_ids:
+                parsed_rows.pop(transaction_id)
+
+        # 3. 一次查询取出本批次涉及的永久忽略规则
+        ignore_rules = {}
+        if parsed_rows:
+            payer_names = {row['payer_name'] for row in parsed_rows.values()}
+            for rule in PermanentIgnoreList.query.filter(PermanentIgnoreList.payer_name.in_(payer_names)):
+                ignore_rules[(rule.payer_name, rule.direction)] = rule
+
+        values = []
+        for parsed_data in parsed_rows.values():
+            ignore_rule = ignore_rules.get((parsed_data['payer_name'], parsed_data['direction']))
+            status = BankTransactionStatus.UNMATCHED
+            ignore_remark = None
+            if ignore_rule:
+                status = BankTransactionStatus.IGNORED
+                ignore_remark = f"{ignore_rule.initial_remark or ''} (永久忽略)".strip()
+            values.append({
+                **parsed_data,
+                'id': uuid.uuid4(),
+                'status': status,
+                'ignore_remark': ignore_remark,
+                'allocated_amount': D(0),
+            })
 
+        # 4. 批量写入；并发导入时被其它请求抢先写入的流水号按重复计
+        new_imports = 0
         try:
+            for start in range(0, len(values), self.IMPORT_BATCH_SIZE):
+                batch = values[start:start + self.IMPORT_BATCH_SIZE]
+                stmt = (
+                    pg_insert(BankTransaction.__table__)
+                    .values(batch)
+                    .on_conflict_do_nothing(index_elements=['transaction_id'])
+                    .returning(BankTransaction.__table__.c.id)
+                )
+                inserted = len(db.session.execute(stmt).all())
+                new_imports += inserted
+                duplicates += len(batch) - inserted
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Database commit failed: {e}", exc_info=True)
-            return {'new_imports': 0, 'duplicates': duplicates, 'errors': new_imports + errors, 'total_lines': len(transactions)}
+            return {
+                'new_imports': 0,
+                'duplicates': duplicates,
+                'errors': len(values) + len(parse_errors),
+                'total_lines': len(transactions),
+                'parse_errors': parse_errors,
+            }
 
-        return {'new_imports': new_imports, 'duplicates': duplicates, 'errors': errors, 'total_lines': len(transactions)}
+        current_app.logger.info(
+            f"Bank statement import: {len(transactions)} lines, {new_imports} new, "
+            f"{duplicates} duplicates, {len(parse_errors)} parse errors"
+        )
+        return {
+            'new_imports': new_imports,
+            'duplicates': duplicates,
+            'errors': len(parse_errors),
+            'total_lines': len(transactions),
+            'parse_errors': parse_errors,
+        }
 
 
-    def match_transactions(self, operator_id: str):
+    def match_transactions(self, operator_id: str, tolerance=D("1.00")) -> dict:
         """
-        尝试将所有处于 UNMATCHED 状态的银行交易与客户账单进行匹配。
+        尝试将所有处于 UNMATCHED 状态的入账流水与客户账单进行匹配。
+
+        本次运行只构建一次未付账单索引（含付款人别名），每笔流水在索引中 O(1) 查找；
+        唯一的精确匹配直接入账，其余流水保持 UNMATCHED，候选（金额组合/容差匹配等）
+        写入 match_candidates 供人工确认，没有候选的写入空列表。
+        所有支付记录、日志和状态更新在一个事务中批量写入。
 
         :param operator_id: 执行此操作的用户的ID。
+        :param tolerance: 容差匹配允许的金额差。
+        :return: 运行报告，含已匹配、待确认（附候选）和无匹配的流水。
         """
-        unmatched_txns = BankTransaction.query.filter_by(status=BankTransactionStatus.UNMATCHED).all()
-        
-        # 获取操作员用户，用于创建支付记录
         operator = User.query.get(operator_id)
         if not operator:
-            print(f"Error: Operator with ID {operator_id} not found.")
-            return
+            return {"error": f"Operator with ID {operator_id} not found."}
 
-        for txn in unmatched_txns:
-            # 1. 根据付款人姓名查找关联合同
-            # 注意：这里的客户名称匹配可能需要更模糊的匹配逻辑
-            contracts = BaseContract.query.filter(BaseContract.customer_name == txn.payer_name).all()
-            if not contracts:
-                txn.status = BankTransactionStatus.ERROR
-                txn.summary = (txn.summary or "") + " [匹配错误：找不到同名客户的合同]"
-                continue
+        unmatched_txns = (
+            BankTransaction.query.filter_by(
+                status=BankTransactionStatus.UNMATCHED,
+                direction=TransactionDirection.CREDIT,
+            )
+            .order_by(BankTransaction.transaction_time)
+            .all()
+        )
+        report = {"matched": [], "pending_confirmation": [], "unmatched": []}
+        if not unmatched_txns:
+            return report
 
-            # 2. 查找这些合同下所有未付清的账单
-            contract_ids = [c.id for c in contracts]
-            bills_to_check = CustomerBill.query.filter(
-                CustomerBill.contract_id.in_(contract_ids),
-                CustomerBill.payment_status.in_([PaymentStatus.UNPAID, PaymentStatus.PARTIALLY_PAID])
-            ).all()
+        engine = BankMatchingEngine(UnpaidBillIndex.build(), tolerance=tolerance)
+        payments = []
+        logs = []
+        paid_by_bill = defaultdict(D)
+        matched_bills = {}
 
-            # 3. 根据金额进行精确匹配
-            matching_bills = []
-            for bill in bills_to_check:
-                amount_due = bill.total_due - bill.total_paid
-                if amount_due == txn.amount:
-                    matching_bills.append(bill)
-
-            # 4. 处理匹配结果
-            if len(matching_bills) == 1:
-                # 找到唯一匹配，创建支付记录
-                bill = matching_bills[0]
-                
+        for txn in unmatched_txns:
+            candidates = engine.candidates_for(txn.payer_name, txn.amount)
+            auto = engine.auto_match(candidates)
+            if auto:
+                bill = auto["bills"][0]
+                engine.index.remove(bill)
                 payment = PaymentRecord(
+                    id=uuid.uuid4(),
                     customer_bill_id=bill.id,
                     amount=txn.amount,
                     payment_date=txn.transaction_time.date(),
                     method="银行转账",  # 默认方式
-                    notes=f"{txn.payer_name} 转账。流水号: {txn.transaction_id}",
-                    created_by_user_id=operator.id
+                    notes=f"{txn.payer_name}转账。流水号: {txn.transaction_id}",
+                    created_by_user_id=operator.id,
+                    bank_transaction_id=txn.id,
                 )
-                db.session.add(payment)
-
-                # 更新账单状态
-                bill.total_paid += txn.amount
-                if bill.total_paid >= bill.total_due:
-                    bill.payment_status = PaymentStatus.PAID
-                else:
-                    bill.payment_status = PaymentStatus.PARTIALLY_PAID
-
-                # 更新银行流水状态
+                payments.append(payment)
+                logs.append(FinancialActivityLog(
+                    customer_bill_id=bill.id,
+                    contract_id=bill.contract_id,
+                    user_id=operator.id,
+                    action="自动匹配银行回款",
+                    details={
+                        "message": f"系统按付款人与金额自动匹配了一笔金额为 {txn.amount} 的回款。",
+                        "bank_transaction_id": str(txn.id),
+                        "payment_record_id": str(payment.id),
+                    },
+                ))
+                paid_by_bill[bill.id] += D(txn.amount)
+                matched_bills[bill.id] = bill
+                txn.allocated_amount = D(txn.allocated_amount or 0) + D(txn.amount)
                 txn.status = BankTransactionStatus.MATCHED
-                txn.payment_record = payment
-                print(f"Successfully matched transaction {txn.id} to bill {bill.id}")
-
-            elif len(matching_bills) == 0:
-                txn.status = BankTransactionStatus.ERROR
-                txn.summary = (txn.summary or "") + f" [匹配错误：找不到金额为 {txn.amount} 的未付账单]"
+                txn.match_candidates = None
+                report["matched"].append({"transaction_id": str(txn.id), "bill_id": str(bill.id)})
+            elif candidates:
+                # 状态保持 UNMATCHED，月度视图与手动分配照常可用，候选随流水一起返回
+                txn.match_candidates = [
+                    {key: value for key, value in candidate.items() if key != "bills"}
+                    for candidate in candidates
+                ]
+                report["pending_confirmation"].append({
+                    "transaction_id": str(txn.id),
+                    "candidates": txn.match_candidates,
+                })
             else:
-                # 找到多个匹配项，需要人工处理
-                txn.status = BankTransactionStatus.ERROR
-                txn.summary = (txn.summary or "") + f" [匹配错误：找到多个金额为 {txn.amount} 的未付账单]"
+                txn.match_candidates = []
+                report["unmatched"].append({"transaction_id": str(txn.id)})
+
+        try:
+            db.session.add_all(payments)
+            db.session.add_all(logs)
+            # 账单实付额直接累加本次入账金额，无需逐张回查支付记录
+            for bill_id, amount in paid_by_bill.items():
+                bill = matched_bills[bill_id]
+                bill.total_paid = D(bill.total_paid or 0) + amount
+                _apply_bill_payment_status(bill)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Auto matching failed: {e}", exc_info=True)
+            return {"error": f"An unexpected error occurred: {str(e)}"}
 
-        db.session.commit()
-        print("Finished matching process.")
+        current_app.logger.info(
+            f"Auto matching finished: {len(report['matched'])} matched, "
+            f"{len(report['pending_confirmation'])} pending confirmation, "
+            f"{len(report['unmatched'])} unmatched"
+        )
+        return report
 
     def find_customer_and_unpaid_bills(self, bank_transaction_id: str, year: int, month: int) -> dict:
         """
         根据银行流水ID和指定的年月，查找关联的客户及该客户的未付清账单。
         """
-        bank_txn = BankTransaction.query.get(bank_transaction_id)
-        if not bank_txn:
-            return {"error": "Bank transaction not found"}
+        result = self.get_allocation_candidates([bank_transaction_id], year, month)
+        return result.get(str(bank_transaction_id), {"error": "Bank transaction not found"})
 
-        payer_name = bank_txn.payer_name
-        contracts = BaseContract.query.filter_by(customer_name=payer_name).all()
+    def get_allocation_candidates(self, bank_transaction_ids: list, year: int, month: int) -> dict:
+        """
+        批量返回多笔流水的分配候选：{流水ID: 与 find_customer_and_unpaid_bills 相同结构的结果}。
 
-        if not contracts:
-            return {"customer_found": False, "searched_payer_name": payer_name}
+        付款人通过进程内缓存解析（付款人别名优先，其次规范化后的客户姓名），
+        所有流水的未付账单用一次查询取出，查询次数与流水条数无关。
+        """
+        txn_ids = []
+        for txn_id in bank_transaction_ids:
+            try:
+                txn_ids.append(uuid.UUID(str(txn_id)))
+            except ValueError:
+                continue
+        bank_txns = BankTransaction.query.filter(BankTransaction.id.in_(txn_ids)).all() if txn_ids else []
 
-        contract_ids = [c.id for c in contracts]
-        
-        # --- 在查询中加入 year 和 month 的过滤条件 ---
-        query = CustomerBill.query.filter(
-            CustomerBill.contract_id.in_(contract_ids),
-            CustomerBill.year == year,
-            CustomerBill.month == month,
-            CustomerBill.total_due > 0,
-            or_(
-                CustomerBill.payment_status == PaymentStatus.UNPAID,
-                CustomerBill.payment_status == PaymentStatus.PARTIALLY_PAID
-            )
-        )
-        
-        unpaid_bills = query.order_by(CustomerBill.cycle_start_date.desc()).all()
-        # -----------------------------------------
+        resolutions = {
+            txn.id: payer_resolution_cache.resolve_payer(txn.payer_name)
+            for txn in bank_txns
+        }
+        all_contract_ids = {
+            contract_id
+            for resolution in resolutions.values()
+            for contract_id in resolution.contract_ids
+        }
+
+        bills_by_contract = defaultdict(list)
+        if all_contract_ids:
+            unpaid_bills = CustomerBill.query.options(
+                db.joinedload(CustomerBill.contract).joinedload(BaseContract.service_personnel)
+            ).filter(
+                CustomerBill.contract_id.in_(list(all_contract_ids)),
+                CustomerBill.year == year,
+                CustomerBill.month == month,
+                CustomerBill.total_due > 0,
+                CustomerBill.payment_status.in_([PaymentStatus.UNPAID, PaymentStatus.PARTIALLY_PAID]),
+            ).order_by(CustomerBill.cycle_start_date.desc()).all()
+            for bill in unpaid_bills:
+                bills_by_contract[bill.contract_id].append(bill)
+
+        results = {}
+        for txn in bank_txns:
+            resolution = resolutions[txn.id]
+            if not resolution:
+                results[str(txn.id)] = {"customer_found": False, "searched_payer_name": txn.payer_name}
+                continue
+
+            bills = [bill for contract_id in resolution.contract_ids for bill in bills_by_contract[contract_id]]
+            bills.sort(key=lambda bill: bill.cycle_start_date, reverse=True)
+            results[str(txn.id)] = {
+                "customer_found": True,
+                "customer_name": txn.payer_name,
+                "matched_by": resolution.matched_by,
+                "unpaid_bills": [self._format_unpaid_bill_candidate(bill) for bill in bills],
+            }
+        return results
 
+    @staticmethod
+    def _format_unpaid_bill_candidate(bill) -> dict:
         return {
-            "customer_found": True,
-            "customer_name": payer_name,
-            "unpaid_bills": [
-                {
-                    "id": str(bill.id),
-                    "employee_name": bill.contract.service_personnel.name if bill.contract and bill.contract.service_personnel else "未知员工",
-                    "cycle": f"{bill.cycle_start_date.strftime('%Y-%m-%d')} to {bill.cycle_end_date.strftime('%Y-%m-%d')}",
-                    "bill_month": bill.month,
-                    "total_due": str(bill.total_due),
-                    "total_paid": str(bill.total_paid),
-                    "amount_remaining": str(bill.total_due - bill.total_paid),
-                    "status": bill.payment_status.value,
-                }
-                for bill in unpaid_bills
-            ]
+            "id": str(bill.id),
+            "employee_name": bill.contract.service_personnel.name if bill.contract and bill.contract.service_personnel else "未知员工",
+            "cycle": f"{bill.cycle_start_date.strftime('%Y-%m-%d')} to {bill.cycle_end_date.strftime('%Y-%m-%d')}",
+            "bill_month": bill.month,
+            "total_due": str(bill.total_due),
+            "total_paid": str(bill.total_paid),
+            "amount_remaining": str(bill.total_due - bill.total_paid),
+            "status": bill.payment_status.value,
         }
 
     def allocate_transaction(self, bank_transaction_id: str, allocations: list, operator_id: str) -> dict:
@@ -1384,6 +1488,8 @@ class BankStatementService:
                 bank_txn.status = BankTransactionStatus.MATCHED
             else:
                 bank_txn.status = BankTransactionStatus.PARTIALLY_ALLOCATED
+            # 人工分配后自动匹配的候选已失效
+            bank_txn.match_candidates = None
             
             db.session.commit()
             return {"success": True, "message": "Allocation successful."}
@@ -5,6 +5,8 @@ from datetime import date, timedelta, datetime
 
 import decimal
 import calendar
+import time
+import uuid
 from dateutil.relativedelta import relativedelta
 
 from backend.extensions import db
@@ -28,10 +30,16 @@ from backend.models import (
     TrialOutcome,
     PayoutRecord,
     BankTransactionStatus,
+    InvoiceRecord,
 )
 from backend.services.renewal_sync_service import calculate_exact_payroll_transfer_amount
+from backend.services.billing_lifecycle_context import ContractLifecycleContext
+from backend.services.billing_summary_service import (
+    deferred_billing_summary_refresh,
+    mark_records_dirty,
+)
 
-from sqlalchemy import func, or_,and_
+from sqlalchemy import func, or_,and_, case
 from sqlalchemy.orm import attributes
 from sqlalchemy.exc import IntegrityError
 
@@ -66,6 +74,13 @@ def _update_bill_payment_status(bill: CustomerBill):
         total_paid = total_paid_query.scalar() or 0
         bill.total_paid = D(total_paid)
 
+    _apply_bill_payment_status(bill)
+
+
+def _apply_bill_payment_status(bill: CustomerBill):
+    """
+    按已确定的 bill.total_paid 设置支付状态（批量对账时由调用方一次性汇总支付额）。
+    """
     # 更新支付状态，增加对超付的处理
     if bill.total_due is not None and bill.total_paid >= bill.total_due:
         bill.payment_status = PaymentStatus.PAID
@@ -77,6 +92,31 @@ def _update_bill_payment_status(bill: CustomerBill):
         # 涵盖 total_paid <= 0 的情况
         bill.payment_status = PaymentStatus.UNPAID
 
+    mark_records_dirty(bill)
+
+BILL_FEE_COLUMNS = ("management_fee", "extension_fee", "employee_commission")
+
+
+def _details_money(details: dict, key: str):
+    """从 calculation_details 中解析金额；缺失或无法解析时返回 None。"""
+    value = (details or {}).get(key)
+    if value is None or value == "":
+        return None
+    try:
+        return D(str(value)).quantize(D("0.01"))
+    except (decimal.InvalidOperation, ValueError):
+        return None
+
+
+def _sync_bill_fee_columns(bill: CustomerBill):
+    """
+    将 calculation_details 中的管理费/延长期服务费/佣金同步到账单的数值列，
+    使仪表盘与导出等聚合查询无需逐行解析 JSON。
+    """
+    for key in BILL_FEE_COLUMNS:
+        setattr(bill, key, _details_money(bill.calculation_details, key))
+
+
 def _update_payroll_payout_status(payroll: EmployeePayroll):
     """
     根据一个薪酬单的所有支付记录，更新其 total_paid_out 和 payout_status.
@@ -98,9 +138,40 @@ def _update_payroll_payout_status(payroll: EmployeePayroll):
         payroll.payout_status = PayoutStatus.PAID
 
     db.session.add(payroll)
+    mark_records_dirty(payroll)
     current_app.logger.info(f"Updated payroll {payroll.id} status to {payroll.payout_status.value} with total_paid_out {payroll.total_paid_out}")
 
 class BillingEngine:
+    # 全周期模式下的预加载上下文（见 generate_all_bills_for_contract），平时为 None
+    _lifecycle = None
+
+    def _lifecycle_for(self, contract_id):
+        """若当前处于该合同的全周期计算中，返回其预加载上下文。"""
+        if self._lifecycle and str(self._lifecycle.contract.id) == str(contract_id):
+            return self._lifecycle
+        return None
+
+    def _has_earlier_main_bill(self, contract, bill):
+        """合同是否存在周期早于该账单的主账单（用于判断首月账单）。"""
+        lifecycle = self._lifecycle_for(contract.id)
+        if lifecycle:
+            return lifecycle.has_bill_before(bill.cycle_start_date)
+        return db.session.query(CustomerBill.id).filter(
+            CustomerBill.contract_id == contract.id,
+            CustomerBill.cycle_start_date < bill.cycle_start_date,
+            CustomerBill.is_substitute_bill == False
+        ).first() is not None
+
+    def _last_main_bill(self, contract_id):
+        """按周期结束日取合同的最后一张主账单。"""
+        lifecycle = self._lifecycle_for(contract_id)
+        if lifecycle:
+            return lifecycle.last_bill_by_cycle_end()
+        return CustomerBill.query.filter(
+            CustomerBill.contract_id == contract_id,
+            CustomerBill.is_substitute_bill == False
+        ).order_by(CustomerBill.cycle_end_date.desc()).first()
+
     def _attendance_overtime_days(self, attendance):
         if not attendance:
             return D(0)
@@ -393,6 +464,8 @@ class BillingEngine:
         for adj in pending_adjustments:
             adj.customer_bill_id = bill.id
             adj.status = 'BILLED'
+            if self._lifecycle:
+                self._lifecycle.register_adjustment(adj)
 
             if adj.adjustment_type == AdjustmentType.DEPOSIT and adj.paid_amount and adj.paid_amount > 0:
                 existing_record = PaymentRecord.query.filter_by(
@@ -440,7 +513,11 @@ class BillingEngine:
         
         contract_poly = db.with_polymorphic(BaseContract, "*")
 
-        if contract_id:
+        lifecycle = self._lifecycle_for(contract_id) if contract_id else None
+        if lifecycle:
+            # 全周期模式：合同已在加载上下文时锁定，无需逐月重新查询
+            contracts_to_process = [lifecycle.contract]
+        elif contract_id:
             contract = db.session.query(contract_poly).filter_by(id=contract_id).with_for_update(of=BaseContract).first()
             if not contract:
                 current_app.logger.warning(f"Contract {contract_id} not found, skipping calculation.")
@@ -502,6 +579,54 @@ class BillingEngine:
                 log = self._create_calculation_log(details)
                 self._update_bill_with_log(bill, payroll, details, log)
 
+    def calculate_contracts_for_month(self, contract_ids, year: int, month: int, force_recalculate=False):
+        """
+        逐个合同计算指定月份的账单，每个合同使用独立事务。
+
+        与 calculate_for_month(contract_id=None) 不同，单个合同出错只回滚该合同，
+        不影响同批其它合同；每个合同在自己的事务内通过 calculate_for_month
+        加行锁，提交后立即释放。
+
+        Returns:
+            运行报告：succeeded / failed / skipped 三个列表，每项带合同ID与耗时(毫秒)。
+        """
+        report = {"succeeded": [], "failed": [], "skipped": []}
+
+        # 批量逐合同提交时推迟月度汇总刷新，结束后统一刷新一次
+        with deferred_billing_summary_refresh():
+            for contract_id in contract_ids:
+                started = time.perf_counter()
+                entry = {"contract_id": str(contract_id)}
+                try:
+                    contract = db.session.get(BaseContract, contract_id)
+                    if not contract or contract.status not in ("active", "terminated"):
+                        entry["reason"] = "合同不存在" if not contract else f"合同状态为 {contract.status}"
+                        entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                        report["skipped"].append(entry)
+                        db.session.rollback()
+                        continue
+
+                    self.calculate_for_month(
+                        year=year,
+                        month=month,
+                        contract_id=contract_id,
+                        force_recalculate=force_recalculate,
+                    )
+                    db.session.commit()
+                    entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    report["succeeded"].append(entry)
+                except Exception as e:
+                    db.session.rollback()
+                    entry["error"] = str(e)
+                    entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    report["failed"].append(entry)
+                    current_app.logger.error(
+                        f"[MonthlyBillingRun] 合同 {contract_id} {year}-{month} 计算失败: {e}",
+                        exc_info=True,
+                    )
+
+        return report
+
     def _calculate_formal_contract_bill_for_month(
         self, contract: BaseContract, year: int, month: int, force_recalculate=False
     ):
@@ -630,10 +755,16 @@ class BillingEngine:
             str(contract.id), force_recalculate=force_recalculate
         )
 
-    def generate_all_bills_for_contract(self, contract_id, force_recalculate=True):
+    def generate_all_bills_for_contract(self, contract_id, force_recalculate=True, preload_context=True):
         """
         Generates or recalculates all bills for the entire lifecycle of a single contract.
         For auto-renewing contracts, it finds the last existing bill to define the loop's end point.
+
+        With preload_context (the default), the contract is locked and its bills, payrolls,
+        attendance, adjustments and attendance forms are loaded once into a
+        ContractLifecycleContext; every cycle is computed against that context and new
+        records are flushed in one batch at the end. Pass preload_context=False to run the
+        plain month-by-month path, which reloads everything through calculate_for_month.
         """
         contract_poly = db.with_polymorphic(BaseContract, "*")
         contract = db.session.query(contract_poly).filter(BaseContract.id == contract_id).first()
@@ -689,19 +820,30 @@ class BillingEngine:
             f"[FullLifecycle] Contract {contract.id} date range for calculation: {start_date} to {end_date}."
         )
 
-        # Iterate through each month in the contract's lifecycle
-        current_month_start = date(start_date.year, start_date.month, 1)
-        while current_month_start <= end_date:
-            year = current_month_start.year
-            month = current_month_start.month
+        if preload_context:
+            self._lifecycle = ContractLifecycleContext.load(contract.id)
 
-            current_app.logger.info(
-                f"  [FullLifecycle] Calculating for {year}-{month} for contract {contract.id}"
-            )
-            self.calculate_for_month(year, month, contract_id, force_recalculate)
+        try:
+            # Iterate through each month in the contract's lifecycle
+            current_month_start = date(start_date.year, start_date.month, 1)
+            while current_month_start <= end_date:
+                year = current_month_start.year
+                month = current_month_start.month
 
-            # Move to the next month
-            current_month_start += relativedelta(months=1)
+                current_app.logger.info(
+                    f"  [FullLifecycle] Calculating for {year}-{month} for contract {contract.id}"
+                )
+                self.calculate_for_month(year, month, contract_id, force_recalculate)
+
+                # Move to the next month
+                current_month_start += relativedelta(months=1)
+
+            if preload_context:
+                db.session.flush()
+        finally:
+            if self._lifecycle:
+                self._lifecycle.close()
+            self._lifecycle = None
 
         current_app.logger.info(
             f"[FullLifecycle] Finished bill generation for contract {contract.id}."
@@ -879,10 +1021,14 @@ class BillingEngine:
     ):
         # <--- 在这里增加下面的代码块 --->
         current_app.logger.debug(f"[DEBUG-ENGINE] -> Entering _calculate_nanny_bill_for_month for contract: {contract.id}, status: {contract.status}")
+        lifecycle = self._lifecycle_for(contract.id)
         if contract.previous_contract_id:
-            # 使用 with_polymorphic 确保能正确加载所有子类属性
-            contract_poly = db.with_polymorphic(BaseContract, "*")
-            previous_contract = db.session.query(contract_poly).filter_by(id =contract.previous_contract_id).first()
+            if lifecycle:
+                previous_contract = lifecycle.previous_contract
+            else:
+                # 使用 with_polymorphic 确保能正确加载所有子类属性
+                contract_poly = db.with_polymorphic(BaseContract, "*")
+                previous_contract = db.session.query(contract_poly).filter_by(id =contract.previous_contract_id).first()
             if previous_contract:
                 current_app.logger.debug(f"[DEBUG-ENGINE]    This contract has a previous_contract: {previous_contract.id}, status: {previous_contract.status}, termination_date: {previous_contract.termination_date}")
         # <--- 增加结束 --->
@@ -890,7 +1036,11 @@ class BillingEngine:
         current_app.logger.debug(f"[DEBUG-ENGINE] _calculate_nanny_bill_for_month called with: end_date_override={end_date_override}, actual_work_days_override={actual_work_days_override}")
 
         bill_to_recalculate = None
-        if force_recalculate:
+        if force_recalculate and lifecycle:
+            bill_to_recalculate = lifecycle.find_bill(
+                cycle_start_date=cycle_start_date_override, year=year, month=month
+            )
+        elif force_recalculate:
             bill_query = CustomerBill.query.filter_by(
                 contract_id=contract.id,
                 year=year,
@@ -948,10 +1098,7 @@ class BillingEngine:
             final_adjustments_synced = True
 
         if not final_adjustments_synced and contract.status in ['terminated', 'finished'] and not bill.is_substitute_bill:
-            last_bill_in_db = CustomerBill.query.filter(
-                CustomerBill.contract_id == contract.id,
-                CustomerBill.is_substitute_bill == False
-            ).order_by(CustomerBill.cycle_end_date.desc()).first()
+            last_bill_in_db = self._last_main_bill(contract.id)
 
             if last_bill_in_db and last_bill_in_db.id == bill.id:
                 current_app.logger.info(f"[NannyCALC] 合同 {contract.id} 已结束，同步最后账单 {bill.id} 的最终结算调整。")
@@ -1160,11 +1307,7 @@ class BillingEngine:
             False,
         )
         # 【核心修复】更健壮地判断是否为合同的首月账单
-        is_first_bill_of_contract = not db.session.query(CustomerBill.id).filter(
-            CustomerBill.contract_id == contract.id,
-            CustomerBill.cycle_start_date < bill.cycle_start_date,
-            CustomerBill.is_substitute_bill == False
-        ).first()
+        is_first_bill_of_contract = not self._has_earlier_main_bill(contract, bill)
         if is_first_bill_of_contract:
             cycle_actual_days = _nanny_service_days_excluding_start(
                 cycle_start,
@@ -1555,11 +1698,7 @@ class BillingEngine:
         # --- 【新逻辑】员工首月10%服务费 ---
         first_month_deduction = D(0)
         # is_first_bill_of_contract = cycle_start == contract_start_date
-        is_first_bill_of_contract = not db.session.query(CustomerBill.id).filter(
-            CustomerBill.contract_id == contract.id,
-            CustomerBill.cycle_start_date < bill.cycle_start_date,
-            CustomerBill.is_substitute_bill == False
-        ).first()
+        is_first_bill_of_contract = not self._has_earlier_main_bill(contract, bill)
         current_app.logger.info("开始检查首月10%返佣逻辑")
 
         if is_first_bill_of_contract and not (isinstance(contract, NannyTrialContract) and contract.trial_outcome == TrialOutcome.SUCCESS):
@@ -1694,9 +1833,16 @@ class BillingEngine:
             return
 
         # --- 强制重算：按现有账单周期重算（同月可能有多张 26 天账单）---
+        lifecycle = self._lifecycle_for(contract.id)
         if force_recalculate:
             bills_to_recalculate = []
-            if cycle_start_date_override:
+            if lifecycle:
+                if cycle_start_date_override:
+                    bill = lifecycle.find_bill(cycle_start_date=cycle_start_date_override)
+                    bills_to_recalculate = [bill] if bill else []
+                else:
+                    bills_to_recalculate = lifecycle.bills_in_month(year, month)
+            elif cycle_start_date_override:
                 bill = CustomerBill.query.filter_by(
                     contract_id=contract.id,
                     cycle_start_date=cycle_start_date_override,
@@ -1787,13 +1933,19 @@ class BillingEngine:
 
         # First, try to find an existing non-substitute bill for this contract and month
         # This is crucial for handling postponed bills
-        existing_bill = CustomerBill.query.filter_by(
-            contract_id=contract.id,
-            cycle_start_date=cycle_start_date,
-            year=year,
-            month=month,
-            is_substitute_bill=False,
-        ).first()
+        lifecycle = self._lifecycle_for(contract.id)
+        if lifecycle:
+            existing_bill = lifecycle.find_bill(
+                cycle_start_date=cycle_start_date, year=year, month=month
+            )
+        else:
+            existing_bill = CustomerBill.query.filter_by(
+                contract_id=contract.id,
+                cycle_start_date=cycle_start_date,
+                year=year,
+                month=month,
+                is_substitute_bill=False,
+            ).first()
 
         # If an existing bill is found and we are not forcing recalculation, skip
         if existing_bill and not force_recalculate:
@@ -1867,14 +2019,7 @@ class BillingEngine:
             and contract.status in ["terminated", "finished"]
             and not bill.is_substitute_bill
         ):
-            last_bill_in_db = (
-                CustomerBill.query.filter(
-                    CustomerBill.contract_id == contract.id,
-                    CustomerBill.is_substitute_bill == False,
-                )
-                .order_by(CustomerBill.cycle_end_date.desc())
-                .first()
-            )
+            last_bill_in_db = self._last_main_bill(contract.id)
             if last_bill_in_db and last_bill_in_db.id == bill.id:
                 current_app.logger.info(
                     f"[MN CALC] 合同 {contract.id} 已结束，同步最后账单 {bill.id} 的最终结算调整。"
@@ -2093,11 +2238,7 @@ class BillingEngine:
         # 【关键修复】统一使用纯 date 对象进行比较
         contract_start_date = self._to_date(contract.actual_onboarding_date or contract.start_date)
         bill_cycle_start_date = self._to_date(bill.cycle_start_date)
-        is_first_bill_of_contract = not db.session.query(CustomerBill.id).filter(
-            CustomerBill.contract_id == contract.id,
-            CustomerBill.cycle_start_date < bill.cycle_start_date,
-            CustomerBill.is_substitute_bill == False
-        ).first()
+        is_first_bill_of_contract = not self._has_earlier_main_bill(contract, bill)
         # is_first_bill = bill_cycle_start_date == contract_start_date
         current_app.logger.info(f"[DEPOSIT-HANDLER-V2] is_first_bill_of_contract: {is_first_bill_of_contract} (bill_cycle_start: {bill_cycle_start_date}, contract_start: {contract_start_date})")
 
@@ -2175,11 +2316,7 @@ class BillingEngine:
         contract_start_date = self._to_date(contract.actual_onboarding_date or contract.start_date)
         bill_cycle_start_date = self._to_date(bill.cycle_start_date)
         # is_first_bill = bill_cycle_start_date == contract_start_date
-        is_first_bill_of_contract = not db.session.query(CustomerBill.id).filter(
-            CustomerBill.contract_id == contract.id,
-            CustomerBill.cycle_start_date < bill.cycle_start_date,
-            CustomerBill.is_substitute_bill == False
-        ).first()
+        is_first_bill_of_contract = not self._has_earlier_main_bill(contract, bill)
 
         if is_first_bill_of_contract:
             # --- 核心修复：使用 like 查询，避免在转移后重复创建 ---
@@ -2581,16 +2718,21 @@ class BillingEngine:
         self, contract, year, month, cycle_start_date, cycle_end_date
     ):
         # 1. 首先尝试查询，这是最高效且最常见的路径
-        bill = CustomerBill.query.filter_by(
-            contract_id=contract.id,
-            cycle_start_date=cycle_start_date,
-            is_substitute_bill=False,
-        ).first()
-        payroll = EmployeePayroll.query.filter_by(
-            contract_id=contract.id,
-            cycle_start_date=cycle_start_date,
-            is_substitute_payroll=False,
-        ).first()
+        lifecycle = self._lifecycle_for(contract.id)
+        if lifecycle:
+            bill = lifecycle.find_bill(cycle_start_date=cycle_start_date)
+            payroll = lifecycle.find_payroll(cycle_start_date)
+        else:
+            bill = CustomerBill.query.filter_by(
+                contract_id=contract.id,
+                cycle_start_date=cycle_start_date,
+                is_substitute_bill=False,
+            ).first()
+            payroll = EmployeePayroll.query.filter_by(
+                contract_id=contract.id,
+                cycle_start_date=cycle_start_date,
+                is_substitute_payroll=False,
+            ).first()
 
         # 2. 如果成功找到，则更新并返回
         if bill and payroll:
@@ -2635,6 +2777,14 @@ class BillingEngine:
             )
             db.session.add(payroll)
 
+            if lifecycle:
+                # 全周期模式下合同已加锁，不存在并发创建；预先分配主键，
+                # 由全周期计算结束时统一 flush
+                bill.id = uuid.uuid4()
+                payroll.id = uuid.uuid4()
+                lifecycle.register_bill_and_payroll(bill, payroll)
+                return bill, payroll
+
             # 立即 flush 以便在当前事务中捕获错误，但不 commit
             db.session.flush()
             current_app.logger.info(
@@ -2686,9 +2836,13 @@ class BillingEngine:
         year = cycle_start_date.year
         month = cycle_start_date.month
 
-        attendance = AttendanceRecord.query.filter_by(
-            contract_id=contract.id, cycle_start_date=cycle_start_date
-        ).first()
+        lifecycle = self._lifecycle_for(contract.id)
+        if lifecycle:
+            attendance = lifecycle.find_attendance(cycle_start_date)
+        else:
+            attendance = AttendanceRecord.query.filter_by(
+                contract_id=contract.id, cycle_start_date=cycle_start_date
+            ).first()
 
         if attendance and attendance.attendance_form_id:
             signed_form = db.session.get(AttendanceForm, attendance.attendance_form_id)
@@ -2745,6 +2899,8 @@ class BillingEngine:
             )
             db.session.add(attendance)
             db.session.flush()
+        if lifecycle:
+            lifecycle.register_attendance(attendance)
         return attendance
 
     def _build_attendance_from_monthly_form(self, contract, cycle_start_date, cycle_end_date):
@@ -2763,12 +2919,7 @@ class BillingEngine:
             else date(cycle_start.year, cycle_start.month + 1, 1)
         )
 
-        candidate_forms = AttendanceForm.query.filter(
-            AttendanceForm.employee_id == contract.service_personnel_id,
-            AttendanceForm.cycle_start_date >= month_start,
-            AttendanceForm.cycle_start_date < next_month_start,
-            AttendanceForm.status.in_(["customer_signed", "synced"]),
-        ).order_by(AttendanceForm.updated_at.desc().nullslast(), AttendanceForm.created_at.desc()).all()
+        candidate_forms = self._candidate_attendance_forms(contract, month_start, next_month_start)
 
         def same_family_or_customer(form):
             form_contract = form.contract
@@ -2812,12 +2963,7 @@ class BillingEngine:
             if cycle_start.month == 12
             else date(cycle_start.year, cycle_start.month + 1, 1)
         )
-        candidate_forms = AttendanceForm.query.filter(
-            AttendanceForm.employee_id == contract.service_personnel_id,
-            AttendanceForm.cycle_start_date >= month_start,
-            AttendanceForm.cycle_start_date < next_month_start,
-            AttendanceForm.status.in_(["customer_signed", "synced"]),
-        ).order_by(AttendanceForm.updated_at.desc().nullslast(), AttendanceForm.created_at.desc()).all()
+        candidate_forms = self._candidate_attendance_forms(contract, month_start, next_month_start)
 
         signed_form = self._find_signed_monthly_attendance_form(contract, cycle_start, candidate_forms)
         if not signed_form or not signed_form.form_data:
@@ -2828,6 +2974,17 @@ class BillingEngine:
         db.session.flush()
         return attendance
 
+    def _candidate_attendance_forms(self, contract, month_start, next_month_start):
+        lifecycle = self._lifecycle_for(contract.id)
+        if lifecycle:
+            return lifecycle.attendance_forms_between(month_start, next_month_start)
+        return AttendanceForm.query.filter(
+            AttendanceForm.employee_id == contract.service_personnel_id,
+            AttendanceForm.cycle_start_date >= month_start,
+            AttendanceForm.cycle_start_date < next_month_start,
+            AttendanceForm.status.in_(["customer_signed", "synced"]),
+        ).order_by(AttendanceForm.updated_at.desc().nullslast(), AttendanceForm.created_at.desc()).all()
+
     def _find_signed_monthly_attendance_form(self, contract, cycle_start, candidate_forms):
         def same_family_or_customer(form):
             form_contract = form.contract
@@ -2927,12 +3084,16 @@ class BillingEngine:
         )
 
     def _get_adjustments(self, bill_id, payroll_id):
-        customer_adjustments = FinancialAdjustment.query.filter_by(
-            customer_bill_id=bill_id
-        ).all()
-        employee_adjustments = FinancialAdjustment.query.filter_by(
-            employee_payroll_id=payroll_id
-        ).all()
+        if self._lifecycle and self._lifecycle.owns(bill_id, payroll_id):
+            customer_adjustments = self._lifecycle.adjustments_for(bill_id=bill_id)
+            employee_adjustments = self._lifecycle.adjustments_for(payroll_id=payroll_id)
+        else:
+            customer_adjustments = FinancialAdjustment.query.filter_by(
+                customer_bill_id=bill_id
+            ).all()
+            employee_adjustments = FinancialAdjustment.query.filter_by(
+                employee_payroll_id=payroll_id
+            ).all()
 
         # 计算增款项（不含公司代付/保证金代付工资，二者在 final 中单独汇总）
         # 定金(DEPOSIT)需计入客户应收
@@ -3213,6 +3374,8 @@ class BillingEngine:
         current_app.logger.info(f"[SAVE-CHECK] Bill ID {bill.id}: log_extras to be saved: {details.get('log_extras')}")
         bill.calculation_details = details
         payroll.calculation_details = details.copy()
+        _sync_bill_fee_columns(bill)
+        mark_records_dirty(bill, payroll)
         
         # 添加保存后验证
         current_app.logger.info(f"[SAVE_DEBUG] After assignment - bill.calculation_details keys: {list(bill.calculation_details.keys()) if bill.calculation_details else 'None'}")
@@ -3430,11 +3593,120 @@ class BillingEngine:
         if not target_bill:
             return { "error": "Target bill not found", "invoice_records": [], "carried_forward_breakdown": [] }
 
+        return self.calculate_invoice_balances([target_bill])[str(target_bill.id)]
+
+    def _invoice_ledger(self, bill_ids):
+        """
+        一条语句取出这些账单所属合同的全部主账单的开票台账。
+
+        每行包含账单自身的管理费 (management_fee 列)、已开票金额，以及用窗口函数
+        按 cycle_start_date 累计的此前所有需开票主账单的欠票 (carried_forward，未截断为 0)。
+
+        Returns:
+            {contract_id: [按周期排序的台账行]}
+        """
+        invoiced = func.coalesce(
+            db.select(func.sum(InvoiceRecord.amount))
+            .where(InvoiceRecord.customer_bill_id == CustomerBill.id)
+            .scalar_subquery(),
+            0,
+        )
+        fee = func.coalesce(CustomerBill.management_fee, 0)
+        outstanding = case((CustomerBill.invoice_needed.is_(True), fee - invoiced), else_=0)
+        carried_forward = func.coalesce(
+            func.sum(outstanding).over(
+                partition_by=CustomerBill.contract_id,
+                order_by=CustomerBill.cycle_start_date,
+                rows=(None, -1),
+            ),
+            0,
+        )
+        target_contracts = db.select(CustomerBill.contract_id).where(CustomerBill.id.in_(bill_ids))
+
+        rows = db.session.execute(
+            db.select(
+                CustomerBill.id,
+                CustomerBill.contract_id,
+                CustomerBill.year,
+                CustomerBill.month,
+                CustomerBill.invoice_needed,
+                fee.label("management_fee"),
+                invoiced.label("invoiced"),
+                carried_forward.label("carried_forward"),
+            )
+            .where(
+                CustomerBill.contract_id.in_(target_contracts),
+                CustomerBill.is_substitute_bill.is_(False),
+            )
+            .order_by(CustomerBill.contract_id, CustomerBill.cycle_start_date)
+        ).all()
+
+        ledger = {}
+        for row in rows:
+            ledger.setdefault(row.contract_id, []).append(row)
+        return ledger
+
+    def calculate_invoice_balances(self, bills):
+        """
+        批量计算发票余额，供账单列表、详情、合同账单列表等场景使用。
+
+        历史欠票由 _invoice_ledger 的窗口函数一次算出，目标账单的发票记录再用
+        一次查询取回；同一合同的多张账单不再重复加载整条账单链。
+
+        Args:
+            bills: 已加载的 CustomerBill 列表。
+
+        Returns:
+            以账单ID字符串为键的发票余额字典。
+        """
+        if not bills:
+            return {}
+
+        bill_ids = [bill.id for bill in bills]
+        ledger = self._invoice_ledger(bill_ids)
+
+        # 与 CustomerBill.invoices 关系的排序一致，单张与批量计算返回相同的发票顺序
+        invoices_by_bill = {bill_id: [] for bill_id in bill_ids}
+        for invoice in InvoiceRecord.query.filter(
+            InvoiceRecord.customer_bill_id.in_(bill_ids)
+        ).order_by(InvoiceRecord.created_at, InvoiceRecord.id).all():
+            invoices_by_bill[invoice.customer_bill_id].append(invoice)
+
+        positions = {
+            row.id: (contract_rows, index)
+            for contract_rows in ledger.values()
+            for index, row in enumerate(contract_rows)
+        }
+
+        balances = {}
+        for target_bill in bills:
+            carried_forward = D(0)
+            historical = []
+            if not target_bill.is_substitute_bill and target_bill.id in positions:
+                contract_rows, index = positions[target_bill.id]
+                carried_forward = D(contract_rows[index].carried_forward)
+                if carried_forward > 0:
+                    historical = contract_rows[:index]
+            balances[str(target_bill.id)] = self._build_invoice_balance(
+                target_bill, invoices_by_bill[target_bill.id], carried_forward, historical
+            )
+        return balances
+
+    def _build_invoice_balance(self, target_bill, target_invoices, carried_forward, historical):
+        """
+        发票余额的纯计算部分，不访问数据库。
+
+        Args:
+            target_bill: 目标客户账单。
+            target_invoices: 目标账单的发票列表。
+            carried_forward: 此前需开票主账单的累计欠票（未截断）；替班账单传 0。
+            historical: 按周期排序的此前主账单台账行，用于欠票明细；替班账单传空。
+        """
         # --- 【核心修正】: 如果是替班账单，则独立计算，不继承历史欠票 ---
         if target_bill.is_substitute_bill:
             # 替班账单的管理费就是它的应开票总额
             current_management_fee = D((target_bill.calculation_details or {}).get('management_fee', '0'))
-            invoiced_this_period = sum((D(invoice.amount) for invoice in target_bill.invoices), D(0)).quantize(D("0.01"))
+            invoiced_this_period = sum((D(invoice.amount) for invoice in target_invoices), D(0)).quantize(D("0.01"))
 
             total_invoiceable_amount = current_management_fee if target_bill.invoice_needed else D(0)
             remaining_un_invoiced = (total_invoiceable_amount - invoiced_this_period).quantize(D("0.01"))
@@ -3445,7 +3717,7 @@ class BillingEngine:
                 "total_invoiceable_amount": str(total_invoiceable_amount),
                 "invoiced_this_period": str(invoiced_this_period),
                 "remaining_un_invoiced": str(remaining_un_invoiced),
-                "invoice_records": [inv.to_dict() for inv in target_bill.invoices],
+                "invoice_records": [inv.to_dict() for inv in target_invoices],
                 "carried_forward_breakdown": [], # 历史欠票明细为空
                 "auto_invoice_needed": target_bill.invoice_needed, # 只取决于它自己
             }
@@ -3455,43 +3727,23 @@ class BillingEngine:
         current_management_fee = D((target_bill.calculation_details or {}).get('management_fee', '0'))
         current_management_fee = current_management_fee.quantize(D("1"))
 
-        historical_bills = (
-            CustomerBill.query.filter(
-                CustomerBill.contract_id == target_bill.contract_id,
-                CustomerBill.cycle_start_date < target_bill.cycle_start_date,
-                CustomerBill.is_substitute_bill.is_(False),
-            )
-            .options(db.selectinload(CustomerBill.invoices))
-            .order_by(CustomerBill.cycle_start_date)
-            .all()
-        )
-
-        total_historical_fees_due = D(0)
-        total_historical_invoiced = D(0)
-        for bill in historical_bills:
-            if bill.invoice_needed:
-                total_historical_fees_due += D((bill.calculation_details or {}).get('management_fee', '0'))
-                total_historical_invoiced += sum((D(invoice.amount) for invoice in bill.invoices), D(0))
-
-        total_carried_forward = total_historical_fees_due - total_historical_invoiced
+        total_carried_forward = D(carried_forward)
         if total_carried_forward < 0:
             total_carried_forward = D(0)
         total_carried_forward = total_carried_forward.quantize(D("0.01"))
 
         carried_forward_breakdown = []
         if total_carried_forward > 0:
-            for bill in historical_bills:
-                if bill.invoice_needed:
-                    historical_management_fee = D((bill.calculation_details or {}).get('management_fee', '0'))
-                    invoiced_amount_for_bill = sum((D(invoice.amount) for invoice in bill.invoices), D(0))
-                    unpaid_balance = historical_management_fee - invoiced_amount_for_bill
+            for row in historical:
+                if row.invoice_needed:
+                    unpaid_balance = D(row.management_fee) - D(row.invoiced)
                     if unpaid_balance > 0:
                         carried_forward_breakdown.append({
-                            "month": f"{bill.year}-{str(bill.month).zfill(2)}",
+                            "month": f"{row.year}-{str(row.month).zfill(2)}",
                             "unpaid_amount": str(unpaid_balance.quantize(D("0.01"))),
                         })
 
-        invoiced_this_period = sum((D(invoice.amount) for invoice in target_bill.invoices), D(0)).quantize(D("0.01"))
+        invoiced_this_period = sum((D(invoice.amount) for invoice in target_invoices), D(0)).quantize(D("0.01"))
         should_be_needed = target_bill.invoice_needed or (total_carried_forward > 0)
 
         if should_be_needed:
@@ -3503,7 +3755,7 @@ class BillingEngine:
             total_invoiceable_amount = D(0)
 
         remaining_un_invoiced = (total_carried_forward + total_invoiceable_amount).quantize(D("0.01"))
-        invoice_records_data = [inv.to_dict() for inv in target_bill.invoices]
+        invoice_records_data = [inv.to_dict() for inv in target_invoices]
 
         return {
             "current_period_charges": str(current_management_fee),
@@ -0,0 +1,235 @@
+# backend/services/billing_lifecycle_context.py
+
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import event, inspect, or_
+
+from backend.extensions import db
+from backend.models import (
+    BaseContract,
+    AttendanceForm,
+    AttendanceRecord,
+    CustomerBill,
+    EmployeePayroll,
+    FinancialAdjustment,
+)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+
+def _sort_timestamp(value):
+    return value.timestamp() if value else float("-inf")
+
+
+class ContractLifecycleContext:
+    """
+    单个合同全周期账单计算的内存上下文。
+
+    一次性加载并锁定合同，预取它的全部主账单、工资单、考勤、财务调整项
+    以及员工的已签署考勤表；BillingEngine 在全周期模式下的逐月计算
+    从这里读取，而不是每个月重新查库。
+
+    上下文里保存的是会话中的实体对象本身，计算过程中对它们的修改、
+    新建的账单/考勤/调整项都会同步登记进来，因此查找结果与直接查库一致。
+    用完后必须调用 close() 解除对会话的监听。
+    """
+
+    ATTENDANCE_FORM_STATUSES = ("customer_signed", "synced")
+
+    def __init__(self, contract):
+        self.contract = contract
+        self.previous_contract = None
+        self._bills = []
+        self._payrolls = []
+        self._attendances = []
+        # 调整项按账单ID / 工资单ID分桶，查找时不再扫描整个会话
+        self._adjustments_by_bill = defaultdict(list)
+        self._adjustments_by_payroll = defaultdict(list)
+        self._attendance_forms = []
+        self._session = None
+
+    @classmethod
+    def load(cls, contract_id):
+        contract_poly = db.with_polymorphic(BaseContract, "*")
+        contract = (
+            db.session.query(contract_poly)
+            .filter(BaseContract.id == contract_id)
+            .with_for_update(of=BaseContract)
+            .first()
+        )
+        if not contract:
+            return None
+
+        context = cls(contract)
+        if contract.previous_contract_id:
+            context.previous_contract = (
+                db.session.query(contract_poly)
+                .filter(BaseContract.id == contract.previous_contract_id)
+                .first()
+            )
+
+        context._bills = (
+            CustomerBill.query.filter_by(contract_id=contract.id, is_substitute_bill=False)
+            .options(db.selectinload(CustomerBill.substitute_records_affecting_bill))
+            .all()
+        )
+        context._payrolls = EmployeePayroll.query.filter_by(
+            contract_id=contract.id, is_substitute_payroll=False
+        ).all()
+        context._attendances = AttendanceRecord.query.filter_by(contract_id=contract.id).all()
+
+        bill_ids = [bill.id for bill in context._bills]
+        payroll_ids = [payroll.id for payroll in context._payrolls]
+        if bill_ids or payroll_ids:
+            for adjustment in FinancialAdjustment.query.filter(
+                or_(
+                    FinancialAdjustment.customer_bill_id.in_(bill_ids),
+                    FinancialAdjustment.employee_payroll_id.in_(payroll_ids),
+                )
+            ):
+                context.register_adjustment(adjustment)
+
+        if contract.service_personnel_id:
+            context._attendance_forms = (
+                AttendanceForm.query.filter(
+                    AttendanceForm.employee_id == contract.service_personnel_id,
+                    AttendanceForm.status.in_(cls.ATTENDANCE_FORM_STATUSES),
+                )
+                .options(db.selectinload(AttendanceForm.contract))
+                .all()
+            )
+
+        # 计算过程中 session.add 的调整项自动登记进索引
+        context._session = db.session()
+        event.listen(context._session, "transient_to_pending", context._on_pending)
+        return context
+
+    def close(self):
+        if self._session is not None:
+            event.remove(self._session, "transient_to_pending", self._on_pending)
+            self._session = None
+
+    def _on_pending(self, session, obj):
+        if isinstance(obj, FinancialAdjustment):
+            self.register_adjustment(obj)
+
+    @staticmethod
+    def _alive(objects):
+        """过滤掉本会话中已删除（待删除或已 flush 删除）的对象。"""
+        pending_deletes = db.session.deleted
+        return [
+            obj for obj in objects
+            if obj not in pending_deletes and not inspect(obj).was_deleted
+        ]
+
+    # --- 账单 / 工资单 ---
+
+    def main_bills(self):
+        return sorted(self._alive(self._bills), key=lambda b: _as_date(b.cycle_start_date))
+
+    def find_bill(self, cycle_start_date=None, year=None, month=None):
+        for bill in self.main_bills():
+            if cycle_start_date is not None and _as_date(bill.cycle_start_date) != _as_date(cycle_start_date):
+                continue
+            if year is not None and bill.year != year:
+                continue
+            if month is not None and bill.month != month:
+                continue
+            return bill
+        return None
+
+    def bills_in_month(self, year, month):
+        return [bill for bill in self.main_bills() if bill.year == year and bill.month == month]
+
+    def has_bill_before(self, cycle_start_date):
+        target = _as_date(cycle_start_date)
+        return any(_as_date(bill.cycle_start_date) < target for bill in self.main_bills())
+
+    def last_bill_by_cycle_end(self):
+        bills = self.main_bills()
+        if not bills:
+            return None
+        return max(bills, key=lambda b: _as_date(b.cycle_end_date))
+
+    def find_payroll(self, cycle_start_date):
+        target = _as_date(cycle_start_date)
+        for payroll in self._alive(self._payrolls):
+            if _as_date(payroll.cycle_start_date) == target:
+                return payroll
+        return None
+
+    def register_bill_and_payroll(self, bill, payroll):
+        if bill not in self._bills:
+            self._bills.append(bill)
+        if payroll not in self._payrolls:
+            self._payrolls.append(payroll)
+
+    def owns(self, bill_id, payroll_id):
+        """账单与工资单是否都属于本上下文（替班账单等其它记录仍走查询）。"""
+        return (
+            any(bill.id == bill_id for bill in self._alive(self._bills))
+            and any(payroll.id == payroll_id for payroll in self._alive(self._payrolls))
+        )
+
+    # --- 考勤 ---
+
+    def find_attendance(self, cycle_start_date):
+        target = _as_date(cycle_start_date)
+        for attendance in self._alive(self._attendances):
+            if _as_date(attendance.cycle_start_date) == target:
+                return attendance
+        return None
+
+    def register_attendance(self, attendance):
+        if attendance is not None and attendance not in self._attendances:
+            self._attendances.append(attendance)
+
+    def attendance_forms_between(self, month_start, next_month_start):
+        forms = [
+            form for form in self._alive(self._attendance_forms)
+            if form.status in self.ATTENDANCE_FORM_STATUSES
+            and month_start <= _as_date(form.cycle_start_date) < next_month_start
+        ]
+        # 与查询的 ORDER BY updated_at DESC NULLS LAST, created_at DESC 保持一致（两次稳定排序）
+        forms.sort(key=lambda f: _sort_timestamp(f.created_at), reverse=True)
+        forms.sort(key=lambda f: _sort_timestamp(f.updated_at), reverse=True)
+        return forms
+
+    # --- 财务调整项 ---
+
+    def register_adjustment(self, adjustment):
+        """
+        登记调整项。外键在登记后被改挂到其它账单/工资单时（如挂接合同级待处理调整项），
+        需要再次调用本方法。
+        """
+        for bucket_id, buckets in (
+            (adjustment.customer_bill_id, self._adjustments_by_bill),
+            (adjustment.employee_payroll_id, self._adjustments_by_payroll),
+        ):
+            if bucket_id is not None and not any(adj is adjustment for adj in buckets[bucket_id]):
+                buckets[bucket_id].append(adjustment)
+
+    def adjustments_for(self, bill_id=None, payroll_id=None):
+        """
+        返回挂在账单/工资单上的调整项，结果等价于按外键查询。
+        桶内按当前外键再核对一次，登记后外键被改走的调整项不会返回。
+        """
+        matched = []
+        if bill_id is not None:
+            matched.extend(
+                adj for adj in self._alive(self._adjustments_by_bill.get(bill_id, []))
+                if adj.customer_bill_id == bill_id
+            )
+        if payroll_id is not None:
+            matched.extend(
+                adj for adj in self._alive(self._adjustments_by_payroll.get(payroll_id, []))
+                if adj.employee_payroll_id == payroll_id and adj not in matched
+            )
+        return matched
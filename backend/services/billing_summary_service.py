@@ -0,0 +1,391 @@
+# backend/services/billing_summary_service.py
+
+from contextlib import contextmanager
+import decimal
+
+from flask import current_app
+from sqlalchemy import event, func, case, inspect, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend.extensions import db
+from backend.models import (
+    AdjustmentType,
+    BaseContract,
+    BillingMonthSummary,
+    CustomerBill,
+    EmployeePayroll,
+    FinancialAdjustment,
+    PaymentStatus,
+)
+
+D = decimal.Decimal
+
+_DIRTY_KEY = "billing_summary_dirty_months"
+_DEFERRED_KEY = "billing_summary_deferred"
+_COMMITTED_KEY = "billing_summary_committed_months"
+
+SUMMARY_AMOUNT_FIELDS = (
+    "total_due",
+    "total_paid",
+    "management_fee",
+    "management_fee_paid",
+    "introduction_fee",
+    "customer_increase",
+    "employee_commission",
+    "payout_due",
+    "payout_paid",
+)
+SUMMARY_COUNT_FIELDS = ("bill_count", "paid_bill_count")
+
+
+def _year_months(obj):
+    """对象当前及本事务内修改前的 (year, month)，账单跨月调整时两边都需要刷新。"""
+    months = set()
+    if obj.year and obj.month:
+        months.add((obj.year, obj.month))
+    state = inspect(obj)
+    old_years = state.attrs.year.history.deleted or [obj.year]
+    old_months = state.attrs.month.history.deleted or [obj.month]
+    for year in old_years:
+        for month in old_months:
+            if year and month:
+                months.add((year, month))
+    return months
+
+
+def mark_billing_month_dirty(year, month, session=None):
+    """登记需要刷新的汇总月份，在当前事务提交后统一重算。"""
+    if not year or not month:
+        return
+    session = session or db.session
+    session.info.setdefault(_DIRTY_KEY, set()).add((int(year), int(month)))
+
+
+def mark_records_dirty(*records):
+    """登记账单/工资单所在月份（含本事务内改动前的月份）。"""
+    for record in records:
+        if record is None:
+            continue
+        for year, month in _year_months(record):
+            mark_billing_month_dirty(year, month)
+
+
+def _adjustment_parents(session, adjustment):
+    """调整项当前及本事务内改动前挂靠的账单/工资单。"""
+    state = inspect(adjustment)
+    parents = []
+    for attr, model in (("customer_bill_id", CustomerBill), ("employee_payroll_id", EmployeePayroll)):
+        history = state.attrs[attr].history
+        for parent_id in set(history.added or [getattr(adjustment, attr)]) | set(history.deleted or []):
+            if parent_id is not None:
+                parents.append(session.get(model, parent_id))
+    return parents
+
+
+@event.listens_for(Session, "before_flush")
+def _mark_flushed_records_dirty(session, flush_context, instances):
+    # 所有经 ORM 写入的账单、工资单、调整项（新建、修改、删除）都会登记所在月份，
+    # 不依赖各业务入口手动调用 mark_records_dirty
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            if isinstance(obj, (CustomerBill, EmployeePayroll)):
+                records = [obj]
+            elif isinstance(obj, FinancialAdjustment):
+                records = _adjustment_parents(session, obj)
+            else:
+                continue
+            for record in records:
+                if record is None:
+                    continue
+                for year, month in _year_months(record):
+                    mark_billing_month_dirty(year, month, session=session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_bulk_changes_dirty(orm_execute_state):
+    # Query.update()/delete() 不经过 flush，执行前先查出受影响的月份
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    where = orm_execute_state.statement.whereclause
+    model = mapper.class_
+    if model in (CustomerBill, EmployeePayroll):
+        queries = [db.select(model.year, model.month)]
+    elif model is FinancialAdjustment:
+        queries = [
+            db.select(CustomerBill.year, CustomerBill.month)
+            .join(FinancialAdjustment, FinancialAdjustment.customer_bill_id == CustomerBill.id),
+            db.select(EmployeePayroll.year, EmployeePayroll.month)
+            .join(FinancialAdjustment, FinancialAdjustment.employee_payroll_id == EmployeePayroll.id),
+        ]
+    else:
+        return
+    session = orm_execute_state.session
+    for query in queries:
+        if where is not None:
+            query = query.where(where)
+        for year, month in session.execute(query.distinct()):
+            mark_billing_month_dirty(year, month, session=session)
+
+
+def _empty_row():
+    row = {field: D(0) for field in SUMMARY_AMOUNT_FIELDS}
+    row.update({field: 0 for field in SUMMARY_COUNT_FIELDS})
+    return row
+
+
+def _aggregate_month(session, year, month):
+    """从明细表重新聚合某个月，返回 {contract_type: {字段: 值}}。"""
+    rows = {}
+
+    def row_for(contract_type):
+        return rows.setdefault(contract_type, _empty_row())
+
+    bill_totals = (
+        session.query(
+            BaseContract.type,
+            func.count(CustomerBill.id),
+            func.count(case((CustomerBill.payment_status == PaymentStatus.PAID, 1))),
+            func.sum(CustomerBill.total_due),
+            func.sum(CustomerBill.total_paid),
+            func.sum(CustomerBill.management_fee),
+            func.sum(case((CustomerBill.payment_status == PaymentStatus.PAID, CustomerBill.management_fee), else_=0)),
+        )
+        .select_from(CustomerBill)
+        .join(BaseContract, CustomerBill.contract_id == BaseContract.id)
+        .filter(CustomerBill.year == year, CustomerBill.month == month)
+        .group_by(BaseContract.type)
+        .all()
+    )
+    for contract_type, count, paid_count, due, paid, fee, fee_paid in bill_totals:
+        row = row_for(contract_type)
+        row["bill_count"] = count or 0
+        row["paid_bill_count"] = paid_count or 0
+        row["total_due"] = D(due or 0)
+        row["total_paid"] = D(paid or 0)
+        row["management_fee"] = D(fee or 0)
+        row["management_fee_paid"] = D(fee_paid or 0)
+
+    bill_adjustments = (
+        session.query(
+            BaseContract.type,
+            FinancialAdjustment.adjustment_type,
+            func.sum(FinancialAdjustment.amount),
+        )
+        .select_from(FinancialAdjustment)
+        .join(CustomerBill, FinancialAdjustment.customer_bill_id == CustomerBill.id)
+        .join(BaseContract, CustomerBill.contract_id == BaseContract.id)
+        .filter(
+            CustomerBill.year == year,
+            CustomerBill.month == month,
+            FinancialAdjustment.adjustment_type.in_([
+                AdjustmentType.INTRODUCTION_FEE,
+                AdjustmentType.CUSTOMER_INCREASE,
+            ]),
+        )
+        .group_by(BaseContract.type, FinancialAdjustment.adjustment_type)
+        .all()
+    )
+    for contract_type, adj_type, amount in bill_adjustments:
+        field = "introduction_fee" if adj_type == AdjustmentType.INTRODUCTION_FEE else "customer_increase"
+        row_for(contract_type)[field] = D(amount or 0)
+
+    payroll_totals = (
+        session.query(
+            BaseContract.type,
+            func.sum(EmployeePayroll.total_due),
+            func.sum(EmployeePayroll.total_paid_out),
+        )
+        .select_from(EmployeePayroll)
+        .join(BaseContract, EmployeePayroll.contract_id == BaseContract.id)
+        .filter(EmployeePayroll.year == year, EmployeePayroll.month == month)
+        .group_by(BaseContract.type)
+        .all()
+    )
+    for contract_type, due, paid_out in payroll_totals:
+        row = row_for(contract_type)
+        row["payout_due"] = D(due or 0)
+        row["payout_paid"] = D(paid_out or 0)
+
+    commissions = (
+        session.query(BaseContract.type, func.sum(FinancialAdjustment.amount))
+        .select_from(FinancialAdjustment)
+        .join(EmployeePayroll, FinancialAdjustment.employee_payroll_id == EmployeePayroll.id)
+        .join(BaseContract, EmployeePayroll.contract_id == BaseContract.id)
+        .filter(
+            EmployeePayroll.year == year,
+            EmployeePayroll.month == month,
+            FinancialAdjustment.adjustment_type == AdjustmentType.EMPLOYEE_COMMISSION,
+        )
+        .group_by(BaseContract.type)
+        .all()
+    )
+    for contract_type, amount in commissions:
+        row_for(contract_type)["employee_commission"] = D(amount or 0)
+
+    return rows
+
+
+def refresh_billing_month(year, month, session=None):
+    """
+    重算并写入某个月的汇总行（按合同类型一行），并删除该月已不存在的类型。
+
+    聚合前先取 pg_advisory_xact_lock(year, month)，同一月份的刷新按事务串行执行，
+    锁在事务结束时释放；后拿到锁的事务在读已提交隔离级别下能看到先提交的明细，
+    不会用过期的聚合结果覆盖汇总。多个月份需按 (year, month) 升序刷新以免死锁。
+    """
+    session = session or db.session
+    session.flush()
+    session.execute(db.select(func.pg_advisory_xact_lock(int(year), int(month))))
+    rows = _aggregate_month(session, year, month)
+
+    stale = session.query(BillingMonthSummary).filter(
+        BillingMonthSummary.year == year,
+        BillingMonthSummary.month == month,
+    )
+    if rows:
+        stale = stale.filter(BillingMonthSummary.contract_type.notin_(list(rows)))
+    stale.delete(synchronize_session=False)
+
+    if rows:
+        values = [
+            dict(year=year, month=month, contract_type=contract_type, **row)
+            for contract_type, row in rows.items()
+        ]
+        stmt = pg_insert(BillingMonthSummary.__table__).values(values)
+        update_columns = {
+            field: stmt.excluded[field]
+            for field in SUMMARY_AMOUNT_FIELDS + SUMMARY_COUNT_FIELDS
+        }
+        update_columns["updated_at"] = func.now()
+        session.execute(
+            stmt.on_conflict_do_update(
+                constraint="uq_billing_month_summary_year_month_type",
+                set_=update_columns,
+            )
+        )
+    return rows
+
+
+def refresh_dirty_billing_months(session=None):
+    """立即在当前事务中刷新会话中登记过的月份，返回刷新的月份列表。"""
+    session = session or db.session
+    # 先 flush，让待写入的改动也登记进来，再取走月份
+    session.flush()
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if not dirty:
+        return []
+    months = sorted(dirty)
+    for year, month in months:
+        refresh_billing_month(year, month, session=session)
+    return months
+
+
+def refresh_billing_months(months):
+    """
+    在独立的会话和事务中刷新给定月份，刷新失败时交给 Celery 任务重试。
+    明细已经提交，月份锁只在这个短事务内持有，不会拖住业务请求的事务。
+    """
+    months = sorted(set(months))
+    if not months:
+        return []
+    try:
+        with Session(db.engine) as session:
+            for year, month in months:
+                refresh_billing_month(year, month, session=session)
+            session.commit()
+        return months
+    except Exception as e:
+        current_app.logger.error(f"刷新账单月度汇总 {months} 失败，转交后台任务: {e}", exc_info=True)
+    try:
+        from backend.tasks import refresh_billing_months_task
+
+        refresh_billing_months_task.delay([list(ym) for ym in months])
+    except Exception as e:
+        current_app.logger.error(
+            f"提交账单月度汇总刷新任务失败，可用 rebuild-billing-month-summary 命令重建: {e}",
+            exc_info=True,
+        )
+    return []
+
+
+@event.listens_for(Session, "before_commit")
+def _collect_dirty_months_before_commit(session):
+    # 只登记本事务涉及的月份，汇总在提交之后另开事务刷新；
+    # 批量计算时可通过 deferred_billing_summary_refresh 推迟到代码块结束
+    if session.info.get(_DEFERRED_KEY):
+        return
+    session.flush()
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if dirty:
+        session.info.setdefault(_COMMITTED_KEY, set()).update(dirty)
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_billing_summary_after_commit(session):
+    months = session.info.pop(_COMMITTED_KEY, None)
+    if months:
+        refresh_billing_months(months)
+
+
+@contextmanager
+def deferred_billing_summary_refresh():
+    """
+    在代码块内推迟汇总刷新（块内可多次 commit），退出时对累计的月份统一刷新一次。
+    用于批量逐合同计算，避免每个合同提交都重算整月。
+    """
+    session = db.session
+    already_deferred = session.info.get(_DEFERRED_KEY)
+    session.info[_DEFERRED_KEY] = True
+    try:
+        yield
+    finally:
+        if not already_deferred:
+            session.info.pop(_DEFERRED_KEY, None)
+            if session.info.get(_DIRTY_KEY):
+                # 提交时登记的月份转入提交后刷新
+                try:
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    current_app.logger.error(f"刷新账单月度汇总失败: {e}", exc_info=True)
+                    # 块内之前各次提交的明细仍需刷新
+                    refresh_billing_months(
+                        (session.info.pop(_DIRTY_KEY, None) or set())
+                        | (session.info.pop(_COMMITTED_KEY, None) or set())
+                    )
+
+
+def rebuild_billing_month_summary(year=None, month=None, session=None):
+    """
+    从明细表全量重建汇总（可限定年份/月份），返回重建的 (year, month) 列表。
+    汇总中存在但明细已没有账单/工资单的月份会被清除。
+    """
+    session = session or db.session
+
+    def month_filter(model, query):
+        if year:
+            query = query.filter(model.year == year)
+        if month:
+            query = query.filter(model.month == month)
+        return query
+
+    months = set(month_filter(CustomerBill, session.query(CustomerBill.year, CustomerBill.month)).distinct())
+    months |= set(month_filter(EmployeePayroll, session.query(EmployeePayroll.year, EmployeePayroll.month)).distinct())
+    months = sorted((y, m) for y, m in months)
+
+    orphaned = month_filter(BillingMonthSummary, session.query(BillingMonthSummary))
+    if months:
+        orphaned = orphaned.filter(
+            tuple_(BillingMonthSummary.year, BillingMonthSummary.month).notin_(months)
+        )
+    orphaned.delete(synchronize_session=False)
+
+    for y, m in months:
+        refresh_billing_month(y, m, session=session)
+    return months
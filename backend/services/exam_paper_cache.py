@@ -0,0 +1,379 @@
+# backend/services/exam_paper_cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 单个进程最多缓存的试卷数
+MAX_CACHED_PAPERS = 128
+# 考生打开试卷时，距上次核对版本不足该秒数则直接使用缓存，不再查询版本；
+# 本进程内的编辑会立即调用 invalidate_exam_paper，其他进程的编辑最多延迟这么久可见
+STAMP_CHECK_INTERVAL = float(os.environ.get("EXAM_PAPER_STAMP_CHECK_SECONDS", "5"))
+
+# 试卷的“版本”：试卷本身、关联课程、题目关联、题目、选项、答案、知识点的最后修改时间与行数。
+# 编辑题目时选项是先删后插，行数/时间都会变化；删除题目会级联删除关联行。
+_PAPER_STAMP_SQL = """
+    SELECT
+        ep.updated_at AS paper_updated_at,
+        (
+            SELECT count(*) FROM exampapercourse epc WHERE epc.exam_paper_id = ep.id
+        ) AS course_count,
+        (
+            SELECT max(tc.updated_at)
+            FROM exampapercourse epc
+            JOIN trainingcourse tc ON tc.id = epc.course_id
+            WHERE epc.exam_paper_id = ep.id
+        ) AS course_updated_at,
+        qs.*
+    FROM exampaper ep
+    LEFT JOIN LATERAL (
+        SELECT
+            count(DISTINCT epq.id) AS question_count,
+            max(epq.updated_at) AS link_updated_at,
+            max(q.updated_at) AS question_updated_at,
+            count(DISTINCT o.id) AS option_count,
+            max(o.updated_at) AS option_updated_at,
+            count(DISTINCT a.id) AS answer_count,
+            max(a.updated_at) AS answer_updated_at,
+            max(kp.updated_at) AS knowledge_point_updated_at,
+            max(kc.updated_at) AS knowledge_point_course_updated_at
+        FROM exampaperquestion epq
+        LEFT JOIN question q ON q.id = epq.question_id
+        LEFT JOIN option o ON o.question_id = q.id
+        LEFT JOIN answer a ON a.question_id = q.id
+        LEFT JOIN knowledgepoint kp ON kp.id = q.knowledge_point_id
+        LEFT JOIN trainingcourse kc ON kc.id = kp.course_id
+        WHERE epq.exam_paper_id = ep.id
+    ) qs ON true
+    WHERE ep.id = %s
+"""
+
+# 与原先逐题查询的 CTE 相同，只是一次取出 target_question 中的全部题目
+_ANSWER_KEY_SQL = """
+    WITH target_question AS (
+        {target}
+    ),
+    option_with_index AS (
+        SELECT
+            id,
+            question_id,
+            option_text,
+            is_correct,
+            chr(65 + (ROW_NUMBER() OVER (PARTITION BY question_id ORDER BY id) - 1)::integer) AS option_char
+        FROM option
+        WHERE question_id IN (SELECT question_id FROM target_question)
+    ),
+    correct_options AS (
+        SELECT
+            question_id,
+            array_agg(id) as correct_option_ids,
+            array_agg(option_char) AS correct_answer_chars
+        FROM option_with_index
+        WHERE is_correct
+        GROUP BY question_id
+    )
+    SELECT
+        q.id,
+        q.question_type,
+        q.question_text,
+        a.explanation,
+        co.correct_answer_chars,
+        co.correct_option_ids,
+        kp.point_name as knowledge_point_name,
+        json_agg(
+            json_build_object(
+                'id', owi.id,
+                'content', owi.option_text,
+                'is_correct', owi.is_correct,
+                'char', owi.option_char
+            ) ORDER BY owi.option_char
+        ) AS options
+    FROM question q
+    LEFT JOIN answer a ON q.id = a.question_id
+    LEFT JOIN option_with_index owi ON q.id = owi.question_id
+    LEFT JOIN correct_options co ON q.id = co.question_id
+    LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id
+    WHERE q.id IN (SELECT question_id FROM target_question)
+    GROUP BY q.id, q.question_type, q.question_text, a.explanation, co.correct_answer_chars, co.correct_option_ids, kp.point_name
+"""
+_PAPER_QUESTIONS = "SELECT question_id FROM exampaperquestion WHERE exam_paper_id = %s"
+_GIVEN_QUESTIONS = "SELECT unnest(%s::uuid[]) AS question_id"
+
+# 考生视图：试卷信息与关联课程
+_CANDIDATE_EXAM_SQL = """
+    SELECT
+        e.id,
+        e.title,
+        e.description,
+        e.created_at,
+        json_agg(json_build_object(
+            'id', tc.id,
+            'name', tc.course_name
+        )) as courses
+    FROM exampaper e
+    LEFT JOIN exampapercourse epc ON e.id = epc.exam_paper_id
+    LEFT JOIN trainingcourse tc ON epc.course_id = tc.id
+    WHERE e.id = %s
+    GROUP BY e.id, e.title, e.description, e.created_at
+"""
+
+# 考生视图：题目与选项，不含正确答案
+_CANDIDATE_QUESTIONS_SQL = """
+    SELECT
+        q.id,
+        q.question_type,
+        q.question_text,
+        q.knowledge_point_id,
+        kp.course_id,
+        epq.id as exam_paper_question_id,
+        json_agg(
+            json_build_object(
+                'id', o.id,
+                'content', o.option_text
+            ) ORDER BY o.id
+        ) as options
+    FROM exampaperquestion epq
+    JOIN question q ON epq.question_id = q.id
+    LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id
+    LEFT JOIN option o ON q.id = o.question_id
+    WHERE epq.exam_paper_id = %s
+    GROUP BY
+        q.id,
+        q.question_type,
+        q.question_text,
+        q.knowledge_point_id,
+        kp.course_id,
+        epq.id
+    ORDER BY epq.created_at ASC
+"""
+
+# 管理视图：试卷信息与关联课程名称
+_DETAIL_EXAM_SQL = """
+    WITH exam_courses AS (
+        SELECT DISTINCT
+            ep.id as exam_id,
+            array_agg(DISTINCT tc.course_name) as course_names
+        FROM exampaper ep
+        JOIN exampapercourse epc ON ep.id = epc.exam_paper_id
+        JOIN trainingcourse tc ON epc.course_id = tc.id
+        WHERE ep.id = %s
+        GROUP BY ep.id
+    )
+    SELECT
+        e.id,
+        e.title,
+        e.description,
+        e.created_at,
+        COALESCE(ec.course_names, ARRAY[]::text[]) as course_names
+    FROM exampaper e
+    LEFT JOIN exam_courses ec ON e.id = ec.exam_id
+    WHERE e.id = %s
+    GROUP BY e.id, e.title, e.description, e.created_at, ec.course_names
+"""
+
+# 管理视图：题目、选项（含正确答案）、解析、知识点与课程
+_DETAIL_QUESTIONS_SQL = """
+    WITH option_numbers AS (
+        SELECT
+            id,
+            question_id,
+            option_text,
+            is_correct,
+            (ROW_NUMBER() OVER (PARTITION BY question_id ORDER BY id) - 1)::integer as option_index
+        FROM option
+        WHERE question_id IN (
+            SELECT question_id FROM exampaperquestion WHERE exam_paper_id = %s
+        )
+    )
+    SELECT
+        q.id,
+        q.question_type,
+        q.question_text,
+        a.explanation,
+        kp.id as knowledge_point_id,
+        kp.point_name as knowledge_point_name,
+        tc.course_name,
+        array_agg(json_build_object(
+            'id', o.id,
+            'option_text', o.option_text,
+            'index', o.option_index,
+            'is_correct', o.is_correct
+        ) ORDER BY o.option_index) as options
+    FROM exampaperquestion epq
+    JOIN question q ON epq.question_id = q.id
+    LEFT JOIN option_numbers o ON q.id = o.question_id
+    LEFT JOIN answer a ON q.id = a.question_id
+    LEFT JOIN knowledgepoint kp ON q.knowledge_point_id = kp.id
+    LEFT JOIN trainingcourse tc ON kp.course_id = tc.id
+    WHERE epq.exam_paper_id = %s
+    GROUP BY q.id, q.question_type, q.question_text, a.explanation, kp.id, kp.point_name, tc.course_name, epq.created_at
+    ORDER BY epq.created_at ASC
+"""
+
+
+class _CompiledPaper:
+    """某一版本试卷的编译结果；各部分在第一次用到时才查询并填入。"""
+
+    __slots__ = ("stamp", "checked_at", "parts")
+
+    def __init__(self, stamp):
+        self.stamp = stamp
+        self.checked_at = time.monotonic()
+        self.parts = {}
+
+
+_lock = threading.Lock()
+# {试卷ID: _CompiledPaper}
+_papers = OrderedDict()
+
+
+def paper_stamp(cur, exam_paper_id):
+    """读取试卷当前版本；试卷不存在时返回 None。"""
+    cur.execute(_PAPER_STAMP_SQL, (exam_paper_id,))
+    row = cur.fetchone()
+    return tuple(row.values()) if row else None
+
+
+def invalidate_exam_paper(exam_paper_id=None):
+    """丢弃某张试卷的缓存；不传 ID 时清空全部（题目、知识点等可能被多张试卷共用）。"""
+    with _lock:
+        if exam_paper_id is None:
+            _papers.clear()
+        else:
+            _papers.pop(str(exam_paper_id), None)
+
+
+def _compiled(cur, exam_paper_id, check_stamp):
+    """
+    返回试卷当前版本的编译结果，试卷不存在时返回 None。
+    check_stamp 为 False 时，最近 STAMP_CHECK_INTERVAL 秒内核对过版本的缓存直接使用。
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _papers.get(exam_paper_id)
+    if entry and not check_stamp and now - entry.checked_at < STAMP_CHECK_INTERVAL:
+        return entry
+
+    stamp = paper_stamp(cur, exam_paper_id)
+    with _lock:
+        if stamp is None:
+            _papers.pop(exam_paper_id, None)
+            return None
+        entry = _papers.get(exam_paper_id)
+        if entry and entry.stamp == stamp:
+            entry.checked_at = now
+        else:
+            entry = _papers[exam_paper_id] = _CompiledPaper(stamp)
+        _papers.move_to_end(exam_paper_id)
+        while len(_papers) > MAX_CACHED_PAPERS:
+            _papers.popitem(last=False)
+    return entry
+
+
+def _part(cur, exam_paper_id, name, build, check_stamp=False):
+    """取编译结果中的某一部分，缺失时用 build(cur, 试卷ID) 查询生成。"""
+    exam_paper_id = str(exam_paper_id)
+    entry = _compiled(cur, exam_paper_id, check_stamp)
+    if entry is None:
+        return None
+    value = entry.parts.get(name)
+    if value is None:
+        value = build(cur, exam_paper_id)
+        with _lock:
+            value = entry.parts.setdefault(name, value)
+    return value
+
+
+def _load_answer_key(cur, target_sql, params):
+    """执行一次答案查询，返回 {题目ID字符串: 行}，并把正确选项整理成字符串集合。"""
+    cur.execute(_ANSWER_KEY_SQL.format(target=target_sql), params)
+    key = {}
+    for row in cur.fetchall():
+        question_id = str(row["id"])
+        if question_id in key:
+            # 一题有多条答案记录时，与原先 fetchone 一样只取第一行
+            continue
+        row = dict(row)
+        row["correct_option_set"] = frozenset(
+            str(opt) for opt in (row["correct_option_ids"] or [])
+        )
+        key[question_id] = row
+    return key
+
+
+def _build_answer_key(cur, exam_paper_id):
+    return _load_answer_key(cur, _PAPER_QUESTIONS, (exam_paper_id,))
+
+
+def _build_candidate_view(cur, exam_paper_id):
+    cur.execute(_CANDIDATE_EXAM_SQL, (exam_paper_id,))
+    exam = dict(cur.fetchone())
+    cur.execute(_CANDIDATE_QUESTIONS_SQL, (exam_paper_id,))
+    # 按题型分组
+    grouped_questions = {"single": [], "multiple": []}
+    for q in cur.fetchall():
+        if q["question_type"] == "单选题":
+            grouped_questions["single"].append(dict(q))
+        elif q["question_type"] == "多选题":
+            grouped_questions["multiple"].append(dict(q))
+    return {"exam": exam, "questions": grouped_questions}
+
+
+def _build_detail_exam(cur, exam_paper_id):
+    cur.execute(_DETAIL_EXAM_SQL, (exam_paper_id, exam_paper_id))
+    return dict(cur.fetchone())
+
+
+def _build_detail_questions(cur, exam_paper_id):
+    cur.execute(_DETAIL_QUESTIONS_SQL, (exam_paper_id, exam_paper_id))
+    return [dict(q) for q in cur.fetchall()]
+
+
+def answer_key_for_paper(cur, exam_paper_id):
+    """
+    返回试卷全部题目的答案信息 {题目ID: 行}（行字段与原逐题查询一致），试卷不存在时返回空字典。
+    判分前总会核对一次版本（一条轻量查询），保证不会用旧答案判分。cur 须为 RealDictCursor。
+    """
+    return _part(cur, exam_paper_id, "answer_key", _build_answer_key, check_stamp=True) or {}
+
+
+def answer_key_for_questions(cur, question_ids):
+    """一次查询取出指定题目（不在试卷中的题目）的答案信息，不缓存。"""
+    question_ids = sorted(set(question_ids))
+    if not question_ids:
+        return {}
+    return _load_answer_key(cur, _GIVEN_QUESTIONS, (question_ids,))
+
+
+def candidate_paper(cur, exam_paper_id):
+    """考生答题视图 {"exam": 试卷及课程, "questions": {"single": [...], "multiple": [...]}}，不含答案。"""
+    return _part(cur, exam_paper_id, "candidate", _build_candidate_view)
+
+
+def paper_detail(cur, exam_paper_id):
+    """管理视图：试卷信息（含 course_names）与全部题目（含正确选项和解析）。"""
+    exam = _part(cur, exam_paper_id, "detail_exam", _build_detail_exam)
+    if exam is None:
+        return None
+    return {**exam, "questions": paper_questions(cur, exam_paper_id)}
+
+
+def paper_questions(cur, exam_paper_id):
+    """管理视图中的题目列表（含正确选项和解析），按加入试卷的顺序排列。"""
+    return _part(cur, exam_paper_id, "detail_questions", _build_detail_questions)
+
+
+def grade_answer(question_info, selected_options):
+    """
+    按题型判分，返回 (是否正确, 得分)：单选题选且只选一个正确选项得 1 分，
+    多选题所选集合与正确集合完全相同得 2 分，其他题型不计分。
+    """
+    correct = question_info["correct_option_set"]
+    if question_info["question_type"] == "单选题":
+        is_correct = len(selected_options) == 1 and selected_options[0] in correct
+        return is_correct, 1 if is_correct else 0
+    if question_info["question_type"] == "多选题":
+        is_correct = set(selected_options) == correct
+        return is_correct, 2 if is_correct else 0
+    return False, 0
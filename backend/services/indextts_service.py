@@ -4,7 +4,11 @@ IndexTTS2 服务 - 调用 Gradio API 进行语音合成
 基于 IndexTTS2 的 Gradio 接口实现零样本 TTS
 """
 
+import contextlib
+import hashlib
 import os
+import threading
+import time
 import httpx
 import tempfile
 import logging
@@ -51,12 +55,16 @@ class IndexTTSService:
         "emo_random": False,
     }
     
-    def __init__(self, base_url: str = None):
+    # 已上传参考音频的句柄有效期（Gradio 服务端会定期清理临时文件）
+    UPLOAD_CACHE_TTL_SECONDS = 3600
+
+    def __init__(self, base_url: str = None, http_client: Optional[httpx.Client] = None):
         """
         初始化 IndexTTS 服务
         
         Args:
             base_url: IndexTTS2 Gradio 服务的基础 URL
+            http_client: 可选的常驻 httpx 客户端；长期持有本服务实例时可复用连接
         """
         self.base_url = base_url or os.environ.get(
             "INDEXTTS_BASE_URL", 
@@ -64,6 +72,64 @@ class IndexTTSService:
         )
         self.api_url = f"{self.base_url}/gradio_api/call/gen_single"
         self.upload_url = f"{self.base_url}/gradio_api/upload"
+        self._http_client = http_client
+        # {文件内容 sha256: (FileData, 上传时间)}
+        self._uploaded = {}
+        # {(路径, mtime, 大小): sha256}，避免每次都重新计算大文件的哈希
+        self._file_hashes = {}
+        self._upload_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _session(self, timeout: float, forget_on_error=()):
+        """
+        提供 httpx 客户端：有常驻客户端时复用，否则临时创建并在用完后关闭。
+        块内出错时丢弃 forget_on_error 中文件的上传句柄（可能已被服务端清理），下次重新上传。
+        """
+        owned = self._http_client is None
+        client = httpx.Client(timeout=timeout) if owned else self._http_client
+        try:
+            yield client
+        except Exception:
+            self._forget_uploads(*forget_on_error)
+            raise
+        finally:
+            if owned:
+                client.close()
+
+    def _file_hash(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        stamp = (file_path, stat.st_mtime_ns, stat.st_size)
+        digest = self._file_hashes.get(stamp)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+            self._file_hashes[stamp] = digest
+        return digest
+
+    def _uploaded_file_data(self, file_path: str) -> Dict[str, Any]:
+        """按文件内容哈希复用已上传的参考音频句柄，过期或首次使用时才上传。"""
+        digest = self._file_hash(file_path)
+        with self._upload_lock:
+            cached = self._uploaded.get(digest)
+            if cached and time.monotonic() - cached[1] < self.UPLOAD_CACHE_TTL_SECONDS:
+                return cached[0]
+        file_data = self._upload_file(file_path)
+        with self._upload_lock:
+            self._uploaded[digest] = (file_data, time.monotonic())
+        return file_data
+
+    def _forget_uploads(self, *file_paths):
+        with self._upload_lock:
+            for file_path in file_paths:
+                if file_path and os.path.exists(file_path):
+                    self._uploaded.pop(self._file_hash(file_path), None)
+
+    def close(self):
+        if self._http_client is not None:
+            self._http_client.close()
         
     def _upload_file(self, file_path: str) -> Dict[str, Any]:
         """
@@ -77,8 +143,8 @@ class IndexTTSService:
         """
         with open(file_path, 'rb') as f:
             files = {'files': (os.path.basename(file_path), f)}
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(self.upload_url, files=files)
+            with self._session(60.0) as client:
+                response = client.post(self.upload_url, files=files, timeout=60.0)
                 response.raise_for_status()
                 result = response.json()
         
@@ -150,15 +216,15 @@ class IndexTTSService:
         logger.info(f"IndexTTS: 参考音频: {voice_reference_path}")
         logger.info(f"IndexTTS: 参数: {final_params}")
         
-        # 上传参考音频
-        voice_ref_data = self._upload_file(voice_reference_path)
-        logger.info(f"IndexTTS: 参考音频已上传: {voice_ref_data}")
+        # 上传参考音频（同一文件内容只上传一次）
+        voice_ref_data = self._uploaded_file_data(voice_reference_path)
+        logger.info(f"IndexTTS: 参考音频句柄: {voice_ref_data}")
         
         # 上传情感参考音频（如果有）
         emo_ref_data = None
         if emotion_reference_path and os.path.exists(emotion_reference_path):
-            emo_ref_data = self._upload_file(emotion_reference_path)
-            logger.info(f"IndexTTS: 情感参考音频已上传: {emo_ref_data}")
+            emo_ref_data = self._uploaded_file_data(emotion_reference_path)
+            logger.info(f"IndexTTS: 情感参考音频句柄: {emo_ref_data}")
         
         # 构建 API 请求数据
         request_data = {
@@ -190,10 +256,10 @@ class IndexTTSService:
             ]
         }
         
-        with httpx.Client(timeout=300.0) as client:
+        with self._session(300.0, forget_on_error=(voice_reference_path, emotion_reference_path)) as client:
             # Step 1: 提交任务
             logger.info(f"IndexTTS: 提交生成请求到 {self.api_url}")
-            response = client.post(self.api_url, json=request_data)
+            response = client.post(self.api_url, json=request_data, timeout=300.0)
             response.raise_for_status()
             result = response.json()
             
@@ -290,6 +356,7 @@ def generate_audio_with_indextts(
     voice_reference_path: str,
     emotion_reference_path: Optional[str] = None,
     base_url: Optional[str] = None,
+    service: Optional[IndexTTSService] = None,
     **params
 ) -> Tuple[bytes, str]:
     """
@@ -300,12 +367,13 @@ def generate_audio_with_indextts(
         voice_reference_path: 参考音频文件路径
         emotion_reference_path: 情感参考音频路径（可选）
         base_url: IndexTTS2 服务 URL（可选）
+        service: 复用的 IndexTTSService 实例（可选，复用连接和已上传的参考音频）
         **params: 其他生成参数
         
     Returns:
         (audio_bytes, mime_type) 元组
     """
-    service = IndexTTSService(base_url=base_url)
+    service = service or IndexTTSService(base_url=base_url)
     return service.generate_audio(
         text=text_to_speak,
         voice_reference_path=voice_reference_path,
@@ -0,0 +1,134 @@
+# backend/services/media_delivery.py
+
+import mimetypes
+import os
+import time
+import zipfile
+from urllib.parse import quote
+
+from flask import Response, current_app, send_file, stream_with_context
+
+ZIP_COPY_CHUNK_SIZE = 1024 * 1024
+# 已经压缩过的格式，放进 ZIP 时不再 deflate
+STORED_EXTENSIONS = frozenset({
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".mp4", ".jpg", ".jpeg", ".png", ".webp", ".zip",
+})
+
+
+def _accel_redirect_location(full_path):
+    """按 MEDIA_ACCEL_REDIRECT（{本地目录: nginx internal location}）把文件路径换成内部跳转地址。"""
+    full_path = os.path.abspath(full_path)
+    for base_dir, location in (current_app.config.get("MEDIA_ACCEL_REDIRECT") or {}).items():
+        base_dir = os.path.abspath(base_dir)
+        if full_path.startswith(base_dir + os.sep):
+            relative = os.path.relpath(full_path, base_dir).replace(os.sep, "/")
+            return f"{location.rstrip('/')}/{quote(relative)}"
+    return None
+
+
+def send_media_file(full_path, mimetype=None, as_attachment=False, download_name=None, max_age=3600):
+    """
+    发送磁盘上的媒体文件，不经过 Python 逐块读取。
+
+    - 文件位于 MEDIA_ACCEL_REDIRECT 配置的目录下时，只返回 X-Accel-Redirect 头，
+      由 nginx 直接发送（Range / ETag / Last-Modified 由 nginx 处理）；
+    - 否则交给 send_file：支持 Range（206/416）、ETag、Last-Modified 与条件请求（304），
+      文件体通过 wsgi.file_wrapper 交给服务器（gunicorn 会使用 sendfile 零拷贝发送）。
+    """
+    location = _accel_redirect_location(full_path)
+    if location:
+        headers = {"X-Accel-Redirect": location, "Cache-Control": f"max-age={max_age}"}
+        if as_attachment or download_name:
+            headers["Content-Disposition"] = _content_disposition(
+                download_name or os.path.basename(full_path), as_attachment
+            )
+        return Response(
+            status=200,
+            mimetype=mimetype or mimetypes.guess_type(full_path)[0] or "application/octet-stream",
+            headers=headers,
+        )
+
+    return send_file(
+        full_path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+        last_modified=os.path.getmtime(full_path),
+        max_age=max_age,
+    )
+
+
+def _content_disposition(filename, as_attachment=True):
+    """非 ASCII 文件名按 RFC 5987 编码，同时给出 ASCII 回退名。"""
+    ascii_name = filename.encode("ascii", "ignore").decode().strip() or "download"
+    kind = "attachment" if as_attachment else "inline"
+    return f'{kind}; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(filename)}'
+
+
+class _ZipStreamBuffer:
+    """zipfile 写入目标：只追加、不可 seek，写入的数据由生成器取走后立即释放。"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return b"".join(chunks)
+
+
+def iter_zip(members):
+    """
+    逐个成员生成 ZIP 数据，内存中最多保留一个复制块。
+
+    members 为 [(压缩包内路径, 磁盘文件路径 或 bytes 内容)]；已压缩的音频/图片按 STORED 存储，
+    其余内容 deflate。读取失败的文件会被跳过并记录日志。
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for arcname, source in members:
+            compress_type = (
+                zipfile.ZIP_STORED
+                if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+                else zipfile.ZIP_DEFLATED
+            )
+            if isinstance(source, bytes):
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                zf.writestr(info, source, compress_type=compress_type)
+                yield buffer.drain()
+                continue
+            try:
+                source_file = open(source, "rb")
+            except OSError as e:
+                current_app.logger.warning(f"打包时无法读取文件 {source}: {e}")
+                continue
+            info = zipfile.ZipInfo.from_file(source, arcname)
+            info.compress_type = compress_type
+            with source_file, zf.open(info, "w", force_zip64=True) as member:
+                for chunk in iter(lambda: source_file.read(ZIP_COPY_CHUNK_SIZE), b""):
+                    member.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def zip_stream_response(members, download_name):
+    """把 iter_zip 包装成附件下载响应（分块传输，不设置 Content-Length）。"""
+    return Response(
+        stream_with_context(chunk for chunk in iter_zip(members) if chunk),
+        mimetype="application/zip",
+        headers={"Content-Disposition": _content_disposition(download_name)},
+    )
@@ -0,0 +1,417 @@
+# backend/services/payer_resolution_cache.py
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import redis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from backend.extensions import db
+from backend.models import BaseContract, PayerAlias, ServicePersonnel
+from backend.redis_client import get_redis
+from backend.services.bank_matching_engine import normalize_payer_name
+
+logger = logging.getLogger(__name__)
+
+_DIRTY_KEY = "payer_resolution_cache_dirty"
+
+# 各进程比对 Redis 中缓存版本的最短间隔（秒），即其它进程变更的最大可见延迟
+VERSION_CHECK_INTERVAL = float(os.environ.get("PAYER_CACHE_VERSION_CHECK_SECONDS", "1.0"))
+
+
+class PayerResolution:
+    """一个付款人名称解析出的合同集合。matched_by 为 'alias'、'name' 或 None。"""
+
+    __slots__ = ("contract_ids", "matched_by", "customer_name")
+
+    def __init__(self, contract_ids=(), matched_by=None, customer_name=None):
+        self.contract_ids = list(contract_ids)
+        self.matched_by = matched_by
+        self.customer_name = customer_name
+
+    def __bool__(self):
+        return bool(self.contract_ids)
+
+
+def _newest_first(created_at):
+    # 与全量加载的 ORDER BY created_at DESC 一致，created_at 为空的排在最后
+    return -created_at.timestamp() if created_at else float("inf")
+
+
+class _Snapshot:
+    """
+    付款人/收款人解析所需的轻量数据快照（只含 ID 和名称列）。
+
+    每个合同、服务人员都记录了它落在哪些索引键下，单个合同或服务人员变更时
+    只需移除并重新加载这几行，不必重建整个快照。
+    """
+
+    def __init__(self):
+        self.loaded_at = time.monotonic()
+        self.customer_name_by_contract = {}
+        self.contracts_by_customer_key = defaultdict(list)
+        self.contracts_by_alias_key = defaultdict(list)
+        self.contracts_by_personnel = defaultdict(list)
+        self.personnel_by_user = {}
+        # 反向索引：合同/服务人员当前登记在哪些键下
+        self._contract_rows = {}
+        self._alias_keys_by_contract = defaultdict(list)
+        self._personnel_rows = {}
+
+    @classmethod
+    def load(cls):
+        snapshot = cls()
+        snapshot._load_contracts()
+        snapshot._load_aliases()
+        snapshot._load_personnel()
+        return snapshot
+
+    def refresh(self, contract_ids=(), personnel_ids=()):
+        """重新加载指定合同（含其付款人别名）和服务人员，已删除的会被移除。"""
+        contract_ids = [cid for cid in contract_ids if cid is not None]
+        personnel_ids = [pid for pid in personnel_ids if pid is not None]
+        for contract_id in contract_ids:
+            self._remove_contract(contract_id)
+        for personnel_id in personnel_ids:
+            self._remove_personnel(personnel_id)
+        if contract_ids:
+            self._load_contracts(contract_ids)
+            self._load_aliases(contract_ids)
+        if personnel_ids:
+            self._load_personnel(personnel_ids)
+
+    # --- 合同 ---
+
+    def _load_contracts(self, contract_ids=None):
+        query = db.session.query(
+            BaseContract.id,
+            BaseContract.customer_name,
+            BaseContract.customer_name_pinyin,
+            BaseContract.service_personnel_id,
+            BaseContract.created_at,
+        )
+        if contract_ids is not None:
+            query = query.filter(BaseContract.id.in_(contract_ids))
+        for row in query.order_by(BaseContract.created_at.desc()):
+            self._add_contract(*row)
+
+    def _add_contract(self, contract_id, customer_name, customer_name_pinyin, personnel_id, created_at):
+        order = _newest_first(created_at)
+        customer_key = normalize_payer_name(customer_name)
+        self.customer_name_by_contract[contract_id] = customer_name
+        self._contract_rows[contract_id] = {
+            "order": order,
+            "customer_key": customer_key,
+            "personnel_id": personnel_id,
+            "search": ((customer_name or "").lower(), (customer_name_pinyin or "").lower()),
+        }
+        self._insert(self.contracts_by_customer_key[customer_key], contract_id)
+        if personnel_id:
+            self._insert(self.contracts_by_personnel[personnel_id], contract_id)
+
+    def _remove_contract(self, contract_id):
+        row = self._contract_rows.pop(contract_id, None)
+        if row is None:
+            return
+        self.customer_name_by_contract.pop(contract_id, None)
+        self._discard(self.contracts_by_customer_key, row["customer_key"], contract_id)
+        if row["personnel_id"]:
+            self._discard(self.contracts_by_personnel, row["personnel_id"], contract_id)
+        for alias_key in self._alias_keys_by_contract.pop(contract_id, []):
+            self._discard(self.contracts_by_alias_key, alias_key, contract_id)
+
+    def _load_aliases(self, contract_ids=None):
+        query = db.session.query(PayerAlias.payer_name, PayerAlias.contract_id)
+        if contract_ids is not None:
+            query = query.filter(PayerAlias.contract_id.in_(contract_ids))
+        for payer_name, contract_id in query:
+            if contract_id in self._contract_rows:
+                alias_key = normalize_payer_name(payer_name)
+                self.contracts_by_alias_key[alias_key].append(contract_id)
+                self._alias_keys_by_contract[contract_id].append(alias_key)
+
+    def _insert(self, contract_ids, contract_id):
+        bisect.insort(contract_ids, contract_id, key=lambda cid: self._contract_rows[cid]["order"])
+
+    @staticmethod
+    def _discard(index, key, contract_id):
+        contract_ids = index.get(key)
+        if contract_ids and contract_id in contract_ids:
+            contract_ids.remove(contract_id)
+            if not contract_ids:
+                del index[key]
+
+    # --- 服务人员 ---
+
+    def _load_personnel(self, personnel_ids=None):
+        query = db.session.query(
+            ServicePersonnel.id,
+            ServicePersonnel.user_id,
+            ServicePersonnel.name,
+            ServicePersonnel.name_pinyin,
+        )
+        if personnel_ids is not None:
+            query = query.filter(ServicePersonnel.id.in_(personnel_ids))
+        for personnel_id, user_id, name, name_pinyin in query:
+            self._personnel_rows[personnel_id] = {
+                "user_id": user_id,
+                "search": ((name or "").lower(), (name_pinyin or "").lower()),
+            }
+            if user_id and user_id not in self.personnel_by_user:
+                self.personnel_by_user[user_id] = personnel_id
+
+    def _remove_personnel(self, personnel_id):
+        row = self._personnel_rows.pop(personnel_id, None)
+        if row and self.personnel_by_user.get(row["user_id"]) == personnel_id:
+            del self.personnel_by_user[row["user_id"]]
+
+    # --- 搜索 ---
+
+    def search_rows(self):
+        """[(名称小写, 拼音小写, 合同ID列表)]：每个合同的客户一行，每个有合同的员工一行。"""
+        # 先复制再遍历，其它线程同时做局部刷新时不会因字典变化而出错
+        for contract_id, row in list(self._contract_rows.items()):
+            yield row["search"] + ([contract_id],)
+        for personnel_id, row in list(self._personnel_rows.items()):
+            contract_ids = self.contracts_by_personnel.get(personnel_id)
+            if contract_ids:
+                yield row["search"] + (contract_ids,)
+
+
+class PayerResolutionCache:
+    """
+    进程内的付款人解析缓存：规范化名称 + 付款人别名 -> 客户/合同ID，
+    以及 员工/用户 -> 合同ID。
+
+    快照整体加载一次，之后的解析都不再访问数据库。PayerAlias / 合同 / 服务人员
+    的变更提交后，发布方把受影响的合同ID、服务人员ID记入 Redis 的变更列表并递增
+    版本号；各进程（包括其它 worker 和 Celery）最多每 version_check_interval 秒
+    比对一次版本，只重新加载受影响的行。Redis 不可用或积压的变更超过列表长度时
+    回退为整体重建；ttl_seconds 是最后的兜底。
+    """
+
+    VERSION_KEY = "payer_resolution_cache:version"
+    CHANGES_KEY = "payer_resolution_cache:changes"
+    MAX_CHANGES = 1000
+
+    def __init__(self, ttl_seconds=300, version_check_interval=VERSION_CHECK_INTERVAL):
+        self.ttl_seconds = ttl_seconds
+        self.version_check_interval = version_check_interval
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+        self._pending_contracts = set()
+        self._pending_personnel = set()
+        self._lock = threading.Lock()
+
+    def invalidate(self, contract_ids=None, personnel_ids=None):
+        """
+        不带参数时丢弃整个快照；否则只把这些合同/服务人员标记为待重新加载，
+        在下一次解析时生效（after_commit 中不能再发 SQL）。
+        """
+        with self._lock:
+            if contract_ids is None and personnel_ids is None:
+                self._snapshot = None
+                return
+            self._pending_contracts.update(contract_ids or ())
+            self._pending_personnel.update(personnel_ids or ())
+
+    def publish(self, contract_ids=(), personnel_ids=()):
+        """本进程提交了变更：本地标记待刷新，并通知其它进程。"""
+        contract_ids, personnel_ids = set(contract_ids), set(personnel_ids)
+        self.invalidate(contract_ids, personnel_ids)
+        payload = json.dumps({
+            "contracts": [str(cid) for cid in contract_ids],
+            "personnel": [str(pid) for pid in personnel_ids],
+        })
+        try:
+            pipe = get_redis().pipeline(transaction=True)
+            pipe.incr(self.VERSION_KEY)
+            pipe.lpush(self.CHANGES_KEY, payload)
+            pipe.ltrim(self.CHANGES_KEY, 0, self.MAX_CHANGES - 1)
+            version = pipe.execute()[0]
+        except redis.RedisError as e:
+            logger.warning(f"发布付款人缓存失效消息失败，其它进程将在 TTL 到期后刷新: {e}")
+            return
+        with self._lock:
+            # 自己的变更已在本地标记，不必再从 Redis 读回
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def _remote_version(self):
+        return int(get_redis().get(self.VERSION_KEY) or 0)
+
+    def _fetch_changes(self, since):
+        """
+        读取版本 since 之后的全部变更，返回 (最新版本, 合同ID集合, 服务人员ID集合)；
+        变更已被截断或并发写入导致对不上时返回 None，调用方应整体重建。
+        """
+        r = get_redis()
+        remote = self._remote_version()
+        missing = remote - since
+        if missing == 0:
+            return remote, set(), set()
+        if missing < 0 or missing > self.MAX_CHANGES:
+            return None
+        pipe = r.pipeline(transaction=True)
+        pipe.get(self.VERSION_KEY)
+        pipe.lrange(self.CHANGES_KEY, 0, missing - 1)
+        current, entries = pipe.execute()
+        if int(current or 0) != remote or len(entries) != missing:
+            return None
+        contract_ids, personnel_ids = set(), set()
+        for entry in entries:
+            change = json.loads(entry)
+            contract_ids.update(_as_uuid(cid) for cid in change.get("contracts", []))
+            personnel_ids.update(_as_uuid(pid) for pid in change.get("personnel", []))
+        return remote, contract_ids, personnel_ids
+
+    def _current(self):
+        with self._lock:
+            now = time.monotonic()
+            snapshot = self._snapshot
+            if snapshot is not None and now - snapshot.loaded_at > self.ttl_seconds:
+                snapshot = None
+
+            if snapshot is not None and now - self._checked_at >= self.version_check_interval:
+                self._checked_at = now
+                try:
+                    if self._version is None:
+                        # 加载时 Redis 不可用：恢复后整体重建一次，补上期间错过的变更
+                        self._remote_version()
+                        changes = None
+                    else:
+                        changes = self._fetch_changes(self._version)
+                except redis.RedisError as e:
+                    logger.debug(f"读取付款人缓存版本失败，暂用现有快照: {e}")
+                    changes = (self._version, set(), set())
+                if changes is None:
+                    snapshot = None
+                else:
+                    self._version, contract_ids, personnel_ids = changes
+                    self._pending_contracts |= contract_ids
+                    self._pending_personnel |= personnel_ids
+
+            if snapshot is None:
+                # 先读版本再加载，加载期间提交的变更会在下次比对时补上
+                try:
+                    self._version = self._remote_version()
+                except redis.RedisError as e:
+                    logger.warning(f"读取付款人缓存版本失败，只依赖 TTL 刷新: {e}")
+                    self._version = None
+                self._checked_at = now
+                self._pending_contracts.clear()
+                self._pending_personnel.clear()
+                snapshot = _Snapshot.load()
+                self._snapshot = snapshot
+            elif self._pending_contracts or self._pending_personnel:
+                snapshot.refresh(self._pending_contracts, self._pending_personnel)
+                self._pending_contracts.clear()
+                self._pending_personnel.clear()
+            return snapshot
+
+    def resolve_payer(self, payer_name) -> PayerResolution:
+        """优先按付款人别名解析，没有别名时回退到客户姓名。"""
+        snapshot = self._current()
+        key = normalize_payer_name(payer_name)
+        if not key:
+            return PayerResolution()
+
+        contract_ids = snapshot.contracts_by_alias_key.get(key)
+        matched_by = "alias"
+        if not contract_ids:
+            contract_ids = snapshot.contracts_by_customer_key.get(key)
+            matched_by = "name"
+        if not contract_ids:
+            return PayerResolution()
+
+        contract_ids = list(dict.fromkeys(contract_ids))
+        return PayerResolution(
+            contract_ids,
+            matched_by,
+            snapshot.customer_name_by_contract.get(contract_ids[0]),
+        )
+
+    def contract_ids_for_payee(self, payee_type, payee_id):
+        """按收款人类型（user / service_personnel / customer）解析合同ID。"""
+        snapshot = self._current()
+        if payee_type == "user":
+            personnel_id = snapshot.personnel_by_user.get(_as_uuid(payee_id))
+            return list(snapshot.contracts_by_personnel.get(personnel_id, []))
+        if payee_type == "service_personnel":
+            return list(snapshot.contracts_by_personnel.get(_as_uuid(payee_id), []))
+        if payee_type == "customer":
+            return list(snapshot.contracts_by_customer_key.get(normalize_payer_name(payee_id), []))
+        return []
+
+    def search_contract_ids(self, search_term):
+        """按客户/员工姓名或拼音做包含匹配，返回合同ID集合。"""
+        snapshot = self._current()
+        term = (search_term or "").strip().lower()
+        pinyin_term = term.replace(" ", "")
+        if not term:
+            return set()
+        matched = set()
+        for name, name_pinyin, contract_ids in snapshot.search_rows():
+            if term in name or (pinyin_term and pinyin_term in name_pinyin):
+                matched.update(contract_ids)
+        return matched
+
+
+def _as_uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+payer_resolution_cache = PayerResolutionCache()
+
+
+def _changed_ids(obj):
+    """返回 (受影响的合同ID, 受影响的服务人员ID)，别名改挂合同时新旧合同都算。"""
+    if isinstance(obj, PayerAlias):
+        history = inspect(obj).attrs.contract_id.history
+        return set(history.added or [obj.contract_id]) | set(history.deleted or []), set()
+    if isinstance(obj, BaseContract):
+        return {obj.id}, set()
+    if isinstance(obj, ServicePersonnel):
+        return set(), {obj.id}
+    return set(), set()
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_payer_cache_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        contract_ids, personnel_ids = _changed_ids(obj)
+        if contract_ids or personnel_ids:
+            dirty = session.info.setdefault(_DIRTY_KEY, (set(), set()))
+            dirty[0].update(contract_ids)
+            dirty[1].update(personnel_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_payer_cache_after_commit(session):
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if dirty:
+        contract_ids, personnel_ids = dirty
+        payer_resolution_cache.publish(
+            {cid for cid in contract_ids if cid is not None},
+            {pid for pid in personnel_ids if pid is not None},
+        )
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_payer_cache_flag(session, previous_transaction):
+    session.info.pop(_DIRTY_KEY, None)
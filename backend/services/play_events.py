@@ -0,0 +1,186 @@
+# backend/services/play_events.py
+
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+
+from backend.extensions import db
+from backend.models import CourseResource, UserResourcePlayLog
+
+# 客户端上报的事件时间最多早于服务器收到时间这么多秒（批量上报时前端可能攒了一段时间）
+MAX_CLIENT_LAG_SECONDS = float(os.environ.get("PLAY_EVENT_MAX_CLIENT_LAG_SECONDS", "600"))
+# 一次上报最多的事件数
+MAX_EVENTS_PER_REQUEST = int(os.environ.get("PLAY_EVENT_MAX_PER_REQUEST", "100"))
+
+# 计入播放次数的事件类型
+PLAY_COUNT_EVENT = "start_play"
+
+_play_log = UserResourcePlayLog.__table__
+_course_resource = CourseResource.__table__
+_SESSION_ID_MAX_LENGTH = _play_log.c.session_id.type.length
+_EVENT_TYPE_MAX_LENGTH = _play_log.c.event_type.type.length
+
+# watch_time_seconds 为 integer 列
+_MAX_WATCH_TIME_SECONDS = 2**31 - 1
+
+# 把尚未计入的 start_play 事件按资源汇总加到 play_count 上，并标记为已计入。
+# 两步在同一条语句中完成：标记与累加同时提交，不会重复或漏计
+_AGGREGATE_SQL = sa.text(
+    """
+    WITH counted AS (
+        UPDATE user_resource_play_log
+        SET play_counted = true
+        WHERE event_type = :event_type AND play_counted = false
+        RETURNING resource_id
+    ),
+    deltas AS (
+        SELECT resource_id, count(*) AS plays
+        FROM counted
+        GROUP BY resource_id
+    )
+    UPDATE course_resource cr
+    SET play_count = COALESCE(cr.play_count, 0) + deltas.plays
+    FROM deltas
+    WHERE cr.id = deltas.resource_id
+    RETURNING cr.id, deltas.plays
+    """
+)
+
+
+def _parse_client_time(value):
+    """ISO 8601 字符串或毫秒时间戳。"""
+    if isinstance(value, bool):
+        raise ValueError("played_at 格式错误")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def resolve_played_at(events, received_at):
+    """
+    计算一批事件的播放时间，返回与 events 等长的列表：
+    - 事件带 played_at（客户端时间）时使用它；
+    - 带 elapsed_ms（客户端单调时钟上距发送时的毫秒数，不受客户端时钟偏差影响）时取 收到时间 - elapsed_ms；
+    - 都没有时按事件在批内的顺序，以收到时间为最后一个事件、依次向前错开 1 微秒，保留先后顺序。
+    结果限制在 [收到时间 - MAX_CLIENT_LAG_SECONDS, 收到时间] 内。格式错误时抛出 ValueError。
+    """
+    earliest = received_at - timedelta(seconds=MAX_CLIENT_LAG_SECONDS)
+    played_at = []
+    for index, event in enumerate(events):
+        if event.get("played_at") not in (None, ""):
+            moment = _parse_client_time(event["played_at"])
+        elif event.get("elapsed_ms") is not None:
+            moment = received_at - timedelta(milliseconds=_number(event["elapsed_ms"], "elapsed_ms"))
+        else:
+            moment = received_at - timedelta(microseconds=len(events) - 1 - index)
+        played_at.append(min(max(moment, earliest), received_at))
+    return played_at
+
+
+def _number(value, field, maximum=None):
+    """转换为有限的非负数；布尔值、非数字、NaN、负数或超过 maximum 时抛出 ValueError。"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{field} 必须是数字")
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"{field} 必须是非负数")
+    if maximum is not None and number > maximum:
+        raise ValueError(f"{field} 不能超过 {maximum}")
+    return number
+
+
+def _text(value, field, max_length):
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError(f"{field} 必须是字符串")
+    text = str(value)
+    if not text.strip():
+        raise ValueError(f"缺少 {field}")
+    if len(text) > max_length:
+        raise ValueError(f"{field} 不能超过 {max_length} 个字符")
+    return text
+
+
+def normalize_play_events(events, received_at):
+    """
+    校验并转换客户端上报的事件，返回可直接插入 user_resource_play_log 的字段字典列表
+    （不含 user_id / resource_id）。任何一个事件不合法时抛出 ValueError，整批不写入。
+    """
+    if not events:
+        raise ValueError("没有需要记录的事件")
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        raise ValueError(f"一次最多上报 {MAX_EVENTS_PER_REQUEST} 个事件")
+    if not all(isinstance(event, dict) for event in events):
+        raise ValueError("事件必须是对象")
+
+    rows = []
+    for event, played_at in zip(events, resolve_played_at(events, received_at)):
+        watch_time = event.get("watch_time_seconds")
+        percentage = event.get("percentage_watched")
+        rows.append({
+            "session_id": _text(event.get("session_id"), "session_id", _SESSION_ID_MAX_LENGTH),
+            "event_type": _text(event.get("event_type"), "event_type", _EVENT_TYPE_MAX_LENGTH),
+            "played_at": played_at,
+            "watch_time_seconds": (
+                None if watch_time is None
+                else int(_number(watch_time, "watch_time_seconds", _MAX_WATCH_TIME_SECONDS))
+            ),
+            "percentage_watched": None if percentage is None else _number(percentage, "percentage_watched"),
+        })
+    return rows
+
+
+def record_play_events(user_id, resource_id, rows):
+    """
+    在当前会话中追加一批播放日志（一条多行 INSERT，不更新 course_resource 热点行），
+    由调用方提交。play_count 由 aggregate_play_counts 定时汇总。
+    """
+    if rows:
+        db.session.execute(
+            sa.insert(_play_log),
+            [{**row, "user_id": user_id, "resource_id": resource_id} for row in rows],
+        )
+    return len(rows)
+
+
+def aggregate_play_counts():
+    """
+    把尚未计入的 start_play 事件汇总到 course_resource.play_count，返回 {资源ID: 新增次数}。
+    多个进程同时汇总时按 advisory lock 串行，由调用方提交。
+    """
+    db.session.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext('play_count_aggregate'))"))
+    return {
+        resource_id: plays
+        for resource_id, plays in db.session.execute(_AGGREGATE_SQL, {"event_type": PLAY_COUNT_EVENT})
+    }
+
+
+def resource_play_counts(resource_ids):
+    """
+    资源的播放次数 {资源ID: 次数}：已汇总的 play_count 加上尚未汇总的 start_play 事件数，
+    所有进程写入的事件提交后即计入。
+    """
+    if not resource_ids:
+        return {}
+    pending = (
+        sa.select(_play_log.c.resource_id, sa.func.count().label("plays"))
+        .where(
+            _play_log.c.resource_id.in_(resource_ids),
+            _play_log.c.event_type == PLAY_COUNT_EVENT,
+            _play_log.c.play_counted == sa.false(),
+        )
+        .group_by(_play_log.c.resource_id)
+        .subquery()
+    )
+    query = (
+        sa.select(
+            _course_resource.c.id,
+            sa.func.coalesce(_course_resource.c.play_count, 0)
+            + sa.func.coalesce(pending.c.plays, 0),
+        )
+        .select_from(_course_resource.outerjoin(pending, pending.c.resource_id == _course_resource.c.id))
+        .where(_course_resource.c.id.in_(resource_ids))
+    )
+    return dict(db.session.execute(query).all())
@@ -0,0 +1,94 @@
+# backend/services/sentence_split_service.py
+
+import uuid
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from backend.extensions import db
+from backend.models import TtsAudio, TtsScript, TtsSentence, sentence_text_hash
+from backend.services.tts_audio_cache import tts_audio_cache
+
+
+def split_script_text(content):
+    """按行拆分脚本；没有换行时按句号拆分，仍无法拆分则整段作为一句。"""
+    content = content or ""
+    sentences = [line.strip() for line in content.split("\n") if line.strip()]
+    if not sentences:
+        sentences = [part.strip() + "。" for part in content.split("。") if part.strip()]
+    if not sentences and content.strip():
+        sentences = [content.strip()]
+    return sentences
+
+
+def find_reusable_audios(texts, training_content_id, exclude_script_id=None):
+    """
+    一次查询找出本培训内容下与给定文本相同、且已生成音频的句子，返回 {文本: 最新的 TtsAudio}。
+    按 text_hash 走索引匹配，再比对原文排除哈希碰撞。
+    """
+    text_by_hash = {sentence_text_hash(text): text for text in set(texts)}
+    if not text_by_hash:
+        return {}
+
+    query = (
+        db.session.query(TtsSentence.sentence_text, TtsAudio)
+        .join(TtsAudio, TtsSentence.id == TtsAudio.tts_sentence_id)
+        .join(TtsScript, TtsSentence.tts_script_id == TtsScript.id)
+        .filter(
+            TtsScript.training_content_id == training_content_id,
+            TtsScript.script_type == "final_tts_script",
+            TtsSentence.text_hash.in_(list(text_by_hash)),
+            TtsSentence.audio_status == "generated",
+            TtsAudio.audio_type == "sentence_audio",
+            TtsAudio.is_latest_for_sentence,
+        )
+        .order_by(TtsScript.version.desc(), TtsAudio.created_at.desc())
+    )
+    if exclude_script_id is not None:
+        query = query.filter(TtsScript.id != exclude_script_id)
+
+    wanted = set(text_by_hash.values())
+    reusable = {}
+    for text, audio in query.all():
+        if text in wanted:
+            reusable.setdefault(text, audio)
+    return reusable
+
+
+def bulk_create_sentences(script_id, training_content_id, texts, reusable_by_text, reuse_label=None):
+    """
+    为脚本批量插入句子，并为可复用音频的句子批量插入指向同一文件的 TtsAudio 记录。
+
+    reusable_by_text 为 {文本: 源 TtsAudio}。reuse_label 不为空时，复用记录的
+    tts_engine 记为该标签，generation_params 记录来源音频。
+    无论句子多少，都只发出两条批量 INSERT（不提交）。返回 (句子数, 复用音频数)。
+    """
+    sentence_rows = []
+    audio_rows = []
+    reused_at = datetime.utcnow().isoformat()
+    for index, text in enumerate(texts):
+        sentence_id = uuid.uuid4()
+        source_audio = reusable_by_text.get(text)
+        sentence_rows.append({
+            "id": sentence_id,
+            "tts_script_id": script_id,
+            "sentence_text": text,
+            "text_hash": sentence_text_hash(text),
+            "order_index": index,
+            "audio_status": "generated" if source_audio else "pending_generation",
+        })
+        if source_audio:
+            values = tts_audio_cache.clone_values(source_audio, sentence_id, training_content_id)
+            if reuse_label:
+                values["tts_engine"] = reuse_label
+                values["generation_params"] = {
+                    "reused_from_audio_id": str(source_audio.id),
+                    "reused_at": reused_at,
+                }
+            audio_rows.append(values)
+
+    if sentence_rows:
+        db.session.execute(sa.insert(TtsSentence), sentence_rows)
+    if audio_rows:
+        db.session.execute(sa.insert(TtsAudio), audio_rows)
+    return len(sentence_rows), len(audio_rows)
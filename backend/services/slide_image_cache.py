@@ -0,0 +1,127 @@
+# backend/services/slide_image_cache.py
+
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = "slide_cache"
+IMAGE_FORMATS = {"jpeg": ("JPEG", ".jpg"), "png": ("PNG", ".png")}
+
+# {(路径, mtime, 大小): sha256}
+_pdf_hashes = {}
+
+
+def pdf_fingerprint(pdf_path):
+    """PDF 文件内容的 sha256；同一文件未修改时直接返回上次的结果。"""
+    stat = os.stat(pdf_path)
+    stamp = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    digest = _pdf_hashes.get(stamp)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        _pdf_hashes[stamp] = digest
+    return digest
+
+
+def slide_size(pdf_path, width):
+    """按第一页的宽高比计算目标尺寸，宽和高都取偶数（libx264 + yuv420p 的要求）。"""
+    with fitz.open(pdf_path) as doc:
+        if len(doc) == 0:
+            raise ValueError(f"PDF 没有任何页面: {pdf_path}")
+        rect = doc[0].rect
+    width = int(width) - int(width) % 2
+    height = int(round(width * rect.height / rect.width))
+    height -= height % 2
+    return width, height
+
+
+def _render_pages(pdf_path, page_indexes, size, image_format, output_paths):
+    """
+    在子进程中渲染一组页面。每个进程只打开一次 PDF，
+    页面直接按目标尺寸光栅化，不再先出全分辨率大图再缩放。
+    """
+    pil_format = IMAGE_FORMATS[image_format][0]
+    with fitz.open(pdf_path) as doc:
+        for page_index, output_path in zip(page_indexes, output_paths):
+            page = doc[page_index]
+            matrix = fitz.Matrix(size[0] / page.rect.width, size[1] / page.rect.height)
+            pixmap = page.get_pixmap(matrix=matrix, alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+            if image.size != size:
+                # 浮点缩放可能差一个像素
+                image = image.resize(size, Image.LANCZOS)
+            tmp_path = f"{output_path}.tmp"
+            image.save(tmp_path, format=pil_format, quality=92)
+            os.replace(tmp_path, output_path)
+    return len(output_paths)
+
+
+def _executor(max_workers):
+    # Celery prefork 的 worker 是守护进程，不能再创建子进程，只能退回线程池
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(max_workers=max_workers)
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def rasterize_pdf(pdf_path, width=1920, image_format="jpeg", max_workers=None):
+    """
+    把 PDF 每一页渲染成 width 宽的图片，返回按页码排序的绝对路径列表。
+
+    结果缓存在 PDF 所在目录的 slide_cache/<PDF哈希>_<宽>x<高>/ 下，
+    文件名为 slide_<页码><扩展名>；PDF 内容和尺寸不变时再次调用不会重新渲染，
+    只补渲染缺失的页面。缺失页面按进程数分块并行渲染。
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片格式: {image_format}")
+    extension = IMAGE_FORMATS[image_format][1]
+    size = slide_size(pdf_path, width)
+    cache_dir = os.path.join(
+        os.path.dirname(os.path.abspath(pdf_path)),
+        CACHE_DIR_NAME,
+        f"{pdf_fingerprint(pdf_path)[:16]}_{size[0]}x{size[1]}",
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    image_paths = [
+        os.path.join(cache_dir, f"slide_{page_index + 1}{extension}")
+        for page_index in range(page_count)
+    ]
+    missing = [index for index, path in enumerate(image_paths) if not os.path.exists(path)]
+    if not missing:
+        logger.info(f"幻灯片缓存命中: {pdf_path} ({page_count} 页, {size[0]}x{size[1]})")
+        return image_paths
+
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(missing)))
+    chunks = [missing[offset::max_workers] for offset in range(max_workers)]
+    with _executor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                _render_pages,
+                pdf_path,
+                chunk,
+                size,
+                image_format,
+                [image_paths[index] for index in chunk],
+            )
+            for chunk in chunks
+            if chunk
+        ]
+        rendered = sum(future.result() for future in futures)
+
+    logger.info(
+        f"幻灯片渲染完成: {pdf_path} (新渲染 {rendered}/{page_count} 页, "
+        f"{size[0]}x{size[1]}, {max_workers} 个并行 worker)"
+    )
+    return image_paths
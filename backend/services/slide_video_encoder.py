@@ -0,0 +1,257 @@
+# backend/services/slide_video_encoder.py
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from pydub import AudioSegment
+
+logger = logging.getLogger(__name__)
+
+# 片段编码参数变化时递增，使旧的缓存片段全部失效
+SEGMENT_ENCODER_VERSION = 1
+SEGMENT_PRESET = "veryfast"
+
+
+class SlideVideoError(RuntimeError):
+    """ffmpeg 编码幻灯片片段或最终混流失败。"""
+
+
+class SlideSegment:
+    """视频中的一段：一张静止的幻灯片图片显示 duration 秒。"""
+
+    __slots__ = ("image_path", "duration")
+
+    def __init__(self, image_path, duration):
+        self.image_path = image_path
+        self.duration = float(duration)
+
+
+def _run_ffmpeg(command):
+    result = subprocess.run(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", errors="replace").strip()
+        raise SlideVideoError(f"ffmpeg 执行失败 (code {result.returncode}): {message[-2000:]}")
+
+
+def segment_frame_counts(segments, fps):
+    """
+    按累计时间换算每段的帧数：第 i 段覆盖 [round(start*fps), round(end*fps)) 帧。
+    低帧率下单段会有半帧以内的误差，但误差不会逐段累积，切页时间始终贴合音频。
+    """
+    counts = []
+    elapsed = 0.0
+    for segment in segments:
+        start_frame = int(round(elapsed * fps))
+        elapsed += segment.duration
+        counts.append(max(1, int(round(elapsed * fps)) - start_frame))
+    return counts
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def segment_cache_key(image_digest, frame_count, size, fps):
+    """片段缓存键：图片内容 + 帧数（即时间范围换算出的时长）+ 尺寸 + 帧率 + 编码参数。"""
+    raw = json.dumps(
+        [SEGMENT_ENCODER_VERSION, SEGMENT_PRESET, image_digest, frame_count, list(size), fps]
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def encode_slide_segment(image_path, frame_count, output_path, size, fps, preset=SEGMENT_PRESET):
+    """把一张静止图片编码成 frame_count 帧的 H.264 片段（无音频）。"""
+    tmp_path = f"{output_path}.tmp.mp4"
+    _run_ffmpeg([
+        AudioSegment.converter,
+        "-y", "-hide_banner", "-loglevel", "error",
+        "-loop", "1",
+        "-framerate", str(fps),
+        "-i", image_path,
+        "-frames:v", str(frame_count),
+        "-vf", f"scale={size[0]}:{size[1]},format=yuv420p",
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-tune", "stillimage",
+        "-r", str(fps),
+        "-an",
+        tmp_path,
+    ])
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def concat_segments_with_audio(segment_paths, audio_path, output_path, duration):
+    """用 concat demuxer 直接拼接片段（不重新编码视频），同时一次性混入音频。"""
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".txt", delete=False, encoding="utf-8"
+    ) as list_file:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+        list_path = list_file.name
+    try:
+        _run_ffmpeg([
+            AudioSegment.converter,
+            "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-i", audio_path,
+            "-map", "0:v:0",
+            "-map", "1:a:0",
+            "-c:v", "copy",
+            "-c:a", "aac",
+            "-b:a", "128k",
+            "-t", f"{duration:.3f}",
+            "-movflags", "+faststart",
+            output_path,
+        ])
+    finally:
+        os.remove(list_path)
+
+
+def encode_static_slides(
+    segments,
+    audio_path,
+    output_path,
+    size,
+    fps=5,
+    max_workers=None,
+    progress_callback=None,
+    segment_cache_dir=None,
+):
+    """
+    静态幻灯片编码路径：每段单独编码成低帧率片段（并行），再无损拼接并一次性混入音频。
+
+    幻灯片本身是静止图片，没有必要像 MoviePy 那样按 24fps 逐帧合成后再编码；
+    这里每段只编码很少的帧，x264 的 stillimage 调优下 P 帧几乎为零开销。
+
+    传入 segment_cache_dir 时，片段按 segment_cache_key 保存在该目录并跨次复用：
+    任务失败重试、或修改 video_script_json 后重新合成，只会编码图片或时长变化了的片段，
+    其余片段直接参与拼接。成功后清理本次没有用到的旧片段。
+    音频不进入片段，只在最后混流时整体编码一次，所以音频变化不会使片段失效。
+
+    progress_callback(done, total, message) 会在每段完成及混流前后被调用。
+    返回视频总时长（秒）。
+    """
+    if not segments:
+        raise ValueError("没有有效的幻灯片片段可以编码。")
+
+    total = len(segments) + 1  # 最后一步为拼接混流
+    frame_counts = segment_frame_counts(segments, fps)
+    duration = sum(frame_counts) / float(fps)
+    work_dir = segment_cache_dir or tempfile.mkdtemp(prefix="slide_segments_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        if segment_cache_dir:
+            image_digests = {}
+            segment_paths = []
+            for segment, frame_count in zip(segments, frame_counts):
+                digest = image_digests.get(segment.image_path)
+                if digest is None:
+                    digest = image_digests[segment.image_path] = _file_sha256(segment.image_path)
+                key = segment_cache_key(digest, frame_count, size, fps)
+                segment_paths.append(os.path.join(work_dir, f"{key}.mp4"))
+        else:
+            segment_paths = [
+                os.path.join(work_dir, f"segment_{index:05d}.mp4") for index in range(len(segments))
+            ]
+
+        # 同一页同一时长在视频中出现多次时只编码一次
+        pending = {}
+        for segment, frame_count, segment_path in zip(segments, frame_counts, segment_paths):
+            if segment_path not in pending and not os.path.exists(segment_path):
+                pending[segment_path] = (segment.image_path, frame_count)
+        reused = len(segments) - len(pending)
+
+        done = reused
+        if progress_callback and reused:
+            progress_callback(done, total, f"复用 {reused}/{len(segments)} 个已编码的幻灯片片段")
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+            futures = [
+                executor.submit(
+                    encode_slide_segment,
+                    image_path,
+                    frame_count,
+                    segment_path,
+                    size,
+                    fps,
+                )
+                for segment_path, (image_path, frame_count) in pending.items()
+            ]
+            for future in futures:
+                future.result()
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total, f"已编码 {done}/{len(segments)} 个幻灯片片段")
+
+        if progress_callback:
+            progress_callback(len(segments), total, "正在拼接片段并混入音频...")
+        concat_segments_with_audio(segment_paths, audio_path, output_path, duration)
+        if progress_callback:
+            progress_callback(total, total, "视频编码完成")
+
+        if segment_cache_dir:
+            keep = {os.path.basename(path) for path in segment_paths}
+            for name in os.listdir(work_dir):
+                if name.endswith(".mp4") and name not in keep:
+                    os.remove(os.path.join(work_dir, name))
+    finally:
+        if not segment_cache_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.info(
+        f"静态幻灯片视频编码完成: {output_path} ({len(segments)} 段, 复用 {reused} 段, "
+        f"新编码 {len(pending)} 段, {duration:.2f}s, {fps}fps)"
+    )
+    return duration
+
+
+def render_slides_with_moviepy(segments, audio_path, output_path, size, progress_logger=None):
+    """
+    原有的 MoviePy 合成路径：每段一个 ImageClip，compose 拼接后按 24fps 逐帧编码。
+    返回视频总时长（秒）。
+    """
+    from moviepy.editor import AudioFileClip, ImageClip, concatenate_videoclips
+
+    audio_clip = AudioFileClip(audio_path)
+    clips = []
+    for segment in segments:
+        with Image.open(segment.image_path) as pil_img:
+            img_array = np.array(pil_img.convert("RGB"))
+        clip = ImageClip(img_array).set_duration(segment.duration)
+        if tuple(clip.size) != tuple(size):
+            clip = clip.resize(size)
+        clips.append(clip)
+
+    if not clips:
+        raise ValueError("没有有效的视频剪辑可以拼接。")
+
+    final_video = concatenate_videoclips(clips, method="compose").set_audio(audio_clip)
+    final_video.write_videofile(
+        output_path,
+        codec="libx264",
+        audio_codec="aac",
+        threads=10,
+        fps=24,
+        preset="fast",
+        logger=progress_logger,
+        ffmpeg_params=["-pix_fmt", "yuv420p"],
+    )
+    return final_video.duration
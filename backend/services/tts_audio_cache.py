@@ -0,0 +1,194 @@
+# backend/services/tts_audio_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import uuid
+
+from flask import current_app
+from sqlalchemy.orm import aliased
+
+from backend.extensions import db
+from backend.models import TtsAudio
+
+logger = logging.getLogger(__name__)
+
+# 不影响合成结果、或每次调用都会变化的配置项，不参与缓存键计算（引擎单独计入键中）
+NON_AUDIO_CONFIG_KEYS = frozenset({
+    "engine",
+    "api_key",
+    "api_key_name_used",
+    "server_url",
+    "base_url",
+    "proxy_url",
+    "tts_engine",
+    "tts_params",
+    "force_regenerate",
+})
+
+# 合成时会用 tts_engine_params 覆盖生效配置的引擎（见 tasks._synthesize_with_engine）
+ENGINES_WITH_PARAMS = frozenset({"gradio_default", "indextts", "tts_server"})
+
+
+def normalize_tts_text(text):
+    """统一全角/半角并合并空白，作为缓存键中的文本部分。"""
+    if not text:
+        return ""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def effective_tts_config(training_content, sentence=None, override_config=None):
+    """按 系统默认 -> 培训内容 -> 单句 -> 临时覆盖 的顺序合并出生效的 TTS 配置。"""
+    config = dict(current_app.config.get("DEFAULT_TTS_CONFIG", {}))
+    if training_content is not None and training_content.default_tts_config:
+        config.update(training_content.default_tts_config)
+    if sentence is not None and sentence.tts_config:
+        config.update(sentence.tts_config)
+    if override_config and isinstance(override_config, dict):
+        config.update(override_config)
+    return config
+
+
+def _voice_for(engine, config, pt_file_path_relative=None):
+    if engine == "gemini_tts":
+        return config.get("voice_name", "Kore")
+    if engine == "tts_server":
+        return config.get("voice", "longanling_v3")
+    if engine == "indextts":
+        return os.path.basename(config.get("voice_reference_path") or "default_voice.wav")
+    if engine == "gradio_default":
+        return pt_file_path_relative or ""
+    return config.get("voice_name") or config.get("voice") or ""
+
+
+def audio_cache_key(text, engine, config, engine_params=None, pt_file_path_relative=None):
+    """
+    计算内容寻址缓存键：SHA-256(规范化文本, 引擎, 音色, 合成实际使用的参数)。
+    同一句话在任何脚本版本、任何课程下，只要引擎/音色/配置一致就得到同一个键。
+
+    写入（单句/批量合成）与查找（含重新拆分句子）都必须经过这里：
+    engine 为空时取配置中的 engine；引擎参数只对会使用它的引擎计入，并覆盖同名配置；
+    Gradio 未指定音色文件时按默认音色文件计算，与接口层的默认值一致。
+    """
+    config = config or {}
+    engine = engine or config.get("engine") or ""
+    params = dict(config)
+    if engine in ENGINES_WITH_PARAMS and engine_params:
+        params.update(engine_params)
+    if engine == "gradio_default" and not pt_file_path_relative:
+        pt_file_path_relative = current_app.config.get("DEFAULT_GRADIO_PT_FILE_PATH")
+    stable_params = {
+        key: value for key, value in params.items() if key not in NON_AUDIO_CONFIG_KEYS
+    }
+    payload = [
+        normalize_tts_text(text),
+        engine,
+        _voice_for(engine, params, pt_file_path_relative),
+        stable_params,
+    ]
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TtsAudioCache:
+    """
+    基于 TtsAudio.cache_key 的句子音频缓存。
+
+    命中时为新句子创建一条指向同一音频文件的 TtsAudio 记录，不再调用 TTS 引擎。
+    只认磁盘上仍存在的文件；hits / misses 为本进程累计的命中统计。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def lookup_many(self, cache_keys, exclude_sentence_ids=None):
+        """
+        一次查询返回 {cache_key: 最新的可用 TtsAudio}，未命中的键不在结果中。
+
+        exclude_sentence_ids 中句子自己用过的音频文件不算命中，
+        避免重新生成时又拿回句子当前的旧音频。
+        """
+        cache_keys = {key for key in cache_keys if key}
+        if not cache_keys:
+            return {}
+
+        storage_base_path = current_app.config.get(
+            "TTS_AUDIO_STORAGE_PATH",
+            os.path.join(current_app.root_path, "static", "tts_audio"),
+        )
+        query = TtsAudio.query.filter(
+            TtsAudio.cache_key.in_(list(cache_keys)),
+            TtsAudio.audio_type == "sentence_audio",
+        )
+        if exclude_sentence_ids:
+            own_audio = aliased(TtsAudio)
+            query = query.filter(
+                TtsAudio.file_path.notin_(
+                    db.select(own_audio.file_path).where(
+                        own_audio.tts_sentence_id.in_(list(exclude_sentence_ids))
+                    )
+                )
+            )
+        candidates = query.order_by(TtsAudio.created_at.desc()).all()
+        found = {}
+        for audio in candidates:
+            if audio.cache_key in found:
+                continue
+            if os.path.exists(os.path.join(storage_base_path, audio.file_path)):
+                found[audio.cache_key] = audio
+
+        self._record(len(found), len(cache_keys) - len(found))
+        return found
+
+    def lookup(self, cache_key, exclude_sentence_ids=None):
+        return self.lookup_many([cache_key], exclude_sentence_ids).get(cache_key)
+
+    @staticmethod
+    def clone_values(source_audio, sentence_id, training_content_id, version=1):
+        """复用 source_audio 文件的新 TtsAudio 行的列值，可直接用于批量插入。"""
+        return {
+            "id": uuid.uuid4(),
+            "tts_sentence_id": sentence_id,
+            "training_content_id": training_content_id,
+            "audio_type": "sentence_audio",
+            "file_path": source_audio.file_path,
+            "duration_ms": source_audio.duration_ms,
+            "file_size_bytes": source_audio.file_size_bytes,
+            "tts_engine": source_audio.tts_engine,
+            "voice_name": source_audio.voice_name,
+            "generation_params": source_audio.generation_params,
+            "cache_key": source_audio.cache_key,
+            "version": version,
+            "is_latest_for_sentence": True,
+        }
+
+    @classmethod
+    def clone_for_sentence(cls, source_audio, sentence, training_content_id, version=1):
+        """为句子创建一条复用 source_audio 文件的新 TtsAudio 记录（未提交）。"""
+        new_audio = TtsAudio(
+            **cls.clone_values(source_audio, sentence.id, training_content_id, version)
+        )
+        db.session.add(new_audio)
+        return new_audio
+
+
+tts_audio_cache = TtsAudioCache()
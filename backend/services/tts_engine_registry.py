@@ -0,0 +1,155 @@
+# backend/services/tts_engine_registry.py
+
+import contextlib
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class _EngineStats:
+    __slots__ = ("calls", "clients_created", "setup_ms", "synthesis_ms", "last_setup_ms", "last_synthesis_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.clients_created = 0
+        self.setup_ms = 0.0
+        self.synthesis_ms = 0.0
+        self.last_setup_ms = 0.0
+        self.last_synthesis_ms = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "clients_created": self.clients_created,
+            "avg_setup_ms": round(self.setup_ms / self.calls, 1) if self.calls else 0.0,
+            "avg_synthesis_ms": round(self.synthesis_ms / self.calls, 1) if self.calls else 0.0,
+            "last_setup_ms": round(self.last_setup_ms, 1),
+            "last_synthesis_ms": round(self.last_synthesis_ms, 1),
+        }
+
+
+class TtsEngineRegistry:
+    """
+    每个 worker 进程一份的 TTS 引擎客户端池。
+
+    GradioClient 初始化时要拉取服务端的 API 描述，IndexTTS 每句都要重新上传参考音频，
+    Gemini 每次都要重新建立代理连接 —— 这些都是与句子长度无关的固定开销。
+    这里按 (引擎, 地址, 凭据) 缓存已初始化的客户端，用完归还，下一句直接复用。
+
+    客户端以"借出/归还"方式使用：同一实例同一时刻只被一个线程持有，
+    所以 requests.Session、GradioClient 这类非线程安全的客户端也可以放进来；
+    并发数由调用方的信号量限制，池中闲置实例数不会超过并发上限。
+    """
+
+    def __init__(self):
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._stats = defaultdict(_EngineStats)
+
+    @contextlib.contextmanager
+    def client(self, key, factory):
+        """借出 key 对应的客户端，没有闲置实例时调用 factory() 新建；出错时丢弃该实例。"""
+        with self._lock:
+            idle = self._idle[key]
+            instance = idle.pop() if idle else None
+        if instance is None:
+            instance = factory()
+            with self._lock:
+                self._stats[key[0]].clients_created += 1
+            logger.info(f"[TTS引擎] 已创建新的客户端: {key[0]} {key[1]}")
+        try:
+            yield instance
+        except Exception:
+            # 连接可能已处于异常状态（代理断开、服务重启），下次重新创建
+            _close_quietly(instance)
+            raise
+        with self._lock:
+            self._idle[key].append(instance)
+
+    def gradio_client(self, src):
+        from gradio_client import Client as GradioClient
+
+        return self.client(("gradio_default", src), lambda: GradioClient(src=src))
+
+    def tts_server(self, base_url, api_key):
+        from backend.services.tts_server_service import TTSServerService
+
+        return self.client(
+            ("tts_server", base_url, api_key),
+            lambda: TTSServerService(base_url=base_url, api_key=api_key),
+        )
+
+    def indextts(self, base_url):
+        from backend.services.indextts_service import IndexTTSService
+
+        return self.client(
+            ("indextts", base_url),
+            lambda: IndexTTSService(base_url=base_url, http_client=httpx.Client(timeout=300.0)),
+        )
+
+    def gemini_http_client(self, proxy_url=None):
+        def create():
+            if proxy_url:
+                transport = httpx.HTTPTransport(proxy=proxy_url, retries=3)
+                return httpx.Client(timeout=180.0, mounts={"all://": transport})
+            return httpx.Client(timeout=180.0, transport=httpx.HTTPTransport(retries=3))
+
+        return self.client(("gemini_tts", proxy_url or ""), create)
+
+    def record(self, engine, setup_ms, synthesis_ms):
+        with self._lock:
+            stats = self._stats[engine]
+            stats.calls += 1
+            stats.setup_ms += setup_ms
+            stats.synthesis_ms += synthesis_ms
+            stats.last_setup_ms = setup_ms
+            stats.last_synthesis_ms = synthesis_ms
+
+    def stats(self):
+        with self._lock:
+            return {engine: stats.as_dict() for engine, stats in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for instances in idle.values():
+            for instance in instances:
+                _close_quietly(instance)
+
+
+class EngineTimer:
+    """记录一次合成中"客户端准备"与"实际合成"各自的耗时（毫秒）。"""
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._ready = None
+        self.setup_ms = 0.0
+        self.synthesis_ms = 0.0
+
+    def ready(self):
+        self._ready = time.perf_counter()
+        self.setup_ms = (self._ready - self._started) * 1000
+
+    def done(self):
+        self.synthesis_ms = (time.perf_counter() - (self._ready or self._started)) * 1000
+
+
+def _close_quietly(instance):
+    close = getattr(instance, "close", None)
+    if close is None:
+        session = getattr(instance, "session", None)
+        close = getattr(session, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+
+tts_engine_registry = TtsEngineRegistry()
@@ -5,13 +5,14 @@ import re
 import uuid
 from decimal import Decimal
 from datetime import datetime, date
-from pydub import AudioSegment
 from pydub.exceptions import CouldntDecodeError
 import time
+import random
 import base64
 from celery.utils.log import get_task_logger  # 使用 Celery 的 logger
 import mimetypes
 from celery.schedules import crontab
+from celery import chord
 
 
 from celery_worker import celery_app
@@ -49,6 +50,18 @@ from .manager_module import get_next_identity
 from .manager_module import reset_all_usage
 from .services.data_sync_service import DataSyncService
 from .services.billing_engine import BillingEngine
+from .services.billing_summary_service import refresh_billing_month
+from .services.play_events import aggregate_play_counts
+from .services.audio_merge_service import AudioMergeError, SentencePcmCache, StreamingAudioWriter
+from .services.tts_audio_cache import audio_cache_key, effective_tts_config, tts_audio_cache
+from .services.tts_engine_registry import EngineTimer, tts_engine_registry
+from .services.slide_image_cache import rasterize_pdf
+from .services.sentence_split_service import bulk_create_sentences, find_reusable_audios, split_script_text
+from .services.slide_video_encoder import (
+    SlideSegment,
+    encode_static_slides,
+    render_slides_with_moviepy,
+)
 
 
 import httpx  # <<<--- 关键：导入httpx库
@@ -56,16 +69,13 @@ import httpx  # <<<--- 关键：导入httpx库
 
 # 合成视频
 import fitz  # PyMuPDF 库的导入名是 fitz
-from pdf2image import convert_from_path
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
 from PIL import Image  # <<<--- 关键：导入Pillow的Image模块
-import numpy as np
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 # 导入需要异步执行的LLM函数和TTS相关的外部客户端
 from backend.api.ai_generate import transform_text_with_llm
-from gradio_client import Client as GradioClient
 
 logger = logging.getLogger(__name__)
 
@@ -300,6 +310,19 @@ def run_llm_function_async(
 
 
 # 2.1: TTS相关辅助函数 (从您原有的tasks.py中保留)
+def _supersede_sentence_audios(sentence_id):
+    """将句子现有音频标记为非最新，返回新音频应使用的版本号。"""
+    TtsAudio.query.filter_by(
+        tts_sentence_id=sentence_id, is_latest_for_sentence=True
+    ).update({"is_latest_for_sentence": False})
+    latest_version = (
+        TtsAudio.query.with_entities(func.max(TtsAudio.version))
+        .filter_by(tts_sentence_id=sentence_id)
+        .scalar()
+    )
+    return (latest_version or 0) + 1
+
+
 def _save_audio_file(
     audio_binary_content,
     training_content_id_str,
@@ -333,7 +356,8 @@ def _save_audio_file(
             raise
 
 
-def _save_merged_audio_file(audio_segment_obj, training_content_id_str, version_number):
+def _merged_audio_file_paths(training_content_id_str, version_number):
+    """为新版本的合并音频生成 (完整路径, 相对路径)，并确保目录存在。"""
     app = create_flask_app_for_task()
     with app.app_context():
         storage_base_path = app.config.get(
@@ -345,22 +369,19 @@ def _save_merged_audio_file(audio_segment_obj, training_content_id_str, version_
 
         timestamp_str = datetime.now().strftime("%Y%m%d%H%M%S%f")
         file_name = f"merged_audio_v{version_number}_{timestamp_str}.mp3"
-        full_file_path = os.path.join(full_dir_path, file_name)
-        relative_file_path = os.path.join(relative_dir, file_name)
+        return os.path.join(full_dir_path, file_name), os.path.join(relative_dir, file_name)
 
-        try:
-            # 使用固定比特率导出，确保输出质量一致
-            # 128k 是 MP3 的标准比特率，平衡质量和文件大小
-            audio_segment_obj.export(
-                full_file_path, 
-                format="mp3",
-                bitrate="128k"
-            )
-            logger.info(f"合并的音频文件已保存: {full_file_path} (128 kb/s)")
-            return relative_file_path, os.path.getsize(full_file_path)
-        except Exception as e:
-            logger.error(f"保存合并的音频文件失败 {full_file_path}: {e}", exc_info=True)
-            raise
+
+def _sentence_pcm_cache_for_content(training_content_id_str):
+    """每个课程内容一个句子 PCM 缓存目录，重新合并时只解码新生成的句子。"""
+    app = create_flask_app_for_task()
+    with app.app_context():
+        storage_base_path = app.config.get(
+            "TTS_AUDIO_STORAGE_PATH", os.path.join(app.root_path, "static", "tts_audio")
+        )
+        return SentencePcmCache(
+            os.path.join(storage_base_path, str(training_content_id_str), ".merge_cache")
+        )
 
 
 # 2.2: 你的专用TTS任务 (保留并确保它们能正确运行)
@@ -416,18 +437,17 @@ def trigger_tts_refine_async(self, oral_script_id_str):
             tts_service_base_url = app.config.get(
                 "TTS_SERVICE_BASE_URL", "http://test.mengyimengsao.com:37860/"
             )
-            gradio_tts_client = GradioClient(tts_service_base_url)
-
-            job = gradio_tts_client.predict(
-                text_file=oral_script.content,
-                oral=2,
-                laugh=0,
-                bk=4,
-                temperature=0.1,
-                top_P=0.7,
-                top_K=20,
-                api_name="/generate_refine",
-            )
+            with tts_engine_registry.gradio_client(tts_service_base_url) as gradio_tts_client:
+                job = gradio_tts_client.predict(
+                    text_file=oral_script.content,
+                    oral=2,
+                    laugh=0,
+                    bk=4,
+                    temperature=0.1,
+                    top_P=0.7,
+                    top_K=20,
+                    api_name="/generate_refine",
+                )
 
             refined_content = None
             if hasattr(job, "result"):
@@ -481,6 +501,348 @@ def trigger_tts_refine_async(self, oral_script_id_str):
             return {"status": "Error", "message": str(e)}
 
 
+def _synthesize_with_engine(
+    app,
+    tts_engine_identifier,
+    sentence_text,
+    final_config,
+    tts_engine_params=None,
+    pt_file_path_relative=None,
+    log_label="sentence",
+):
+    """
+    调用指定 TTS 引擎合成一句话，返回 (音频二进制, MIME 类型, 用于记录的生成参数)。
+    引擎客户端从本进程的 tts_engine_registry 借用，跨句子、跨任务复用。
+    """
+    timer = EngineTimer()
+    audio_binary_content = None
+    output_audio_mime_type = "audio/mpeg"
+    actual_generation_params_for_log = {}
+
+    if tts_engine_identifier == "gemini_tts":
+        logger.info(
+            f"GenerateAudio Task: Using Gemini TTS for {log_label}"
+        )
+
+        # ++++++++++++++++ 集成代理和密钥管理器 (最终版) ++++++++++++++++
+        # 1. 从 current_app 获取全局的管理器实例
+        # manager = current_app.proxy_key_manager
+        # manager = proxy_key_manager
+
+        # # 2. 向管理器请求下一个可用的 "身份"
+        # identity = manager.get_next_identity()
+
+        text_to_speak = (
+            final_config.get("system_prompt", "") + sentence_text
+        )
+        identity = get_next_identity()  # 代理和密钥轮询
+        proxy_url = identity["proxy_url"]
+        api_key_name = identity["id"]
+
+        logger.info(
+            f"Successfully retrieved identity '{api_key_name}' from manager."
+        )
+        # 配置Gemini TTS 参数
+        # gemini_voice = tts_engine_params.get("voice_name","Kore")
+        # gemini_temp = tts_engine_params.get("temperature", 0.5)
+        # gemini_model_name = tts_engine_params.get("model", "gemini-2.5-pro-preview-tts")
+        # gemini_model_name = tts_engine_params.get("model", "gemini-2.5-flash-preview-tts")
+        # --- 调用您真正的业务逻辑 ---
+        logger.info(
+            "--- [业务逻辑开始] 正在调用 generate_audio_with_gemini_tts ---"
+        )
+
+        with tts_engine_registry.gemini_http_client(proxy_url) as gemini_http_client:
+            timer.ready()
+            audio_binary_content, output_audio_mime_type = (
+                generate_audio_with_gemini_tts(
+                    text_to_speak=text_to_speak,
+                    api_key=identity["api_key"],
+                    model_name=final_config.get(
+                        "model", "gemini-2.5-flash-preview-tts"
+                    ),
+                    voice_name=final_config.get("voice_name", "Kore"),
+                    temperature=final_config.get("temperature", 0.1),
+                    proxy_url=identity["proxy_url"],
+                    http_client=gemini_http_client,
+                )
+            )
+        final_config["api_key_name_used"] = identity["id"]  # 记录使用的key
+        logger.info(
+            "--- [业务逻辑结束] 调用 generate_audio_with_gemini_tts 成功 ---"
+        )
+
+        actual_generation_params_for_log = {
+            "engine": "gemini_tts",
+            "voice_name": final_config.get("voice_name", "Kore"),
+            "temperature": final_config.get("temperature", 0.1),
+            "model": final_config.get("model", "gemini-2.5-flash-preview-tts"),
+            "api_key_name": api_key_name,  # 记录我们用了哪个Key
+            "proxy_used": proxy_url,  # 记录我们用了哪个代理
+        }
+        # actual_generation_params_for_log = {"engine": "gemini_tts", "voice_name": gemini_voice, "temperature": gemini_temp, "model": gemini_model_name, "api_key_name": gemini_api_key_name}
+
+    elif tts_engine_identifier == "gradio_default":
+        logger.info(
+            f"GenerateAudio Task: Using Gradio TTS for {log_label}"
+        )
+        tts_service_base_url = app.config.get(
+            "TTS_SERVICE_BASE_URL", "http://test.mengyimengsao.com:37860/"
+        )
+        default_gradio_params = current_app.config[
+            "DEFAULT_GRADIO_PARAMS"
+        ]  # 确保在当前应用上下文中设置
+        gradio_predict_params = {
+            **default_gradio_params,
+            **(tts_engine_params or {}),
+        }
+
+        absolute_pt_file_path_for_log = None
+        if pt_file_path_relative:
+            pt_folder = os.path.join(app.root_path, "static", "tts_pt")
+            absolute_pt_file_path = os.path.join(
+                pt_folder, pt_file_path_relative
+            )
+
+            if os.path.exists(absolute_pt_file_path):
+                logger.info(
+                    f"[SingleAudioTask] 使用指定的音色文件: {absolute_pt_file_path}"
+                )
+                default_gradio_params["pt_file"] = {
+                    "path": absolute_pt_file_path,
+                    "meta": {"_type": "gradio.FileData"},
+                }
+            else:
+                logger.warning(
+                    f"[SingleAudioTask] 指定的音色文件不存在: {absolute_pt_file_path}，将使用默认音色。"
+                )
+        else:
+            logger.info("[SingleAudioTask] 未指定音色文件，使用默认音色。")
+
+        with tts_engine_registry.gradio_client(tts_service_base_url) as gradio_tts_client:
+            timer.ready()
+            job_result = gradio_tts_client.predict(
+                text_file=sentence_text,
+                **gradio_predict_params,
+                api_name="/generate_tts_audio",
+            )
+
+        # --- 从 job_result 中提取 audio_binary_content 和 output_audio_mime_type ---
+        if isinstance(job_result, tuple) and len(job_result) > 0:
+            output_component = job_result[0]
+            if (
+                isinstance(output_component, dict)
+                and output_component.get("is_file")
+                and output_component.get("name")
+            ):
+                audio_file_path_from_gradio = output_component["name"]
+                if os.path.exists(audio_file_path_from_gradio):
+                    with open(audio_file_path_from_gradio, "rb") as af:
+                        audio_binary_content = af.read()
+                # 尝试从文件名猜测MIME类型，如果Gradio不直接返回
+                output_audio_mime_type = (
+                    mimetypes.guess_type(audio_file_path_from_gradio)[0]
+                    or "audio/wav"
+                )
+            elif isinstance(
+                output_component, str
+            ) and output_component.startswith("data:audio/"):
+                header, encoded = output_component.split(",", 1)
+                audio_binary_content = base64.b64decode(encoded)
+                output_audio_mime_type = header.split(":")[1].split(";")[0]
+        elif isinstance(job_result, str) and os.path.exists(
+            job_result
+        ):  # 如果直接返回有效路径
+            audio_file_path_from_gradio = job_result
+            with open(audio_file_path_from_gradio, "rb") as af:
+                audio_binary_content = af.read()
+            output_audio_mime_type = (
+                mimetypes.guess_type(audio_file_path_from_gradio)[0]
+                or "audio/wav"
+            )
+
+        # --------------------------------------------------------------------
+        actual_generation_params_for_log = {
+            **gradio_predict_params,
+            "engine": "gradio_default",
+            "pt_file_used": absolute_pt_file_path_for_log,
+        }
+        if (
+            "pt_file" in actual_generation_params_for_log
+            and actual_generation_params_for_log["pt_file"] is not None
+        ):
+            # 只记录路径，而不是 FileData 对象
+            actual_generation_params_for_log["pt_file_path"] = (
+                absolute_pt_file_path_for_log
+            )
+            del actual_generation_params_for_log["pt_file"]
+
+    elif tts_engine_identifier == "indextts":
+        # IndexTTS2 引擎 - 零样本 TTS
+        logger.info(
+            f"GenerateAudio Task: Using IndexTTS2 for {log_label}"
+        )
+
+        # 获取 IndexTTS2 服务配置
+        indextts_base_url = app.config.get(
+            "INDEXTTS_BASE_URL", "http://test.mengyimengsao.com:37860"
+        )
+
+        # 获取参考音频路径
+        voice_reference_path = final_config.get("voice_reference_path")
+        if not voice_reference_path:
+            # 使用默认参考音频
+            default_voice_folder = os.path.join(app.root_path, "static", "tts_voices")
+            voice_reference_path = final_config.get(
+                "voice_reference_path",
+                os.path.join(default_voice_folder, "default_voice.wav")
+            )
+
+        # 如果是相对路径，转换为绝对路径
+        if not os.path.isabs(voice_reference_path):
+            voice_folder = os.path.join(app.root_path, "static", "tts_voices")
+            voice_reference_path = os.path.join(voice_folder, voice_reference_path)
+
+        if not os.path.exists(voice_reference_path):
+            raise FileNotFoundError(f"参考音频文件不存在: {voice_reference_path}")
+
+        logger.info(f"IndexTTS2: 使用参考音频: {voice_reference_path}")
+
+        # 获取情感参考音频（可选）
+        emotion_reference_path = final_config.get("emotion_reference_path")
+        if emotion_reference_path and not os.path.isabs(emotion_reference_path):
+            voice_folder = os.path.join(app.root_path, "static", "tts_voices")
+            emotion_reference_path = os.path.join(voice_folder, emotion_reference_path)
+
+        # 构建 IndexTTS2 参数
+        indextts_params = {
+            "emo_control_method": final_config.get("emo_control_method", "Same as the voice reference"),
+            "emo_weight": final_config.get("emo_weight", 0.8),
+            "max_text_tokens_per_segment": final_config.get("max_text_tokens_per_segment", 120),
+            "do_sample": final_config.get("do_sample", True),
+            "top_p": final_config.get("top_p", 0.8),
+            "top_k": final_config.get("top_k", 30),
+            "temperature": final_config.get("temperature", 0.8),
+            "length_penalty": final_config.get("length_penalty", 0.0),
+            "num_beams": final_config.get("num_beams", 3),
+            "repetition_penalty": final_config.get("repetition_penalty", 10.0),
+            "max_mel_tokens": final_config.get("max_mel_tokens", 1500),
+            # 情感向量
+            "vec_happy": final_config.get("vec_happy", 0.0),
+            "vec_angry": final_config.get("vec_angry", 0.0),
+            "vec_sad": final_config.get("vec_sad", 0.0),
+            "vec_afraid": final_config.get("vec_afraid", 0.0),
+            "vec_disgusted": final_config.get("vec_disgusted", 0.0),
+            "vec_melancholic": final_config.get("vec_melancholic", 0.0),
+            "vec_surprised": final_config.get("vec_surprised", 0.0),
+            "vec_calm": final_config.get("vec_calm", 0.0),
+            "emo_text": final_config.get("emo_text", ""),
+            "emo_random": final_config.get("emo_random", False),
+        }
+
+        # 如果有 tts_engine_params，合并进去
+        if tts_engine_params:
+            indextts_params.update(tts_engine_params)
+
+        # 移除已经作为单独参数传递的键，避免重复
+        indextts_params.pop("voice_reference_path", None)
+        indextts_params.pop("emotion_reference_path", None)
+        indextts_params.pop("base_url", None)
+
+        # 调用 IndexTTS2 服务
+        logger.info("--- [业务逻辑开始] 正在调用 generate_audio_with_indextts ---")
+
+        with tts_engine_registry.indextts(indextts_base_url) as indextts_service:
+            timer.ready()
+            audio_binary_content, output_audio_mime_type = generate_audio_with_indextts(
+                text_to_speak=sentence_text,
+                voice_reference_path=voice_reference_path,
+                emotion_reference_path=emotion_reference_path,
+                base_url=indextts_base_url,
+                service=indextts_service,
+                **indextts_params
+            )
+
+        logger.info("--- [业务逻辑结束] 调用 generate_audio_with_indextts 成功 ---")
+
+        actual_generation_params_for_log = {
+            "engine": "indextts",
+            "voice_reference": os.path.basename(voice_reference_path),
+            "emotion_reference": os.path.basename(emotion_reference_path) if emotion_reference_path else None,
+            "emo_control_method": indextts_params.get("emo_control_method"),
+            "temperature": indextts_params.get("temperature"),
+            "base_url": indextts_base_url,
+        }
+
+    elif tts_engine_identifier == "tts_server":
+        # TTS-Server 微服务引擎
+        logger.info(
+            f"GenerateAudio Task: Using TTS-Server for {log_label}"
+        )
+
+        # 从环境变量获取默认配置
+        tts_server_params = {
+            "model": final_config.get("model", "cosyvoice-v3-flash"),
+            "voice": final_config.get("voice", "longanling_v3"),
+            "server_url": final_config.get("server_url") or app.config.get("TTS_SERVER_BASE_URL", "http://localhost:5002"),
+            "api_key": final_config.get("api_key") or app.config.get("TTS_SERVER_API_KEY", ""),
+            "format": final_config.get("format", "mp3"),
+        }
+
+        # 如果有 tts_engine_params，合并进去
+        if tts_engine_params:
+            tts_server_params.update(tts_engine_params)
+
+        # 直接使用句子文本，TTS-Server 现在支持 SSML
+        text_to_synthesize = sentence_text
+
+        try:
+            with tts_engine_registry.tts_server(
+                tts_server_params["server_url"], tts_server_params["api_key"]
+            ) as tts_server_service:
+                timer.ready()
+                audio_binary_content = tts_server_service.synthesize_text(
+                    text=text_to_synthesize,
+                    model=tts_server_params["model"],
+                    voice=tts_server_params["voice"],
+                    format=tts_server_params["format"],
+                    enable_ssml=True  # 默认启用 SSML
+                )
+
+            # Set MIME type based on format
+            format_to_mime = {
+                "mp3": "audio/mpeg",
+                "wav": "audio/wav",
+                "flac": "audio/flac"
+            }
+            output_audio_mime_type = format_to_mime.get(tts_server_params["format"], "audio/mpeg")
+
+            actual_generation_params_for_log = {
+                "engine": "tts_server",
+                "model": tts_server_params["model"],
+                "voice": tts_server_params["voice"],
+                "voice_name": tts_server_params["voice"],  # Add voice_name for consistency
+                "server_url": tts_server_params["server_url"],
+                "format": tts_server_params["format"],
+                "enable_ssml": True  # 记录 SSML 已启用
+            }
+
+        except Exception as e:
+            logger.error(f"TTS-Server generation failed: {e}")
+            raise
+
+    else:
+        raise ValueError(f"未知的 TTS 引擎标识符: {tts_engine_identifier}")
+
+    timer.done()
+    tts_engine_registry.record(tts_engine_identifier, timer.setup_ms, timer.synthesis_ms)
+    logger.info(
+        f"[TTS引擎] {tts_engine_identifier} {log_label}: "
+        f"客户端准备 {timer.setup_ms:.0f}ms, 合成 {timer.synthesis_ms:.0f}ms"
+    )
+    return audio_binary_content, output_audio_mime_type, actual_generation_params_for_log
+
+
 @celery_app.task(
     bind=True,
     name="tasks.generate_single_sentence_audio_async",
@@ -533,389 +895,69 @@ def generate_single_sentence_audio_async(
             return {"status": "Error", "message": "未找到关联的培训内容"}
 
         # --- 核心：配置解析逻辑 ---
-        final_config = {}
-        # 1. 从App配置加载系统默认值
-        final_config.update(
-            current_app.config.get("DEFAULT_TTS_CONFIG", {})
-        )  # 假设你在app.py中定义了DEFAULT_TTS_CONFIG
-        # 2. 从TrainingContent加载全局配置
-        if training_content.default_tts_config:
-            final_config.update(training_content.default_tts_config)
-        # 3. 从TtsSentence加载单句特定配置
-        if sentence.tts_config:
-            final_config.update(sentence.tts_config)
-        # 4. 使用API传入的临时配置覆盖
-        if override_config and isinstance(override_config, dict):
-            final_config.update(override_config)
+        # 系统默认 -> TrainingContent 全局配置 -> TtsSentence 单句配置 -> API 临时覆盖
+        final_config = effective_tts_config(training_content, sentence, override_config)
+        force_regenerate = bool(final_config.pop("force_regenerate", False))
 
         logger.info(
             f"[AudioTask:{self.request.id}] Sentence {sentence_id_str} | Final TTS Config: {final_config}"
         )
 
+        # --- 内容寻址缓存：相同文本+引擎+音色+配置的音频已存在时直接复用，不消耗 TTS 配额 ---
+        cache_key = audio_cache_key(
+            sentence.sentence_text,
+            tts_engine_identifier,
+            final_config,
+            engine_params=tts_engine_params,
+            pt_file_path_relative=pt_file_path_relative,
+        )
+        # 用户主动重新生成时不查缓存；句子自己当前/历史的音频文件任何情况下都不算命中
+        cached_audio = (
+            None
+            if force_regenerate
+            else tts_audio_cache.lookup(cache_key, exclude_sentence_ids=[sentence.id])
+        )
+        if cached_audio:
+            new_audio_record = tts_audio_cache.clone_for_sentence(
+                cached_audio,
+                sentence,
+                training_content.id,
+                version=_supersede_sentence_audios(sentence.id),
+            )
+            sentence.audio_status = "generated"
+            db.session.commit()
+            logger.info(
+                f"GenerateAudio Task: 句子 {sentence_id_str} 命中音频缓存，复用 {cached_audio.file_path} "
+                f"(累计 {tts_audio_cache.stats()})"
+            )
+            return {
+                "status": "Success",
+                "audio_id": str(new_audio_record.id),
+                "file_path": new_audio_record.file_path,
+                "mime_type": mimetypes.guess_type(new_audio_record.file_path)[0] or "audio/mpeg",
+                "cache_hit": True,
+            }
+
         try:
             sentence.audio_status = "generating"
             db.session.commit()
 
-            audio_binary_content = None
-            output_audio_mime_type = "audio/mpeg"
-            actual_generation_params_for_log = {}
-
-            if tts_engine_identifier == "gemini_tts":
-                logger.info(
-                    f"GenerateAudio Task: Using Gemini TTS for sentence {sentence_id_str}"
-                )
-
-                # ++++++++++++++++ 集成代理和密钥管理器 (最终版) ++++++++++++++++
-                # 1. 从 current_app 获取全局的管理器实例
-                # manager = current_app.proxy_key_manager
-                # manager = proxy_key_manager
-
-                # # 2. 向管理器请求下一个可用的 "身份"
-                # identity = manager.get_next_identity()
-
-                text_to_speak = (
-                    final_config.get("system_prompt", "") + sentence.sentence_text
-                )
-                identity = get_next_identity()  # 代理和密钥轮询
-                proxy_url = identity["proxy_url"]
-                api_key_name = identity["id"]
-
-                logger.info(
-                    f"Successfully retrieved identity '{api_key_name}' from manager."
-                )
-                # ++++++++++++++++ Celery 内部对照诊断 ++++++++++++++++
-                logger.info("--- [诊断开始] 正在执行独立的 httpx 代理测试 ---")
-                try:
-                    test_url = "https://api.ipify.org?format=json"
-                    transport = httpx.HTTPTransport(proxy=proxy_url)
-                    mounts = {"all://": transport}
-                    with httpx.Client(mounts=mounts, timeout=15.0) as client:
-                        logger.info(
-                            "[诊断] 独立的 httpx.Client 已创建，正在发送请求..."
-                        )
-                        response = client.get(test_url)
-                        logger.info(
-                            f"[诊断] 独立的 httpx 请求已收到响应，状态码: {response.status_code}"
-                        )
-                        if response.status_code == 200:
-                            logger.info(
-                                f"✅ [诊断成功] 独立的 httpx 调用{api_key_name}成功！响应: {response.json()}"
-                            )
-                        else:
-                            logger.error(
-                                f"❌ [诊断失败] 独立的 httpx 调用失败！状态码: {response.status_code}"
-                            )
-                except Exception as e:
-                    logger.error(
-                        f"❌ [诊断失败] 独立的 httpx 调用{api_key_name}时发生致命错误: {type(e).__name__}: {e}",
-                        exc_info=True,
-                    )
-                    # 诊断失败后，可以选择直接返回，不再继续执行
-                    # raise e # 或者重新抛出异常，让Celery重试
-                logger.info("--- [诊断结束] ---")
-                # ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-
-                # 配置Gemini TTS 参数
-                # gemini_voice = tts_engine_params.get("voice_name","Kore")
-                # gemini_temp = tts_engine_params.get("temperature", 0.5)
-                # gemini_model_name = tts_engine_params.get("model", "gemini-2.5-pro-preview-tts")
-                # gemini_model_name = tts_engine_params.get("model", "gemini-2.5-flash-preview-tts")
-                # --- 调用您真正的业务逻辑 ---
-                logger.info(
-                    "--- [业务逻辑开始] 正在调用 generate_audio_with_gemini_tts ---"
-                )
-
-                audio_binary_content, output_audio_mime_type = (
-                    generate_audio_with_gemini_tts(
-                        text_to_speak=text_to_speak,
-                        api_key=identity["api_key"],
-                        model_name=final_config.get(
-                            "model", "gemini-2.5-flash-preview-tts"
-                        ),
-                        voice_name=final_config.get("voice_name", "Kore"),
-                        temperature=final_config.get("temperature", 0.1),
-                        proxy_url=identity["proxy_url"],
-                    )
-                )
-                final_config["api_key_name_used"] = identity["id"]  # 记录使用的key
-                logger.info(
-                    "--- [业务逻辑结束] 调用 generate_audio_with_gemini_tts 成功 ---"
-                )
-
-                actual_generation_params_for_log = {
-                    "engine": "gemini_tts",
-                    "voice_name": final_config.get("voice_name", "Kore"),
-                    "temperature": final_config.get("temperature", 0.1),
-                    "model": final_config.get("model", "gemini-2.5-flash-preview-tts"),
-                    "api_key_name": api_key_name,  # 记录我们用了哪个Key
-                    "proxy_used": proxy_url,  # 记录我们用了哪个代理
-                }
-                # actual_generation_params_for_log = {"engine": "gemini_tts", "voice_name": gemini_voice, "temperature": gemini_temp, "model": gemini_model_name, "api_key_name": gemini_api_key_name}
-
-            elif tts_engine_identifier == "gradio_default":
-                logger.info(
-                    f"GenerateAudio Task: Using Gradio TTS for sentence {sentence_id_str}"
-                )
-                tts_service_base_url = app.config.get(
-                    "TTS_SERVICE_BASE_URL", "http://test.mengyimengsao.com:37860/"
-                )
-                gradio_tts_client = GradioClient(src=tts_service_base_url)
-                default_gradio_params = current_app.config[
-                    "DEFAULT_GRADIO_PARAMS"
-                ]  # 确保在当前应用上下文中设置
-                gradio_predict_params = {
-                    **default_gradio_params,
-                    **(tts_engine_params or {}),
-                }
-
-                absolute_pt_file_path_for_log = None
-                if pt_file_path_relative:
-                    pt_folder = os.path.join(app.root_path, "static", "tts_pt")
-                    absolute_pt_file_path = os.path.join(
-                        pt_folder, pt_file_path_relative
-                    )
-
-                    if os.path.exists(absolute_pt_file_path):
-                        logger.info(
-                            f"[SingleAudioTask] 使用指定的音色文件: {absolute_pt_file_path}"
-                        )
-                        default_gradio_params["pt_file"] = {
-                            "path": absolute_pt_file_path,
-                            "meta": {"_type": "gradio.FileData"},
-                        }
-                    else:
-                        logger.warning(
-                            f"[SingleAudioTask] 指定的音色文件不存在: {absolute_pt_file_path}，将使用默认音色。"
-                        )
-                else:
-                    logger.info("[SingleAudioTask] 未指定音色文件，使用默认音色。")
-
-                job_result = gradio_tts_client.predict(
-                    text_file=sentence.sentence_text,
-                    **gradio_predict_params,
-                    api_name="/generate_tts_audio",
-                )
-
-                # --- 从 job_result 中提取 audio_binary_content 和 output_audio_mime_type ---
-                if isinstance(job_result, tuple) and len(job_result) > 0:
-                    output_component = job_result[0]
-                    if (
-                        isinstance(output_component, dict)
-                        and output_component.get("is_file")
-                        and output_component.get("name")
-                    ):
-                        audio_file_path_from_gradio = output_component["name"]
-                        if os.path.exists(audio_file_path_from_gradio):
-                            with open(audio_file_path_from_gradio, "rb") as af:
-                                audio_binary_content = af.read()
-                        # 尝试从文件名猜测MIME类型，如果Gradio不直接返回
-                        output_audio_mime_type = (
-                            mimetypes.guess_type(audio_file_path_from_gradio)[0]
-                            or "audio/wav"
-                        )
-                    elif isinstance(
-                        output_component, str
-                    ) and output_component.startswith("data:audio/"):
-                        header, encoded = output_component.split(",", 1)
-                        audio_binary_content = base64.b64decode(encoded)
-                        output_audio_mime_type = header.split(":")[1].split(";")[0]
-                elif isinstance(job_result, str) and os.path.exists(
-                    job_result
-                ):  # 如果直接返回有效路径
-                    audio_file_path_from_gradio = job_result
-                    with open(audio_file_path_from_gradio, "rb") as af:
-                        audio_binary_content = af.read()
-                    output_audio_mime_type = (
-                        mimetypes.guess_type(audio_file_path_from_gradio)[0]
-                        or "audio/wav"
-                    )
-
-                # --------------------------------------------------------------------
-                actual_generation_params_for_log = {
-                    **gradio_predict_params,
-                    "engine": "gradio_default",
-                    "pt_file_used": absolute_pt_file_path_for_log,
-                }
-                if (
-                    "pt_file" in actual_generation_params_for_log
-                    and actual_generation_params_for_log["pt_file"] is not None
-                ):
-                    # 只记录路径，而不是 FileData 对象
-                    actual_generation_params_for_log["pt_file_path"] = (
-                        absolute_pt_file_path_for_log
-                    )
-                    del actual_generation_params_for_log["pt_file"]
-
-            elif tts_engine_identifier == "indextts":
-                # IndexTTS2 引擎 - 零样本 TTS
-                logger.info(
-                    f"GenerateAudio Task: Using IndexTTS2 for sentence {sentence_id_str}"
-                )
-                
-                # 获取 IndexTTS2 服务配置
-                indextts_base_url = app.config.get(
-                    "INDEXTTS_BASE_URL", "http://test.mengyimengsao.com:37860"
-                )
-                
-                # 获取参考音频路径
-                voice_reference_path = final_config.get("voice_reference_path")
-                if not voice_reference_path:
-                    # 使用默认参考音频
-                    default_voice_folder = os.path.join(app.root_path, "static", "tts_voices")
-                    voice_reference_path = final_config.get(
-                        "voice_reference_path",
-                        os.path.join(default_voice_folder, "default_voice.wav")
-                    )
-                
-                # 如果是相对路径，转换为绝对路径
-                if not os.path.isabs(voice_reference_path):
-                    voice_folder = os.path.join(app.root_path, "static", "tts_voices")
-                    voice_reference_path = os.path.join(voice_folder, voice_reference_path)
-                
-                if not os.path.exists(voice_reference_path):
-                    raise FileNotFoundError(f"参考音频文件不存在: {voice_reference_path}")
-                
-                logger.info(f"IndexTTS2: 使用参考音频: {voice_reference_path}")
-                
-                # 获取情感参考音频（可选）
-                emotion_reference_path = final_config.get("emotion_reference_path")
-                if emotion_reference_path and not os.path.isabs(emotion_reference_path):
-                    voice_folder = os.path.join(app.root_path, "static", "tts_voices")
-                    emotion_reference_path = os.path.join(voice_folder, emotion_reference_path)
-                
-                # 构建 IndexTTS2 参数
-                indextts_params = {
-                    "emo_control_method": final_config.get("emo_control_method", "Same as the voice reference"),
-                    "emo_weight": final_config.get("emo_weight", 0.8),
-                    "max_text_tokens_per_segment": final_config.get("max_text_tokens_per_segment", 120),
-                    "do_sample": final_config.get("do_sample", True),
-                    "top_p": final_config.get("top_p", 0.8),
-                    "top_k": final_config.get("top_k", 30),
-                    "temperature": final_config.get("temperature", 0.8),
-                    "length_penalty": final_config.get("length_penalty", 0.0),
-                    "num_beams": final_config.get("num_beams", 3),
-                    "repetition_penalty": final_config.get("repetition_penalty", 10.0),
-                    "max_mel_tokens": final_config.get("max_mel_tokens", 1500),
-                    # 情感向量
-                    "vec_happy": final_config.get("vec_happy", 0.0),
-                    "vec_angry": final_config.get("vec_angry", 0.0),
-                    "vec_sad": final_config.get("vec_sad", 0.0),
-                    "vec_afraid": final_config.get("vec_afraid", 0.0),
-                    "vec_disgusted": final_config.get("vec_disgusted", 0.0),
-                    "vec_melancholic": final_config.get("vec_melancholic", 0.0),
-                    "vec_surprised": final_config.get("vec_surprised", 0.0),
-                    "vec_calm": final_config.get("vec_calm", 0.0),
-                    "emo_text": final_config.get("emo_text", ""),
-                    "emo_random": final_config.get("emo_random", False),
-                }
-                
-                # 如果有 tts_engine_params，合并进去
-                if tts_engine_params:
-                    indextts_params.update(tts_engine_params)
-                
-                # 移除已经作为单独参数传递的键，避免重复
-                indextts_params.pop("voice_reference_path", None)
-                indextts_params.pop("emotion_reference_path", None)
-                indextts_params.pop("base_url", None)
-                
-                # 调用 IndexTTS2 服务
-                logger.info("--- [业务逻辑开始] 正在调用 generate_audio_with_indextts ---")
-                
-                audio_binary_content, output_audio_mime_type = generate_audio_with_indextts(
-                    text_to_speak=sentence.sentence_text,
-                    voice_reference_path=voice_reference_path,
-                    emotion_reference_path=emotion_reference_path,
-                    base_url=indextts_base_url,
-                    **indextts_params
-                )
-                
-                logger.info("--- [业务逻辑结束] 调用 generate_audio_with_indextts 成功 ---")
-                
-                actual_generation_params_for_log = {
-                    "engine": "indextts",
-                    "voice_reference": os.path.basename(voice_reference_path),
-                    "emotion_reference": os.path.basename(emotion_reference_path) if emotion_reference_path else None,
-                    "emo_control_method": indextts_params.get("emo_control_method"),
-                    "temperature": indextts_params.get("temperature"),
-                    "base_url": indextts_base_url,
-                }
-
-            elif tts_engine_identifier == "tts_server":
-                # TTS-Server 微服务引擎
-                logger.info(
-                    f"GenerateAudio Task: Using TTS-Server for sentence {sentence_id_str}"
+            audio_binary_content, output_audio_mime_type, actual_generation_params_for_log = (
+                _synthesize_with_engine(
+                    app,
+                    tts_engine_identifier,
+                    sentence.sentence_text,
+                    final_config,
+                    tts_engine_params=tts_engine_params,
+                    pt_file_path_relative=pt_file_path_relative,
+                    log_label=f"sentence {sentence_id_str}",
                 )
-                
-                # 从环境变量获取默认配置
-                tts_server_params = {
-                    "model": final_config.get("model", "cosyvoice-v3-flash"),
-                    "voice": final_config.get("voice", "longanling_v3"),
-                    "server_url": final_config.get("server_url") or app.config.get("TTS_SERVER_BASE_URL", "http://localhost:5002"),
-                    "api_key": final_config.get("api_key") or app.config.get("TTS_SERVER_API_KEY", ""),
-                    "format": final_config.get("format", "mp3"),
-                }
-                
-                # 如果有 tts_engine_params，合并进去
-                if tts_engine_params:
-                    tts_server_params.update(tts_engine_params)
-                
-                # 直接使用句子文本，TTS-Server 现在支持 SSML
-                text_to_synthesize = sentence.sentence_text
-                
-                try:
-                    from backend.services.tts_server_service import TTSServerService
-                    tts_server_service = TTSServerService(
-                        base_url=tts_server_params["server_url"],
-                        api_key=tts_server_params["api_key"]
-                    )
-                    
-                    audio_binary_content = tts_server_service.synthesize_text(
-                        text=text_to_synthesize,
-                        model=tts_server_params["model"],
-                        voice=tts_server_params["voice"],
-                        format=tts_server_params["format"],
-                        enable_ssml=True  # 默认启用 SSML
-                    )
-                    
-                    # Set MIME type based on format
-                    format_to_mime = {
-                        "mp3": "audio/mpeg",
-                        "wav": "audio/wav",
-                        "flac": "audio/flac"
-                    }
-                    output_audio_mime_type = format_to_mime.get(tts_server_params["format"], "audio/mpeg")
-                    
-                    actual_generation_params_for_log = {
-                        "engine": "tts_server",
-                        "model": tts_server_params["model"],
-                        "voice": tts_server_params["voice"],
-                        "voice_name": tts_server_params["voice"],  # Add voice_name for consistency
-                        "server_url": tts_server_params["server_url"],
-                        "format": tts_server_params["format"],
-                        "enable_ssml": True  # 记录 SSML 已启用
-                    }
-                    
-                except Exception as e:
-                    logger.error(f"TTS-Server generation failed: {e}")
-                    raise
-
-            else:
-                raise ValueError(f"未知的 TTS 引擎标识符: {tts_engine_identifier}")
+            )
 
             if not audio_binary_content:
                 raise Exception("未能从所选的TTS引擎获取有效的音频内容")
 
-            TtsAudio.query.filter_by(
-                tts_sentence_id=sentence.id, is_latest_for_sentence=True
-            ).update({"is_latest_for_sentence": False})
-            new_version = 1
-            latest_audio_for_sentence = (
-                TtsAudio.query.filter_by(tts_sentence_id=sentence.id)
-                .order_by(TtsAudio.version.desc())
-                .first()
-            )
-            if latest_audio_for_sentence:
-                new_version = latest_audio_for_sentence.version + 1
+            new_version = _supersede_sentence_audios(sentence.id)
 
             file_extension = mimetypes.guess_extension(output_audio_mime_type) or ".mp3"
             if output_audio_mime_type == "audio/wav":
@@ -940,6 +982,7 @@ def generate_single_sentence_audio_async(
                 or actual_generation_params_for_log.get("roleid")
                 or "default",
                 generation_params=final_config,
+                cache_key=cache_key,
                 version=new_version,
                 is_latest_for_sentence=True,
             )
@@ -1132,34 +1175,426 @@ def batch_generate_audio_task(
                 final_task_status_celery = "SUCCESS"
             db.session.commit()
 
-            final_meta = {
-                "total_sentences": initially_to_process_count,
-                "submitted_subtasks": len(submitted_subtasks_info),
-                "failed_to_submit": failed_to_submit_count,
+            final_meta = {
+                "total_sentences": initially_to_process_count,
+                "submitted_subtasks": len(submitted_subtasks_info),
+                "failed_to_submit": failed_to_submit_count,
+                "message": final_message,
+                "engine_used": tts_engine_identifier,
+                "sub_tasks": submitted_subtasks_info,  # <--- 在最终 meta 中包含子任务信息
+            }
+            if failed_to_submit_count > 0 and len(submitted_subtasks_info) == 0:
+                final_task_status_celery = "FAILURE"
+            else:  # 即使部分派发失败，主任务也算部分成功完成了派发
+                final_task_status_celery = "SUCCESS"
+
+            return {"status": final_task_status_celery, **final_meta}
+
+        except Exception as e_batch_init:  # 捕获批量任务初始化或早期错误
+            logger.error(
+                f"[BatchTask:{self.request.id}] 批量任务初始化失败: {e_batch_init}",
+                exc_info=True,
+            )
+            if "training_content" in locals() and training_content:
+                training_content.status = "error_batch_processing_init"
+                db.session.commit()
+            self.update_state(state="FAILURE", meta={"error": str(e_batch_init)})
+            return {
+                "status": "Error",
+                "message": f"批量语音生成任务失败: {str(e_batch_init)}",
+            }
+
+
+# 批量合成模式：各引擎每批句子数、单进程并发上限与每分钟调用次数上限（None 为不限），
+# 可通过 app.config["TTS_ENGINE_BATCH_LIMITS"] 覆盖。
+# Gemini 与单句任务的 rate_limit="10/m" 保持一致
+DEFAULT_TTS_ENGINE_BATCH_LIMITS = {
+    "gemini_tts": {"batch_size": 8, "concurrency": 4, "rate_per_minute": 10},
+    "tts_server": {"batch_size": 16, "concurrency": 4, "rate_per_minute": None},
+    "indextts": {"batch_size": 4, "concurrency": 1, "rate_per_minute": None},
+    "gradio_default": {"batch_size": 4, "concurrency": 1, "rate_per_minute": None},
+}
+# 与 generate_single_sentence_audio_async 相同的重试策略：遇到这些异常时指数退避重试
+TTS_RETRYABLE_ERRORS = (httpx.HTTPStatusError, httpx.ReadTimeout, httpx.ProxyError)
+TTS_BATCH_MAX_RETRIES = 5
+TTS_BATCH_RETRY_BACKOFF_MAX = 60
+BATCH_PENDING_AUDIO_STATUSES = (
+    "pending_generation",
+    "error_generation",
+    "pending_regeneration",
+    "error_submission",
+    "queued",
+)
+
+_engine_semaphores = {}
+_engine_semaphores_lock = threading.Lock()
+_engine_rate_limiters = {}
+
+
+class _TokenBucket:
+    """每分钟最多 rate_per_minute 次的令牌桶，线程安全；取不到令牌时阻塞等待。"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.refill_per_second = self.capacity / 60.0
+        # 初始只放一个令牌，避免任务一开始就把一分钟的额度并发打满
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+
+
+def _engine_batch_limits(app, tts_engine_identifier):
+    """返回 (batch_size, concurrency, rate_per_minute)，rate_per_minute 为 None 表示不限速。"""
+    limits = {**DEFAULT_TTS_ENGINE_BATCH_LIMITS.get(
+        tts_engine_identifier, {"batch_size": 4, "concurrency": 1, "rate_per_minute": 10}
+    )}
+    limits.update(
+        (app.config.get("TTS_ENGINE_BATCH_LIMITS") or {}).get(tts_engine_identifier, {})
+    )
+    rate_per_minute = limits.get("rate_per_minute")
+    return (
+        max(1, int(limits["batch_size"])),
+        max(1, int(limits["concurrency"])),
+        float(rate_per_minute) if rate_per_minute else None,
+    )
+
+
+def _engine_rate_limiter(tts_engine_identifier, rate_per_minute):
+    """同一 worker 进程内同一引擎共享一个令牌桶；不限速时返回 None。"""
+    if not rate_per_minute:
+        return None
+    with _engine_semaphores_lock:
+        limiter = _engine_rate_limiters.get(tts_engine_identifier)
+        if limiter is None or limiter.capacity != rate_per_minute:
+            limiter = _TokenBucket(rate_per_minute)
+            _engine_rate_limiters[tts_engine_identifier] = limiter
+        return limiter
+
+
+def _engine_semaphore(tts_engine_identifier, concurrency):
+    """同一 worker 进程内同一引擎共享一个信号量，多个批量任务并行时也不超过并发上限。"""
+    with _engine_semaphores_lock:
+        semaphore = _engine_semaphores.get(tts_engine_identifier)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(concurrency)
+            _engine_semaphores[tts_engine_identifier] = semaphore
+        return semaphore
+
+
+def _synthesize_with_retry(app, job, tts_engine_identifier, tts_engine_params,
+                           pt_file_path_relative, semaphore, rate_limiter):
+    """
+    合成一句：每次调用前从引擎令牌桶取令牌，遇到 TTS_RETRYABLE_ERRORS（429、超时、代理错误）
+    时按 1、2、4…秒（上限 TTS_BATCH_RETRY_BACKOFF_MAX，带随机抖动）退避后重试，
+    最多重试 TTS_BATCH_MAX_RETRIES 次。退避期间不占用并发名额。
+    """
+    for attempt in range(TTS_BATCH_MAX_RETRIES + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            with semaphore:
+                return _synthesize_with_engine(
+                    app,
+                    tts_engine_identifier,
+                    job["text"],
+                    job["config"],
+                    tts_engine_params=tts_engine_params,
+                    pt_file_path_relative=pt_file_path_relative,
+                    log_label=f"sentence {job['sentence_id']}",
+                )
+        except TTS_RETRYABLE_ERRORS as e:
+            if attempt >= TTS_BATCH_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(TTS_BATCH_RETRY_BACKOFF_MAX, 2 ** attempt))
+            logger.warning(
+                f"[BatchSynthesis] 句子 {job['sentence_id']} 第 {attempt + 1} 次合成失败 "
+                f"(引擎: {tts_engine_identifier}): {e}，{delay:.1f} 秒后重试"
+            )
+            time.sleep(delay)
+
+
+def _run_sentence_synthesis_job(app, job, tts_engine_identifier, tts_engine_params,
+                                pt_file_path_relative, semaphore, rate_limiter=None):
+    """在线程池中合成一句并保存文件（不访问数据库），返回结果字典。"""
+    try:
+        with app.app_context():
+            audio_binary_content, mime_type, log_params = _synthesize_with_retry(
+                app,
+                job,
+                tts_engine_identifier,
+                tts_engine_params,
+                pt_file_path_relative,
+                semaphore,
+                rate_limiter,
+            )
+            if not audio_binary_content:
+                raise Exception("未能从所选的TTS引擎获取有效的音频内容")
+
+            file_extension = mimetypes.guess_extension(mime_type) or ".mp3"
+            if mime_type == "audio/wav":
+                file_extension = ".wav"
+            relative_path, file_size = _save_audio_file(
+                audio_binary_content,
+                job["training_content_id"],
+                job["sentence_id"],
+                job["version"],
+                file_extension,
+            )
+        return {
+            **job,
+            "ok": True,
+            "file_path": relative_path,
+            "file_size": file_size,
+            "voice_name": log_params.get("voice_name") or log_params.get("roleid") or "default",
+        }
+    except Exception as e:
+        logger.error(
+            f"[BatchSynthesis] 句子 {job['sentence_id']} 合成失败 (引擎: {tts_engine_identifier}): {e}",
+            exc_info=True,
+        )
+        return {**job, "ok": False, "error": str(e)}
+
+
+def _set_sentence_audio_status(sentence_ids, status):
+    if sentence_ids:
+        TtsSentence.query.filter(TtsSentence.id.in_(sentence_ids)).update(
+            {"audio_status": status}, synchronize_session=False
+        )
+
+
+def _supersede_latest_sentence_audios(sentence_ids):
+    if sentence_ids:
+        TtsAudio.query.filter(
+            TtsAudio.tts_sentence_id.in_(sentence_ids),
+            TtsAudio.is_latest_for_sentence.is_(True),
+        ).update({"is_latest_for_sentence": False}, synchronize_session=False)
+
+
+@celery_app.task(bind=True, name="tasks.batch_synthesize_audio_task", max_retries=1)
+def batch_synthesize_audio_task(
+    self,
+    final_script_id_str,
+    tts_engine_identifier="gradio_default",
+    pt_file_path_relative_for_gradio=None,
+    tts_engine_params_for_all=None,
+):
+    """
+    批量合成模式：在一个任务内按引擎批大小分组合成待生成的句子。
+
+    与 batch_generate_audio_task（每句一个子任务）相比：配置只解析一次、先批量查内容寻址缓存，
+    线程池中每个线程复用同一个引擎客户端，并受每引擎并发上限和每分钟调用次数约束，
+    429/超时等错误按与单句任务相同的策略退避重试；
+    句子状态和 TtsAudio 记录按批次批量写入，每批只提交一次、更新一次进度。
+    """
+    app = create_flask_app_for_task()
+    with app.app_context():
+        task_id = self.request.id
+        training_content = None
+        try:
+            script = TtsScript.query.get(uuid.UUID(final_script_id_str))
+            if not script or script.script_type != "final_tts_script":
+                return {"status": "Error", "message": "脚本未找到或类型不正确"}
+
+            training_content = script.training_content
+            if not training_content:
+                return {"status": "Error", "message": "脚本没有关联的培训内容"}
+
+            sentences = (
+                TtsSentence.query.filter(
+                    TtsSentence.tts_script_id == script.id,
+                    TtsSentence.audio_status.in_(BATCH_PENDING_AUDIO_STATUSES),
+                )
+                .order_by(TtsSentence.order_index)
+                .all()
+            )
+            total = len(sentences)
+            if total == 0:
+                meta_no_sentences = {
+                    "total_sentences": 0,
+                    "submitted_subtasks": 0,
+                    "succeeded_in_batch": 0,
+                    "failed_in_batch": 0,
+                    "message": "没有需要处理的句子。",
+                }
+                self.update_state(state="SUCCESS", meta=meta_no_sentences)
+                return {"status": "Success", **meta_no_sentences}
+
+            batch_size, concurrency, rate_per_minute = _engine_batch_limits(app, tts_engine_identifier)
+            logger.info(
+                f"[BatchSynthesis:{task_id}] 脚本 {script.id} 共 {total} 句待合成 "
+                f"(引擎: {tts_engine_identifier}, 批大小: {batch_size}, 并发: {concurrency}, "
+                f"限速: {rate_per_minute or '不限'}/分钟)"
+            )
+
+            sentence_ids = [sentence.id for sentence in sentences]
+            _set_sentence_audio_status(sentence_ids, "queued_for_generation")
+            training_content.status = "processing_batch_audio"
+            db.session.commit()
+
+            # 1. 一次性解析每句的生效配置、缓存键和下一个版本号
+            latest_versions = dict(
+                db.session.query(TtsAudio.tts_sentence_id, func.max(TtsAudio.version))
+                .filter(TtsAudio.tts_sentence_id.in_(sentence_ids))
+                .group_by(TtsAudio.tts_sentence_id)
+                .all()
+            )
+            jobs = []
+            for sentence in sentences:
+                config = effective_tts_config(training_content, sentence)
+                config.pop("force_regenerate", None)
+                jobs.append({
+                    "sentence_id": sentence.id,
+                    "training_content_id": training_content.id,
+                    "text": sentence.sentence_text,
+                    "config": config,
+                    "cache_key": audio_cache_key(
+                        sentence.sentence_text,
+                        tts_engine_identifier,
+                        config,
+                        engine_params=tts_engine_params_for_all,
+                        pt_file_path_relative=pt_file_path_relative_for_gradio,
+                    ),
+                    "version": (latest_versions.get(sentence.id) or 0) + 1,
+                })
+
+            # 2. 批量查内容寻址缓存，命中的句子直接复用
+            cached_by_key = tts_audio_cache.lookup_many(
+                (job["cache_key"] for job in jobs), exclude_sentence_ids=sentence_ids
+            )
+            cache_hit_jobs = [job for job in jobs if job["cache_key"] in cached_by_key]
+            jobs = [job for job in jobs if job["cache_key"] not in cached_by_key]
+            if cache_hit_jobs:
+                hit_ids = [job["sentence_id"] for job in cache_hit_jobs]
+                _supersede_latest_sentence_audios(hit_ids)
+                sentences_by_id = {sentence.id: sentence for sentence in sentences}
+                for job in cache_hit_jobs:
+                    tts_audio_cache.clone_for_sentence(
+                        cached_by_key[job["cache_key"]],
+                        sentences_by_id[job["sentence_id"]],
+                        training_content.id,
+                        version=job["version"],
+                    )
+                _set_sentence_audio_status(hit_ids, "generated")
+                db.session.commit()
+
+            succeeded = len(cache_hit_jobs)
+            failed = 0
+            processed = len(cache_hit_jobs)
+            self.update_state(
+                state="PROGRESS",
+                meta={
+                    "total_sentences": total,
+                    "submitted_subtasks": processed,
+                    "message": f"缓存命中 {len(cache_hit_jobs)} 句，开始合成其余 {len(jobs)} 句...",
+                },
+            )
+
+            # 3. 按批合成，线程池大小即该引擎的并发上限
+            semaphore = _engine_semaphore(tts_engine_identifier, concurrency)
+            rate_limiter = _engine_rate_limiter(tts_engine_identifier, rate_per_minute)
+            with ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix=f"tts-{tts_engine_identifier}"
+            ) as executor:
+                for batch_start in range(0, len(jobs), batch_size):
+                    batch = jobs[batch_start:batch_start + batch_size]
+                    _set_sentence_audio_status([job["sentence_id"] for job in batch], "generating")
+                    db.session.commit()
+
+                    results = list(executor.map(
+                        lambda job: _run_sentence_synthesis_job(
+                            app,
+                            job,
+                            tts_engine_identifier,
+                            tts_engine_params_for_all,
+                            pt_file_path_relative_for_gradio,
+                            semaphore,
+                            rate_limiter,
+                        ),
+                        batch,
+                    ))
+
+                    ok_results = [result for result in results if result["ok"]]
+                    failed_ids = [result["sentence_id"] for result in results if not result["ok"]]
+                    ok_ids = [result["sentence_id"] for result in ok_results]
+
+                    _supersede_latest_sentence_audios(ok_ids)
+                    db.session.add_all([
+                        TtsAudio(
+                            tts_sentence_id=result["sentence_id"],
+                            training_content_id=training_content.id,
+                            audio_type="sentence_audio",
+                            file_path=result["file_path"],
+                            file_size_bytes=result["file_size"],
+                            tts_engine=tts_engine_identifier,
+                            voice_name=result["voice_name"],
+                            generation_params=result["config"],
+                            cache_key=result["cache_key"],
+                            version=result["version"],
+                            is_latest_for_sentence=True,
+                        )
+                        for result in ok_results
+                    ])
+                    _set_sentence_audio_status(ok_ids, "generated")
+                    _set_sentence_audio_status(failed_ids, "error_generation")
+                    db.session.commit()
+
+                    succeeded += len(ok_ids)
+                    failed += len(failed_ids)
+                    processed += len(batch)
+                    self.update_state(
+                        state="PROGRESS",
+                        meta={
+                            "total_sentences": total,
+                            "submitted_subtasks": processed,
+                            "succeeded_in_batch": succeeded,
+                            "failed_in_batch": failed,
+                            "message": f"已合成 {processed}/{total} 句（失败 {failed}）...",
+                        },
+                    )
+
+            training_content.status = (
+                "audio_generation_complete" if failed == 0 else "partial_audio_generated"
+            )
+            db.session.commit()
+
+            final_message = (
+                f"批量合成完成。总句子数: {total}, 成功: {succeeded} (缓存复用 {len(cache_hit_jobs)}), 失败: {failed}."
+            )
+            logger.info(f"[BatchSynthesis:{task_id}] {final_message}")
+            return {
+                "status": "SUCCESS" if succeeded or not failed else "FAILURE",
+                "total_sentences": total,
+                "submitted_subtasks": processed,
+                "succeeded_in_batch": succeeded,
+                "failed_in_batch": failed,
+                "cache_hits": len(cache_hit_jobs),
                 "message": final_message,
                 "engine_used": tts_engine_identifier,
-                "sub_tasks": submitted_subtasks_info,  # <--- 在最终 meta 中包含子任务信息
+                "sub_tasks": [],
             }
-            if failed_to_submit_count > 0 and len(submitted_subtasks_info) == 0:
-                final_task_status_celery = "FAILURE"
-            else:  # 即使部分派发失败，主任务也算部分成功完成了派发
-                final_task_status_celery = "SUCCESS"
 
-            return {"status": final_task_status_celery, **final_meta}
-
-        except Exception as e_batch_init:  # 捕获批量任务初始化或早期错误
-            logger.error(
-                f"[BatchTask:{self.request.id}] 批量任务初始化失败: {e_batch_init}",
-                exc_info=True,
-            )
-            if "training_content" in locals() and training_content:
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[BatchSynthesis:{task_id}] 批量合成失败: {e}", exc_info=True)
+            if training_content:
                 training_content.status = "error_batch_processing_init"
                 db.session.commit()
-            self.update_state(state="FAILURE", meta={"error": str(e_batch_init)})
-            return {
-                "status": "Error",
-                "message": f"批量语音生成任务失败: {str(e_batch_init)}",
-            }
+            self.update_state(state="FAILURE", meta={"error": str(e)})
+            return {"status": "Error", "message": f"批量语音生成任务失败: {str(e)}"}
 
 
 @celery_app.task(bind=True, name="tasks.merge_all_audios_for_content", max_retries=1)
@@ -1320,8 +1755,6 @@ def merge_all_audios_for_content(self, training_content_id_str):
         content.status = "merging_audio"
         db.session.commit()
 
-        merged_sound = None
-        current_total_duration_ms = 0
         new_segments_data = []
 
         self.update_state(
@@ -1334,64 +1767,89 @@ def merge_all_audios_for_content(self, training_content_id_str):
             },
         )
 
+        pcm_cache = None
         try:
-            for i, audio_info in enumerate(sentence_audio_objects):
-                try:
-                    # pydub will infer format from extension, or you can specify format
-                    segment_sound = AudioSegment.from_file(audio_info["file_path"])
-                except CouldntDecodeError:
-                    logger.error(
-                        f"[MergeTask:{task_id}] Could not decode audio file: {audio_info['file_path']}. Skipping or failing."
-                    )
-                    content.status = (
-                        f'merge_failed_decode_error_sent_{audio_info["order_index"]+1}'
+            # Determine new version for the merged audio
+            latest_merged_version_obj = (
+                TtsAudio.query.with_entities(func.max(TtsAudio.version))
+                .filter_by(training_content_id=content.id, audio_type="merged_audio")
+                .scalar()
+            )
+            new_merged_version = (latest_merged_version_obj or 0) + 1
+            merged_full_path, merged_relative_path = _merged_audio_file_paths(
+                content.id, new_merged_version
+            )
+
+            # 逐句写入 ffmpeg 编码进程，一次编码出最终 MP3（128 kb/s）。
+            # 上次合并解码过的句子直接从 PCM 缓存读取，只有新生成的句子需要解码；
+            # 时间轴由每句的时长累加得到，不再反复复制已合并的整段音频。
+            pcm_cache = _sentence_pcm_cache_for_content(content.id)
+            if pcm_cache.last_merge:
+                previous_ids = set(pcm_cache.last_merge["audio_ids"])
+                changed_count = sum(
+                    1 for info in sentence_audio_objects
+                    if str(info["audio_record"].id) not in previous_ids
+                )
+                logger.info(
+                    f"[MergeTask:{task_id}] 与上次合并相比有 {changed_count}/{len(sentence_audio_objects)} 句音频发生变化。"
+                )
+            with StreamingAudioWriter(merged_full_path, bitrate="128k", pcm_cache=pcm_cache) as writer:
+                for i, audio_info in enumerate(sentence_audio_objects):
+                    try:
+                        # pydub will infer format from extension, or you can specify format
+                        start_time_ms, end_time_ms, _ = writer.append_file(
+                            audio_info["file_path"], audio_info["audio_record"].id
+                        )
+                    except (CouldntDecodeError, FileNotFoundError) as e:
+                        writer.abort()
+                        logger.error(
+                            f"[MergeTask:{task_id}] Could not decode audio file: {audio_info['file_path']} ({e}). Skipping or failing."
+                        )
+                        content.status = (
+                            f'merge_failed_decode_error_sent_{audio_info["order_index"]+1}'
+                        )
+                        db.session.commit()
+                        self.update_state(
+                            state="FAILURE",
+                            meta={
+                                "error": f'Could not decode audio for sentence order {audio_info["order_index"] + 1}'
+                            },
+                        )
+                        return {
+                            "status": "Error",
+                            "message": f'Error decoding audio for sentence {audio_info["order_index"] + 1}',
+                        }
+
+                    new_segments_data.append(
+                        {
+                            "tts_sentence_id": audio_info["sentence_id"],
+                            "original_order_index": audio_info["order_index"],
+                            "original_sentence_text_ref": audio_info["text_ref"],
+                            "start_ms": start_time_ms,
+                            "end_ms": end_time_ms,
+                            "duration_ms": end_time_ms - start_time_ms,
+                        }
                     )
-                    db.session.commit()
+
                     self.update_state(
-                        state="FAILURE",
+                        state="PROGRESS",
                         meta={
-                            "error": f'Could not decode audio for sentence order {audio_info["order_index"] + 1}'
+                            "current_step": "merging_files",
+                            "total_sentences": len(sentence_audio_objects),
+                            "merged_count": i + 1,
+                            "message": f"Merged sentence {i+1}/{len(sentence_audio_objects)}. Current duration: {writer.duration_ms / 1000:.2f}s",
                         },
                     )
-                    return {
-                        "status": "Error",
-                        "message": f'Error decoding audio for sentence {audio_info["order_index"] + 1}',
-                    }
-
-                segment_duration_ms = len(segment_sound)  # Duration in milliseconds
-
-                start_time_ms = current_total_duration_ms
-                end_time_ms = current_total_duration_ms + segment_duration_ms
-
-                new_segments_data.append(
-                    {
-                        "tts_sentence_id": audio_info["sentence_id"],
-                        "original_order_index": audio_info["order_index"],
-                        "original_sentence_text_ref": audio_info["text_ref"],
-                        "start_ms": start_time_ms,
-                        "end_ms": end_time_ms,
-                        "duration_ms": segment_duration_ms,
-                    }
-                )
-
-                if merged_sound is None:
-                    merged_sound = segment_sound
-                else:
-                    merged_sound = merged_sound + segment_sound
-
-                current_total_duration_ms = end_time_ms
 
-                self.update_state(
-                    state="PROGRESS",
-                    meta={
-                        "current_step": "merging_files",
-                        "total_sentences": len(sentence_audio_objects),
-                        "merged_count": i + 1,
-                        "message": f"Merged sentence {i+1}/{len(sentence_audio_objects)}. Current duration: {current_total_duration_ms / 1000:.2f}s",
-                    },
-                )
+            current_total_duration_ms = writer.duration_ms
+            merged_file_size = writer.file_size
+            pcm_cache.record_merge(
+                [info["audio_record"].id for info in sentence_audio_objects],
+                merged_relative_path,
+                current_total_duration_ms,
+            )
 
-            if merged_sound is None:
+            if not new_segments_data:
                 logger.warning(
                     f"[MergeTask:{task_id}] No audio segments were actually merged (e.g., empty list)."
                 )
@@ -1409,20 +1867,6 @@ def merge_all_audios_for_content(self, training_content_id_str):
                 is_latest_for_content=True,
             ).update({"is_latest_for_content": False})
 
-            # Determine new version for the merged audio
-            latest_merged_version_obj = (
-                TtsAudio.query.with_entities(func.max(TtsAudio.version))
-                .filter_by(training_content_id=content.id, audio_type="merged_audio")
-                .scalar()
-            )
-            new_merged_version = (latest_merged_version_obj or 0) + 1
-
-            # Save the merged audio file
-            # 1. 保存合并后的音频文件 (这部分逻辑不变)
-            logger.info(f"[MergeTask:{task_id}] 准备保存合并后的音频文件...")
-            merged_relative_path, merged_file_size = _save_merged_audio_file(
-                merged_sound, content.id, new_merged_version
-            )
             logger.info(
                 f"[MergeTask:{task_id}] 合并音频已保存，相对路径: {merged_relative_path}"
             )
@@ -1553,6 +1997,9 @@ def merge_all_audios_for_content(self, training_content_id_str):
                 state="FAILURE", meta={"error": str(e), "exc_type": type(e).__name__}
             )
             return {"status": "Error", "message": f"Merging process failed: {str(e)}"}
+        finally:
+            if pcm_cache is not None:
+                pcm_cache.close()
 
 def _get_slide_number(path_string):
     """
@@ -1598,20 +2045,12 @@ def analyze_video_script_task(self, synthesis_id_str):
             # 3.1 将pdf转为的图片并存储
             logger.info(f"[AnalyzeTask:{self.request.id}] 开始将PDF转换为预览图片...")
 
-            # 定义图片存储目录
-            # 使用 instance_path 确保路径在项目内，但通常不在版本控制中
-            preview_image_dir_name = "preview_images"
             # synthesis_task.ppt_pdf_path 的目录是 instance/uploads/video_synthesis/{content_id}/
+            # 图片直接按视频尺寸渲染并缓存在该目录的 slide_cache/ 下，视频合成时复用同一批图片
             base_dir = os.path.dirname(synthesis_task.ppt_pdf_path)
-            image_storage_path = os.path.join(base_dir, preview_image_dir_name)
-            os.makedirs(image_storage_path, exist_ok=True)
-
-            # 执行转换
-            images = convert_from_path(
+            image_paths = rasterize_pdf(
                 synthesis_task.ppt_pdf_path,
-                output_folder=image_storage_path,
-                fmt="jpeg",  # 使用jpeg格式以减小文件大小
-                output_file="slide_",
+                width=app.config.get("VIDEO_SLIDE_WIDTH", 1920),
             )
 
             # 获取相对路径用于URL访问
@@ -1619,14 +2058,13 @@ def analyze_video_script_task(self, synthesis_id_str):
             base_web_path = os.path.join(
                 "video_synthesis",
                 str(synthesis_task.training_content_id),
-                preview_image_dir_name,
             )
 
             # 使用新的、更健壮的辅助函数进行排序
             image_relative_paths = sorted(
                 [
-                    os.path.join(base_web_path, os.path.basename(img.filename))
-                    for img in images
+                    os.path.join(base_web_path, os.path.relpath(path, base_dir))
+                    for path in image_paths
                 ],
                 key=_get_slide_number,
             )
@@ -1743,11 +2181,12 @@ task_context = threading.local()
 class CeleryProgressLogger:
     """
     一个更健壮的自定义日志处理器，用于捕获 moviepy/ffmpeg 的进度
-    并更新 Celery 任务状态。
+    并更新 Celery 任务状态；传入 synthesis_task 时同时写 VideoSynthesis.progress。
     """
 
-    def __init__(self, task, total_duration):
+    def __init__(self, task, total_duration, synthesis_task=None):
         self.task = task
+        self.synthesis_task = synthesis_task
         self.total_duration = total_duration
         self.logger = get_task_logger(__name__)
         self.duration_regex = re.compile(r"time=(\\d{2}):(\\d{2}):(\\d{2})\\.(\\d{2})")
@@ -1764,14 +2203,7 @@ class CeleryProgressLogger:
                 mapped_progress = 46  # 音频写入阶段
             elif "building video" in line.lower():
                 mapped_progress = 48  # 视频构建阶段
-            self.task.update_state(
-                state="PROGRESS",
-                meta={
-                    "current_step": "encoding_video",
-                    "progress": mapped_progress,
-                    "message": line,
-                },
-            )
+            self._report(mapped_progress, line)
             return
         elif len(args) >= 2 and args[0] == "bar":
             line = args[1]
@@ -1793,18 +2225,26 @@ class CeleryProgressLogger:
                 percent = (processed_seconds / self.total_duration) * 100
                 mapped_progress = 50 + int((percent / 100) * 45)
                 self.last_progress = mapped_progress
-                self.task.update_state(
-                    state="PROGRESS",
-                    meta={
-                        "current_step": "encoding_video",
-                        "progress": min(mapped_progress, 95),
-                        "message": f"视频编码合成中... {int(percent)}%",
-                    },  # Removed extra backslash
-                )
+                self._report(min(mapped_progress, 95), f"视频编码合成中... {int(percent)}%")
                 self.last_update_time = current_time
             except Exception as e:
                 self.logger.warning(f"解析 FFMPEG 进度行失败: {line} - 错误: {e}")
 
+    def _report(self, progress, message):
+        if self.synthesis_task is not None:
+            _report_video_synthesis_progress(
+                self.task, self.synthesis_task, progress, "encoding_video", message
+            )
+            return
+        self.task.update_state(
+            state="PROGRESS",
+            meta={
+                "current_step": "encoding_video",
+                "progress": progress,
+                "message": message,
+            },
+        )
+
     def bars_callback(self, bar, attr, value, old_value=None):
         pass
 
@@ -1843,17 +2283,28 @@ class CeleryProgressLogger:
                     message = f"视频编码合成中... {int(percent)}%"
 
                 self.last_progress = mapped_progress
-                self.task.update_state(
-                    state="PROGRESS",
-                    meta={
-                        "current_step": "encoding_video",  # 统一阶段名
-                        "progress": min(mapped_progress, 95),
-                        "message": message,
-                    },
-                )
+                self._report(min(mapped_progress, 95), message)
                 self.last_update_time = current_time
 
 
+def _report_video_synthesis_progress(task, synthesis_task, progress, step, message, min_interval=1.0):
+    """
+    同时更新 Celery 任务状态和 VideoSynthesis.progress，前端不依赖 Celery 结果后端也能看到进度。
+    数据库写入按 min_interval 秒节流，进度到 100 时总是写入。
+    """
+    task.update_state(
+        state="PROGRESS",
+        meta={"current_step": step, "progress": progress, "message": message},
+    )
+    now = time.monotonic()
+    last_written = getattr(synthesis_task, "_progress_written_at", 0.0)
+    if progress < 100 and now - last_written < min_interval:
+        return
+    synthesis_task.progress = progress
+    db.session.commit()
+    synthesis_task._progress_written_at = now
+
+
 # --- 视频合成任务 ---<<<
 @celery_app.task(bind=True, name="tasks.synthesize_video_task")
 def synthesize_video_task(self, synthesis_id_str):
@@ -1908,29 +2359,9 @@ def synthesize_video_task(self, synthesis_id_str):
                 },
             )  # Removed extra backslash
 
-            pdf_images_dir = os.path.join(os.path.dirname(pdf_path), "images")
-            os.makedirs(pdf_images_dir, exist_ok=True)
-            images = convert_from_path(
-                pdf_path, output_folder=pdf_images_dir, fmt="png", output_file="slide_"
-            )
-
-            def get_page_number_from_filename(filename):
-                """使用正则表达式从文件名中安全地提取页码。"""
-                # 匹配 'slide_' 之后的一串或多串由连字符连接的数字中的第一个数字
-                # 例如，从 'slide_0001-01.png' 中匹配到 '0001'
-                match = re.search(r"slide_(\\d+)", os.path.basename(filename))
-                if match:
-                    return int(match.group(1))
-                # 如果上面的正则没匹配到，尝试一个更宽松的，只找数字
-                match_fallback = re.search(r"(\\d+)", os.path.basename(filename))
-                if match_fallback:
-                    return int(match_fallback.group(1))
-                # 如果完全找不到数字，返回一个极大值，让它排在最后，避免排序崩溃
-                return float("inf")
-
-            # 使用新的、更健壮的 key 函数进行排序
-            image_paths = sorted(
-                [img.filename for img in images], key=get_page_number_from_filename
+            # 与分析阶段的预览图共用缓存：PDF 未变化时不会重新渲染
+            image_paths = rasterize_pdf(
+                pdf_path, width=app.config.get("VIDEO_SLIDE_WIDTH", 1920)
             )
 
             # image_paths = sorted([img.filename for img in images], key=lambda x: int(os.path.basename(x).split('_')[1].split('.')[0]))
@@ -1945,7 +2376,7 @@ def synthesize_video_task(self, synthesis_id_str):
                 },
             )  # Removed extra backslash
 
-            # 3. 加载音频
+            # 3. 确定视频尺寸
             self.update_state(
                 state="PROGRESS",
                 meta={
@@ -1954,10 +2385,7 @@ def synthesize_video_task(self, synthesis_id_str):
                     "message": "步骤 3: 正在创建视频剪辑...",
                 },
             )  # Removed extra backslash
-            audio_clip = AudioFileClip(audio_path)
 
-            # 4. 创建视频剪辑
-            clips = []
             # 使用第一张图片来确定视频的初始尺寸
             first_image_path = image_paths[0]
             with Image.open(first_image_path) as img:
@@ -1978,14 +2406,8 @@ def synthesize_video_task(self, synthesis_id_str):
                     f"[VideoSynthTask:{self.request.id}] 视频标准尺寸确定为: {video_size}"
                 )
 
-            self.update_state(
-                state="PROGRESS",
-                meta={
-                    "current_step": "audio_loading",
-                    "message": "步骤 3: 正在加载音频...",
-                },
-            )  # Removed extra backslash
-
+            # 4. 按脚本生成每页幻灯片的显示片段
+            slide_segments = []
             for script_item in video_scripts:
                 ppt_page_num = script_item["ppt_page"]
                 time_range_str = script_item["time_range"]
@@ -2013,69 +2435,19 @@ def synthesize_video_task(self, synthesis_id_str):
                     logger.debug(
                         f"[VideoSynthTask:{task_id}]   - 处理剪辑: 页码 {ppt_page_num}, 路径 {img_path}, 时长 {duration}s"
                     )
+                    slide_segments.append(SlideSegment(img_path, duration))
 
-                    # <<<--- 关键修改：预处理图片 ---<<<
-                    # 1. 用Pillow打开图片
-                    with Image.open(img_path) as pil_img:
-                        # 2. 确保它是RGB格式 (移除alpha通道)
-                        rgb_img = pil_img.convert("RGB")
-                        # 3. 将Pillow图像对象转换为Numpy数组
-                        img_array = np.array(rgb_img)
-
-                    # 4. 使用处理后的Numpy数组创建ImageClip
-                    clip = ImageClip(img_array).set_duration(duration)
-
-                    # 5. (可选但推荐) 确保每个剪辑的尺寸都与标准尺寸一致
-                    if clip.size != video_size:
-                        clip = clip.resize(video_size)
-                    # ----------------------------------->>>
-
-                    clips.append(clip)
-
-            if not clips:
+            if not slide_segments:
                 raise ValueError("没有有效的视频剪辑可以拼接。")
 
+            # 5. 保存最终视频文件
+            synthesis_mode = app.config.get("VIDEO_SYNTHESIS_MODE", "static")
             logger.info(
-                f"[VideoSynthTask:{task_id}] 正在拼接 {len(clips)} 个视频剪辑..."
-            )
-            self.update_state(
-                state="PROGRESS",
-                meta={
-                    "current_step": "concatenation",
-                    "progress": 40,
-                    "message": f"正在拼接 {len(clips)} 个视频剪辑...",
-                },
-            )  # Removed extra backslash
-
-            final_video = concatenate_videoclips(clips, method="compose").set_audio(
-                audio_clip
+                f"[VideoSynthTask:{task_id}] 正在编码 {len(slide_segments)} 个幻灯片片段 (模式: {synthesis_mode})..."
             )
-
-            # --- 调试代码 ---
-            IS_DEBUG_MODE = False
-            DEBUG_DURATION_SECONDS = 4
-            final_video_to_write = (
-                final_video.subclip(0, DEBUG_DURATION_SECONDS)
-                if IS_DEBUG_MODE
-                else final_video
+            _report_video_synthesis_progress(
+                self, synthesis_task, 40, "encoding_video", "步骤 5: 开始视频编码..."
             )
-            # --------------
-
-            self.update_state(
-                state="PROGRESS",
-                meta={"current_step": "set_audio", "message": "正在设置音频..."},
-            )  # Removed extra backslash
-            # final_video = final_video.set_audio(audio_clip)
-
-            # 5. 保存最终视频文件
-            self.update_state(
-                state="PROGRESS",
-                meta={
-                    "current_step": "encoding_video",
-                    "progress": 50,
-                    "message": "步骤 5: 开始视频编码...",
-                },
-            )  # Removed extra backslash
             video_output_dir = os.path.join(
                 current_app.instance_path,
                 "uploads",
@@ -2086,35 +2458,43 @@ def synthesize_video_task(self, synthesis_id_str):
             video_filename = f"{uuid.uuid4().hex}_{secure_filename(synthesis_task.training_content.content_name)}.mp4"
             video_save_path = os.path.join(video_output_dir, video_filename)
 
-            # audio_fps = audio_clip.fps
-
-            # 实例化 logger，但不需要手动计算音频块数，让 moviepy 在内部处理
-            custom_logger = CeleryProgressLogger(self, final_video_to_write.duration)
-
-            # 执行写入，移除 buffersize 参数
-            final_video_to_write.write_videofile(
-                video_save_path,
-                codec="libx264",
-                audio_codec="aac",
-                # ++++++++++++++++ 关键优化 ++++++++++++++++
-                # 1. 将线程数设置为您CPU的核心数（原始为4）
-                threads=10,
-                fps=24,
-                # 2. (推荐) 使用更快的预设来减少CPU计算时间，会稍微影响画质的质量
-                #    ultrafast > superfast > veryfast > faster > fast > medium
-                #    可以先从 'fast' 或 'veryfast' 开始尝试
-                preset="fast",
-                # preset='medium',
-                logger=custom_logger,
-                ffmpeg_params=["-pix_fmt", "yuv420p"],
-                # <<<--- 移除 'buffersize=buffersize' 参数 ---<<<
-            )
+            if synthesis_mode == "moviepy":
+                # 原有路径：MoviePy 逐帧合成，进度由 CeleryProgressLogger 解析
+                custom_logger = CeleryProgressLogger(
+                    self,
+                    sum(segment.duration for segment in slide_segments),
+                    synthesis_task=synthesis_task,
+                )
+                video_duration = render_slides_with_moviepy(
+                    slide_segments,
+                    audio_path,
+                    video_save_path,
+                    video_size,
+                    progress_logger=custom_logger,
+                )
+            else:
+                def on_progress(done, total, message):
+                    # 编码阶段映射到 40-95%
+                    _report_video_synthesis_progress(
+                        self,
+                        synthesis_task,
+                        40 + int(done / total * 55),
+                        "encoding_video",
+                        message,
+                    )
 
-            logger.info(f"[VideoSynthTask:{task_id}] 视频文件写入成功！")
-            # --- 进度捕获逻辑结束 ---<<<
-            # ----------------------------------------------------->>>
+                video_duration = encode_static_slides(
+                    slide_segments,
+                    audio_path,
+                    video_save_path,
+                    video_size,
+                    fps=app.config.get("VIDEO_STATIC_FPS", 5),
+                    progress_callback=on_progress,
+                    # 片段缓存与幻灯片图片缓存放在一起，失败重试或修改脚本后只重编码变化的片段
+                    segment_cache_dir=os.path.join(os.path.dirname(pdf_path), "segment_cache"),
+                )
 
-            logger.info(f"[VideoSynthTask:{self.request.id}] 视频文件写入成功！")
+            logger.info(f"[VideoSynthTask:{task_id}] 视频文件写入成功！")
 
             # 6. 在 CourseResource 表中创建记录
             self.update_state(
@@ -2138,8 +2518,7 @@ def synthesize_video_task(self, synthesis_id_str):
                 file_type="video",
                 mime_type="video/mp4",
                 size_bytes=os.path.getsize(video_save_path),
-                # duration_seconds=float(final_video.duration),
-                duration_seconds=float(final_video_to_write.duration),
+                duration_seconds=float(video_duration),
                 uploaded_by_user_id=synthesis_task.training_content.uploaded_by_user_id,
             )
             db.session.add(new_resource)
@@ -2147,6 +2526,7 @@ def synthesize_video_task(self, synthesis_id_str):
 
             # 7. 更新 VideoSynthesis 任务状态
             synthesis_task.status = "complete"
+            synthesis_task.progress = 100
             synthesis_task.generated_resource_id = new_resource.id
             db.session.commit()
 
@@ -2236,42 +2616,65 @@ def merge_current_generated_audios_async(self, training_content_id_str):
             },
         )
 
-        merged_sound = None
         processed_count = 0
         audio_storage_base = app.config.get("TTS_AUDIO_STORAGE_PATH")
 
+        pcm_cache = None
         try:
-            for sentence, audio_record in generated_sentences_with_audio:
-                audio_file_full_path = os.path.join(
-                    audio_storage_base, audio_record.file_path
+            new_merged_version = 1
+            latest_merged = (
+                TtsAudio.query.filter_by(
+                    training_content_id=content.id, audio_type="merged_audio"
                 )
-                if not os.path.exists(audio_file_full_path):
-                    logger.warning(
-                        f"[MergeCurrentTask:{self.request.id}] 音频文件不存在: {audio_file_full_path} for sentence {sentence.id}。跳过此句。"
-                    )
-                    continue
+                .order_by(TtsAudio.version.desc())
+                .first()
+            )
+            if latest_merged:
+                new_merged_version = latest_merged.version + 1
 
-                try:
-                    # 根据文件扩展名加载音频
-                    file_ext = (
-                        os.path.splitext(audio_record.file_path)[1].lower().lstrip(".")
+            merged_full_path, merged_relative_path = _merged_audio_file_paths(
+                content.id, new_merged_version
+            )
+
+            pcm_cache = _sentence_pcm_cache_for_content(content.id)
+            merged_audio_ids = []
+            with StreamingAudioWriter(merged_full_path, bitrate="128k", pcm_cache=pcm_cache) as writer:
+                for sentence, audio_record in generated_sentences_with_audio:
+                    audio_file_full_path = os.path.join(
+                        audio_storage_base, audio_record.file_path
                     )
-                    if not file_ext:  # 如果没有扩展名，尝试根据MIME类型或默认
-                        # 这里可以添加更复杂的逻辑，例如从 audio_record.generation_params 或 mime_type 推断
-                        file_ext = "wav"  # 或 "mp3"
+                    if not os.path.exists(audio_file_full_path):
                         logger.warning(
-                            f"音频文件 {audio_record.file_path} 无扩展名, 尝试作为 {file_ext} 加载。"
+                            f"[MergeCurrentTask:{self.request.id}] 音频文件不存在: {audio_file_full_path} for sentence {sentence.id}。跳过此句。"
                         )
+                        continue
 
-                    sound_segment = AudioSegment.from_file(
-                        audio_file_full_path, format=file_ext
-                    )
+                    try:
+                        # 根据文件扩展名加载音频
+                        file_ext = (
+                            os.path.splitext(audio_record.file_path)[1].lower().lstrip(".")
+                        )
+                        if not file_ext:  # 如果没有扩展名，尝试根据MIME类型或默认
+                            # 这里可以添加更复杂的逻辑，例如从 audio_record.generation_params 或 mime_type 推断
+                            file_ext = "wav"  # 或 "mp3"
+                            logger.warning(
+                                f"音频文件 {audio_record.file_path} 无扩展名, 尝试作为 {file_ext} 加载。"
+                            )
 
-                    if merged_sound is None:
-                        merged_sound = sound_segment
-                    else:
-                        merged_sound += sound_segment
+                        writer.append_file(
+                            audio_file_full_path, audio_record.id, audio_format=file_ext
+                        )
+                    except AudioMergeError:
+                        raise  # 编码进程已中断，无法继续合并
+                    except Exception as e_segment:
+                        logger.error(
+                            f"[MergeCurrentTask:{self.request.id}] 合并句子 {sentence.id} 的音频失败: {e_segment}",
+                            exc_info=True,
+                        )
+                        # 解码失败的句子跳过，不影响其余句子的合并
+                        continue
 
+                    merged_audio_ids.append(audio_record.id)
                     processed_count += 1
                     self.update_state(
                         state="PROGRESS",
@@ -2281,17 +2684,13 @@ def merge_current_generated_audios_async(self, training_content_id_str):
                             "message": f"已合并 {processed_count}/{len(generated_sentences_with_audio)} 个音频...",
                         },
                     )
-                except Exception as e_segment:
-                    logger.error(
-                        f"[MergeCurrentTask:{self.request.id}] 合并句子 {sentence.id} 的音频失败: {e_segment}",
-                        exc_info=True,
-                    )
-                    # 可以选择是跳过这个句子还是中止整个合并
-                    # 这里选择跳过
 
-            if merged_sound is None:
+            if processed_count == 0:
                 raise Exception("未能成功合并任何音频片段。")
 
+            merged_file_size = writer.file_size
+            pcm_cache.record_merge(merged_audio_ids, merged_relative_path, writer.duration_ms)
+
             # 将旧的合并语音标记为非最新
             TtsAudio.query.filter_by(
                 training_content_id=content.id,
@@ -2299,30 +2698,12 @@ def merge_current_generated_audios_async(self, training_content_id_str):
                 is_latest_for_content=True,
             ).update({"is_latest_for_content": False})
 
-            new_merged_version = 1
-            latest_merged = (
-                TtsAudio.query.filter_by(
-                    training_content_id=content.id, audio_type="merged_audio"
-                )
-                .order_by(TtsAudio.version.desc())
-                .first()
-            )
-            if latest_merged:
-                new_merged_version = latest_merged.version + 1
-
-            # 决定合并后的文件格式，例如 MP3
-            # merged_file_extension = ".mp3"
-
-            merged_relative_path, merged_file_size = _save_merged_audio_file(
-                merged_sound, content.id, new_merged_version
-            )
-
             new_merged_audio_record = TtsAudio(
                 training_content_id=content.id,
                 audio_type="merged_audio",
                 file_path=merged_relative_path,
                 file_size_bytes=merged_file_size,
-                duration_ms=len(merged_sound),  # pydub 音频长度是毫秒
+                duration_ms=writer.duration_ms,
                 version=new_merged_version,
                 is_latest_for_content=True,
                 tts_engine="merged",  # 或记录参与合并的引擎（如果单一）
@@ -2355,6 +2736,9 @@ def merge_current_generated_audios_async(self, training_content_id_str):
                 "status": "Error",
                 "message": "合并音频时发生服务器错误: " + str(e),
             }  # Removed extra backslash
+        finally:
+            if pcm_cache is not None:
+                pcm_cache.close()
 
 
 @celery_app.task(name="tasks.reset_daily_tts_usage")
@@ -2365,44 +2749,6 @@ def reset_daily_tts_usage_task():
     logger.info("Daily TTS usage has been reset successfully.")
 
 
-# --- 辅助函数：保存合并后的音频文件 ---
-def _find_reusable_audio_info(text_to_match, training_content_id_to_match):
-    """
-    辅助函数：在指定 training_content_id 下查找具有相同文本且已生成音频的句子，
-    并返回其最新的 TtsAudio 记录的信息。
-    """
-    # 查询 TtsSentence，需要通过 join TtsScript 来过滤 training_content_id
-    reusable_sentence_with_audio = (
-        db.session.query(TtsSentence, TtsAudio)
-        .join(TtsAudio, TtsSentence.id == TtsAudio.tts_sentence_id)
-        .join(
-            TtsScript,
-            TtsSentence.tts_script_id == TtsScript.id,  # <--- 加入 TtsScript
-        )
-        .filter(
-            TtsScript.training_content_id
-            == training_content_id_to_match,  # <--- 通过 TtsScript 过滤
-            TtsSentence.sentence_text == text_to_match,
-            TtsSentence.audio_status == "generated",
-            TtsAudio.is_latest_for_sentence,
-        )
-        .order_by(TtsAudio.created_at.desc())
-        .first()
-    )
-
-    if reusable_sentence_with_audio:
-        _, audio_record = reusable_sentence_with_audio
-        return {
-            "file_path": audio_record.file_path,
-            "duration_ms": audio_record.duration_ms,
-            "file_size_bytes": audio_record.file_size_bytes,
-            "tts_engine": audio_record.tts_engine,
-            "voice_name": audio_record.voice_name,
-            "generation_params": audio_record.generation_params,
-        }
-    return None
-
-
 # 匹配拆分后的句子，看库中是否已有此音频
 @celery_app.task(bind=True, name="tasks.resplit_and_match_sentences")
 def resplit_and_match_sentences_task(self, final_tts_script_id_str):
@@ -2435,6 +2781,29 @@ def resplit_and_match_sentences_task(self, final_tts_script_id_str):
             #    这样可以确保每个脚本版本都有自己的一套句子，避免混淆。
             #    但这也意味着我们不能直接从“上一个版本”的句子复用，而是从整个 TrainingContent 下复用。
 
+            # 简化流程：基于新的脚本内容创建句子，并尝试复用音频
+            new_sentence_texts = split_script_text(final_script.content)
+
+            # 在调用任何 TTS 引擎之前批量查找可复用音频：
+            # 先按内容寻址缓存键（文本+课程默认引擎/音色/配置，跨脚本版本和课程），
+            # 未命中的再回退到本课程内同文本的已生成音频。
+            # 引擎取课程配置中的 engine，与批量合成接口的默认参数（空引擎参数、默认音色文件）一致
+            content_config = effective_tts_config(training_content)
+            key_by_text = {
+                text: audio_cache_key(text, None, content_config)
+                for text in set(new_sentence_texts)
+            }
+            cached_by_key = tts_audio_cache.lookup_many(key_by_text.values())
+            fallback_by_text = find_reusable_audios(
+                [text for text, key in key_by_text.items() if key not in cached_by_key],
+                training_content.id,
+            )
+            reusable_by_text = {
+                text: cached_by_key.get(key) or fallback_by_text.get(text)
+                for text, key in key_by_text.items()
+                if key in cached_by_key or text in fallback_by_text
+            }
+
             # 先删除当前脚本版本已有的所有句子，以便重新创建
             # 这样可以确保每个脚本版本下的句子列表是干净的
             TtsSentence.query.filter_by(tts_script_id=final_script.id).delete()
@@ -2449,61 +2818,13 @@ def resplit_and_match_sentences_task(self, final_tts_script_id_str):
             # b. 为新文本列表创建新的 TtsSentence 对象，并尝试从整个 TrainingContent 下的旧音频中复用。
             # c. （可选）删除那些在旧版本脚本中存在，但在新版本脚本中不再存在的句子（如果需要清理）。
 
-            # 简化流程：基于新的脚本内容创建句子，并尝试复用音频
-            new_sentence_texts = [
-                s.strip() for s in final_script.content.split("\n") if s.strip()
-            ]
-            if not new_sentence_texts:  # 如果换行符分割后为空，尝试用标点
-                # ... (更智能的拆分逻辑) ...
-                pass  # 保持简单
-
-            created_count = 0
-            reused_audio_count = 0
-
-            for index, text in enumerate(new_sentence_texts):
-                new_sentence = TtsSentence(
-                    tts_script_id=final_script.id,
-                    sentence_text=text,
-                    order_index=index,
-                    # audio_status 默认为 pending_generation
-                )
-                db.session.add(new_sentence)
-                db.session.flush()  # 获取 new_sentence.id
-
-                reusable_audio_info = _find_reusable_audio_info(
-                    text, training_content.id
-                )
-
-                if reusable_audio_info:
-                    new_sentence.audio_status = "generated"  # 标记为已生成
-
-                    # 创建新的 TtsAudio 记录，指向复用的文件
-                    new_audio_record = TtsAudio(
-                        tts_sentence_id=new_sentence.id,
-                        training_content_id=training_content.id,
-                        audio_type="sentence_audio",
-                        file_path=reusable_audio_info["file_path"],
-                        duration_ms=reusable_audio_info["duration_ms"],
-                        file_size_bytes=reusable_audio_info["file_size_bytes"],
-                        tts_engine=reusable_audio_info[
-                            "tts_engine"
-                        ],  # 可以记录为 "reused_from_" + original_engine
-                        voice_name=reusable_audio_info["voice_name"],
-                        generation_params=reusable_audio_info["generation_params"],
-                        version=1,  # 对于这个新句子，这是第一个（复用的）音频版本
-                        is_latest_for_sentence=True,
-                    )
-                    db.session.add(new_audio_record)
-                    reused_audio_count += 1
-                    logger.info(
-                        f"[ResplitTask:{self.request.id}] 句子 '{text[:30]}...' (新ID: {new_sentence.id}) 复用了音频: {reusable_audio_info['file_path']}"
-                    )
-
-                else:
-                    new_sentence.audio_status = "pending_generation"
-                    # logger.info(f"[ResplitTask:{self.request.id}] 句子 '{text[:30]}...' (新ID: {new_sentence.id}) 需要重新生成音频。")
-
-                created_count += 1
+            # 句子与复用的音频记录各一条批量 INSERT，与上面的删除同在一个事务中提交
+            created_count, reused_audio_count = bulk_create_sentences(
+                final_script.id,
+                training_content.id,
+                new_sentence_texts,
+                reusable_by_text,
+            )
 
             training_content.status = (
                 "pending_audio_generation"  # 或 'audio_matching_complete'
@@ -2511,12 +2832,15 @@ def resplit_and_match_sentences_task(self, final_tts_script_id_str):
             db.session.commit()
             logger.info(
                 f"[ResplitTask:{self.request.id}] 脚本 {final_script.id} 重新拆分完成。创建/更新句子数: {created_count}，复用音频数: {reused_audio_count}"
+                f"（缓存命中 {len(cached_by_key)}/{len(key_by_text)} 种文本，本进程累计 {tts_audio_cache.stats()}）"
             )
             return {
                 "status": "Success",
                 "message": f"句子已重新处理，复用音频 {reused_audio_count} 个。",
                 "created_sentences": created_count,
                 "reused_audios": reused_audio_count,
+                "cache_hits": len(cached_by_key),
+                "cache_misses": len(key_by_text) - len(cached_by_key),
             }
 
         except Exception as e:
@@ -2556,6 +2880,32 @@ def setup_periodic_tasks(sender, **kwargs):
         sync_all_contracts_task.s(),
         name="sync contracts from jinshuju every hour",
     )
+    # 把新的 start_play 播放日志汇总到 course_resource.play_count
+    sender.add_periodic_task(
+        PLAY_COUNT_AGGREGATE_INTERVAL,
+        aggregate_resource_play_counts_task.s(),
+        name="aggregate resource play counts",
+    )
+
+
+PLAY_COUNT_AGGREGATE_INTERVAL = float(os.environ.get("PLAY_COUNT_AGGREGATE_INTERVAL", "60"))
+
+
+@celery_app.task(name="tasks.aggregate_resource_play_counts")
+def aggregate_resource_play_counts_task():
+    """定时把尚未计入的 start_play 播放日志按资源汇总到 course_resource.play_count。"""
+    app = create_flask_app_for_task()
+    with app.app_context():
+        try:
+            deltas = aggregate_play_counts()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[PlayCount] 汇总播放次数失败: {e}", exc_info=True)
+            raise
+        if deltas:
+            logger.info(f"[PlayCount] {len(deltas)} 个资源新增播放 {sum(deltas.values())} 次")
+        return {"resources": len(deltas), "plays": sum(deltas.values())}
 
 
 @celery_app.task(bind=True, name="tasks.auto_check_and_extend_renewal_bills")
@@ -2823,6 +3173,114 @@ def calculate_monthly_billing_task(
             raise
 
 
+MONTHLY_BILLING_CHUNK_SIZE = 25
+
+
+@celery_app.task(bind=True, name="tasks.dispatch_monthly_billing_run")
+def dispatch_monthly_billing_run_task(
+    self, year, month, force_recalculate=False, chunk_size=MONTHLY_BILLING_CHUNK_SIZE
+):
+    """
+    月度账单批量计算的分发模式：
+    将所有 active/terminated 合同按 chunk_size 分块，以 chord 派发给
+    calculate_monthly_billing_chunk_task 并行计算，最后由
+    summarize_monthly_billing_run_task 汇总成运行报告。
+    本任务会被 chord 替换，轮询本任务ID即可拿到最终报告。
+    """
+    app = create_flask_app_for_task()
+    with app.app_context():
+        contract_ids = [
+            str(row[0])
+            for row in db.session.query(BaseContract.id)
+            .filter(BaseContract.status.in_(["active", "terminated"]))
+            .order_by(BaseContract.id)
+            .all()
+        ]
+        started_at = datetime.utcnow().isoformat()
+        logger.info(
+            f"[MonthlyBillingRun:{self.request.id}] {year}-{month} 共 {len(contract_ids)} 个合同，分块大小 {chunk_size}"
+        )
+
+        if not contract_ids:
+            return summarize_monthly_billing_run_task([], year, month, started_at)
+
+        chunks = [
+            contract_ids[i : i + chunk_size]
+            for i in range(0, len(contract_ids), chunk_size)
+        ]
+        return self.replace(
+            chord(
+                [
+                    calculate_monthly_billing_chunk_task.s(chunk, year, month, force_recalculate)
+                    for chunk in chunks
+                ],
+                summarize_monthly_billing_run_task.s(year, month, started_at),
+            )
+        )
+
+
+@celery_app.task(name="tasks.calculate_monthly_billing_chunk")
+def calculate_monthly_billing_chunk_task(contract_ids, year, month, force_recalculate=False):
+    """计算一块合同的月度账单，每个合同独立事务，返回该块的运行报告。"""
+    app = create_flask_app_for_task()
+    with app.app_context():
+        engine = BillingEngine()
+        report = engine.calculate_contracts_for_month(
+            contract_ids, year, month, force_recalculate=force_recalculate
+        )
+        logger.info(
+            f"[MonthlyBillingRun] {year}-{month} 分块完成: 成功 {len(report['succeeded'])}, "
+            f"失败 {len(report['failed'])}, 跳过 {len(report['skipped'])}"
+        )
+        return report
+
+
+@celery_app.task(name="tasks.summarize_monthly_billing_run")
+def summarize_monthly_billing_run_task(chunk_reports, year, month, started_at):
+    """chord 回调：合并各分块报告。"""
+    summary = {"succeeded": [], "failed": [], "skipped": []}
+    for report in chunk_reports:
+        for key in summary:
+            summary[key].extend(report.get(key, []))
+
+    total = sum(len(items) for items in summary.values())
+    message = (
+        f"{year}-{month} 账单计算完成: 共 {total} 个合同，成功 {len(summary['succeeded'])}，"
+        f"失败 {len(summary['failed'])}，跳过 {len(summary['skipped'])}。"
+    )
+    logger.info(f"[MonthlyBillingRun] {message}")
+    return {
+        "status": "Success" if not summary["failed"] else "PartialFailure",
+        "message": message,
+        "year": year,
+        "month": month,
+        "started_at": started_at,
+        "finished_at": datetime.utcnow().isoformat(),
+        "total": total,
+        "total_duration_ms": round(
+            sum(item.get("duration_ms", 0) for items in summary.values() for item in items), 1
+        ),
+        **summary,
+    }
+
+
+@celery_app.task(
+    name="tasks.refresh_billing_months",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def refresh_billing_months_task(months):
+    """提交后未能立即刷新的账单月度汇总，由本任务重试刷新。months 为 [[year, month], ...]。"""
+    app = create_flask_app_for_task()
+    with app.app_context():
+        for year, month in sorted(tuple(ym) for ym in months):
+            refresh_billing_month(year, month)
+        db.session.commit()
+        logger.info(f"[BillingSummary] 已刷新账单月度汇总 {months}")
+        return months
+
+
 @celery_app.task(name="tasks.generate_all_bills")
 def generate_all_bills_task(contract_id):
     app = create_flask_app_for_task()
@@ -0,0 +1,72 @@
+# backend/tests/test_audio_merge_cache.py
+"""
+单元测试：句子 PCM 缓存的容量上限、并发合并时的清理保护，以及缓存文件丢失时回退到解码源文件
+"""
+import os
+
+from backend.services.audio_merge_service import SentencePcmCache, StreamingAudioWriter
+
+
+class _Segment:
+    """只实现 SentencePcmCache 用到的属性。"""
+
+    def __init__(self, size, frame_rate=16000, channels=1):
+        self.raw_data = b"\x00" * size
+        self.frame_rate = frame_rate
+        self.channels = channels
+
+    def __len__(self):
+        return len(self.raw_data) // (2 * self.frame_rate // 1000)
+
+
+def test_put_respects_disk_cap(tmp_path):
+    with SentencePcmCache(str(tmp_path), max_bytes=1000) as cache:
+        assert cache.put("a", _Segment(400)) is not None
+        assert cache.put("b", _Segment(400)) is not None
+        assert cache.put("c", _Segment(400)) is None
+        assert cache.get("c") is None
+        assert cache.get("a", 16000, 1)["size"] == 400
+
+
+def test_prune_is_skipped_while_another_merge_uses_the_cache(tmp_path):
+    cache_dir = str(tmp_path)
+    with SentencePcmCache(cache_dir) as cache:
+        cache.put("old", _Segment(100))
+        cache.put("new", _Segment(100))
+
+        with SentencePcmCache(cache_dir) as concurrent_merge:
+            cache.record_merge(["new"], "merged_v2.mp3", 10)
+            # 另一个合并可能正在流式读取 old，不能删除
+            assert concurrent_merge.get("old") is not None
+
+        cache.record_merge(["new"], "merged_v2.mp3", 10)
+        assert cache.get("old") is None
+        assert cache.get("new") is not None
+        assert cache.last_merge["audio_ids"] == ["new"]
+
+
+def test_missing_cached_pcm_falls_back_to_decoding_source(tmp_path, monkeypatch):
+    cache = SentencePcmCache(str(tmp_path / "cache"))
+    cache.put("sentence", _Segment(320))
+    os.remove(os.path.join(cache.cache_dir, "sentence.pcm"))
+    # 元数据还在但 PCM 已被删除，get 与打开之间被删除时走同一条回退路径
+    monkeypatch.setattr(cache, "get", lambda *args: {
+        "frame_rate": 16000, "channels": 1, "duration_ms": 10, "size": 320,
+        "path": os.path.join(cache.cache_dir, "sentence.pcm"),
+    })
+
+    decoded = []
+    writer = StreamingAudioWriter(str(tmp_path / "merged.mp3"), pcm_cache=cache)
+    monkeypatch.setattr(
+        "backend.services.audio_merge_service.AudioSegment.from_file",
+        lambda path, format=None: decoded.append(path) or _Segment(320),
+    )
+    monkeypatch.setattr(writer, "_convert", lambda segment: segment)
+    monkeypatch.setattr(writer, "_write", lambda write_fn: None)
+
+    start_ms, end_ms, from_cache = writer.append_file("source.wav", "sentence")
+
+    assert decoded == ["source.wav"]
+    assert from_cache is False
+    assert (start_ms, end_ms) == (0, 10)
+    cache.close()
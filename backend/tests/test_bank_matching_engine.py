@@ -0,0 +1,191 @@
+# backend/tests/test_bank_matching_engine.py
+"""
+单元测试：银行流水自动匹配的候选打分、并列时的排序，以及匹配结果的持久化
+"""
+import uuid
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from backend.models import (
+    db,
+    BankTransaction,
+    BankTransactionStatus,
+    CustomerBill,
+    FinancialActivityLog,
+    NannyContract,
+    PaymentRecord,
+    PaymentStatus,
+    ServicePersonnel,
+    TransactionDirection,
+    User,
+)
+from backend.services.bank_matching_engine import (
+    BankMatchingEngine,
+    UnpaidBillIndex,
+    normalize_payer_name,
+)
+from backend.services.bank_statement_service import BankStatementService
+
+
+def _bill(month, day=1):
+    return SimpleNamespace(id=uuid.uuid4(), cycle_start_date=datetime(2025, month, day))
+
+
+def _engine(outstanding_by_bill, payer="张三", **kwargs):
+    index = UnpaidBillIndex()
+    for bill, outstanding in outstanding_by_bill:
+        index.add(bill, {normalize_payer_name(payer)}, outstanding)
+    return BankMatchingEngine(index, **kwargs)
+
+
+def test_normalize_payer_name_ignores_width_case_and_punctuation():
+    assert normalize_payer_name("Ｚhang San（转账）") == normalize_payer_name("zhangsan(转账)")
+    assert normalize_payer_name(" 张·三 ") == "张三"
+
+
+def test_exact_match_ranks_before_tolerance_and_is_auto_matched():
+    exact, near = _bill(1), _bill(2)
+    engine = _engine([(exact, "500.00"), (near, "500.50")])
+
+    candidates = engine.candidates_for("张三", "500.00")
+
+    assert [c["match_type"] for c in candidates] == ["exact", "tolerance"]
+    assert candidates[0]["bill_ids"] == [str(exact.id)]
+    assert candidates[1]["difference"] == "-0.50"
+    assert BankMatchingEngine.auto_match(candidates) is candidates[0]
+
+
+def test_tied_exact_matches_prefer_earlier_cycle_and_are_not_auto_matched():
+    later, earlier = _bill(3), _bill(1)
+    engine = _engine([(later, "300.00"), (earlier, "300.00")])
+
+    candidates = engine.candidates_for("张三", "300.00")
+
+    assert [c["bill_ids"] for c in candidates] == [[str(earlier.id)], [str(later.id)]]
+    assert BankMatchingEngine.auto_match(candidates) is None
+
+
+def test_combinations_prefer_fewer_bills_then_smaller_difference():
+    a, b, c = _bill(1), _bill(2), _bill(3)
+    engine = _engine([(a, "400.00"), (b, "600.00"), (c, "999.50")])
+
+    candidates = engine.candidates_for("张三", "1000.00")
+
+    # 组合精确匹配排在容差匹配之前
+    assert candidates[0]["match_type"] == "combination"
+    assert candidates[0]["bill_ids"] == [str(a.id), str(b.id)]
+    assert candidates[1]["match_type"] == "tolerance"
+    assert candidates[1]["bill_ids"] == [str(c.id)]
+
+
+def test_tolerance_candidates_sorted_by_difference():
+    far, near = _bill(1), _bill(2)
+    engine = _engine([(far, "199.00"), (near, "199.80")], tolerance=Decimal("1.00"))
+
+    candidates = engine.candidates_for("张三", "200.00")
+
+    assert [c["bill_ids"] for c in candidates] == [[str(near.id)], [str(far.id)]]
+
+
+def test_removed_bill_is_not_matched_twice():
+    bill = _bill(1)
+    engine = _engine([(bill, "100.00")])
+    engine.index.remove(bill)
+
+    assert engine.candidates_for("张三", "100.00") == []
+
+
+@pytest.fixture
+def matching_fixture(_app):
+    with _app.app_context():
+        operator = User(username="自动匹配测试员", phone_number="13900009903", password="x")
+        employee = ServicePersonnel(name="自动匹配测试育儿嫂", phone_number="13900009904")
+        db.session.add_all([operator, employee])
+        db.session.flush()
+        contract = NannyContract(
+            customer_name="自动匹配测试客户",
+            customer_name_pinyin="zidongpipeiceshikehu",
+            service_personnel_id=employee.id,
+            start_date=datetime(2025, 1, 1),
+            end_date=datetime(2025, 3, 28),
+            employee_level="6000",
+            status="active",
+        )
+        db.session.add(contract)
+        db.session.flush()
+
+        bills = []
+        for month, due in ((1, "400.00"), (2, "600.00"), (3, "300.00")):
+            bill = CustomerBill(
+                contract_id=contract.id,
+                year=2025,
+                month=month,
+                cycle_start_date=datetime(2025, month, 1),
+                cycle_end_date=datetime(2025, month, 28),
+                customer_name=contract.customer_name,
+                payment_details={},
+                calculation_details={},
+                total_due=Decimal(due),
+                total_paid=Decimal("0"),
+                payment_status=PaymentStatus.UNPAID,
+            )
+            db.session.add(bill)
+            bills.append(bill)
+
+        txns = []
+        for suffix, payer, amount in (
+            ("exact", contract.customer_name, "300.00"),
+            ("combo", contract.customer_name, "1000.00"),
+            ("none", "查无此人", "123.45"),
+        ):
+            txn = BankTransaction(
+                transaction_id=f"AUTO-MATCH-TEST-{suffix}",
+                transaction_time=datetime(2025, 3, 10, 10, 0),
+                amount=Decimal(amount),
+                payer_name=payer,
+                direction=TransactionDirection.CREDIT,
+                status=BankTransactionStatus.UNMATCHED,
+                allocated_amount=Decimal("0"),
+            )
+            db.session.add(txn)
+            txns.append(txn)
+        db.session.commit()
+        yield operator, bills, txns
+
+        bill_ids = [bill.id for bill in bills]
+        txn_ids = [txn.id for txn in txns]
+        FinancialActivityLog.query.filter(FinancialActivityLog.customer_bill_id.in_(bill_ids)).delete(synchronize_session=False)
+        PaymentRecord.query.filter(PaymentRecord.customer_bill_id.in_(bill_ids)).delete(synchronize_session=False)
+        BankTransaction.query.filter(BankTransaction.id.in_(txn_ids)).delete(synchronize_session=False)
+        CustomerBill.query.filter(CustomerBill.id.in_(bill_ids)).delete(synchronize_session=False)
+        NannyContract.query.filter_by(id=contract.id).delete()
+        ServicePersonnel.query.filter_by(id=employee.id).delete()
+        User.query.filter_by(id=operator.id).delete()
+        db.session.commit()
+
+
+def test_match_transactions_persists_payments_and_candidates(_app, matching_fixture):
+    operator, (january, february, march), (exact_txn, combo_txn, none_txn) = matching_fixture
+    with _app.app_context():
+        report = BankStatementService().match_transactions(operator.id)
+        assert "error" not in report
+
+        exact_txn = db.session.get(BankTransaction, exact_txn.id)
+        assert exact_txn.status == BankTransactionStatus.MATCHED
+        assert exact_txn.match_candidates is None
+        march = db.session.get(CustomerBill, march.id)
+        assert march.total_paid == Decimal("300.00")
+        assert march.payment_status == PaymentStatus.PAID
+        assert PaymentRecord.query.filter_by(bank_transaction_id=exact_txn.id).count() == 1
+
+        # 组合候选写回流水，状态仍为 UNMATCHED，月度视图与手动分配照常可用
+        combo_txn = db.session.get(BankTransaction, combo_txn.id)
+        assert combo_txn.status == BankTransactionStatus.UNMATCHED
+        assert combo_txn.match_candidates[0]["match_type"] == "combination"
+        assert combo_txn.match_candidates[0]["bill_ids"] == [str(january.id), str(february.id)]
+
+        none_txn = db.session.get(BankTransaction, none_txn.id)
+        assert none_txn.status == BankTransactionStatus.UNMATCHED
+        assert none_txn.match_candidates == []
@@ -0,0 +1,119 @@
+# backend/tests/test_batch_synthesis.py
+"""
+单元测试：批量合成模式的每句任务与单句任务一样，遇到限流/超时会退避重试，
+并受每引擎每分钟调用次数的令牌桶约束
+"""
+import threading
+
+import httpx
+import pytest
+
+from backend import tasks
+
+
+def _job():
+    return {
+        "sentence_id": "sentence-1",
+        "training_content_id": "content-1",
+        "text": "宝宝哭闹时先检查是否饿了。",
+        "config": {},
+        "cache_key": "key",
+        "version": 1,
+    }
+
+
+def _rate_limited():
+    request = httpx.Request("POST", "https://tts.example.com")
+    return httpx.HTTPStatusError("429", request=request, response=httpx.Response(429, request=request))
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(tasks.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_job_retries_transient_errors_then_succeeds(_app, monkeypatch, tmp_path, no_sleep):
+    calls = []
+
+    def flaky_synthesize(app, engine, text, config, **kwargs):
+        calls.append(text)
+        if len(calls) == 1:
+            raise _rate_limited()
+        if len(calls) == 2:
+            raise httpx.ReadTimeout("timeout")
+        return b"RIFF", "audio/wav", {"voice_name": "Kore"}
+
+    monkeypatch.setattr(tasks, "_synthesize_with_engine", flaky_synthesize)
+    monkeypatch.setattr(
+        tasks, "_save_audio_file",
+        lambda content, content_id, sentence_id, version, extension: (f"{sentence_id}{extension}", len(content)),
+    )
+
+    result = tasks._run_sentence_synthesis_job(
+        _app, _job(), "gemini_tts", {}, None, threading.BoundedSemaphore(1)
+    )
+
+    assert result["ok"] is True
+    assert len(calls) == 3
+    assert len(no_sleep) == 2
+    assert all(0 <= delay <= tasks.TTS_BATCH_RETRY_BACKOFF_MAX for delay in no_sleep)
+
+
+def test_job_gives_up_after_max_retries_and_does_not_retry_other_errors(_app, monkeypatch, no_sleep):
+    calls = []
+
+    def always_rate_limited(app, engine, text, config, **kwargs):
+        calls.append(text)
+        raise _rate_limited()
+
+    monkeypatch.setattr(tasks, "_synthesize_with_engine", always_rate_limited)
+    result = tasks._run_sentence_synthesis_job(
+        _app, _job(), "gemini_tts", {}, None, threading.BoundedSemaphore(1)
+    )
+    assert result["ok"] is False
+    assert len(calls) == tasks.TTS_BATCH_MAX_RETRIES + 1
+
+    calls.clear()
+
+    def broken(app, engine, text, config, **kwargs):
+        calls.append(text)
+        raise ValueError("配置错误")
+
+    monkeypatch.setattr(tasks, "_synthesize_with_engine", broken)
+    result = tasks._run_sentence_synthesis_job(
+        _app, _job(), "gemini_tts", {}, None, threading.BoundedSemaphore(1)
+    )
+    assert result["ok"] is False
+    assert len(calls) == 1
+
+
+def test_token_bucket_spaces_calls_to_the_engine_rate(monkeypatch, no_sleep):
+    clock = [1000.0]
+    monkeypatch.setattr(tasks.time, "monotonic", lambda: clock[0])
+
+    def advance(seconds):
+        no_sleep.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(tasks.time, "sleep", advance)
+    no_sleep.clear()
+
+    bucket = tasks._TokenBucket(10)
+    for _ in range(4):
+        bucket.acquire()
+
+    # 第一次立即取得，之后每 6 秒一个令牌
+    assert clock[0] - 1000.0 == pytest.approx(18.0)
+
+
+def test_engine_limits_and_rate_limiters(_app, monkeypatch):
+    monkeypatch.setitem(_app.config, "TTS_ENGINE_BATCH_LIMITS", {"tts_server": {"rate_per_minute": 30}})
+    assert tasks._engine_batch_limits(_app, "gemini_tts") == (8, 4, 10.0)
+    assert tasks._engine_batch_limits(_app, "tts_server") == (16, 4, 30.0)
+    assert tasks._engine_batch_limits(_app, "indextts")[2] is None
+
+    assert tasks._engine_rate_limiter("indextts", None) is None
+    limiter = tasks._engine_rate_limiter("gemini_tts", 10.0)
+    assert tasks._engine_rate_limiter("gemini_tts", 10.0) is limiter
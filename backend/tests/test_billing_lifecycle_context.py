@@ -0,0 +1,143 @@
+# backend/tests/test_billing_lifecycle_context.py
+"""
+单元测试：全周期账单计算（预加载上下文）与逐月计算结果一致
+"""
+import pytest
+from datetime import datetime
+from decimal import Decimal
+
+from backend.models import (
+    db,
+    NannyContract,
+    CustomerBill,
+    EmployeePayroll,
+    AttendanceRecord,
+    FinancialAdjustment,
+    ServicePersonnel,
+)
+from backend.services.billing_engine import BillingEngine
+
+
+def _create_nanny_contract(suffix):
+    employee = ServicePersonnel(
+        name=f"测试育儿嫂{suffix}",
+        phone_number=f"1390000{suffix:04d}",
+    )
+    db.session.add(employee)
+    db.session.flush()
+
+    contract = NannyContract(
+        customer_name=f"全周期测试客户{suffix}",
+        customer_name_pinyin=f"quanzhouqiceshikehu{suffix}",
+        service_personnel_id=employee.id,
+        start_date=datetime(2025, 1, 10),
+        end_date=datetime(2025, 6, 20),
+        employee_level="6000",
+        management_fee_amount=Decimal("600.00"),
+        status="active",
+    )
+    db.session.add(contract)
+    db.session.commit()
+    return contract.id, employee.id
+
+
+def _cleanup(contract_id, employee_id):
+    payroll_ids = [p.id for p in EmployeePayroll.query.filter_by(contract_id=contract_id)]
+    bill_ids = [b.id for b in CustomerBill.query.filter_by(contract_id=contract_id)]
+    FinancialAdjustment.query.filter(
+        db.or_(
+            FinancialAdjustment.customer_bill_id.in_(bill_ids),
+            FinancialAdjustment.employee_payroll_id.in_(payroll_ids),
+            FinancialAdjustment.contract_id == contract_id,
+        )
+    ).delete(synchronize_session=False)
+    AttendanceRecord.query.filter_by(contract_id=contract_id).delete()
+    EmployeePayroll.query.filter_by(contract_id=contract_id).delete()
+    CustomerBill.query.filter_by(contract_id=contract_id).delete()
+    NannyContract.query.filter_by(id=contract_id).delete()
+    ServicePersonnel.query.filter_by(id=employee_id).delete()
+    db.session.commit()
+
+
+def _details_by_cycle(contract_id):
+    bills = (
+        CustomerBill.query.filter_by(contract_id=contract_id, is_substitute_bill=False)
+        .order_by(CustomerBill.cycle_start_date)
+        .all()
+    )
+    return [
+        (bill.cycle_start_date.date(), bill.cycle_end_date.date(), bill.calculation_details)
+        for bill in bills
+    ]
+
+
+@pytest.fixture
+def twin_nanny_contracts(_app):
+    with _app.app_context():
+        first = _create_nanny_contract(1)
+        second = _create_nanny_contract(2)
+        yield first[0], second[0]
+        _cleanup(*first)
+        _cleanup(*second)
+
+
+def test_lifecycle_mode_creates_identical_bills(_app, twin_nanny_contracts):
+    month_by_month_id, lifecycle_id = twin_nanny_contracts
+    with _app.app_context():
+        engine = BillingEngine()
+        engine.generate_all_bills_for_contract(month_by_month_id, preload_context=False)
+        db.session.commit()
+        engine.generate_all_bills_for_contract(lifecycle_id, preload_context=True)
+        db.session.commit()
+
+        expected = _details_by_cycle(month_by_month_id)
+        actual = _details_by_cycle(lifecycle_id)
+
+        assert len(expected) == 6
+        assert actual == expected
+
+
+def test_lifecycle_mode_recalculation_matches_month_by_month(_app, twin_nanny_contracts):
+    contract_id, _ = twin_nanny_contracts
+    with _app.app_context():
+        engine = BillingEngine()
+        engine.generate_all_bills_for_contract(contract_id, preload_context=False)
+        db.session.commit()
+        expected = _details_by_cycle(contract_id)
+
+        engine.generate_all_bills_for_contract(contract_id, preload_context=True)
+        db.session.commit()
+
+        assert _details_by_cycle(contract_id) == expected
+        assert engine._lifecycle is None
+
+
+def test_lifecycle_context_indexes_new_and_reassigned_adjustments(_app, twin_nanny_contracts):
+    from backend.models import AdjustmentType
+    from backend.services.billing_lifecycle_context import ContractLifecycleContext
+
+    contract_id, _ = twin_nanny_contracts
+    with _app.app_context():
+        BillingEngine().generate_all_bills_for_contract(contract_id, preload_context=False)
+        db.session.commit()
+
+        context = ContractLifecycleContext.load(contract_id)
+        try:
+            first, second = context.main_bills()[:2]
+            added = FinancialAdjustment(
+                customer_bill_id=first.id,
+                adjustment_type=AdjustmentType.CUSTOMER_INCREASE,
+                amount=Decimal("10.00"),
+                description="索引测试",
+                date=first.cycle_start_date.date(),
+            )
+            db.session.add(added)
+            assert added in context.adjustments_for(bill_id=first.id)
+
+            added.customer_bill_id = second.id
+            assert added not in context.adjustments_for(bill_id=first.id)
+            context.register_adjustment(added)
+            assert added in context.adjustments_for(bill_id=second.id)
+        finally:
+            context.close()
+            db.session.rollback()
@@ -0,0 +1,185 @@
+# backend/tests/test_billing_summary.py
+"""
+单元测试：账单月度汇总随明细的各种写入路径（ORM 修改、删除、批量删除）保持一致，
+且在明细提交后另开事务刷新
+"""
+import pytest
+from datetime import datetime
+from decimal import Decimal
+
+from backend.models import (
+    db,
+    BillingMonthSummary,
+    CustomerBill,
+    FinancialAdjustment,
+    AdjustmentType,
+    NannyContract,
+    PaymentStatus,
+    ServicePersonnel,
+)
+from backend.services.billing_summary_service import (
+    _aggregate_month,
+    refresh_billing_month,
+)
+
+# 用一个不会有真实数据的年份，汇总只包含本测试的账单
+YEAR = 2091
+
+
+def _summary(month):
+    rows = BillingMonthSummary.query.filter_by(year=YEAR, month=month).all()
+    return {row.contract_type: row for row in rows}
+
+
+def _new_bill(contract, month, total_due):
+    bill = CustomerBill(
+        contract_id=contract.id,
+        year=YEAR,
+        month=month,
+        cycle_start_date=datetime(YEAR, month, 1),
+        cycle_end_date=datetime(YEAR, month, 28),
+        customer_name=contract.customer_name,
+        payment_details={},
+        calculation_details={"management_fee": "100.00"},
+        management_fee=Decimal("100.00"),
+        total_due=Decimal(total_due),
+    )
+    db.session.add(bill)
+    return bill
+
+
+@pytest.fixture
+def summary_contract(_app):
+    with _app.app_context():
+        employee = ServicePersonnel(name="汇总测试育儿嫂", phone_number="13900009902")
+        db.session.add(employee)
+        db.session.flush()
+        contract = NannyContract(
+            customer_name="汇总测试客户",
+            customer_name_pinyin="huizongceshikehu",
+            service_personnel_id=employee.id,
+            start_date=datetime(YEAR, 1, 1),
+            end_date=datetime(YEAR, 3, 28),
+            employee_level="6000",
+            status="active",
+        )
+        db.session.add(contract)
+        db.session.commit()
+        yield contract
+
+        bill_ids = [b.id for b in CustomerBill.query.filter_by(contract_id=contract.id)]
+        FinancialAdjustment.query.filter(
+            FinancialAdjustment.customer_bill_id.in_(bill_ids)
+        ).delete(synchronize_session=False)
+        CustomerBill.query.filter_by(contract_id=contract.id).delete()
+        NannyContract.query.filter_by(id=contract.id).delete()
+        ServicePersonnel.query.filter_by(id=employee.id).delete()
+        BillingMonthSummary.query.filter_by(year=YEAR).delete()
+        db.session.commit()
+
+
+def test_summary_follows_orm_changes_without_explicit_marking(_app, summary_contract):
+    with _app.app_context():
+        bill = _new_bill(summary_contract, 1, "1000.00")
+        db.session.commit()
+        assert _summary(1)["nanny"].total_due == Decimal("1000.00")
+
+        # 直接改属性（与银行流水分配/撤销的写法相同），不调用 mark_records_dirty
+        bill.total_paid = Decimal("1000.00")
+        bill.payment_status = PaymentStatus.PAID
+        db.session.commit()
+        row = _summary(1)["nanny"]
+        assert row.total_paid == Decimal("1000.00")
+        assert row.paid_bill_count == 1
+
+        db.session.add(FinancialAdjustment(
+            customer_bill_id=bill.id,
+            adjustment_type=AdjustmentType.CUSTOMER_INCREASE,
+            amount=Decimal("50.00"),
+            description="汇总测试增款",
+            date=datetime(YEAR, 1, 5).date(),
+        ))
+        db.session.commit()
+        assert _summary(1)["nanny"].customer_increase == Decimal("50.00")
+
+        # 账单改到另一个月，两个月都要刷新
+        bill.month = 2
+        db.session.commit()
+        assert "nanny" not in _summary(1)
+        assert _summary(2)["nanny"].bill_count == 1
+
+
+def test_summary_follows_orm_and_bulk_deletes(_app, summary_contract):
+    with _app.app_context():
+        first = _new_bill(summary_contract, 3, "300.00")
+        db.session.commit()
+        _new_bill(summary_contract, 1, "100.00")
+        db.session.commit()
+
+        db.session.delete(first)
+        db.session.commit()
+        assert "nanny" not in _summary(3)
+
+        CustomerBill.query.filter_by(contract_id=summary_contract.id).delete()
+        db.session.commit()
+        assert "nanny" not in _summary(1)
+
+
+def test_refresh_matches_fresh_aggregate(_app, summary_contract):
+    with _app.app_context():
+        _new_bill(summary_contract, 1, "100.00")
+        db.session.commit()
+        rows = refresh_billing_month(YEAR, 1)
+        db.session.commit()
+        assert rows == _aggregate_month(db.session, YEAR, 1)
+        assert _summary(1)["nanny"].bill_count == 1
+
+
+def test_refresh_runs_after_commit_in_its_own_transaction(_app, summary_contract, monkeypatch):
+    from backend.services import billing_summary_service
+
+    seen = []
+    refresh = billing_summary_service.refresh_billing_month
+
+    def spying_refresh(year, month, session=None):
+        # 刷新时明细已提交：另开连接也能看到；且不在业务请求的会话中
+        with db.engine.connect() as connection:
+            committed = connection.execute(
+                db.select(db.func.count()).select_from(CustomerBill.__table__)
+                .where(CustomerBill.__table__.c.contract_id == summary_contract.id)
+            ).scalar()
+        seen.append((year, month, committed, session is db.session()))
+        return refresh(year, month, session=session)
+
+    monkeypatch.setattr(billing_summary_service, "refresh_billing_month", spying_refresh)
+    with _app.app_context():
+        _new_bill(summary_contract, 1, "100.00")
+        db.session.commit()
+
+        assert seen == [(YEAR, 1, 1, False)]
+        assert _summary(1)["nanny"].bill_count == 1
+
+
+def test_failed_refresh_keeps_the_commit_and_hands_months_to_celery(_app, summary_contract, monkeypatch):
+    from backend import tasks
+    from backend.services import billing_summary_service
+
+    def failing_refresh(year, month, session=None):
+        raise RuntimeError("汇总刷新失败")
+
+    queued = []
+    monkeypatch.setattr(billing_summary_service, "refresh_billing_month", failing_refresh)
+    monkeypatch.setattr(tasks.refresh_billing_months_task, "delay", queued.append)
+    with _app.app_context():
+        _new_bill(summary_contract, 2, "200.00")
+        db.session.commit()
+
+        assert CustomerBill.query.filter_by(contract_id=summary_contract.id, month=2).count() == 1
+        assert queued == [[[YEAR, 2]]]
+
+    # 后台任务重试刷新
+    monkeypatch.undo()
+    monkeypatch.setattr(tasks, "create_flask_app_for_task", lambda: _app)
+    assert tasks.refresh_billing_months_task.run([[YEAR, 2]]) == [[YEAR, 2]]
+    with _app.app_context():
+        assert _summary(2)["nanny"].total_due == Decimal("200.00")
@@ -0,0 +1,237 @@
+# backend/tests/test_exam_paper_cache.py
+"""
+单元测试：试卷编译缓存与数据库保持一致——判分用的答案总是当前版本，
+其他进程的修改通过版本戳失效，本进程的修改通过 invalidate_exam_paper 立即失效
+"""
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from backend.db import get_db_connection
+from backend.models import (
+    db,
+    Answer,
+    ExamPaper,
+    ExamPaperQuestion,
+    KnowledgePoint,
+    Option,
+    Question,
+    TrainingCourse,
+)
+from backend.services import exam_paper_cache
+from backend.services.exam_paper_cache import (
+    answer_key_for_paper,
+    answer_key_for_questions,
+    candidate_paper,
+    grade_answer,
+    invalidate_exam_paper,
+    paper_detail,
+    paper_questions,
+)
+
+
+def _query(fn, *args):
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return fn(cur, *args)
+
+
+def _execute_elsewhere(sql, params):
+    """用单独的连接直接改库，模拟另一个进程的编辑（不会调用 invalidate_exam_paper）。"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+
+
+@pytest.fixture
+def exam_paper(_app):
+    with _app.app_context():
+        invalidate_exam_paper()
+        course = TrainingCourse(course_name="试卷缓存测试课程")
+        db.session.add(course)
+        db.session.flush()
+        point = KnowledgePoint(course_id=course.id, point_name="试卷缓存测试知识点")
+        db.session.add(point)
+        db.session.flush()
+
+        single = Question(knowledge_point_id=point.id, question_type="单选题", question_text="缓存单选题")
+        multiple = Question(knowledge_point_id=point.id, question_type="多选题", question_text="缓存多选题")
+        db.session.add_all([single, multiple])
+        db.session.flush()
+        options = {
+            "single_a": Option(question_id=single.id, option_text="甲", is_correct=True),
+            "single_b": Option(question_id=single.id, option_text="乙", is_correct=False),
+            "multiple_a": Option(question_id=multiple.id, option_text="丙", is_correct=True),
+            "multiple_b": Option(question_id=multiple.id, option_text="丁", is_correct=True),
+        }
+        db.session.add_all(options.values())
+        db.session.add(Answer(question_id=single.id, explanation="旧解析"))
+
+        paper = ExamPaper(title="试卷缓存测试")
+        db.session.add(paper)
+        db.session.flush()
+        db.session.add_all([
+            ExamPaperQuestion(exam_paper_id=paper.id, question_id=single.id),
+            ExamPaperQuestion(exam_paper_id=paper.id, question_id=multiple.id),
+        ])
+        db.session.commit()
+        yield paper, single, multiple, options
+
+        db.session.rollback()
+        ExamPaper.query.filter_by(id=paper.id).delete()
+        TrainingCourse.query.filter_by(id=course.id).delete()
+        db.session.commit()
+        invalidate_exam_paper()
+
+
+def test_answer_key_matches_uncached_query(_app, exam_paper):
+    paper, single, multiple, options = exam_paper
+    with _app.app_context():
+        cached = _query(answer_key_for_paper, paper.id)
+        fresh = _query(answer_key_for_questions, [str(single.id), str(multiple.id)])
+
+        assert cached.keys() == fresh.keys() == {str(single.id), str(multiple.id)}
+        for question_id, row in fresh.items():
+            assert cached[question_id]["correct_option_set"] == row["correct_option_set"]
+            assert cached[question_id]["explanation"] == row["explanation"]
+
+        single_key = cached[str(single.id)]
+        assert grade_answer(single_key, [str(options["single_a"].id)]) == (True, 1)
+        assert grade_answer(single_key, [str(options["single_b"].id)]) == (False, 0)
+        multiple_key = cached[str(multiple.id)]
+        both = [str(options["multiple_a"].id), str(options["multiple_b"].id)]
+        assert grade_answer(multiple_key, both) == (True, 2)
+        assert grade_answer(multiple_key, both[:1]) == (False, 0)
+
+
+def test_answer_key_never_grades_with_stale_answers(_app, exam_paper, monkeypatch):
+    paper, single, _, options = exam_paper
+    # 即使版本核对间隔很长，判分前也必须核对版本
+    monkeypatch.setattr(exam_paper_cache, "STAMP_CHECK_INTERVAL", 3600)
+    with _app.app_context():
+        before = _query(answer_key_for_paper, paper.id)[str(single.id)]
+        assert before["correct_option_set"] == {str(options["single_a"].id)}
+
+        # 另一个进程把正确答案改成乙
+        _execute_elsewhere(
+            "UPDATE option SET is_correct = (id = %s), updated_at = now() WHERE question_id = %s",
+            (str(options["single_b"].id), str(single.id)),
+        )
+        after = _query(answer_key_for_paper, paper.id)[str(single.id)]
+        assert after["correct_option_set"] == {str(options["single_b"].id)}
+        assert grade_answer(after, [str(options["single_a"].id)]) == (False, 0)
+
+        # 解析修改同样可见
+        _execute_elsewhere(
+            "UPDATE answer SET explanation = '新解析', updated_at = now() WHERE question_id = %s",
+            (str(single.id),),
+        )
+        assert _query(answer_key_for_paper, paper.id)[str(single.id)]["explanation"] == "新解析"
+
+
+def test_removed_question_and_deleted_paper_invalidate_the_answer_key(_app, exam_paper):
+    paper, single, multiple, _ = exam_paper
+    with _app.app_context():
+        assert len(_query(answer_key_for_paper, paper.id)) == 2
+
+        _execute_elsewhere(
+            "DELETE FROM exampaperquestion WHERE exam_paper_id = %s AND question_id = %s",
+            (str(paper.id), str(multiple.id)),
+        )
+        assert set(_query(answer_key_for_paper, paper.id)) == {str(single.id)}
+
+        _execute_elsewhere("DELETE FROM exampaper WHERE id = %s", (str(paper.id),))
+        assert _query(answer_key_for_paper, paper.id) == {}
+        assert _query(candidate_paper, paper.id) is None
+
+
+def test_views_follow_stamp_interval_and_local_invalidation(_app, exam_paper, monkeypatch):
+    paper, single, _, options = exam_paper
+    monkeypatch.setattr(exam_paper_cache, "STAMP_CHECK_INTERVAL", 3600)
+    with _app.app_context():
+        first = _query(candidate_paper, paper.id)
+        texts = {o["content"] for q in first["questions"]["single"] for o in q["options"]}
+        assert texts == {"甲", "乙"}
+        # 考生视图不含正确答案
+        assert all("is_correct" not in o for q in first["questions"]["single"] for o in q["options"])
+
+        _execute_elsewhere(
+            "UPDATE option SET option_text = '甲改', updated_at = now() WHERE id = %s",
+            (str(options["single_a"].id),),
+        )
+        # 核对间隔内，其他进程的修改暂不可见（考生视图允许这段延迟）
+        assert _query(candidate_paper, paper.id) is first
+
+        # 本进程的编辑接口会调用 invalidate_exam_paper，立即可见
+        invalidate_exam_paper(paper.id)
+        refreshed = _query(candidate_paper, paper.id)
+        texts = {o["content"] for q in refreshed["questions"]["single"] for o in q["options"]}
+        assert texts == {"甲改", "乙"}
+
+        # 间隔到期后重新核对版本，其他进程的修改同样可见
+        _execute_elsewhere(
+            "UPDATE option SET option_text = '乙改', updated_at = now() WHERE id = %s",
+            (str(options["single_b"].id),),
+        )
+        monkeypatch.setattr(exam_paper_cache, "STAMP_CHECK_INTERVAL", 0)
+        detail = _query(paper_questions, paper.id)
+        single_detail = next(q for q in detail if str(q["id"]) == str(single.id))
+        assert {o["option_text"] for o in single_detail["options"]} == {"甲改", "乙改"}
+
+
+def test_grading_sees_orm_edits_and_questions_outside_the_paper(_app, exam_paper):
+    paper, single, multiple, options = exam_paper
+    with _app.app_context():
+        assert _query(answer_key_for_paper, paper.id)[str(single.id)]["knowledge_point_name"] == "试卷缓存测试知识点"
+
+        # 编辑接口的写法：ORM 修改，updated_at 由 onupdate 刷新
+        point = db.session.get(KnowledgePoint, single.knowledge_point_id)
+        point.point_name = "改名后的知识点"
+        db.session.get(Option, options["multiple_b"].id).is_correct = False
+        db.session.commit()
+
+        answer_key = _query(answer_key_for_paper, paper.id)
+        assert answer_key[str(single.id)]["knowledge_point_name"] == "改名后的知识点"
+        assert answer_key[str(multiple.id)]["correct_option_set"] == {str(options["multiple_a"].id)}
+        assert grade_answer(answer_key[str(multiple.id)], [str(options["multiple_a"].id)]) == (True, 2)
+
+        # 提交了不在试卷中的题目时，单独查询其答案
+        db.session.query(ExamPaperQuestion).filter_by(
+            exam_paper_id=paper.id, question_id=multiple.id
+        ).delete()
+        db.session.commit()
+        assert str(multiple.id) not in _query(answer_key_for_paper, paper.id)
+        outside = _query(answer_key_for_questions, [str(multiple.id)])
+        assert outside[str(multiple.id)]["correct_option_set"] == {str(options["multiple_a"].id)}
+
+
+def test_course_rename_reaches_cached_views(_app, exam_paper, monkeypatch):
+    paper, single, _, _ = exam_paper
+    monkeypatch.setattr(exam_paper_cache, "STAMP_CHECK_INTERVAL", 3600)
+    with _app.app_context():
+        course_id = db.session.get(KnowledgePoint, single.knowledge_point_id).course_id
+        _execute_elsewhere(
+            "INSERT INTO exampapercourse (exam_paper_id, course_id) VALUES (%s, %s)",
+            (str(paper.id), str(course_id)),
+        )
+        invalidate_exam_paper(paper.id)
+        assert [c["name"] for c in _query(candidate_paper, paper.id)["exam"]["courses"]] == ["试卷缓存测试课程"]
+        assert _query(paper_detail, paper.id)["course_names"] == ["试卷缓存测试课程"]
+
+        # 与 update_course 接口相同的语句：改名同时刷新 updated_at
+        rename = """
+            UPDATE trainingcourse
+            SET course_name = %s, age_group = %s, description = %s, updated_at = NOW()
+            WHERE id = %s
+        """
+        _execute_elsewhere(rename, ("改名后的课程", "", "", str(course_id)))
+        # 本进程的接口提交后调用 invalidate_exam_paper()，立即可见
+        invalidate_exam_paper()
+        assert [c["name"] for c in _query(candidate_paper, paper.id)["exam"]["courses"]] == ["改名后的课程"]
+        assert _query(paper_detail, paper.id)["course_names"] == ["改名后的课程"]
+
+        # 其他进程的改名通过 updated_at 版本戳在核对间隔到期后可见
+        _execute_elsewhere(rename, ("再次改名的课程", "", "", str(course_id)))
+        monkeypatch.setattr(exam_paper_cache, "STAMP_CHECK_INTERVAL", 0)
+        assert [c["name"] for c in _query(candidate_paper, paper.id)["exam"]["courses"]] == ["再次改名的课程"]
+        detail = _query(paper_questions, paper.id)
+        assert {q["course_name"] for q in detail} == {"再次改名的课程"}
@@ -0,0 +1,197 @@
+# backend/tests/test_invoice_balances.py
+"""
+回归测试：批量发票余额计算 (calculate_invoice_balances) 与改造前逐张计算的结果一致
+"""
+import pytest
+from datetime import date, datetime, timezone
+from decimal import Decimal as D
+
+from backend.models import (
+    db,
+    NannyContract,
+    CustomerBill,
+    InvoiceRecord,
+    ServicePersonnel,
+)
+from backend.services.billing_engine import BillingEngine
+
+
+def _baseline_invoice_balance(target_bill):
+    """改造前 calculate_invoice_balance 的逐张实现，作为对照。"""
+    if target_bill.is_substitute_bill:
+        current_management_fee = D((target_bill.calculation_details or {}).get('management_fee', '0'))
+        invoiced_this_period = sum((D(invoice.amount) for invoice in target_bill.invoices), D(0)).quantize(D("0.01"))
+        total_invoiceable_amount = current_management_fee if target_bill.invoice_needed else D(0)
+        remaining_un_invoiced = (total_invoiceable_amount - invoiced_this_period).quantize(D("0.01"))
+        return {
+            "current_period_charges": str(current_management_fee),
+            "total_carried_forward": "0.00",
+            "total_invoiceable_amount": str(total_invoiceable_amount),
+            "invoiced_this_period": str(invoiced_this_period),
+            "remaining_un_invoiced": str(remaining_un_invoiced),
+            "invoice_records": [inv.to_dict() for inv in target_bill.invoices],
+            "carried_forward_breakdown": [],
+            "auto_invoice_needed": target_bill.invoice_needed,
+        }
+
+    current_management_fee = D((target_bill.calculation_details or {}).get('management_fee', '0'))
+    current_management_fee = current_management_fee.quantize(D("1"))
+
+    historical_bills = (
+        CustomerBill.query.filter(
+            CustomerBill.contract_id == target_bill.contract_id,
+            CustomerBill.cycle_start_date < target_bill.cycle_start_date,
+            CustomerBill.is_substitute_bill.is_(False),
+        )
+        .order_by(CustomerBill.cycle_start_date)
+        .all()
+    )
+
+    total_historical_fees_due = D(0)
+    total_historical_invoiced = D(0)
+    for bill in historical_bills:
+        if bill.invoice_needed:
+            total_historical_fees_due += D((bill.calculation_details or {}).get('management_fee', '0'))
+            total_historical_invoiced += sum((D(invoice.amount) for invoice in bill.invoices), D(0))
+
+    total_carried_forward = max(total_historical_fees_due - total_historical_invoiced, D(0)).quantize(D("0.01"))
+
+    carried_forward_breakdown = []
+    if total_carried_forward > 0:
+        for bill in historical_bills:
+            if bill.invoice_needed:
+                fee = D((bill.calculation_details or {}).get('management_fee', '0'))
+                unpaid_balance = fee - sum((D(invoice.amount) for invoice in bill.invoices), D(0))
+                if unpaid_balance > 0:
+                    carried_forward_breakdown.append({
+                        "month": f"{bill.year}-{str(bill.month).zfill(2)}",
+                        "unpaid_amount": str(unpaid_balance.quantize(D("0.01"))),
+                    })
+
+    invoiced_this_period = sum((D(invoice.amount) for invoice in target_bill.invoices), D(0)).quantize(D("0.01"))
+    should_be_needed = target_bill.invoice_needed or (total_carried_forward > 0)
+    total_invoiceable_amount = current_management_fee.quantize(D("1")) if should_be_needed else D(0)
+    remaining_un_invoiced = (total_carried_forward + total_invoiceable_amount).quantize(D("0.01"))
+
+    return {
+        "current_period_charges": str(current_management_fee),
+        "total_carried_forward": str(total_carried_forward),
+        "total_invoiceable_amount": str(total_invoiceable_amount),
+        "invoiced_this_period": str(invoiced_this_period),
+        "remaining_un_invoiced": str(remaining_un_invoiced),
+        "invoice_records": [inv.to_dict() for inv in target_bill.invoices],
+        "carried_forward_breakdown": carried_forward_breakdown,
+        "auto_invoice_needed": should_be_needed,
+    }
+
+
+def _add_bill(contract, month, fee, invoice_needed=True, is_substitute_bill=False):
+    bill = CustomerBill(
+        contract_id=contract.id,
+        year=2025,
+        month=month,
+        cycle_start_date=datetime(2025, month, 1 if not is_substitute_bill else 10),
+        cycle_end_date=datetime(2025, month, 28),
+        customer_name=contract.customer_name,
+        payment_details={},
+        calculation_details={"management_fee": fee},
+        management_fee=D(fee),
+        invoice_needed=invoice_needed,
+        is_substitute_bill=is_substitute_bill,
+    )
+    db.session.add(bill)
+    db.session.flush()
+    return bill
+
+
+def _add_invoice(bill, amount, created_at):
+    db.session.add(InvoiceRecord(
+        customer_bill_id=bill.id,
+        amount=D(amount),
+        issue_date=date(2025, bill.month, 15),
+        created_at=created_at,
+    ))
+
+
+@pytest.fixture
+def invoiced_contract(_app):
+    with _app.app_context():
+        employee = ServicePersonnel(name="发票测试育儿嫂", phone_number="13900009901")
+        db.session.add(employee)
+        db.session.flush()
+        contract = NannyContract(
+            customer_name="发票余额测试客户",
+            customer_name_pinyin="fapiaoyuerceshikehu",
+            service_personnel_id=employee.id,
+            start_date=datetime(2025, 1, 1),
+            end_date=datetime(2025, 3, 28),
+            employee_level="6000",
+            management_fee_amount=D("600.00"),
+            status="active",
+        )
+        db.session.add(contract)
+        db.session.flush()
+
+        january = _add_bill(contract, 1, "600.00")
+        february = _add_bill(contract, 2, "600.00")
+        march = _add_bill(contract, 3, "600.00")
+        substitute = _add_bill(contract, 2, "150.00", is_substitute_bill=True)
+
+        # 同一时间录入的两张发票，顺序只能靠 id 决定
+        same_moment = datetime(2025, 1, 20, 9, 0, tzinfo=timezone.utc)
+        _add_invoice(january, "200.00", same_moment)
+        _add_invoice(january, "100.00", same_moment)
+        _add_invoice(february, "600.00", datetime(2025, 2, 20, 9, 0, tzinfo=timezone.utc))
+        _add_invoice(substitute, "50.00", datetime(2025, 2, 21, 9, 0, tzinfo=timezone.utc))
+        db.session.commit()
+
+        bill_ids = [january.id, february.id, march.id, substitute.id]
+        yield bill_ids
+
+        InvoiceRecord.query.filter(InvoiceRecord.customer_bill_id.in_(bill_ids)).delete(synchronize_session=False)
+        CustomerBill.query.filter(CustomerBill.id.in_(bill_ids)).delete(synchronize_session=False)
+        NannyContract.query.filter_by(id=contract.id).delete()
+        ServicePersonnel.query.filter_by(id=employee.id).delete()
+        db.session.commit()
+
+
+def test_bulk_invoice_balances_match_baseline(_app, invoiced_contract):
+    with _app.app_context():
+        bills = CustomerBill.query.filter(CustomerBill.id.in_(invoiced_contract)).all()
+        expected = {str(bill.id): _baseline_invoice_balance(bill) for bill in bills}
+        db.session.expire_all()
+
+        engine = BillingEngine()
+        bulk = engine.calculate_invoice_balances(
+            CustomerBill.query.filter(CustomerBill.id.in_(invoiced_contract)).all()
+        )
+        single = {str(bill_id): engine.calculate_invoice_balance(bill_id) for bill_id in invoiced_contract}
+
+        assert bulk == expected
+        assert single == expected
+
+
+def test_invoice_balance_values_and_order(_app, invoiced_contract):
+    january_id, february_id, march_id, substitute_id = invoiced_contract
+    with _app.app_context():
+        engine = BillingEngine()
+
+        january = engine.calculate_invoice_balance(january_id)
+        assert january["total_carried_forward"] == "0.00"
+        assert january["invoiced_this_period"] == "300.00"
+        assert january["remaining_un_invoiced"] == "600.00"
+        invoices = InvoiceRecord.query.filter_by(customer_bill_id=january_id).all()
+        assert [r["id"] for r in january["invoice_records"]] == [
+            str(inv.id) for inv in sorted(invoices, key=lambda inv: (inv.created_at, inv.id))
+        ]
+
+        march = engine.calculate_invoice_balance(march_id)
+        assert march["total_carried_forward"] == "300.00"
+        assert march["carried_forward_breakdown"] == [{"month": "2025-01", "unpaid_amount": "300.00"}]
+        assert march["total_invoiceable_amount"] == "600"
+        assert march["remaining_un_invoiced"] == "900.00"
+
+        substitute = engine.calculate_invoice_balance(substitute_id)
+        assert substitute["total_carried_forward"] == "0.00"
+        assert substitute["invoiced_this_period"] == "50.00"
+        assert substitute["remaining_un_invoiced"] == "100.00"
@@ -0,0 +1,98 @@
+# backend/tests/test_payer_resolution_cache.py
+"""
+单元测试：付款人解析缓存在合同/别名变更后按合同局部刷新，并通过 Redis 版本号通知其它进程
+"""
+import pytest
+import redis
+from datetime import datetime
+
+from backend.models import db, NannyContract, PayerAlias, ServicePersonnel, User
+from backend.redis_client import get_redis
+from backend.services import payer_resolution_cache as cache_module
+from backend.services.payer_resolution_cache import PayerResolutionCache, payer_resolution_cache
+
+
+@pytest.fixture
+def cached_contract(_app):
+    with _app.app_context():
+        operator = User(username="付款人缓存测试员", phone_number="13900009905", password="x")
+        employee = ServicePersonnel(name="付款人缓存测试育儿嫂", phone_number="13900009906")
+        db.session.add_all([operator, employee])
+        db.session.flush()
+        contract = NannyContract(
+            customer_name="缓存测试客户甲",
+            customer_name_pinyin="huancunceshikehujia",
+            service_personnel_id=employee.id,
+            start_date=datetime(2025, 1, 1),
+            end_date=datetime(2025, 6, 30),
+            employee_level="6000",
+            status="active",
+        )
+        db.session.add(contract)
+        db.session.commit()
+        yield contract, operator
+
+        PayerAlias.query.filter_by(contract_id=contract.id).delete()
+        NannyContract.query.filter_by(id=contract.id).delete()
+        ServicePersonnel.query.filter_by(id=employee.id).delete()
+        User.query.filter_by(id=operator.id).delete()
+        db.session.commit()
+
+
+def _count_full_loads(monkeypatch):
+    loads = []
+    original = cache_module._Snapshot.load.__func__
+
+    def counting_load(cls):
+        loads.append(1)
+        return original(cls)
+
+    monkeypatch.setattr(cache_module._Snapshot, "load", classmethod(counting_load))
+    return loads
+
+
+def test_local_changes_refresh_only_affected_contracts(_app, cached_contract, monkeypatch):
+    contract, operator = cached_contract
+    with _app.app_context():
+        assert payer_resolution_cache.resolve_payer("缓存测试客户甲").contract_ids == [contract.id]
+        loads = _count_full_loads(monkeypatch)
+
+        contract.customer_name = "缓存测试客户乙"
+        db.session.commit()
+        assert not payer_resolution_cache.resolve_payer("缓存测试客户甲")
+        resolution = payer_resolution_cache.resolve_payer("缓存测试客户乙")
+        assert resolution.contract_ids == [contract.id]
+        assert resolution.matched_by == "name"
+
+        db.session.add(PayerAlias(
+            payer_name="缓存测试代付人",
+            contract_id=contract.id,
+            created_by_user_id=operator.id,
+        ))
+        db.session.commit()
+        resolution = payer_resolution_cache.resolve_payer("缓存测试代付人")
+        assert resolution.contract_ids == [contract.id]
+        assert resolution.matched_by == "alias"
+        assert contract.id in payer_resolution_cache.search_contract_ids("缓存测试客户乙")
+
+        # 只局部刷新，没有重建整个快照
+        assert loads == []
+
+
+def test_other_process_sees_changes_through_redis_version(_app, cached_contract):
+    contract, _ = cached_contract
+    try:
+        get_redis().ping()
+    except redis.RedisError:
+        pytest.skip("Redis 不可用")
+
+    with _app.app_context():
+        # 另一个实例模拟其它 worker 进程中的缓存
+        other = PayerResolutionCache(version_check_interval=0)
+        assert other.resolve_payer("缓存测试客户甲").contract_ids == [contract.id]
+
+        contract.customer_name = "缓存测试客户丙"
+        db.session.commit()
+
+        assert not other.resolve_payer("缓存测试客户甲")
+        assert other.resolve_payer("缓存测试客户丙").contract_ids == [contract.id]
@@ -0,0 +1,161 @@
+# backend/tests/test_play_events.py
+"""
+单元测试：播放事件——批内事件保留先后顺序，非法事件在写入前被拒绝，
+日志提交后立即对所有读者可见，play_count 由定时汇总累加且不重复计数
+"""
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from backend.models import (
+    db,
+    CourseResource,
+    TrainingCourse,
+    User,
+    UserResourcePlayLog,
+)
+from backend.services.play_events import (
+    aggregate_play_counts,
+    normalize_play_events,
+    record_play_events,
+    resolve_played_at,
+    resource_play_counts,
+)
+
+RECEIVED_AT = datetime(2026, 3, 1, 8, 0, 0, tzinfo=timezone.utc)
+
+
+def _event(event_type="progress", **extra):
+    return {"session_id": "s1", "event_type": event_type, **extra}
+
+
+def test_events_without_client_time_keep_their_batch_order():
+    played_at = resolve_played_at([_event("start_play"), _event(), _event("pause")], RECEIVED_AT)
+
+    assert played_at == sorted(played_at)
+    assert len(set(played_at)) == 3
+    assert played_at[-1] == RECEIVED_AT
+
+
+def test_client_time_and_monotonic_offset_are_used_and_clamped():
+    played_at = resolve_played_at(
+        [
+            _event(played_at=(RECEIVED_AT - timedelta(seconds=30)).isoformat()),
+            _event(elapsed_ms=5000),
+            # 客户端时钟超前 / 严重滞后
+            _event(played_at=(RECEIVED_AT + timedelta(hours=1)).isoformat()),
+            _event(played_at=int((RECEIVED_AT - timedelta(days=2)).timestamp() * 1000)),
+        ],
+        RECEIVED_AT,
+    )
+
+    assert played_at[0] == RECEIVED_AT - timedelta(seconds=30)
+    assert played_at[1] == RECEIVED_AT - timedelta(seconds=5)
+    assert played_at[2] == RECEIVED_AT
+    assert played_at[3] == RECEIVED_AT - timedelta(seconds=600)
+
+    with pytest.raises(ValueError):
+        resolve_played_at([_event(played_at="昨天")], RECEIVED_AT)
+
+
+@pytest.mark.parametrize(
+    "bad_event",
+    [
+        {"session_id": "s" * 101, "event_type": "progress"},
+        {"session_id": "s1", "event_type": "e" * 51},
+        {"session_id": "s1"},
+        {"session_id": ["s1"], "event_type": "progress"},
+        _event(watch_time_seconds="十秒"),
+        _event(watch_time_seconds=True),
+        _event(watch_time_seconds=2**31),
+        _event(percentage_watched=float("nan")),
+        _event(percentage_watched=-0.5),
+        _event(elapsed_ms="soon"),
+    ],
+)
+def test_invalid_events_are_rejected_before_writing(bad_event):
+    with pytest.raises(ValueError):
+        normalize_play_events([_event("start_play"), bad_event], RECEIVED_AT)
+
+
+def test_events_are_converted_to_column_types():
+    [row] = normalize_play_events(
+        [_event(watch_time_seconds="12.7", percentage_watched="0.25")], RECEIVED_AT
+    )
+    assert row["watch_time_seconds"] == 12
+    assert row["percentage_watched"] == 0.25
+    assert row["played_at"] == RECEIVED_AT
+
+    with pytest.raises(ValueError):
+        normalize_play_events([], RECEIVED_AT)
+
+
+@pytest.fixture
+def two_resources(_app):
+    with _app.app_context():
+        viewer = User(username="播放事件测试用户", phone_number="13900009908", password="x")
+        course = TrainingCourse(course_name="播放事件测试课程")
+        db.session.add_all([viewer, course])
+        db.session.flush()
+        resources = [
+            CourseResource(
+                name=f"播放事件测试资源{index}",
+                file_path=f"play-event-test-{index}.mp4",
+                file_type="video",
+                course_id=course.id,
+                play_count=5,
+            )
+            for index in range(2)
+        ]
+        db.session.add_all(resources)
+        db.session.commit()
+        # 先把其他数据中尚未汇总的事件计入，本测试只关注自己的事件
+        aggregate_play_counts()
+        db.session.commit()
+        yield viewer, resources
+
+        db.session.rollback()
+        TrainingCourse.query.filter_by(id=course.id).delete()
+        User.query.filter_by(id=viewer.id).delete()
+        db.session.commit()
+
+
+def _record(viewer, resource, events):
+    rows = normalize_play_events(events, datetime.now(timezone.utc))
+    record_play_events(viewer.id, resource.id, rows)
+    db.session.commit()
+
+
+def _logged_events(resource):
+    # 用单独的连接读取，模拟其他进程的播放历史请求
+    with db.engine.connect() as connection:
+        return list(connection.scalars(
+            db.select(UserResourcePlayLog.event_type)
+            .where(UserResourcePlayLog.resource_id == resource.id)
+            .order_by(UserResourcePlayLog.played_at)
+        ))
+
+
+def test_recorded_events_are_visible_and_counted_everywhere(_app, two_resources):
+    viewer, (first, second) = two_resources
+    with _app.app_context():
+        _record(viewer, first, [_event("start_play"), _event("heartbeat"), _event("start_play")])
+        _record(viewer, second, [_event("start_play")])
+
+        # 提交即落库：任何进程的播放历史都能看到，顺序与上报顺序一致
+        assert _logged_events(first) == ["start_play", "heartbeat", "start_play"]
+        # 尚未汇总时统计也包含新事件
+        assert resource_play_counts([first.id, second.id]) == {first.id: 7, second.id: 6}
+        db.session.expire_all()
+        assert db.session.get(CourseResource, first.id).play_count == 5
+
+        deltas = aggregate_play_counts()
+        db.session.commit()
+        assert deltas[first.id] == 2 and deltas[second.id] == 1
+        db.session.expire_all()
+        assert db.session.get(CourseResource, first.id).play_count == 7
+        assert resource_play_counts([first.id, second.id]) == {first.id: 7, second.id: 6}
+
+        # 再次汇总不会重复计数
+        assert first.id not in aggregate_play_counts()
+        db.session.commit()
+        assert resource_play_counts([first.id]) == {first.id: 7}
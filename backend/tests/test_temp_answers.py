@@ -0,0 +1,203 @@
+# backend/tests/test_temp_answers.py
+"""
+单元测试：临时答案同步批量 upsert——返回成功即已落库，校验题目属于试卷，
+按作答时间处理乱序，交卷后迟到的保存不会生成新的未提交记录
+"""
+import uuid
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from backend.api.temp_answer import (
+    get_temp_answers,
+    mark_temp_answers_submitted,
+    save_temp_answer,
+    save_temp_answers,
+)
+from backend.models import (
+    db,
+    ExamPaper,
+    ExamPaperQuestion,
+    KnowledgePoint,
+    Option,
+    Question,
+    TempAnswerRecord,
+    TrainingCourse,
+    User,
+)
+
+
+def _call(response):
+    if isinstance(response, tuple):
+        return response[0].get_json(), response[1]
+    return response.get_json(), response.status_code
+
+
+def _pending(exam, user):
+    # 答案由接口用单独的连接写入，丢弃会话中已加载的旧状态
+    db.session.expire_all()
+    return {
+        str(r.question_id): [str(o) for o in r.selected_option_ids]
+        for r in TempAnswerRecord.query.filter_by(
+            exam_paper_id=exam.id, user_id=user.id, is_submitted=False
+        )
+    }
+
+
+def _iso(moment):
+    return moment.isoformat()
+
+
+@pytest.fixture
+def answer_sheet(_app):
+    with _app.app_context():
+        user = User(username="临时答案测试考生", phone_number="13900009907", password="x")
+        course = TrainingCourse(course_name="临时答案测试课程")
+        db.session.add_all([user, course])
+        db.session.flush()
+        point = KnowledgePoint(course_id=course.id, point_name="临时答案测试知识点")
+        db.session.add(point)
+        db.session.flush()
+        on_paper = Question(knowledge_point_id=point.id, question_type="单选题", question_text="卷内题")
+        off_paper = Question(knowledge_point_id=point.id, question_type="单选题", question_text="卷外题")
+        db.session.add_all([on_paper, off_paper])
+        db.session.flush()
+        a = Option(question_id=on_paper.id, option_text="甲", is_correct=True)
+        b = Option(question_id=on_paper.id, option_text="乙", is_correct=False)
+        other = Option(question_id=off_paper.id, option_text="丙", is_correct=True)
+        db.session.add_all([a, b, other])
+        paper = ExamPaper(title="临时答案测试试卷")
+        db.session.add(paper)
+        db.session.flush()
+        db.session.add(ExamPaperQuestion(exam_paper_id=paper.id, question_id=on_paper.id))
+        db.session.commit()
+        yield paper, user, on_paper, off_paper, (str(a.id), str(b.id), str(other.id))
+
+        db.session.rollback()
+        TempAnswerRecord.query.filter_by(exam_paper_id=paper.id).delete()
+        ExamPaper.query.filter_by(id=paper.id).delete()
+        TrainingCourse.query.filter_by(id=course.id).delete()
+        User.query.filter_by(id=user.id).delete()
+        db.session.commit()
+
+
+def test_saved_answers_are_visible_to_any_reader_immediately(_app, answer_sheet):
+    paper, user, question, _, (a, b, _) = answer_sheet
+    with _app.app_context():
+        body, status = _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [a]))
+        assert status == 200
+        assert body["accepted"] == 1 and body["record_id"]
+
+        # 不依赖任何进程内状态：直接查库即可看到
+        assert _pending(paper, user) == {str(question.id): [a]}
+        body, _ = _call(get_temp_answers(str(paper.id), str(user.id)))
+        assert [str(row["question_id"]) for row in body["temp_answers"]] == [str(question.id)]
+
+        # 同一题再次作答覆盖原记录，不新增行
+        _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [b]))
+        assert _pending(paper, user) == {str(question.id): [b]}
+        assert TempAnswerRecord.query.filter_by(exam_paper_id=paper.id).count() == 1
+
+
+def test_answers_outside_the_paper_are_rejected(_app, answer_sheet):
+    paper, user, question, off_paper, (a, _, other) = answer_sheet
+    with _app.app_context():
+        body, status = _call(save_temp_answers(str(paper.id), str(user.id), [
+            {"question_id": str(question.id), "selected_options": [a]},
+            {"question_id": str(off_paper.id), "selected_options": [other]},
+        ]))
+        assert status == 400
+        assert body["invalid_question_ids"] == [str(off_paper.id)]
+
+        body, status = _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [other]))
+        assert status == 400
+        assert body["invalid_option_ids"] == [other]
+
+        _, status = _call(save_temp_answer(str(paper.id), str(user.id), "not-a-uuid", [a]))
+        assert status == 400
+        assert _pending(paper, user) == {}
+
+
+def test_database_errors_are_reported_not_dropped(_app, answer_sheet):
+    paper, _, question, _, (a, _, _) = answer_sheet
+    with _app.app_context():
+        # 考生不存在：外键错误必须返回失败，而不是返回成功后丢弃
+        _, status = _call(save_temp_answer(str(paper.id), str(uuid.uuid4()), str(question.id), [a]))
+        assert status == 500
+        assert TempAnswerRecord.query.filter_by(exam_paper_id=paper.id).count() == 0
+
+
+def test_out_of_order_saves_keep_the_latest_click(_app, answer_sheet):
+    paper, user, question, _, (a, b, _) = answer_sheet
+    now = datetime.now(timezone.utc)
+    with _app.app_context():
+        _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [b], _iso(now - timedelta(seconds=1))))
+        # 更早点击的请求后到达
+        body, _ = _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [a], _iso(now - timedelta(seconds=5))))
+        assert body["skipped"] == 1
+        assert _pending(paper, user) == {str(question.id): [b]}
+
+        # 同一批里重复的题目取作答时间最晚的一次
+        _call(save_temp_answers(str(paper.id), str(user.id), [
+            {"question_id": str(question.id), "selected_options": [a], "answered_at": _iso(now)},
+            {"question_id": str(question.id), "selected_options": [b], "answered_at": _iso(now - timedelta(milliseconds=500))},
+        ]))
+        assert _pending(paper, user) == {str(question.id): [a]}
+
+
+def test_late_save_after_submission_does_not_start_a_new_attempt(_app, answer_sheet):
+    paper, user, question, _, (a, b, _) = answer_sheet
+    with _app.app_context():
+        clicked_at = datetime.now(timezone.utc)
+        _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [a], _iso(clicked_at)))
+        _, status = _call(mark_temp_answers_submitted(str(paper.id), str(user.id)))
+        assert status == 200
+
+        # 交卷前点击、交卷后才到达的保存属于已交卷的考试
+        body, status = _call(save_temp_answer(
+            str(paper.id), str(user.id), str(question.id), [b],
+            _iso(clicked_at),
+        ))
+        assert status == 200
+        assert body["skipped"] == 1
+        assert _pending(paper, user) == {}
+
+        # 交卷之后的新一次作答正常保存
+        body, _ = _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [b]))
+        assert body["accepted"] == 1
+        assert _pending(paper, user) == {str(question.id): [b]}
+
+
+def test_each_save_is_a_single_statement(_app, answer_sheet, monkeypatch):
+    from backend.api import temp_answer
+
+    paper, user, question, _, (a, _, _) = answer_sheet
+    statements = []
+    connect = temp_answer.get_db_connection
+
+    class CountingCursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        def execute(self, sql, params=None):
+            statements.append(sql)
+            return self._cursor.execute(sql, params)
+
+        def __getattr__(self, name):
+            return getattr(self._cursor, name)
+
+    class CountingConnection:
+        def __init__(self):
+            self._conn = connect()
+
+        def cursor(self, *args, **kwargs):
+            return CountingCursor(self._conn.cursor(*args, **kwargs))
+
+        def __getattr__(self, name):
+            return getattr(self._conn, name)
+
+    monkeypatch.setattr(temp_answer, "get_db_connection", CountingConnection)
+    with _app.app_context():
+        # 校验、收到时间和写入都在一条语句中完成
+        body, status = _call(save_temp_answer(str(paper.id), str(user.id), str(question.id), [a]))
+        assert status == 200 and body["accepted"] == 1
+        assert len(statements) == 1
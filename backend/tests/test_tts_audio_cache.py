@@ -0,0 +1,223 @@
+# backend/tests/test_tts_audio_cache.py
+"""
+单元测试：句子音频内容寻址缓存的键在合成与重新拆分两条路径上一致，
+以及重新生成时不会拿回句子自己的旧音频
+"""
+import pytest
+
+from backend.models import (
+    db,
+    TrainingContent,
+    TrainingCourse,
+    TtsAudio,
+    TtsScript,
+    TtsSentence,
+)
+from backend.services.sentence_split_service import bulk_create_sentences
+from backend.services.tts_audio_cache import (
+    audio_cache_key,
+    effective_tts_config,
+    tts_audio_cache,
+)
+from backend import tasks
+
+TEXT = "宝宝哭闹时先检查是否饿了。"
+GRADIO_CONFIG = {"engine": "gradio_default", "temperature": 0.3}
+
+
+@pytest.fixture
+def tts_storage(_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(_app.config, "TTS_AUDIO_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setitem(_app.config, "DEFAULT_GRADIO_PT_FILE_PATH", "seed_1397_restored_emb.pt")
+    monkeypatch.setitem(_app.config, "DEFAULT_TTS_CONFIG", {})
+    return tmp_path
+
+
+@pytest.fixture
+def tts_content(_app, tts_storage):
+    with _app.app_context():
+        course = TrainingCourse(course_name="语音缓存测试课程")
+        db.session.add(course)
+        db.session.flush()
+        content = TrainingContent(
+            course_id=course.id,
+            content_name="语音缓存测试内容",
+            original_content=TEXT,
+            status="pending",
+            default_tts_config=dict(GRADIO_CONFIG),
+        )
+        db.session.add(content)
+        db.session.flush()
+        script = TtsScript(
+            training_content_id=content.id,
+            script_type="final_tts_script",
+            content=TEXT,
+            version=1,
+        )
+        db.session.add(script)
+        db.session.commit()
+        yield content, script
+
+        db.session.rollback()
+        TrainingCourse.query.filter_by(id=course.id).delete()
+        db.session.commit()
+
+
+def _write_audio(storage, content, sentence, cache_key, version=1):
+    relative_path = f"{content.id}/{sentence.id}/sentence_v{version}.wav"
+    full_path = storage / relative_path
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    full_path.write_bytes(b"RIFF")
+    audio = TtsAudio(
+        tts_sentence_id=sentence.id,
+        training_content_id=content.id,
+        audio_type="sentence_audio",
+        file_path=relative_path,
+        tts_engine="gradio_default",
+        cache_key=cache_key,
+        version=version,
+        is_latest_for_sentence=True,
+    )
+    db.session.add(audio)
+    return audio
+
+
+def _new_sentence(script, text=TEXT, order_index=0, status="generated"):
+    sentence = TtsSentence(
+        tts_script_id=script.id,
+        sentence_text=text,
+        order_index=order_index,
+        audio_status=status,
+    )
+    db.session.add(sentence)
+    db.session.flush()
+    return sentence
+
+
+def test_synthesis_and_resplit_paths_build_the_same_key(_app, tts_storage):
+    with _app.app_context():
+        # 单句/批量合成：接口传入的引擎、引擎参数、默认音色文件，配置中还带着请求体里的字段
+        synthesis_config = dict(GRADIO_CONFIG, tts_engine="gradio_default", tts_params={})
+        written = audio_cache_key(
+            TEXT,
+            "gradio_default",
+            synthesis_config,
+            engine_params={},
+            pt_file_path_relative="seed_1397_restored_emb.pt",
+        )
+        # 重新拆分：只有课程配置
+        assert audio_cache_key(TEXT, None, GRADIO_CONFIG) == written
+        # 首尾空白不影响键
+        assert audio_cache_key(" 宝宝哭闹时先检查是否饿了。 ", None, GRADIO_CONFIG) == written
+
+        # 音色文件或会覆盖配置的引擎参数不同，则是不同的音频
+        assert audio_cache_key(TEXT, None, GRADIO_CONFIG, pt_file_path_relative="other.pt") != written
+        assert audio_cache_key(TEXT, None, GRADIO_CONFIG, engine_params={"temperature": 0.9}) != written
+
+        # IndexTTS 的引擎参数与配置相同时不影响键；Gemini 不使用引擎参数
+        indextts_config = {"engine": "indextts", "voice_reference_path": "a.wav", "emo_weight": 0.8}
+        assert audio_cache_key(
+            TEXT, "indextts", indextts_config, engine_params={"emo_weight": 0.8}
+        ) == audio_cache_key(TEXT, None, indextts_config)
+        gemini_config = {"engine": "gemini_tts", "voice_name": "Kore"}
+        assert audio_cache_key(
+            TEXT, "gemini_tts", gemini_config, engine_params={"model": "x"}
+        ) == audio_cache_key(TEXT, None, gemini_config)
+
+
+def test_lookup_excludes_the_sentences_own_audio_files(_app, tts_content, tts_storage):
+    content, script = tts_content
+    with _app.app_context():
+        key = audio_cache_key(TEXT, None, GRADIO_CONFIG)
+        owner = _new_sentence(script)
+        other = _new_sentence(script, order_index=1, status="pending_generation")
+        original = _write_audio(tts_storage, content, owner, key)
+        db.session.flush()
+        # 另一句复用了同一个文件
+        tts_audio_cache.clone_for_sentence(original, other, content.id)
+        db.session.commit()
+
+        assert tts_audio_cache.lookup(key).file_path == original.file_path
+        assert tts_audio_cache.lookup(key, exclude_sentence_ids=[owner.id]) is None
+        assert tts_audio_cache.lookup(key, exclude_sentence_ids=[other.id]) is None
+
+
+def test_regenerate_synthesizes_new_audio(_app, tts_content, tts_storage, monkeypatch):
+    content, script = tts_content
+    with _app.app_context():
+        config_key = audio_cache_key(
+            TEXT, "gradio_default", GRADIO_CONFIG,
+            engine_params={}, pt_file_path_relative="seed_1397_restored_emb.pt",
+        )
+        sentence = _new_sentence(script)
+        old_audio = _write_audio(tts_storage, content, sentence, config_key)
+        db.session.commit()
+        sentence_id, old_path = sentence.id, old_audio.file_path
+
+    synthesized = []
+
+    def fake_synthesize(app, engine, text, config, **kwargs):
+        synthesized.append(text)
+        return b"RIFF-new", "audio/wav", {}
+
+    def fake_save(audio_binary_content, training_content_id, sid, version, extension=".wav"):
+        relative_path = f"{training_content_id}/{sid}/sentence_v{version}{extension}"
+        full_path = tts_storage / relative_path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_bytes(audio_binary_content)
+        return relative_path, len(audio_binary_content)
+
+    monkeypatch.setattr(tasks, "create_flask_app_for_task", lambda: _app)
+    monkeypatch.setattr(tasks, "_synthesize_with_engine", fake_synthesize)
+    monkeypatch.setattr(tasks, "_save_audio_file", fake_save)
+
+    # 不传 force_regenerate 也不能拿回自己的旧音频
+    result = tasks.generate_single_sentence_audio_async.run(
+        str(sentence_id),
+        tts_engine_identifier="gradio_default",
+        pt_file_path_relative="seed_1397_restored_emb.pt",
+        tts_engine_params={},
+        override_config={"tts_engine": "gradio_default", "tts_params": {}},
+    )
+
+    assert result["status"] == "Success"
+    assert "cache_hit" not in result
+    assert synthesized == [TEXT]
+    assert result["file_path"] != old_path
+    with _app.app_context():
+        latest = TtsAudio.query.filter_by(tts_sentence_id=sentence_id, is_latest_for_sentence=True).one()
+        assert latest.version == 2
+        assert latest.cache_key == config_key
+
+
+def test_resplit_reuses_audio_written_by_synthesis(_app, tts_content, tts_storage):
+    content, script = tts_content
+    with _app.app_context():
+        written_key = audio_cache_key(
+            TEXT, "gradio_default", dict(GRADIO_CONFIG, tts_params={}),
+            engine_params={}, pt_file_path_relative="seed_1397_restored_emb.pt",
+        )
+        source = _write_audio(tts_storage, content, _new_sentence(script), written_key)
+        new_script = TtsScript(
+            training_content_id=content.id,
+            script_type="final_tts_script",
+            content=TEXT,
+            version=2,
+        )
+        db.session.add(new_script)
+        db.session.commit()
+
+        # 与重新拆分任务相同的查找方式
+        resplit_key = audio_cache_key(TEXT, None, effective_tts_config(content))
+        cached = tts_audio_cache.lookup_many([resplit_key])
+        assert cached[resplit_key].file_path == source.file_path
+
+        bulk_create_sentences(new_script.id, content.id, [TEXT], {TEXT: cached[resplit_key]})
+        db.session.commit()
+        reused = (
+            TtsAudio.query.join(TtsSentence, TtsSentence.id == TtsAudio.tts_sentence_id)
+            .filter(TtsSentence.tts_script_id == new_script.id)
+            .one()
+        )
+        assert reused.file_path == source.file_path
+        assert reused.cache_key == written_key
@@ -12,6 +12,8 @@ from reportlab.pdfbase.ttfonts import TTFont
 from PIL import Image as PILImage
 from flask import current_app
 
+from backend.services.slide_image_cache import rasterize_pdf
+
 logger = logging.getLogger(__name__)
 
 def register_fonts():
@@ -128,6 +130,17 @@ def generate_alignment_pdf(output_stream, synthesis_task, training_content, orie
     upload_folder = current_app.config.get('UPLOAD_FOLDER')
     if not upload_folder:
         upload_folder = os.path.join(current_app.instance_path, 'uploads')
+
+    # 原 PDF 还在时使用幻灯片缓存（与预览图、视频合成共用，通常直接命中）
+    rendered_slides = []
+    pdf_path = synthesis_task.ppt_pdf_path
+    if pdf_path and os.path.exists(pdf_path):
+        try:
+            rendered_slides = rasterize_pdf(
+                pdf_path, width=current_app.config.get('VIDEO_SLIDE_WIDTH', 1920)
+            )
+        except Exception as e:
+            logger.error(f"渲染幻灯片失败，改用已保存的预览图: {pdf_path}, {e}")
     
     # 遍历页面
     sorted_pages = sorted(grouped_scripts.keys())
@@ -145,6 +158,8 @@ def generate_alignment_pdf(output_stream, synthesis_task, training_content, orie
         
         if not img_path_rel and page_num <= len(ppt_image_paths):
             img_path_rel = ppt_image_paths[page_num - 1]
+        if isinstance(page_num, int) and 0 < page_num <= len(rendered_slides):
+            img_path_rel = rendered_slides[page_num - 1]
 
         story.append(Paragraph(f"第 {page_num} 页", chinese_style))
         
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback, useMemo } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
@@ -207,28 +207,41 @@ const ExamTake = () => {
     }
   }, [exam, tokenData, preview, loadTempAnswers]);
   
-  const saveAnswerToServer = useCallback(debounce(async (questionId, answerData) => {
-    if (!tokenData?.sub) return;
+  // 待自动保存的作答 { questionId: { selected_options, answered_at } }，防抖后一次请求提交多题
+  const pendingAnswersRef = useRef({});
+
+  const flushPendingAnswers = useMemo(() => debounce(async () => {
+    const pending = pendingAnswersRef.current;
+    const questionIds = Object.keys(pending);
+    if (!tokenData?.sub || questionIds.length === 0) return;
+    pendingAnswersRef.current = {};
+    const batch = questionIds.map(question_id => ({ question_id, ...pending[question_id] }));
     try {
-      const selected_options = answerData.question_type === '单选题'
-        ? (answerData.selected ? [answerData.selected] : [])
-        : Object.entries(answerData.selected || {}).filter(([, sel]) => sel).map(([id]) => id);
-      if(selected_options.length === 0) return;
-      await api.post(`/exams/${examId}/temp-answers`, { user_id: tokenData.sub, question_id: questionId, selected_options });
-    } catch (err) { console.error('自动保存失败：', err); }
-  }, 500), [examId, tokenData]);
-
-  const handleAnswerChange = (questionId, optionId, type) => {
-    let newAnswers;
-    if (type === '多选题') {
-      newAnswers = { ...answers, [questionId]: { question_type: type, selected: { ...answers[questionId]?.selected, [optionId]: !answers[questionId]?.selected?.[optionId] } } };
-    } else {
-      newAnswers = { ...answers, [questionId]: { question_type: type, selected: optionId } };
+      await api.post(`/exams/${examId}/temp-answers`, { user_id: tokenData.sub, answers: batch });
+    } catch (err) {
+      console.error('自动保存失败：', err);
+      // 放回未保存的作答（期间又作答过的题以新的为准），下次保存时重试
+      batch.forEach(({ question_id, ...answer }) => {
+        if (!pendingAnswersRef.current[question_id]) pendingAnswersRef.current[question_id] = answer;
+      });
+    }
+  }, 500, { maxWait: 3000 }), [examId, tokenData]);
+
+  // 离开页面前写出尚未保存的作答
+  useEffect(() => () => flushPendingAnswers.flush(), [flushPendingAnswers]);
+
+  const saveAnswerToServer = (questionId, answerData) => {
+    const selected_options = answerData.question_type === '单选题'
+      ? (answerData.selected ? [answerData.selected] : [])
+      : Object.entries(answerData.selected || {}).filter(([, sel]) => sel).map(([id]) => id);
+    if (selected_options.length === 0) {
+      delete pendingAnswersRef.current[questionId];
+      return;
     }
-    setAnswers(newAnswers);
-    if (tokenData?.sub) saveAnswerToServer(questionId, newAnswers[questionId]);
+    pendingAnswersRef.current[questionId] = { selected_options, answered_at: answerData.answered_at };
+    flushPendingAnswers();
   };
-  
+
   const checkIncompleteQuestions = () => {
     return exam.questions.map((question, index) => {
       const answer = answers[question.id];
@@ -256,6 +269,9 @@ const ExamTake = () => {
       return;
     }
     setIsSubmitting(true);
+    // 交卷提交的是全部作答，不再需要自动保存
+    flushPendingAnswers.cancel();
+    pendingAnswersRef.current = {};
     try {
       const formattedAnswers = Object.entries(answers).map(([questionId, answer]) => ({
         question_id: questionId,
@@ -258,6 +258,8 @@ const MediaPlayerPage = () => {
         event_type: event_type,
         watch_time_seconds: Math.floor(playedSeconds),
         percentage_watched: parseFloat(playedRatio.toFixed(4)),
+        // 事件发生时间，服务端据此保留同一会话内事件的先后顺序
+        played_at: new Date().toISOString(),
         ...eventData
       };
       await api.post(`/resources/${resourceId}/play-log`, payload);
@@ -0,0 +1,48 @@
+"""add cache key to tts audio
+
+Revision ID: a0b1c2d3e4f5
+Revises: f9a0b1c2d3e4
+Create Date: 2026-07-27 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a0b1c2d3e4f5"
+down_revision = "f9a0b1c2d3e4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("tts_audio")}
+    indexes = {index["name"] for index in inspector.get_indexes("tts_audio")}
+
+    with op.batch_alter_table("tts_audio", schema=None) as batch_op:
+        if "cache_key" not in columns:
+            batch_op.add_column(
+                sa.Column(
+                    "cache_key",
+                    sa.String(length=64),
+                    nullable=True,
+                    comment="内容寻址缓存键 (规范化文本+引擎+音色+生效配置的 SHA-256)",
+                )
+            )
+        if "ix_tts_audio_cache_key" not in indexes:
+            batch_op.create_index("ix_tts_audio_cache_key", ["cache_key"], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("tts_audio")}
+    indexes = {index["name"] for index in inspector.get_indexes("tts_audio")}
+
+    with op.batch_alter_table("tts_audio", schema=None) as batch_op:
+        if "ix_tts_audio_cache_key" in indexes:
+            batch_op.drop_index("ix_tts_audio_cache_key")
+        if "cache_key" in columns:
+            batch_op.drop_column("cache_key")
@@ -0,0 +1,42 @@
+"""add progress to video synthesis
+
+Revision ID: b1c2d3e4f5a6
+Revises: a0b1c2d3e4f5
+Create Date: 2026-07-28 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "b1c2d3e4f5a6"
+down_revision = "a0b1c2d3e4f5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("video_synthesis")}
+
+    with op.batch_alter_table("video_synthesis", schema=None) as batch_op:
+        if "progress" not in columns:
+            batch_op.add_column(
+                sa.Column(
+                    "progress",
+                    sa.Integer(),
+                    nullable=True,
+                    comment="视频合成进度 (0-100)",
+                )
+            )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("video_synthesis")}
+
+    with op.batch_alter_table("video_synthesis", schema=None) as batch_op:
+        if "progress" in columns:
+            batch_op.drop_column("progress")
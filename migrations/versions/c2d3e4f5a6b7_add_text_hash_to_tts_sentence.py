@@ -0,0 +1,50 @@
+"""add text hash to tts sentence
+
+Revision ID: c2d3e4f5a6b7
+Revises: b1c2d3e4f5a6
+Create Date: 2026-07-29 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c2d3e4f5a6b7"
+down_revision = "b1c2d3e4f5a6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("tts_sentence")}
+    indexes = {index["name"] for index in inspector.get_indexes("tts_sentence")}
+
+    with op.batch_alter_table("tts_sentence", schema=None) as batch_op:
+        if "text_hash" not in columns:
+            batch_op.add_column(
+                sa.Column(
+                    "text_hash",
+                    sa.String(length=32),
+                    nullable=True,
+                    comment="句子文本的 MD5（与 PostgreSQL md5(sentence_text) 一致），用于批量查找可复用音频",
+                )
+            )
+        if "ix_tts_sentence_text_hash" not in indexes:
+            batch_op.create_index("ix_tts_sentence_text_hash", ["text_hash"], unique=False)
+
+    op.execute("UPDATE tts_sentence SET text_hash = md5(sentence_text) WHERE text_hash IS NULL")
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("tts_sentence")}
+    indexes = {index["name"] for index in inspector.get_indexes("tts_sentence")}
+
+    with op.batch_alter_table("tts_sentence", schema=None) as batch_op:
+        if "ix_tts_sentence_text_hash" in indexes:
+            batch_op.drop_index("ix_tts_sentence_text_hash")
+        if "text_hash" in columns:
+            batch_op.drop_column("text_hash")
@@ -0,0 +1,54 @@
+"""unique pending temp answer per exam user question
+
+Revision ID: d3e4f5a6b7c8
+Revises: c2d3e4f5a6b7
+Create Date: 2026-08-05 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d3e4f5a6b7c8"
+down_revision = "c2d3e4f5a6b7"
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "uq_temp_answer_record_pending"
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = {index["name"] for index in inspector.get_indexes("temp_answer_record")}
+    if INDEX_NAME in indexes:
+        return
+
+    # 同一考生同一题未提交的临时答案只保留最新一条
+    op.execute(
+        """
+        DELETE FROM temp_answer_record t
+        USING temp_answer_record newer
+        WHERE t.is_submitted = false
+          AND newer.is_submitted = false
+          AND newer.exam_paper_id = t.exam_paper_id
+          AND newer.user_id = t.user_id
+          AND newer.question_id = t.question_id
+          AND (newer.updated_at, newer.id) > (t.updated_at, t.id)
+        """
+    )
+    op.create_index(
+        INDEX_NAME,
+        "temp_answer_record",
+        ["exam_paper_id", "user_id", "question_id"],
+        unique=True,
+        postgresql_where=sa.text("is_submitted = false"),
+    )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = {index["name"] for index in inspector.get_indexes("temp_answer_record")}
+    if INDEX_NAME in indexes:
+        op.drop_index(INDEX_NAME, table_name="temp_answer_record")
@@ -0,0 +1,73 @@
+"""add materialized fee columns to customer bills
+
+Revision ID: d7e8f9a0b1c2
+Revises: c6d7e8f9a0b1
+Create Date: 2026-07-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d7e8f9a0b1c2"
+down_revision = "c6d7e8f9a0b1"
+branch_labels = None
+depends_on = None
+
+
+FEE_COLUMNS = (
+    ("management_fee", "管理费 (物化自 calculation_details)"),
+    ("extension_fee", "延长期服务费 (物化自 calculation_details)"),
+    ("employee_commission", "员工佣金 (物化自 calculation_details)"),
+)
+
+# 与 billing_engine._details_money 一致：能解析为金额的取两位小数，缺失或非法的保持 NULL
+NUMERIC_PATTERN = r"^\s*[-+]?([0-9]+(\.[0-9]*)?|\.[0-9]+)\s*$"
+
+
+def _backfill_sql(name):
+    value = f"calculation_details ->> '{name}'"
+    money = f"round(trim({value})::numeric, 2)"
+    # 嵌套 CASE 保证先校验格式再转换，非法文本不会让整条 UPDATE 报错
+    return f"""
+        CASE WHEN {value} ~ '{NUMERIC_PATTERN}' THEN
+            CASE WHEN abs({money}) < 10000000000 THEN {money} END
+        END
+    """
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("customer_bills")}
+    indexes = {index["name"] for index in inspector.get_indexes("customer_bills")}
+
+    with op.batch_alter_table("customer_bills", schema=None) as batch_op:
+        for name, comment in FEE_COLUMNS:
+            if name not in columns:
+                batch_op.add_column(sa.Column(name, sa.Numeric(precision=12, scale=2), nullable=True, comment=comment))
+        if "ix_customer_bills_year_month_fees" not in indexes:
+            batch_op.create_index(
+                "ix_customer_bills_year_month_fees",
+                ["year", "month", "payment_status"],
+                unique=False,
+                postgresql_include=[name for name, _ in FEE_COLUMNS],
+            )
+
+    # 回填历史账单；之后新计算的账单由 BillingEngine 同步
+    assignments = ",\n".join(f"{name} = {_backfill_sql(name)}" for name, _ in FEE_COLUMNS)
+    op.execute(f"UPDATE customer_bills SET {assignments}")
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("customer_bills")}
+    indexes = {index["name"] for index in inspector.get_indexes("customer_bills")}
+
+    with op.batch_alter_table("customer_bills", schema=None) as batch_op:
+        if "ix_customer_bills_year_month_fees" in indexes:
+            batch_op.drop_index("ix_customer_bills_year_month_fees")
+        for name, _ in reversed(FEE_COLUMNS):
+            if name in columns:
+                batch_op.drop_column(name)
@@ -0,0 +1,41 @@
+"""add match candidates to bank transactions
+
+Revision ID: e4f5a6b7c8d9
+Revises: d3e4f5a6b7c8
+Create Date: 2026-08-12 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "e4f5a6b7c8d9"
+down_revision = "d3e4f5a6b7c8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("bank_transactions")}
+    if "match_candidates" not in columns:
+        with op.batch_alter_table("bank_transactions", schema=None) as batch_op:
+            batch_op.add_column(
+                sa.Column(
+                    "match_candidates",
+                    postgresql.JSONB(astext_type=sa.Text()),
+                    nullable=True,
+                    comment="自动匹配给出的待确认账单候选 (按优先级排序)",
+                )
+            )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("bank_transactions")}
+    if "match_candidates" in columns:
+        with op.batch_alter_table("bank_transactions", schema=None) as batch_op:
+            batch_op.drop_column("match_candidates")
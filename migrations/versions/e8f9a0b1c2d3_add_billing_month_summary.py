@@ -0,0 +1,62 @@
+"""add billing month summary
+
+Revision ID: e8f9a0b1c2d3
+Revises: d7e8f9a0b1c2
+Create Date: 2026-07-22 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "e8f9a0b1c2d3"
+down_revision = "d7e8f9a0b1c2"
+branch_labels = None
+depends_on = None
+
+
+def _amount(name, comment):
+    return sa.Column(name, sa.Numeric(precision=14, scale=2), server_default="0", nullable=False, comment=comment)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "billing_month_summary" in inspector.get_table_names():
+        return
+
+    op.create_table(
+        "billing_month_summary",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.Integer(), nullable=False),
+        sa.Column("contract_type", sa.String(length=50), nullable=False, comment="合同类型 (与 contracts.type 一致)"),
+        sa.Column("bill_count", sa.Integer(), server_default="0", nullable=False, comment="账单数"),
+        sa.Column("paid_bill_count", sa.Integer(), server_default="0", nullable=False, comment="已结清账单数"),
+        _amount("total_due", "客户应付合计"),
+        _amount("total_paid", "客户实付合计"),
+        _amount("management_fee", "应收管理费"),
+        _amount("management_fee_paid", "已结清账单的管理费"),
+        _amount("introduction_fee", "介绍费调整项合计"),
+        _amount("customer_increase", "客户增款调整项合计"),
+        _amount("employee_commission", "员工佣金调整项合计 (按工资单月份)"),
+        _amount("payout_due", "员工应发合计"),
+        _amount("payout_paid", "员工实发合计"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("year", "month", "contract_type", name="uq_billing_month_summary_year_month_type"),
+        comment="账单月度汇总（仪表盘预聚合）",
+    )
+    with op.batch_alter_table("billing_month_summary", schema=None) as batch_op:
+        batch_op.create_index(batch_op.f("ix_billing_month_summary_year"), ["year"], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "billing_month_summary" not in inspector.get_table_names():
+        return
+
+    with op.batch_alter_table("billing_month_summary", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_billing_month_summary_year"))
+    op.drop_table("billing_month_summary")
@@ -0,0 +1,63 @@
+"""add play_counted to user_resource_play_log
+
+Revision ID: f5a6b7c8d9e0
+Revises: e4f5a6b7c8d9
+Create Date: 2026-08-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f5a6b7c8d9e0"
+down_revision = "e4f5a6b7c8d9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("user_resource_play_log")}
+    indexes = {index["name"] for index in inspector.get_indexes("user_resource_play_log")}
+
+    with op.batch_alter_table("user_resource_play_log", schema=None) as batch_op:
+        if "play_counted" not in columns:
+            batch_op.add_column(
+                sa.Column(
+                    "play_counted",
+                    sa.Boolean(),
+                    nullable=False,
+                    server_default=sa.text("false"),
+                    comment="start_play 事件是否已由定时汇总计入 course_resource.play_count",
+                )
+            )
+
+    # 已有日志在写入时已经计入了 play_count
+    if "play_counted" not in columns:
+        op.execute("UPDATE user_resource_play_log SET play_counted = true")
+
+    if "ix_user_resource_play_log_uncounted_start_play" not in indexes:
+        op.create_index(
+            "ix_user_resource_play_log_uncounted_start_play",
+            "user_resource_play_log",
+            ["resource_id"],
+            unique=False,
+            postgresql_where=sa.text("event_type = 'start_play' AND play_counted = false"),
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("user_resource_play_log")}
+    indexes = {index["name"] for index in inspector.get_indexes("user_resource_play_log")}
+
+    if "ix_user_resource_play_log_uncounted_start_play" in indexes:
+        op.drop_index(
+            "ix_user_resource_play_log_uncounted_start_play",
+            table_name="user_resource_play_log",
+        )
+    with op.batch_alter_table("user_resource_play_log", schema=None) as batch_op:
+        if "play_counted" in columns:
+            batch_op.drop_column("play_counted")
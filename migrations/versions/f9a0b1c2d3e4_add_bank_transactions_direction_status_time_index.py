@@ -0,0 +1,39 @@
+"""add bank transactions direction status time index
+
+Revision ID: f9a0b1c2d3e4
+Revises: e8f9a0b1c2d3
+Create Date: 2026-07-24 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f9a0b1c2d3e4"
+down_revision = "e8f9a0b1c2d3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = {index["name"] for index in inspector.get_indexes("bank_transactions")}
+
+    with op.batch_alter_table("bank_transactions", schema=None) as batch_op:
+        if "ix_bank_transactions_direction_status_time" not in indexes:
+            batch_op.create_index(
+                "ix_bank_transactions_direction_status_time",
+                ["direction", "status", "transaction_time"],
+                unique=False,
+            )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = {index["name"] for index in inspector.get_indexes("bank_transactions")}
+
+    with op.batch_alter_table("bank_transactions", schema=None) as batch_op:
+        if "ix_bank_transactions_direction_status_time" in indexes:
+            batch_op.drop_index("ix_bank_transactions_direction_status_time")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark the bank reconciliation month view.
+
+Counts the SQL statements and wall time of
+BankStatementService.get_and_categorize_transactions for each given month,
+next to the number of entries the view returns. The statement count
+should stay flat no matter how many transactions a month has.
+
+    python scripts/benchmark_bank_month_view.py 2025-01 2025-02 2025-03
+    python scripts/benchmark_bank_month_view.py 2025-03 --repeat 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+load_dotenv(REPO_ROOT / "backend/.env")
+
+from backend.app import app
+from backend.models import db
+from backend.services.bank_statement_service import BankStatementService
+
+
+def parse_month(value):
+    year, month = value.split("-")
+    return int(year), int(month)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bank reconciliation month view.")
+    parser.add_argument("months", nargs="+", type=parse_month, help="Months as YYYY-MM.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per month; the fastest is reported.")
+    args = parser.parse_args()
+
+    with app.app_context():
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        service = BankStatementService()
+
+        print(f"{'month':<8} | {'entries':>7} | {'queries':>7} | {'best ms':>8}")
+        print("-" * 41)
+        try:
+            for year, month in args.months:
+                best_ms = None
+                for _ in range(args.repeat):
+                    db.session.expire_all()
+                    statements.clear()
+                    started = time.perf_counter()
+                    result = service.get_and_categorize_transactions(year, month)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    best_ms = elapsed_ms if best_ms is None else min(best_ms, elapsed_ms)
+                txn_count = sum(len(items) for items in result.values())
+                print(f"{year}-{month:02d}  | {txn_count:>7} | {len(statements):>7} | {best_ms:>8.1f}")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+            db.session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark the fixed per-sentence overhead of a TTS engine.
+
+Synthesizes the same few sentences twice with backend.tasks._synthesize_with_engine:
+once "cold", dropping every pooled client before each sentence (what every
+call used to pay: new GradioClient, new proxy connection, re-uploaded
+reference voice), and once "warm", reusing the worker's engine registry.
+Client setup and synthesis time are reported separately; nothing is written
+to the database.
+
+    python scripts/benchmark_tts_engine_overhead.py --engine tts_server
+    python scripts/benchmark_tts_engine_overhead.py --engine indextts --sentences 5
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+load_dotenv(REPO_ROOT / "backend/.env")
+
+from backend.app import app
+from backend.services.tts_engine_registry import tts_engine_registry
+from backend.tasks import _synthesize_with_engine
+
+SAMPLE_SENTENCES = [
+    "欢迎来到今天的培训课程。",
+    "首先我们来了解一下新生儿护理的基本要求。",
+    "每次接触宝宝之前，请务必先洗手。",
+    "喂奶后要帮助宝宝拍嗝，避免吐奶。",
+    "如果发现异常情况，请及时联系客户和公司。",
+]
+
+
+def run(engine, sentences, cold):
+    totals = {"setup_ms": 0.0, "synthesis_ms": 0.0}
+    for index, text in enumerate(sentences):
+        if cold:
+            tts_engine_registry.close()
+        _synthesize_with_engine(
+            app,
+            engine,
+            text,
+            dict(app.config.get("DEFAULT_TTS_CONFIG", {})),
+            log_label=f"benchmark {index}",
+        )
+        stats = tts_engine_registry.stats()[engine]
+        totals["setup_ms"] += stats["last_setup_ms"]
+        totals["synthesis_ms"] += stats["last_synthesis_ms"]
+    count = len(sentences)
+    return totals["setup_ms"] / count, totals["synthesis_ms"] / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-sentence TTS engine overhead.")
+    parser.add_argument(
+        "--engine",
+        default="tts_server",
+        choices=["gemini_tts", "gradio_default", "indextts", "tts_server"],
+    )
+    parser.add_argument("--sentences", type=int, default=3, help="Sentences per run (max %d)." % len(SAMPLE_SENTENCES))
+    args = parser.parse_args()
+
+    sentences = SAMPLE_SENTENCES[: max(1, min(args.sentences, len(SAMPLE_SENTENCES)))]
+    with app.app_context():
+        print(f"{'mode':<6} | {'sentences':>9} | {'setup ms':>9} | {'synth ms':>9}")
+        print("-" * 43)
+        for mode, cold in (("cold", True), ("warm", False)):
+            tts_engine_registry.close()
+            setup_ms, synthesis_ms = run(args.engine, sentences, cold)
+            print(f"{mode:<6} | {len(sentences):>9} | {setup_ms:>9.1f} | {synthesis_ms:>9.1f}")
+        print(f"\nclients created: {tts_engine_registry.stats()[args.engine]['clients_created']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark the two slide video encoding paths.
+
+Builds a synthetic deck (numbered 1920x1080 slides and a sine-tone audio
+track of matching length) in a temporary directory, then renders it with
+the MoviePy path (one ImageClip per slide, composited at 24fps) and with
+the static-slide path (per-slide low frame-rate segments, concatenated
+without re-encoding, audio muxed once). Reports wall time, CPU time
+including ffmpeg child processes, and output size. Needs ffmpeg but no
+database.
+
+    python scripts/benchmark_video_synthesis.py
+    python scripts/benchmark_video_synthesis.py --slides 30 --seconds 12 --skip-moviepy
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from pydub.generators import Sine
+
+from backend.services.slide_video_encoder import (
+    SlideSegment,
+    encode_static_slides,
+    render_slides_with_moviepy,
+)
+
+SIZE = (1920, 1080)
+
+
+def build_deck(work_dir, slides, seconds):
+    segments = []
+    for index in range(slides):
+        path = os.path.join(work_dir, f"slide_{index + 1}.jpg")
+        image = Image.new("RGB", SIZE, (250, 250, 245))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((80, 80, SIZE[0] - 80, 200), fill=(40, 90, 160))
+        draw.text((120, 120), f"Slide {index + 1}", fill=(255, 255, 255))
+        for line in range(8):
+            y = 280 + line * 80
+            draw.rectangle((120, y, 120 + (line * 97 + index * 53) % 1400 + 200, y + 30), fill=(120, 120, 120))
+        image.save(path, quality=92)
+        # 时长略有差异，模拟真实脚本
+        segments.append(SlideSegment(path, seconds + (index % 3) * 0.37))
+
+    audio_path = os.path.join(work_dir, "audio.mp3")
+    total_ms = int(sum(segment.duration for segment in segments) * 1000)
+    Sine(440).to_audio_segment(duration=total_ms, volume=-20).export(audio_path, format="mp3")
+    return segments, audio_path
+
+
+def measure(label, fn):
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    output_path, duration = fn()
+    wall = time.perf_counter() - started
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(
+        getattr(after, field) - getattr(before, field)
+        for before, after in ((before_self, after_self), (before_children, after_children))
+        for field in ("ru_utime", "ru_stime")
+    )
+    size_mb = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"{label:<8} | {wall:>8.1f} | {cpu:>8.1f} | {duration:>9.1f} | {size_mb:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the slide video encoding paths.")
+    parser.add_argument("--slides", type=int, default=30, help="Slides in the synthetic deck.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Approximate seconds per slide.")
+    parser.add_argument("--fps", type=int, default=5, help="Frame rate of the static-slide path.")
+    parser.add_argument("--skip-moviepy", action="store_true", help="Only run the static-slide path.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="video_bench_") as work_dir:
+        segments, audio_path = build_deck(work_dir, args.slides, args.seconds)
+        print(f"{args.slides} slides, {sum(s.duration for s in segments):.1f}s of audio\n")
+        print(f"{'path':<8} | {'wall s':>8} | {'cpu s':>8} | {'video s':>9} | {'MB':>7}")
+        print("-" * 53)
+
+        static_output = os.path.join(work_dir, "static.mp4")
+        measure(
+            "static",
+            lambda: (
+                static_output,
+                encode_static_slides(segments, audio_path, static_output, SIZE, fps=args.fps),
+            ),
+        )
+
+        if not args.skip_moviepy:
+            moviepy_output = os.path.join(work_dir, "moviepy.mp4")
+            measure(
+                "moviepy",
+                lambda: (
+                    moviepy_output,
+                    render_slides_with_moviepy(segments, audio_path, moviepy_output, SIZE),
+                ),
+            )
+
+
+if __name__ == "__main__":
+    main()